@@ -21,13 +21,24 @@ from fastapi.responses import StreamingResponse
 import io
 import contextlib
 import sys
+from functools import partial
 
 project_root = str(Path(__file__).parent)
 sys.path.append(project_root)
 
 from src.rag.rag_pipeline import RAGPipeline
 from src.vectorstore.vector_store import VectorStoreManager
+from src.vectorstore.store_cache import (
+    CachedStore,
+    VectorStoreCache,
+    estimate_store_bytes,
+    store_signature,
+    vectorstore_lock,
+)
 from src.agent.react_agent import ReActRAGAgent
+from src.rag.answer_cache import AnswerCache, dir_signature, make_key
+from src.vectorstore.ann_index import IndexSpec
+from src.vectorstore.embedding_cache import default_query_cache, embed_query
 
 load_dotenv()
 
@@ -113,36 +124,110 @@ class IngestRequest(BaseModel):
 
 # ────────────────────────────────────────────────────────────
 # Vector store + Document listHybrid retrieval
+# 进程级 LRU 缓存：FAISS 对象 + docstore 文档列表 + BM25
+# 目录签名（文件 mtime / generation）变化时自动重新加载，内存预算见 RAG_STORE_CACHE_MB
 # ────────────────────────────────────────────────────────────
+_store_cache = VectorStoreCache()
+
+
+def _load_store_snapshot(docs_dir: str) -> CachedStore:
+    """在向量库目录共享锁内加载一份完整快照（写者持排他锁替换文件，不会读到半成品）"""
+    from src.rag.hybrid_retriever import load_or_build_bm25, vectorstore_documents
+
+    vector_store_manager = _get_or_create_vsm(docs_dir)
+    vectorstore_path = os.path.join(docs_dir, "vectorstore")
+
+    with vectorstore_lock(vectorstore_path):
+        vectorstore = vector_store_manager.load_vectorstore(
+            vectorstore_path, trust_source=True
+        )
+
+        # FAISS docstore Document list BM25
+        documents = []
+        bm25 = None
+        try:
+            if hasattr(vectorstore, "docstore") and hasattr(
+                vectorstore.docstore, "_dict"
+            ):
+                documents = vectorstore_documents(vectorstore)
+                print(
+                    f"[RAG_app] 从 docstore 提取到 {len(documents)} 个文档块，启用混合检索"
+                )
+        except Exception as e:
+            print(f"[RAG_app] 提取 docstore 失败（{e}），混合检索降级为纯向量检索")
+
+        if documents:
+            try:
+                bm25 = load_or_build_bm25(
+                    vectorstore_path,
+                    documents,
+                    tombstones=getattr(vectorstore, "tombstones", None),
+                )
+            except Exception as e:
+                print(f"[RAG_app] 加载 BM25 索引失败（{e}），将按文档现场构建")
+
+        # load_or_build_bm25 可能重建 bm25.index，签名放在最后取
+        signature = store_signature(vectorstore_path)
+
+    return CachedStore(
+        vectorstore=vectorstore,
+        documents=documents,
+        bm25=bm25,
+        signature=signature,
+        nbytes=estimate_store_bytes(
+            vectorstore, documents, os.path.join(vectorstore_path, "bm25.index")
+        ),
+    )
 
 
 def _load_vectorstore_and_docs(docs_dir: str):
     """
-    加载向量存储，同时返回文档列表（供 BM25 使用）。
+    加载向量存储，同时返回文档列表与 BM25 检索器。
+    命中进程级缓存时不再读盘反序列化；索引文件变化后自动换入新版本。
     使用全局缓存的 VectorStoreManager，避免每次请求重新加载 embedding 模型。
+
+    Returns:
+        (vectorstore, documents, bm25, vector_store_manager)，bm25 在无文档时为 None
     """
-    vector_store_manager = _get_or_create_vsm(docs_dir)
     vectorstore_path = os.path.join(docs_dir, "vectorstore")
-
     if not os.path.exists(vectorstore_path):
         raise FileNotFoundError(f"向量存储路径不存在: {vectorstore_path}")
 
-    vectorstore = vector_store_manager.load_vectorstore(
-        vectorstore_path, trust_source=True
-    )
+    entry = _store_cache.get(docs_dir, vectorstore_path, _load_store_snapshot)
+    return entry.vectorstore, entry.documents, entry.bm25, _get_or_create_vsm(docs_dir)
 
-    # FAISS docstore Document list BM25
-    documents = []
-    try:
-        if hasattr(vectorstore, "docstore") and hasattr(vectorstore.docstore, "_dict"):
-            documents = list(vectorstore.docstore._dict.values())
-            print(
-                f"[RAG_app] 从 docstore 提取到 {len(documents)} 个文档块，启用混合检索"
-            )
-    except Exception as e:
-        print(f"[RAG_app] 提取 docstore 失败（{e}），混合检索降级为纯向量检索")
 
-    return vectorstore, documents, vector_store_manager
+# ────────────────────────────────────────────────────────────
+# 回答缓存 + 相同请求合并
+# key = (接口, 知识库目录, 模型, use_hybrid, 规范化 query)，索引签名变化时该知识库条目失效
+# 配置见 RAG_ANSWER_CACHE_SIZE / RAG_ANSWER_CACHE_TTL / RAG_ANSWER_CACHE_SIM
+# ────────────────────────────────────────────────────────────
+_answer_cache = AnswerCache()
+_native_encoders: dict = {}
+
+
+def _query_embedder(docs_dir: str):
+    """语义查找用的 query 向量函数（复用该目录的 embedding 模型，开启语义查找时才加载）"""
+    return lambda q: embed_query(_get_or_create_vsm(docs_dir).embeddings, q)
+
+
+def _native_query_embedder(vs_path: str):
+    """原生向量库的 query 向量函数，按 embedding 模型名缓存编码器"""
+
+    def embed(q: str):
+        from src.rag.native_rag import NativeVectorStore
+
+        model_name = "sentence-transformers/all-MiniLM-L6-v2"
+        config_path = os.path.join(vs_path, "native_config.json")
+        if os.path.exists(config_path):
+            with open(config_path) as f:
+                model_name = json.load(f).get("model_name", model_name)
+        encoder = _native_encoders.get(model_name)
+        if encoder is None:
+            encoder = _native_encoders[model_name] = NativeVectorStore(model_name)
+        return encoder.query_vector(q)
+
+    return embed
 
 
 # ────────────────────────────────────────────────────────────
@@ -185,25 +270,24 @@ async def process_query(query_body: QueryRequest):
     - 附带引用溯源（SOURCES: 行）
     """
 
+    if query_body.docs_dir:
+        docs_dir = query_body.docs_dir
+    else:
+        vectorstore_path = os.getenv("VECTORSTORE_PATH", "")
+        docs_dir = str(Path(vectorstore_path).parent) if vectorstore_path else ""
+    model_id, provider, is_cloud = _resolve_rag_model(query_body.model)
+
     async def generate():
         try:
             yield f"data: 开始处理查询: {query_body.query}\n\n"
 
-            if query_body.docs_dir:
-                docs_dir = query_body.docs_dir
-            else:
-                vectorstore_path = os.getenv("VECTORSTORE_PATH", "")
-                docs_dir = (
-                    str(Path(vectorstore_path).parent) if vectorstore_path else ""
-                )
-
             if not docs_dir or not os.path.exists(docs_dir):
                 yield "data: ERROR: 文档目录未指定或不存在\n\n"
                 return
 
             yield "data: 正在加载向量存储...\n\n"
             try:
-                vectorstore, documents, _ = _load_vectorstore_and_docs(docs_dir)
+                vectorstore, documents, bm25, _ = _load_vectorstore_and_docs(docs_dir)
             except FileNotFoundError as e:
                 yield f"data: ERROR: {str(e)}\n\n"
                 return
@@ -213,7 +297,6 @@ async def process_query(query_body: QueryRequest):
             use_hybrid = query_body.use_hybrid and bool(documents)
             yield f"data: 检索模式: {'混合检索(BM25+向量)' if use_hybrid else '纯向量检索'}\n\n"
 
-            model_id, provider, is_cloud = _resolve_rag_model(query_body.model)
             yield f"data: 使用模型: {model_id}（{'云端·' + provider if is_cloud else 'Ollama 本地'}）\n\n"
 
             # - Cloud model -
@@ -227,6 +310,7 @@ async def process_query(query_body: QueryRequest):
                         bm25_top_k=3,
                         vector_top_k=3,
                         final_top_k=3,
+                        bm25=bm25,
                     )
                     results = retriever.retrieve_with_scores(query_body.query)
                 else:
@@ -323,6 +407,7 @@ async def process_query(query_body: QueryRequest):
                 vectorstore=vectorstore,
                 documents=documents if use_hybrid else None,
                 use_hybrid=use_hybrid,
+                bm25=bm25,
             )
 
             loop = asyncio.get_event_loop()
@@ -345,8 +430,27 @@ async def process_query(query_body: QueryRequest):
 
             yield f"data: ERROR: {str(e)}\n{traceback.format_exc()}\n\n"
 
+    vectorstore_path = os.path.join(docs_dir, "vectorstore") if docs_dir else ""
+    if vectorstore_path and os.path.exists(vectorstore_path):
+        # 相同问题命中缓存直接回放；正在生成时共享同一次生成
+        key = make_key(
+            "rag_stream",
+            os.path.abspath(docs_dir),
+            model_id,
+            query_body.query,
+            query_body.use_hybrid,
+        )
+        stream = _answer_cache.stream(
+            key,
+            store_signature(vectorstore_path),
+            generate,
+            embed=_query_embedder(docs_dir),
+        )
+    else:
+        stream = generate()
+
     return StreamingResponse(
-        generate(),
+        stream,
         media_type="text/event-stream",
         headers={"Cache-Control": "no-cache", "Connection": "keep-alive"},
     )
@@ -364,19 +468,36 @@ async def process_query_sync(query_body: QueryRequest):
         if not query_body.docs_dir or not os.path.exists(query_body.docs_dir):
             raise HTTPException(status_code=400, detail="文档目录未指定或不存在")
 
-        vectorstore, documents, _ = _load_vectorstore_and_docs(query_body.docs_dir)
-        use_hybrid = query_body.use_hybrid and bool(documents)
-
         model_id, provider, is_cloud = _resolve_rag_model(query_body.model)
 
-        rag = RAGPipeline(
-            llm_model=model_id,
-            vectorstore=vectorstore,
-            documents=documents if use_hybrid else None,
-            use_hybrid=use_hybrid,
-        )
+        def _run_sync():
+            vectorstore, documents, bm25, _ = _load_vectorstore_and_docs(
+                query_body.docs_dir
+            )
+            use_hybrid = query_body.use_hybrid and bool(documents)
 
-        result = rag.process_query(query_body.query)
+            rag = RAGPipeline(
+                llm_model=model_id,
+                vectorstore=vectorstore,
+                documents=documents if use_hybrid else None,
+                use_hybrid=use_hybrid,
+                bm25=bm25,
+            )
+            return rag.process_query(query_body.query)
+
+        key = make_key(
+            "rag_sync",
+            os.path.abspath(query_body.docs_dir),
+            model_id,
+            query_body.query,
+            query_body.use_hybrid,
+        )
+        result = await _answer_cache.run(
+            key,
+            store_signature(os.path.join(query_body.docs_dir, "vectorstore")),
+            lambda: asyncio.to_thread(_run_sync),
+            embed=_query_embedder(query_body.docs_dir),
+        )
         return {
             "status": "success",
             "model": model_id,
@@ -412,10 +533,12 @@ async def ingest_documents(ingest_body: IngestRequest):
         import traceback
 
         try:
-            from src.ingestion.document_loader import DocumentLoader
+            from src.ingestion.document_loader import DocumentLoader, load_file_chunks
+            from src.ingestion.parallel_loader import ParallelLoader
             from src.vectorstore.vector_store import VectorStoreManager
 
             _vsm_cache.pop(ingest_body.docs_dir, None)
+            _store_cache.invalidate(ingest_body.docs_dir)
             vector_store_manager = VectorStoreManager(docs_dir=ingest_body.docs_dir)
             vectorstore_path = ingest_body.docs_dir + "/vectorstore"
 
@@ -437,8 +560,10 @@ async def ingest_documents(ingest_body: IngestRequest):
 
             msg_queue.put_nowait("data: Walking through directory to process files\n\n")
 
+            # 1. 收集待解析文件（按路径排序，入库顺序可复现）
+            file_paths = []
             for root, dirs, files in os.walk(ingest_body.docs_dir):
-                dirs[:] = [d for d in dirs if d not in loader.IGNORED_DIRECTORIES]
+                dirs[:] = sorted(d for d in dirs if d not in loader.IGNORED_DIRECTORIES)
                 if "vectorstore" in os.path.basename(root):
                     msg_queue.put_nowait(
                         f"data: Skipping vectorstore directory: {root}\n\n"
@@ -447,45 +572,40 @@ async def ingest_documents(ingest_body: IngestRequest):
 
                 msg_queue.put_nowait(f"data: Found {len(files)} files in {root}\n\n")
 
-                for file in files:
+                for file in sorted(files):
                     file_path = os.path.join(root, file)
-                    try:
-                        should_skip, skip_reason = loader.should_skip_file(file_path)
-                        if should_skip:
-                            msg_queue.put_nowait(
-                                f"data: Skipping file: {file} ({skip_reason})\n\n"
-                            )
-                            skipped_count += 1
-                            continue
-
-                        msg_queue.put_nowait(f"data: Processing file: {file_path}\n\n")
-                        docs = loader.load_document(file_path)
+                    should_skip, skip_reason = loader.should_skip_file(file_path)
+                    if should_skip:
                         msg_queue.put_nowait(
-                            f"data: Successfully loaded {len(docs)} document chunks from {file_path}\n\n"
+                            f"data: Skipping file: {file} ({skip_reason})\n\n"
                         )
-                        documents.extend(docs)
-                        processed_count += 1
-
-                    except ValueError as ve:
-                        if "Skipped file" in str(ve):
-                            msg_queue.put_nowait(
-                                f"data: Skipping file: {file} ({str(ve)})\n\n"
-                            )
-                            skipped_count += 1
-                        else:
-                            msg_queue.put_nowait(
-                                f"data: Unsupported file type {file_path}: {str(ve)}\n\n"
-                            )
-                            error_count += 1
-                    except Exception as e:
-                        msg_queue.put_nowait(
-                            f"data: Error processing {file_path}: {str(e)}\n\n"
-                        )
-                        error_count += 1
+                        skipped_count += 1
+                        continue
+                    file_paths.append(file_path)
+
+            # 2. 进程池并行解析 + 分块（单文件超时 / 失败只影响该文件）
+            parallel_loader = ParallelLoader(
+                partial(load_file_chunks, docs_dir=ingest_body.docs_dir)
+            )
+            for result in parallel_loader.iter_load(file_paths):
+                if result.ok:
+                    msg_queue.put_nowait(
+                        f"data: Successfully loaded {len(result.documents)} document chunks from {result.path}\n\n"
+                    )
+                    documents.extend(result.documents)
+                    processed_count += 1
+                else:
+                    msg_queue.put_nowait(
+                        f"data: Error processing {result.path}: {result.error}\n\n"
+                    )
+                    error_count += 1
 
             msg_queue.put_nowait(
                 f"data: Processing summary: {processed_count} processed, {skipped_count} skipped, {error_count} errors\n\n"
             )
+            msg_queue.put_nowait(
+                f"data: Parsing throughput: {parallel_loader.last_stats.summary()}\n\n"
+            )
 
             if not documents:
                 msg_queue.put_nowait(
@@ -510,6 +630,7 @@ async def ingest_documents(ingest_body: IngestRequest):
                     "processed": processed_count,
                     "skipped": skipped_count,
                     "errors": error_count,
+                    "parsing": parallel_loader.last_stats.to_dict(),
                 },
             }
             msg_queue.put_nowait(f"data: {json.dumps(result)}\n\n")
@@ -580,6 +701,8 @@ async def rag_health_check():
             "streaming",
             "react_agent",
         ],
+        "answer_cache": _answer_cache.stats(),
+        "query_embedding_cache": default_query_cache().stats(),
     }
 
 
@@ -623,7 +746,7 @@ async def agent_query(query_body: AgentQueryRequest):
 
             yield "data: 📂 正在加载向量存储...\n\n"
             try:
-                vectorstore, documents, _ = _load_vectorstore_and_docs(docs_dir)
+                vectorstore, documents, bm25, _ = _load_vectorstore_and_docs(docs_dir)
             except FileNotFoundError as e:
                 yield f"data: ERROR: {str(e)}\n\n"
                 return
@@ -704,10 +827,11 @@ async def native_ingest_documents(req: NativeIngestRequest):
 
         try:
             from src.rag.native_rag import (
-                load_documents_from_dir,
-                split_documents,
+                iter_documents_from_dir,
+                iter_split_documents,
                 NativeVectorStore,
             )
+            from src.ingestion.parallel_loader import LoadStats
 
             msg_queue.put_nowait(
                 f"data: [原生RAG] 开始向量化，目录: {req.docs_dir}\n\n"
@@ -717,29 +841,38 @@ async def native_ingest_documents(req: NativeIngestRequest):
                 msg_queue.put_nowait(f"data: [ERROR] 目录不存在: {req.docs_dir}\n\n")
                 return
 
-            # 1.
-            msg_queue.put_nowait("data: [原生RAG] 正在加载文档...\n\n")
-            raw_docs = load_documents_from_dir(req.docs_dir)
-            if not raw_docs:
-                msg_queue.put_nowait("data: [ERROR] 未找到可加载的文档\n\n")
-                return
-            msg_queue.put_nowait(
-                f"data: [原生RAG] 加载完成，共 {len(raw_docs)} 页原始文档\n\n"
-            )
+            # 流式入库：逐页读取 → 分块 → 按批编码并写入索引，大 PDF 不整本驻留内存
+            def on_page(file_path: str, page: int, n_pages: int):
+                if page == n_pages or page % 20 == 0:
+                    msg_queue.put_nowait(
+                        f"data: [原生RAG] {os.path.basename(file_path)}: "
+                        f"已读取 {page}/{n_pages} 页\n\n"
+                    )
+
+            def on_flush(n_chunks: int):
+                msg_queue.put_nowait(
+                    f"data: [原生RAG] 已向量化 {n_chunks} 个文本块\n\n"
+                )
 
-            # 2.
-            msg_queue.put_nowait("data: [原生RAG] 正在分块...\n\n")
-            chunks = split_documents(raw_docs, chunk_size=1000, chunk_overlap=200)
             msg_queue.put_nowait(
-                f"data: [原生RAG] 分块完成，共 {len(chunks)} 个文本块\n\n"
+                "data: [原生RAG] 正在加载、分块并计算向量（sentence-transformers）...\n\n"
             )
-
-            # 3. event loop
+            load_stats = LoadStats()
+            pages = iter_documents_from_dir(
+                req.docs_dir, on_page=on_page, stats=load_stats
+            )
+            chunks = iter_split_documents(pages, chunk_size=1000, chunk_overlap=200)
+            vs = NativeVectorStore(
+                model_name="sentence-transformers/all-MiniLM-L6-v2",
+                index_spec=IndexSpec.from_kb_dir(req.docs_dir),
+            )
+            n_chunks = vs.build_index_streaming(chunks, on_flush=on_flush)
+            if not n_chunks:
+                msg_queue.put_nowait("data: [ERROR] 未找到可加载的文档\n\n")
+                return
             msg_queue.put_nowait(
-                "data: [原生RAG] 正在计算向量（sentence-transformers）...\n\n"
+                f"data: [原生RAG] 文档解析: {load_stats.summary()}\n\n"
             )
-            vs = NativeVectorStore(model_name="sentence-transformers/all-MiniLM-L6-v2")
-            vs.build_index(chunks)
 
             # 4.
             save_path = os.path.join(req.docs_dir, "native_vectorstore")
@@ -747,8 +880,8 @@ async def native_ingest_documents(req: NativeIngestRequest):
             msg_queue.put_nowait(f"data: [原生RAG] 向量存储已保存至: {save_path}\n\n")
 
             result = {
-                "message": f"[原生RAG] 向量化完成，共 {len(chunks)} 个文本块",
-                "documents_count": len(chunks),
+                "message": f"[原生RAG] 向量化完成，共 {n_chunks} 个文本块",
+                "documents_count": n_chunks,
                 "vectorstore_path": save_path,
             }
             msg_queue.put_nowait(f"data: {json.dumps(result, ensure_ascii=False)}\n\n")
@@ -948,8 +1081,23 @@ async def native_query(req: NativeQueryRequest):
 
             yield f"data: [ERROR] 原生 RAG 查询失败: {e}\n{traceback.format_exc()}\n\n"
 
+    vs_path = os.path.join(req.docs_dir, "native_vectorstore")
+    if os.path.isdir(vs_path):
+        key = make_key(
+            "native_stream",
+            os.path.abspath(req.docs_dir),
+            _resolve_rag_model(req.model)[0],
+            req.query,
+            req.use_hybrid,
+        )
+        stream = _answer_cache.stream(
+            key, dir_signature(vs_path), generate, embed=_native_query_embedder(vs_path)
+        )
+    else:
+        stream = generate()
+
     return StreamingResponse(
-        generate(),
+        stream,
         media_type="text/event-stream",
         headers={"Cache-Control": "no-cache", "Connection": "keep-alive"},
     )
@@ -966,7 +1114,9 @@ async def agent_query_sync(query_body: AgentQueryRequest):
         if not query_body.docs_dir or not os.path.exists(query_body.docs_dir):
             raise HTTPException(status_code=400, detail="文档目录未指定或不存在")
 
-        vectorstore, documents, _ = _load_vectorstore_and_docs(query_body.docs_dir)
+        vectorstore, documents, bm25, _ = _load_vectorstore_and_docs(
+            query_body.docs_dir
+        )
 
         model_id, _, _ = _resolve_rag_model(getattr(query_body, "model", None))
         agent = ReActRAGAgent(
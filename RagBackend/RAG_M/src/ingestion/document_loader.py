@@ -1,5 +1,5 @@
 import os
-from typing import List, Optional
+from typing import Callable, Iterator, List, Optional
 from langchain_community.document_loaders import (
     PyPDFLoader,
     TextLoader,
@@ -126,6 +126,22 @@ class DocumentLoader:
             file_path: Local file path or Google Drive file ID
             is_google_drive: Whether the file is from Google Drive
         """
+        return list(self.iter_document(file_path, is_google_drive=is_google_drive))
+
+    def iter_document(
+        self,
+        file_path: str,
+        is_google_drive: bool = False,
+        on_page: Optional[Callable[[str, int], None]] = None,
+    ) -> Iterator:
+        """
+        流式加载并分块：每读入一页立即切分并产出文本块，PDF 不再整本读入页面列表
+
+        Args:
+            file_path: Local file path or Google Drive file ID
+            is_google_drive: Whether the file is from Google Drive
+            on_page: 每读入一页回调 on_page(file_path, page)，page 从 1 开始
+        """
         should_skip, skip_reason = self.should_skip_file(file_path)
         if should_skip:
             raise ValueError(
@@ -144,75 +160,95 @@ class DocumentLoader:
 
         # Error handling
         if file_extension == ".pdf":
-            try:
-                loader = PyPDFLoader(file_path)
-                documents = loader.load()
-                if not documents or all(
-                    not doc.page_content.strip() for doc in documents
-                ):
-                    raise ValueError(
-                        f"PDF 解析内容为空，该文件可能是扫描件或加密文件：{os.path.basename(file_path)}"
-                    )
-            except Exception as pdf_err:
-                # pdfplumber
-                try:
-                    import pdfplumber
-
-                    text_pages = []
-                    with pdfplumber.open(file_path) as pdf:
-                        for i, page in enumerate(pdf.pages):
-                            text = page.extract_text() or ""
-                            if text.strip():
-                                from langchain.schema import Document
-
-                                text_pages.append(
-                                    Document(
-                                        page_content=text,
-                                        metadata={"source": file_path, "page": i},
-                                    )
-                                )
-                    if text_pages:
-                        documents = text_pages
-                        print(
-                            f"[PDF fallback] 使用 pdfplumber 成功解析 {os.path.basename(file_path)}"
-                        )
-                    else:
-                        raise ValueError(
-                            f"PDF 内容为空（可能是扫描件）：{os.path.basename(file_path)}"
-                        )
-                except ImportError:
-                    # pdfplumber
-                    raise ValueError(
-                        f"PDF 解析失败（{pdf_err}）。建议安装 pdfplumber: pip install pdfplumber，或将 PDF 转为 TXT 后上传。"
-                    )
+            pages = self._iter_pdf_pages(file_path)
         elif file_extension in [".txt", ".md"]:
             try:
                 # 1.
                 normalized_path = os.path.normpath(file_path)
                 # 2. utf-8
                 loader = TextLoader(normalized_path, encoding="utf-8")
-                documents = loader.load()
+                pages = loader.load()
             except UnicodeDecodeError:
                 # 3. utf-8latin-1
                 loader = TextLoader(normalized_path, encoding="latin-1")
-                documents = loader.load()
+                pages = loader.load()
             except Exception as e:
                 # 4.
                 print(f"Error loading text file {file_path}: {str(e)}")
                 raise ValueError(f"Error loading {file_path}: {str(e)}")
         elif file_extension in [".xlsx", ".xls"]:
-            loader = UnstructuredExcelLoader(file_path)
+            pages = UnstructuredExcelLoader(file_path).lazy_load()
         elif file_extension == ".csv":
-            loader = CSVLoader(file_path)
+            pages = CSVLoader(file_path).lazy_load()
         elif file_extension == ".docx":
             try:
                 loader = Docx2txtLoader(file_path)
             except (ImportError, IOError):
                 loader = UnstructuredWordDocumentLoader(file_path)
+            pages = loader.lazy_load()
         else:
             raise ValueError(f"Unsupported file type: {file_extension}")
 
-        # documentsloader.load()
-        if "documents" not in locals():
-            documents = loader.load()
-        return self.text_splitter.split_documents(documents)
+        for i, page in enumerate(pages, start=1):
+            if on_page is not None:
+                on_page(file_path, i)
+            yield from self.text_splitter.split_documents([page])
+
+    def _iter_pdf_pages(self, file_path: str) -> Iterator:
+        """
+        逐页读取 PDF：优先 PyPDFLoader.lazy_load，只产出有文本的页；
+        尚未产出任何页时解析失败或全部为空（扫描件）则回退 pdfplumber 逐页读取
+        """
+        yielded = 0
+        try:
+            for page in PyPDFLoader(file_path).lazy_load():
+                if page.page_content.strip():
+                    yielded += 1
+                    yield page
+            if not yielded:
+                raise ValueError(
+                    f"PDF 解析内容为空，该文件可能是扫描件或加密文件：{os.path.basename(file_path)}"
+                )
+            return
+        except Exception as pdf_err:
+            if yielded:
+                raise
+            # pdfplumber
+            try:
+                import pdfplumber
+            except ImportError:
+                # pdfplumber
+                raise ValueError(
+                    f"PDF 解析失败（{pdf_err}）。建议安装 pdfplumber: pip install pdfplumber，或将 PDF 转为 TXT 后上传。"
+                )
+
+        from langchain.schema import Document
+
+        with pdfplumber.open(file_path) as pdf:
+            for i, page in enumerate(pdf.pages):
+                text = page.extract_text() or ""
+                if text.strip():
+                    yielded += 1
+                    yield Document(
+                        page_content=text,
+                        metadata={"source": file_path, "page": i},
+                    )
+                # 释放 pdfplumber 对已处理页面的对象缓存
+                page.flush_cache()
+        if not yielded:
+            raise ValueError(
+                f"PDF 内容为空（可能是扫描件）：{os.path.basename(file_path)}"
+            )
+        print(f"[PDF fallback] 使用 pdfplumber 成功解析 {os.path.basename(file_path)}")
+
+
+# 进程池任务（parallel_loader）：每个子进程按知识库目录缓存一个 DocumentLoader
+_process_loaders = {}
+
+
+def load_file_chunks(file_path: str, docs_dir: Optional[str] = None) -> List:
+    """解析并分块单个文件，供 ParallelLoader 在子进程中调用"""
+    loader = _process_loaders.get(docs_dir)
+    if loader is None:
+        loader = _process_loaders[docs_dir] = DocumentLoader(docs_dir=docs_dir)
+    return loader.load_document(file_path)
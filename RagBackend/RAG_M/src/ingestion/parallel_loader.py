@@ -0,0 +1,291 @@
+"""
+parallel_loader.py
+目录入库的并行文件解析：每个文件一个任务，分发到 CPU 进程池
+
+  解析（ParallelLoader） → 分块 → 编码（BatchEmbedder） → 写入
+
+  - load_fn(file_path) 在子进程中执行，返回该文件的文档列表（页 / 文本块）
+  - 结果按输入顺序产出，与串行加载一致（向量库中 chunk 顺序可复现）
+  - 单文件超时：超时文件记为失败，卡住的子进程连同进程池一起终止重建，
+    其余在途文件重新提交；单文件异常只影响该文件
+  - 子进程崩溃（BrokenProcessPool）时无法判断是哪个文件所致：在途文件逐个在单进程池中重试，
+    只有单独运行时仍崩溃的文件记为失败，同批的正常文件不受牵连
+  - 在途 + 已完成未产出的文件数不超过 workers × 2，内存占用与目录大小无关
+  - 统计吞吐（LoadStats）：文件数 / 页数 / MB、files/s、MB/s
+
+workers <= 1、只有一个文件或文件总量小于 RAG_INGEST_PARALLEL_MIN_MB 时不启进程池，
+由调用方在当前进程内逐个解析（启动 spawn 进程的开销大于并行收益）。
+load_fn 须为模块顶层函数或其 functools.partial（spawn 子进程按模块路径导入）。
+
+配置（环境变量）：
+  RAG_INGEST_WORKERS          解析进程数，默认 CPU 核数
+  RAG_INGEST_FILE_TIMEOUT     单文件解析超时（秒），默认 300
+  RAG_INGEST_PARALLEL_MIN_MB  启用进程池的最小文件总量（MB），默认 4
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+DEFAULT_WORKERS = int(os.getenv("RAG_INGEST_WORKERS", "0")) or (os.cpu_count() or 1)
+DEFAULT_FILE_TIMEOUT = float(os.getenv("RAG_INGEST_FILE_TIMEOUT", "300"))
+PARALLEL_MIN_BYTES = int(
+    float(os.getenv("RAG_INGEST_PARALLEL_MIN_MB", "4")) * 1024 * 1024
+)
+
+
+@dataclass
+class FileResult:
+    """单个文件的解析结果；error 非空时 documents 为空"""
+
+    path: str
+    documents: List[Any] = field(default_factory=list)
+    error: Optional[str] = None
+    timed_out: bool = False
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class LoadStats:
+    files: int = 0
+    failed: int = 0
+    timed_out: int = 0
+    documents: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    workers: int = 1
+
+    def record(self, path: str, documents: int, error: bool, timed_out: bool = False):
+        self.files += 1
+        self.failed += int(error)
+        self.timed_out += int(timed_out)
+        self.documents += documents
+        self.bytes += _file_size(path)
+
+    @property
+    def files_per_sec(self) -> float:
+        return self.files / self.seconds if self.seconds else 0.0
+
+    @property
+    def mb_per_sec(self) -> float:
+        return self.bytes / 1024 / 1024 / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = asdict(self)
+        d["seconds"] = round(self.seconds, 3)
+        d["files_per_sec"] = round(self.files_per_sec, 2)
+        d["mb_per_sec"] = round(self.mb_per_sec, 2)
+        return d
+
+    def summary(self) -> str:
+        return (
+            f"{self.files} 个文件（失败 {self.failed}，超时 {self.timed_out}），"
+            f"{self.documents} 页，{self.bytes / 1024 / 1024:.1f} MB，"
+            f"耗时 {self.seconds:.2f}s，{self.files_per_sec:.1f} 文件/s，"
+            f"{self.mb_per_sec:.1f} MB/s，workers={self.workers}"
+        )
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _load_one(load_fn: Callable[[str], List[Any]], path: str) -> Tuple[List, float]:
+    """子进程入口：解析单个文件并计时"""
+    t0 = time.perf_counter()
+    documents = list(load_fn(path))
+    return documents, time.perf_counter() - t0
+
+
+def _terminate(pool: ProcessPoolExecutor) -> None:
+    """终止进程池（包括仍在解析的子进程）；shutdown 本身不会中断运行中的任务"""
+    processes = list((getattr(pool, "_processes", None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+
+class ParallelLoader:
+    """
+    进程池文件解析器。
+
+    用法：
+        loader = ParallelLoader(load_file, workers=8, timeout=120)
+        for result in loader.iter_load(paths):   # 按 paths 顺序
+            if result.ok: docs.extend(result.documents)
+        print(loader.last_stats.summary())
+    """
+
+    def __init__(
+        self,
+        load_fn: Callable[[str], List[Any]],
+        workers: Optional[int] = None,
+        timeout: Optional[float] = None,
+        min_parallel_bytes: Optional[int] = None,
+    ):
+        self.load_fn = load_fn
+        self.workers = max(1, workers or DEFAULT_WORKERS)
+        self.timeout = timeout or DEFAULT_FILE_TIMEOUT
+        self.min_parallel_bytes = (
+            PARALLEL_MIN_BYTES if min_parallel_bytes is None else min_parallel_bytes
+        )
+        self.last_stats = LoadStats()
+
+    def pool_size(self, paths: List[str]) -> int:
+        """paths 实际使用的进程数；1 表示应在当前进程内解析"""
+        workers = min(self.workers, len(paths))
+        if workers <= 1:
+            return 1
+        if sum(_file_size(p) for p in paths) < self.min_parallel_bytes:
+            return 1
+        return workers
+
+    def iter_load(
+        self, paths: Iterable[str], stats: Optional[LoadStats] = None
+    ) -> Iterator[FileResult]:
+        """按输入顺序逐个产出 FileResult；stats 为 None 时新建，可通过 last_stats 读取"""
+        paths = list(paths)
+        stats = stats if stats is not None else LoadStats()
+        self.last_stats = stats
+        workers = self.pool_size(paths)
+        stats.workers = workers
+        t0 = time.perf_counter()
+        results = (
+            self._iter_inline(paths)
+            if workers <= 1
+            else self._iter_pool(paths, workers)
+        )
+        try:
+            for result in results:
+                stats.record(
+                    result.path, len(result.documents), not result.ok, result.timed_out
+                )
+                stats.seconds = time.perf_counter() - t0
+                yield result
+        finally:
+            results.close()
+            stats.seconds = time.perf_counter() - t0
+        print(f"[ParallelLoader] 解析完成: {stats.summary()}")
+
+    def load(self, paths: Iterable[str]) -> List[FileResult]:
+        return list(self.iter_load(paths))
+
+    def _iter_inline(self, paths: List[str]) -> Iterator[FileResult]:
+        for path in paths:
+            try:
+                documents, seconds = _load_one(self.load_fn, path)
+                yield FileResult(path, documents, seconds=seconds)
+            except Exception as e:
+                yield FileResult(path, error=f"{type(e).__name__}: {e}")
+
+    def _new_pool(self, workers: int) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def _iter_pool(self, paths: List[str], workers: int) -> Iterator[FileResult]:
+        n = len(paths)
+        window = workers * 2
+        pool = self._new_pool(workers)
+        pending: Dict[Future, Tuple[int, float]] = {}  # future -> (下标, 截止时间)
+        finished: Dict[int, FileResult] = {}
+        isolate: List[int] = []  # 崩溃时在途的文件，逐个单独重试
+        isolating = False  # 当前进程池是否为单文件隔离池
+        next_submit = next_yield = 0
+
+        def submit(i: int) -> None:
+            future = pool.submit(_load_one, self.load_fn, paths[i])
+            pending[future] = (i, time.monotonic() + self.timeout)
+
+        try:
+            while next_yield < n:
+                if not pending and isolating != bool(isolate):
+                    # 隔离重试完毕（或开始隔离）：切换进程池规模
+                    pool.shutdown(wait=True)
+                    isolating = bool(isolate)
+                    pool = self._new_pool(1 if isolating else workers)
+                if isolating:
+                    if not pending and isolate:
+                        submit(isolate.pop(0))
+                else:
+                    # 同时运行的任务不超过进程数，截止时间即从开始解析算起
+                    while (
+                        next_submit < n
+                        and len(pending) < workers
+                        and next_submit - next_yield < window
+                    ):
+                        submit(next_submit)
+                        next_submit += 1
+                if next_yield in finished:
+                    yield finished.pop(next_yield)
+                    next_yield += 1
+                    continue
+
+                nearest = min(deadline for _, deadline in pending.values())
+                done, _ = wait(
+                    list(pending),
+                    timeout=max(0.0, nearest - time.monotonic()),
+                    return_when=FIRST_COMPLETED,
+                )
+                crashed = []
+                for future in done:
+                    i, _ = pending.pop(future)
+                    try:
+                        documents, seconds = future.result()
+                        finished[i] = FileResult(paths[i], documents, seconds=seconds)
+                    except BrokenProcessPool:
+                        crashed.append(i)
+                    except Exception as e:
+                        finished[i] = FileResult(
+                            paths[i], error=f"{type(e).__name__}: {e}"
+                        )
+
+                now = time.monotonic()
+                expired = [f for f, (_, deadline) in pending.items() if deadline <= now]
+                for future in expired:
+                    i, _ = pending.pop(future)
+                    print(f"[ParallelLoader] 解析超时，已终止: {paths[i]}")
+                    finished[i] = FileResult(
+                        paths[i],
+                        error=f"解析超时（>{self.timeout:g}s）",
+                        timed_out=True,
+                        seconds=self.timeout,
+                    )
+
+                if expired or crashed:
+                    # 运行中的任务无法单独取消：终止整个进程池
+                    in_flight = [i for i, _ in pending.values()]
+                    pending.clear()
+                    _terminate(pool)
+                    if crashed and isolating:
+                        # 单独运行时崩溃：确定是该文件所致
+                        for i in crashed:
+                            print(f"[ParallelLoader] 解析进程异常退出: {paths[i]}")
+                            finished[i] = FileResult(paths[i], error="解析进程异常退出")
+                    elif crashed:
+                        isolate.extend(sorted(crashed + in_flight))
+                        in_flight = []
+                    isolating = bool(isolate)
+                    pool = self._new_pool(1 if isolating else workers)
+                    # 仅超时：其余在途文件重新提交
+                    for i in sorted(in_flight):
+                        submit(i)
+        finally:
+            if pending:
+                _terminate(pool)
+            else:
+                pool.shutdown(wait=True)
@@ -0,0 +1,325 @@
+"""
+answer_cache.py
+RAG 回答缓存 + 相同请求合并（request coalescing）
+
+  - AnswerCache.stream   SSE 流式接口：命中缓存直接回放；相同请求正在生成时跟随同一次生成，
+                         逐块推送给所有等待者；否则启动一次生成，完成后写入缓存
+  - AnswerCache.run      非流式接口：相同请求共享同一个结果（同一个 asyncio.Task）
+
+缓存 key 为 (namespace, kb, model, 选项..., 规范化 query)：
+  - 规范化：NFKC、转小写、合并空白、去掉末尾标点（「什么是RAG？」与「什么是 rag」视为同一问题）
+  - 可选语义查找：RAG_ANSWER_CACHE_SIM > 0 且调用方提供 embed 时，
+    同一 (namespace, kb, model, 选项) 下余弦相似度不低于阈值的已缓存问题也算命中
+  - TTL + LRU 淘汰
+  - 失效：调用方传入知识库索引签名（文件 mtime / generation），签名变化时清空该知识库的全部条目
+
+生成任务独立于发起请求的连接运行：首个请求的客户端断开不影响其余等待者，
+生成完成后结果照常写入缓存。只有完整成功的回答才会被缓存。
+
+配置（环境变量）：
+  RAG_ANSWER_CACHE_SIZE   最大条目数，默认 512；0 表示只合并请求、不缓存
+  RAG_ANSWER_CACHE_TTL    条目有效期（秒），默认 3600
+  RAG_ANSWER_CACHE_SIM    语义查找的余弦相似度阈值，默认 0（关闭），建议 0.95 左右
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+import numpy as np
+
+_DEFAULT_SIZE = int(os.getenv("RAG_ANSWER_CACHE_SIZE", "512"))
+_DEFAULT_TTL = float(os.getenv("RAG_ANSWER_CACHE_TTL", "3600"))
+_DEFAULT_SIM = float(os.getenv("RAG_ANSWER_CACHE_SIM", "0"))
+
+_TRAILING_PUNCT = "?？。.!！~～ "
+_ERROR_MARKERS = ("data: ERROR", "data: [ERROR]", "data: [云端模型错误]")
+
+
+def normalize_query(query: str) -> str:
+    """NFKC + 小写 + 合并空白 + 去掉末尾标点"""
+    q = unicodedata.normalize("NFKC", query).lower()
+    q = re.sub(r"\s+", " ", q).strip()
+    return q.rstrip(_TRAILING_PUNCT)
+
+
+def make_key(namespace: str, kb: str, model: str, query: str, *options) -> Tuple:
+    """缓存 key：最后一项为规范化 query，其余部分决定语义查找的范围"""
+    return (namespace, kb, model, *options, normalize_query(query))
+
+
+def dir_signature(path: str) -> Tuple:
+    """目录签名：目录下各文件的 (name, mtime_ns, size)，用于没有 generation 文件的索引"""
+    sig = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith("."):
+                    st = entry.stat()
+                    sig.append((entry.name, st.st_mtime_ns, st.st_size))
+    except OSError:
+        pass
+    return tuple(sorted(sig))
+
+
+def sse_answer_complete(chunks: List[str]) -> bool:
+    """SSE 回答是否完整成功：以 COMPLETE 结尾且中途没有错误行"""
+    if not chunks or chunks[-1].strip() != "data: COMPLETE":
+        return False
+    return not any(c.startswith(_ERROR_MARKERS) for c in chunks)
+
+
+# ─────────────────────────────────────────────────────────────────
+# 缓存条目 / 进行中的生成
+# ─────────────────────────────────────────────────────────────────
+
+
+@dataclass
+class _Entry:
+    value: Any
+    expires_at: float
+    vec: Optional[np.ndarray] = None
+
+
+@dataclass
+class _Flight:
+    """一次进行中的流式生成，所有等待者共享 chunks"""
+
+    chunks: List[str] = field(default_factory=list)
+    done: bool = False
+    error: Optional[BaseException] = None
+    cond: asyncio.Condition = field(default_factory=asyncio.Condition)
+    task: Optional[asyncio.Task] = None
+
+    async def follow(self) -> AsyncIterator[str]:
+        i = 0
+        while True:
+            async with self.cond:
+                await self.cond.wait_for(lambda: len(self.chunks) > i or self.done)
+                new = self.chunks[i:]
+                done = self.done
+            for chunk in new:
+                yield chunk
+            i += len(new)
+            if done and i >= len(self.chunks):
+                break
+        if self.error is not None:
+            raise self.error
+
+
+# ─────────────────────────────────────────────────────────────────
+# AnswerCache
+# ─────────────────────────────────────────────────────────────────
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        max_entries: int = _DEFAULT_SIZE,
+        ttl: float = _DEFAULT_TTL,
+        similarity: float = _DEFAULT_SIM,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+        self._signatures: Dict[Tuple, Any] = {}  # (namespace, kb) → 索引签名
+        self._flights: Dict[Tuple, _Flight] = {}
+        self._pending: Dict[Tuple, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    # ── 同步读写 ───────────────────────────────────────────────
+
+    def _check_signature(self, key: Tuple, signature: Any) -> None:
+        """知识库索引签名变化时清空该知识库的条目（调用方持有 _lock）"""
+        kb = key[:2]
+        if self._signatures.get(kb, signature) != signature:
+            for k in [k for k in self._entries if k[:2] == kb]:
+                del self._entries[k]
+        self._signatures[kb] = signature
+
+    def get(
+        self, key: Tuple, signature: Any, vec: Optional[np.ndarray] = None
+    ) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            self._check_signature(key, signature)
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None and vec is not None and self.similarity > 0:
+                entry = self._nearest(key, vec, now)
+                if entry is not None:
+                    self.semantic_hits += 1
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry.value
+
+    def _nearest(self, key: Tuple, vec: np.ndarray, now: float) -> Optional[_Entry]:
+        scope = key[:-1]
+        best, best_sim = None, self.similarity
+        for k, entry in self._entries.items():
+            if k[:-1] != scope or entry.vec is None or entry.expires_at <= now:
+                continue
+            sim = float(np.dot(entry.vec, vec))
+            if sim >= best_sim:
+                best, best_sim = k, sim
+        if best is None:
+            return None
+        self._entries.move_to_end(best)
+        return self._entries[best]
+
+    def put(
+        self,
+        key: Tuple,
+        signature: Any,
+        value: Any,
+        vec: Optional[np.ndarray] = None,
+    ) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            # 生成期间索引已更新：旧索引上的回答不再写入
+            if self._signatures.get(key[:2], signature) != signature:
+                return
+            self._signatures[key[:2]] = signature
+            self._entries[key] = _Entry(value, time.monotonic() + self.ttl, vec)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, kb: Optional[str] = None) -> None:
+        """清空指定知识库（任意 namespace）或全部条目"""
+        with self._lock:
+            if kb is None:
+                self._entries.clear()
+                return
+            for k in [k for k in self._entries if k[1] == kb]:
+                del self._entries[k]
+
+    async def _embed(self, embed: Optional[Callable[[str], Any]], key: Tuple):
+        if embed is None or self.similarity <= 0 or self.max_entries <= 0:
+            return None
+        vec = np.asarray(await asyncio.to_thread(embed, key[-1]), dtype=np.float32)
+        return vec / (np.linalg.norm(vec) + 1e-9)
+
+    # ── 流式 ───────────────────────────────────────────────────
+
+    async def stream(
+        self,
+        key: Tuple,
+        signature: Any,
+        producer: Callable[[], AsyncIterator[str]],
+        embed: Optional[Callable[[str], Any]] = None,
+        cacheable: Callable[[List[str]], bool] = sse_answer_complete,
+    ) -> AsyncIterator[str]:
+        """
+        命中缓存 → 回放 chunks；相同 key 正在生成 → 跟随；否则启动 producer()。
+        embed(query) 返回 query 向量，仅在开启语义查找时调用。
+        """
+        vec = await self._embed(embed, key)
+        cached = self.get(key, signature, vec)
+        if cached is not None:
+            for chunk in cached:
+                yield chunk
+            return
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+        else:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.ensure_future(
+                self._produce(key, signature, flight, producer, vec, cacheable)
+            )
+        async for chunk in flight.follow():
+            yield chunk
+
+    async def _produce(self, key, signature, flight, producer, vec, cacheable):
+        try:
+            async for chunk in producer():
+                async with flight.cond:
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            self._flights.pop(key, None)
+            async with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+        if flight.error is None and cacheable(flight.chunks):
+            self.put(key, signature, list(flight.chunks), vec)
+
+    # ── 非流式 ─────────────────────────────────────────────────
+
+    async def run(
+        self,
+        key: Tuple,
+        signature: Any,
+        fn: Callable[[], Awaitable[Any]],
+        embed: Optional[Callable[[str], Any]] = None,
+        cacheable: Callable[[Any], bool] = lambda value: value is not None,
+    ) -> Any:
+        """非流式版本：命中缓存直接返回，相同 key 的并发请求共享同一次 fn()"""
+        vec = await self._embed(embed, key)
+        cached = self.get(key, signature, vec)
+        if cached is not None:
+            return cached
+
+        task = self._pending.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = self._pending[key] = asyncio.ensure_future(
+                self._run(key, signature, fn, vec, cacheable)
+            )
+            # 所有等待者都已断开时，避免 "exception was never retrieved"
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        # shield：某个等待者被取消不会取消共享的任务
+        return await asyncio.shield(task)
+
+    async def _run(self, key, signature, fn, vec, cacheable):
+        try:
+            value = await fn()
+        finally:
+            self._pending.pop(key, None)
+        if cacheable(value):
+            self.put(key, signature, value, vec)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._flights) + len(self._pending),
+            }
@@ -0,0 +1,367 @@
+"""
+bm25_index.py
+倒排索引版 BM25 引擎（纯 Python，无第三方依赖）
+
+与逐文档扫描版的区别：
+  - 构建期一次性生成 term -> postings(doc_id, tf) 倒排表，并预计算每个文档的长度归一化项
+  - 查询期只遍历查询词对应的 postings，未命中的文档不参与计算
+  - top-k 使用 heapq.nlargest，避免对全量得分排序
+
+评分公式与原 BM25 / NativeBM25 完全一致（k1=1.5, b=0.75，IDF 带 +1 平滑），
+查询中重复出现的词按出现次数加权，新旧实现得分在浮点误差内一致。
+
+持久化（与 index.faiss 同目录的 bm25.index）：
+  - InvertedBM25Index.save(path)        写出紧凑的数组文件（先写临时文件再原子替换）
+  - MmapBM25Index(path)                 查询进程 mmap 只读打开，加载近乎零开销
+  - InvertedBM25Index.from_file(path)   读回为可变索引，用于增量追加后再保存
+
+文件布局（本机字节序，各段 8 字节对齐）：
+  header(64B) | term_off Q[T+1] | post_off Q[T+1] | idf d[T] | norm d[N]
+  | doc_len I[N] | doc_ids I[P] | tfs I[P] | vocab(utf-8, 按字节序排序)
+
+使用方式：
+  from src.rag.bm25_index import InvertedBM25Index
+  index = InvertedBM25Index([d.page_content for d in docs])
+  hits = index.top_k("知识图谱", k=5)   # [(doc_id, score), ...]
+"""
+
+from __future__ import annotations
+
+import heapq
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_TOKEN_RE = re.compile(r"[\u4e00-\u9fff]|[a-z0-9]+")
+
+BM25_INDEX_FILENAME = "bm25.index"
+
+_MAGIC = b"BM25IDX1"
+_VERSION = 1
+_HEADER = struct.Struct("<8sIIQQQddd")
+_HEADER_SIZE = 64
+
+
+def tokenize(text: str) -> List[str]:
+    """中文按单字、英文/数字按连续串切分（与原 BM25._tokenize 保持一致）"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+# ─────────────────────────────────────────────────────────────────
+# 查询逻辑（内存版 / mmap 版共用）
+# ─────────────────────────────────────────────────────────────────
+
+
+class _BM25Scoring:
+    """子类需提供 k1 / _norm（按 doc_id 索引的长度归一化项）/ _lookup / __len__"""
+
+    def _lookup(self, term: str):
+        raise NotImplementedError
+
+    def score_candidates(self, query: str) -> Dict[int, float]:
+        """只对命中查询词的文档打分，返回 {doc_id: score}（score 恒 > 0）"""
+        q_tf: Dict[str, int] = {}
+        for t in tokenize(query):
+            q_tf[t] = q_tf.get(t, 0) + 1
+
+        scores: Dict[int, float] = {}
+        norm = self._norm
+        k1p1 = self.k1 + 1
+        for t, q_count in q_tf.items():
+            hit = self._lookup(t)
+            if hit is None:
+                continue
+            doc_ids, tfs, idf = hit
+            w = idf * q_count
+            get = scores.get
+            for doc_id, tf in zip(doc_ids, tfs):
+                scores[doc_id] = get(doc_id, 0.0) + w * tf * k1p1 / (tf + norm[doc_id])
+        return scores
+
+    def top_k(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """堆选 top-k，返回 [(doc_id, score), ...]；同分时 doc_id 小者在前"""
+        if k <= 0:
+            return []
+        scores = self.score_candidates(query)
+        if not scores:
+            return []
+        return heapq.nlargest(k, scores.items(), key=lambda x: (x[1], -x[0]))
+
+    def get_scores(self, query: str) -> List[float]:
+        """兼容接口：返回与文档顺序对齐的稠密得分列表（未命中为 0.0）"""
+        dense = [0.0] * len(self)
+        for doc_id, score in self.score_candidates(query).items():
+            dense[doc_id] = score
+        return dense
+
+
+# ─────────────────────────────────────────────────────────────────
+# 内存版（构建 / 增量追加 / 保存）
+# ─────────────────────────────────────────────────────────────────
+
+
+class InvertedBM25Index(_BM25Scoring):
+    """
+    倒排索引 BM25。
+    postings[term] = (doc_ids, tfs)，两者均为 array('I')，doc_id 严格递增。
+    """
+
+    def __init__(
+        self,
+        texts: Iterable[str] = (),
+        k1: float = 1.5,
+        b: float = 0.75,
+    ):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.doc_len: array = array("I")
+        self.idf: Dict[str, float] = {}
+        self.avgdl: float = 0.0
+        self._norm: List[float] = []
+        self.add_texts(texts)
+
+    # - -
+
+    def add_texts(self, texts: Iterable[str]) -> None:
+        """追加文档（doc_id 接续现有编号），追加后重算 avgdl / IDF"""
+        postings = self.postings
+        doc_len = self.doc_len
+        for doc_id, text in enumerate(texts, start=len(doc_len)):
+            tokens = tokenize(text)
+            doc_len.append(len(tokens))
+            tf_map: Dict[str, int] = {}
+            for t in tokens:
+                tf_map[t] = tf_map.get(t, 0) + 1
+            for t, tf in tf_map.items():
+                plist = postings.get(t)
+                if plist is None:
+                    plist = postings[t] = (array("I"), array("I"))
+                plist[0].append(doc_id)
+                plist[1].append(tf)
+        self._finalize()
+
+    def _finalize(self) -> None:
+        """根据 postings 和 doc_len 计算 avgdl / IDF / 长度归一化项"""
+        n = len(self.doc_len)
+        self.avgdl = sum(self.doc_len) / max(n, 1)
+        self.idf = {
+            t: math.log((n - len(p[0]) + 0.5) / (len(p[0]) + 0.5) + 1)
+            for t, p in self.postings.items()
+        }
+        avgdl = self.avgdl or 1.0
+        k1, b = self.k1, self.b
+        self._norm = [k1 * (1 - b + b * dl / avgdl) for dl in self.doc_len]
+
+    # - -
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    @property
+    def vocab_size(self) -> int:
+        return len(self.postings)
+
+    def _lookup(self, term: str):
+        plist = self.postings.get(term)
+        if plist is None:
+            return None
+        return plist[0], plist[1], self.idf[term]
+
+    # - -
+
+    def save(self, path: str) -> None:
+        """写出数组文件：先写 path.tmp，再 os.replace 原子替换（已 mmap 的读者不受影响）"""
+        terms = sorted(self.postings, key=lambda t: t.encode("utf-8"))
+        vocab = bytearray()
+        term_off = array("Q", [0])
+        post_off = array("Q", [0])
+        idf = array("d")
+        doc_ids = array("I")
+        tfs = array("I")
+        for t in terms:
+            vocab += t.encode("utf-8")
+            term_off.append(len(vocab))
+            ids, freqs = self.postings[t]
+            doc_ids.extend(ids)
+            tfs.extend(freqs)
+            post_off.append(len(doc_ids))
+            idf.append(self.idf[t])
+
+        header = _HEADER.pack(
+            _MAGIC,
+            _VERSION,
+            1 if sys.byteorder == "little" else 0,
+            len(self.doc_len),
+            len(terms),
+            len(doc_ids),
+            self.k1,
+            self.b,
+            self.avgdl,
+        ).ljust(_HEADER_SIZE, b"\0")
+
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(header)
+            for section in (
+                term_off,
+                post_off,
+                idf,
+                array("d", self._norm),
+                self.doc_len,
+                doc_ids,
+                tfs,
+            ):
+                section.tofile(f)
+                f.write(b"\0" * (-f.tell() % 8))
+            f.write(vocab)
+        os.replace(tmp, path)
+
+    @classmethod
+    def from_file(cls, path: str) -> "InvertedBM25Index":
+        """将磁盘索引完整读回为可变的内存索引（增量追加时使用）"""
+        src = MmapBM25Index(path)
+        try:
+            obj = cls(k1=src.k1, b=src.b)
+            obj.doc_len = array("I", src._doc_len)
+            for tid in range(src.vocab_size):
+                lo, hi = src._post_off[tid], src._post_off[tid + 1]
+                obj.postings[src._term(tid)] = (
+                    array("I", src._doc_ids[lo:hi]),
+                    array("I", src._tfs[lo:hi]),
+                )
+            obj._finalize()
+            return obj
+        finally:
+            src.close()
+
+
+# ─────────────────────────────────────────────────────────────────
+# mmap 只读版（查询进程使用）
+# ─────────────────────────────────────────────────────────────────
+
+
+def _layout(n_docs: int, n_terms: int, n_postings: int) -> List[Tuple[str, str, int]]:
+    """按写入顺序返回 (名称, typecode, 元素个数)"""
+    return [
+        ("term_off", "Q", n_terms + 1),
+        ("post_off", "Q", n_terms + 1),
+        ("idf", "d", n_terms),
+        ("norm", "d", n_docs),
+        ("doc_len", "I", n_docs),
+        ("doc_ids", "I", n_postings),
+        ("tfs", "I", n_postings),
+    ]
+
+
+class MmapBM25Index(_BM25Scoring):
+    """
+    mmap 打开 bm25.index，所有数组段为零拷贝 memoryview；
+    词表按 utf-8 字节序排序，查询词用二分查找定位，不在加载时构建 dict。
+    多个 worker 进程共享同一份 page cache。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._parse()
+        except Exception:
+            self._mm.close()
+            raise
+
+    def _parse(self) -> None:
+        if len(self._mm) < _HEADER_SIZE:
+            raise ValueError(f"BM25 索引文件损坏: {self.path}")
+        (magic, version, little, n_docs, n_terms, n_postings, k1, b, avgdl) = (
+            _HEADER.unpack_from(self._mm, 0)
+        )
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"BM25 索引格式不匹配: {self.path}")
+        if bool(little) != (sys.byteorder == "little"):
+            raise ValueError(f"BM25 索引字节序与本机不一致: {self.path}")
+
+        self.k1, self.b, self.avgdl = k1, b, avgdl
+        self._n_docs, self._n_terms = n_docs, n_terms
+
+        buf = memoryview(self._mm)
+        pos = _HEADER_SIZE
+        for name, code, count in _layout(n_docs, n_terms, n_postings):
+            size = count * array(code).itemsize
+            setattr(self, "_" + name, buf[pos : pos + size].cast(code))
+            pos += size + (-size % 8)
+        self._vocab = buf[pos : pos + self._term_off[n_terms]]
+        if len(self._vocab) != self._term_off[n_terms]:
+            raise ValueError(f"BM25 索引文件被截断: {self.path}")
+
+    def close(self) -> None:
+        for name, _, _ in _layout(0, 0, 0):
+            getattr(self, "_" + name).release()
+        self._vocab.release()
+        self._mm.close()
+
+    # - -
+
+    def __len__(self) -> int:
+        return self._n_docs
+
+    @property
+    def vocab_size(self) -> int:
+        return self._n_terms
+
+    @property
+    def idf(self) -> Dict[str, float]:
+        """兼容属性：按需构建 term -> idf 字典（查询路径不依赖它）"""
+        return {self._term(i): self._idf[i] for i in range(self._n_terms)}
+
+    def _term(self, tid: int) -> str:
+        raw = self._vocab[self._term_off[tid] : self._term_off[tid + 1]]
+        return raw.tobytes().decode("utf-8")
+
+    def _term_id(self, term: str) -> Optional[int]:
+        key = term.encode("utf-8")
+        vocab, off = self._vocab, self._term_off
+        lo, hi = 0, self._n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            cur = vocab[off[mid] : off[mid + 1]].tobytes()
+            if cur < key:
+                lo = mid + 1
+            elif cur > key:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def _lookup(self, term: str):
+        tid = self._term_id(term)
+        if tid is None:
+            return None
+        lo, hi = self._post_off[tid], self._post_off[tid + 1]
+        return self._doc_ids[lo:hi], self._tfs[lo:hi], self._idf[tid]
+
+
+def load_bm25_index(
+    path: str, expected_docs: Optional[int] = None
+) -> Optional[MmapBM25Index]:
+    """打开磁盘索引；文件缺失、损坏或文档数与向量库不一致时返回 None（由调用方重建）"""
+    if not os.path.exists(path):
+        return None
+    try:
+        index = MmapBM25Index(path)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"[BM25Index] 打开索引失败，将重建: {path} ({e})")
+        return None
+    if expected_docs is not None and len(index) != expected_docs:
+        print(
+            f"[BM25Index] 索引文档数 {len(index)} 与向量库 {expected_docs} 不一致，将重建"
+        )
+        index.close()
+        return None
+    return index
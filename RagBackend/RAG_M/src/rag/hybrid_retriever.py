@@ -7,13 +7,36 @@ hybrid_retriever.py
 
 from __future__ import annotations
 
-import math
-import re
-from typing import List, Tuple, Dict, Any
+import heapq
+import os
+from typing import List, Tuple, Dict, Any, Optional
 
+import numpy as np
 from langchain.docstore.document import Document
 from langchain_community.vectorstores import FAISS
 
+try:
+    from src.rag.bm25_index import (
+        BM25_INDEX_FILENAME,
+        InvertedBM25Index,
+        load_bm25_index,
+        tokenize,
+    )
+except ImportError:
+    from rag.bm25_index import (
+        BM25_INDEX_FILENAME,
+        InvertedBM25Index,
+        load_bm25_index,
+        tokenize,
+    )
+
+try:
+    from src.rag.rank_fusion import fuse_ranked
+    from src.vectorstore.embedding_cache import query_vector as _query_vector
+except ImportError:
+    from rag.rank_fusion import fuse_ranked
+    from vectorstore.embedding_cache import query_vector as _query_vector
+
 
 # - BM25 -
 
@@ -22,88 +45,133 @@ class BM25:
     """
     内存版 BM25 检索器（无需额外依赖）
     k1=1.5, b=0.75  （标准 Okapi BM25 参数）
+    底层为倒排索引（bm25_index.InvertedBM25Index），构建一次，查询只遍历命中词的 postings
+    传入 index 时直接复用（如 load_or_build_bm25 打开的 mmap 索引），不再重新分词
+    传入 tombstones（向量库的 DeletionBitmap）时，按 metadata["chunk_id"] 跳过已软删除的文档块，
+    与向量检索一侧一致；compaction 前被删除的文档不会经 BM25 一路召回
     """
 
-    def __init__(self, documents: List[Document], k1: float = 1.5, b: float = 0.75):
+    def __init__(
+        self,
+        documents: List[Document],
+        k1: float = 1.5,
+        b: float = 0.75,
+        index=None,
+        tombstones=None,
+    ):
         self.k1 = k1
         self.b = b
         self.documents = documents
-        self.corpus: List[List[str]] = [
-            self._tokenize(d.page_content) for d in documents
-        ]
-        self._build_index()
+        if index is None:
+            index = InvertedBM25Index((d.page_content for d in documents), k1, b)
+        self.index = index
+        self._dead = None  # 与 documents 对齐的废弃标记；无废弃时为 None
+        if tombstones:
+            chunk_ids = np.fromiter(
+                ((d.metadata or {}).get("chunk_id", -1) for d in documents),
+                dtype=np.int64,
+                count=len(documents),
+            )
+            dead = tombstones.mask(chunk_ids)
+            if dead.any():
+                self._dead = dead
+
+    @property
+    def idf(self) -> Dict[str, float]:
+        return self.index.idf
+
+    @property
+    def avgdl(self) -> float:
+        return self.index.avgdl
 
     # - +
     @staticmethod
     def _tokenize(text: str) -> List[str]:
-        text = text.lower()
-        tokens = re.findall(r"[\u4e00-\u9fff]|[a-z0-9]+", text)
-        return tokens
-
-    def _build_index(self):
-        N = len(self.corpus)
-        self.avgdl = sum(len(d) for d in self.corpus) / max(N, 1)
-        df: Dict[str, int] = {}
-        for doc_tokens in self.corpus:
-            for token in set(doc_tokens):
-                df[token] = df.get(token, 0) + 1
-        # IDF
-        self.idf: Dict[str, float] = {}
-        for token, freq in df.items():
-            self.idf[token] = math.log((N - freq + 0.5) / (freq + 0.5) + 1)
+        return tokenize(text)
 
     def get_scores(self, query: str) -> List[float]:
-        query_tokens = self._tokenize(query)
-        scores = []
-        for doc_tokens in self.corpus:
-            score = 0.0
-            doc_len = len(doc_tokens)
-            tf_map: Dict[str, int] = {}
-            for t in doc_tokens:
-                tf_map[t] = tf_map.get(t, 0) + 1
-            for token in query_tokens:
-                if token not in self.idf:
-                    continue
-                tf = tf_map.get(token, 0)
-                idf = self.idf[token]
-                numerator = tf * (self.k1 + 1)
-                denominator = tf + self.k1 * (
-                    1 - self.b + self.b * doc_len / self.avgdl
-                )
-                score += idf * numerator / denominator
-            scores.append(score)
+        scores = self.index.get_scores(query)
+        if self._dead is not None:
+            for i in np.flatnonzero(self._dead):
+                scores[i] = 0.0
         return scores
 
     def retrieve(self, query: str, top_k: int = 5) -> List[Tuple[Document, float]]:
-        scores = self.get_scores(query)
-        ranked = sorted(enumerate(scores), key=lambda x: x[1], reverse=True)[:top_k]
-        return [(self.documents[i], s) for i, s in ranked if s > 0]
+        if self._dead is None:
+            hits = self.index.top_k(query, top_k)
+        elif top_k <= 0:
+            hits = []
+        else:
+            dead = self._dead
+            live = (
+                (i, s)
+                for i, s in self.index.score_candidates(query).items()
+                if not dead[i]
+            )
+            hits = heapq.nlargest(top_k, live, key=lambda x: (x[1], -x[0]))
+        return [(self.documents[i], s) for i, s in hits]
+
+
+def vectorstore_documents(vectorstore: FAISS) -> List[Document]:
+    """
+    按 FAISS 内部向量顺序取出 docstore 中的全部文档。
+    index_to_docstore_id 的 key 为行号（旧库）或稳定 chunk_id（IndexIDMap2），
+    两者都随内部顺序单调递增，按 key 排序即可。
+    """
+    store = vectorstore.docstore._dict
+    mapping = getattr(vectorstore, "index_to_docstore_id", None)
+    if not mapping:
+        return list(store.values())
+    return [store[mapping[i]] for i in sorted(mapping)]
+
+
+def load_or_build_bm25(
+    vectorstore_path: str, documents: List[Document], tombstones=None
+) -> BM25:
+    """
+    优先 mmap 打开向量库目录下的 bm25.index；
+    文件缺失、文档数不一致或比 index.faiss 旧时，现场构建并写回，下次请求直接复用。
+    documents 必须与 FAISS 内部顺序一致（见 vectorstore_documents）。
+    tombstones 为向量库的软删除位图，命中其中 chunk_id 的文档不参与 BM25 召回。
+    """
+    index_path = os.path.join(vectorstore_path, BM25_INDEX_FILENAME)
+    faiss_path = os.path.join(vectorstore_path, "index.faiss")
+
+    index = None
+    if not (
+        os.path.exists(faiss_path)
+        and os.path.exists(index_path)
+        and os.path.getmtime(index_path) < os.path.getmtime(faiss_path)
+    ):
+        index = load_bm25_index(index_path, expected_docs=len(documents))
+
+    if index is None:
+        print(f"[BM25] 构建并持久化 BM25 索引: {index_path}")
+        index = InvertedBM25Index(d.page_content for d in documents)
+        try:
+            index.save(index_path)
+        except OSError as e:
+            print(f"[BM25] 写入 BM25 索引失败（本次仍使用内存索引）: {e}")
+    return BM25(documents, index=index, tombstones=tombstones)
 
 
 # - RRF -
 
 
 def reciprocal_rank_fusion(
-    ranked_lists: List[List[Tuple[Document, float]]], k: int = 60
+    ranked_lists: List[List[Tuple[Document, float]]],
+    k: int = 60,
+    weights: Optional[List[float]] = None,
 ) -> List[Tuple[Document, float]]:
     """
     Reciprocal Rank Fusion
-    ranked_lists: 多个排序结果列表，每项是 (document, score) 元组
+    ranked_lists: 多个排序结果列表（可多于两路），每项是 (document, score) 元组
     k: RRF 常数（默认 60）
+    weights: 各路权重，默认均为 1
     返回：融合后的 (document, rrf_score) 列表（降序）
+    文档按整数 chunk_id 去重合并（见 rank_fusion.chunk_key）
     """
-    # page_content
-    rrf_scores: Dict[str, float] = {}
-    doc_map: Dict[str, Document] = {}
-
-    for ranked in ranked_lists:
-        for rank, (doc, _) in enumerate(ranked, start=1):
-            key = doc.page_content[:200]  # 200 key
-            rrf_scores[key] = rrf_scores.get(key, 0.0) + 1.0 / (k + rank)
-            doc_map[key] = doc
-
-    fused = sorted(rrf_scores.items(), key=lambda x: x[1], reverse=True)
-    return [(doc_map[key], score) for key, score in fused]
+    return fuse_ranked(ranked_lists, k, weights)
 
 
 # - Hybrid retrieval -
@@ -122,26 +190,48 @@ class HybridRetriever:
         bm25_top_k: int = 5,
         vector_top_k: int = 5,
         final_top_k: int = 4,
+        bm25: Optional[BM25] = None,
     ):
         self.vectorstore = vectorstore
         self.bm25_top_k = bm25_top_k
         self.vector_top_k = vector_top_k
         self.final_top_k = final_top_k
 
-        print(f"[HybridRetriever] 构建 BM25 索引，共 {len(documents)} 个文档块...")
-        self.bm25 = BM25(documents)
-        print("[HybridRetriever] BM25 索引构建完成")
+        if bm25 is not None:
+            self.bm25 = bm25
+        else:
+            print(f"[HybridRetriever] 构建 BM25 索引，共 {len(documents)} 个文档块...")
+            self.bm25 = BM25(
+                documents, tombstones=getattr(vectorstore, "tombstones", None)
+            )
+            print("[HybridRetriever] BM25 索引构建完成")
+
+    def _vector_results(
+        self, query: str, query_vector: Optional[Any] = None
+    ) -> List[Tuple[Document, float]]:
+        """向量检索；query 向量经进程级 LRU 缓存，或由调用方预先传入"""
+        if query_vector is None:
+            query_vector = _query_vector(self.vectorstore, query)
+        if query_vector is None:
+            # embedding 模型无法识别（不缓存），按文本检索
+            raw = self.vectorstore.similarity_search_with_score(
+                query, k=self.vector_top_k
+            )
+        else:
+            raw = self.vectorstore.similarity_search_with_score_by_vector(
+                query_vector, k=self.vector_top_k
+            )
+        return [(doc, score) for doc, score in raw]
 
-    def retrieve(self, query: str) -> List[Document]:
+    def retrieve(
+        self, query: str, query_vector: Optional[Any] = None
+    ) -> List[Document]:
         """执行混合检索，返回融合排序后的 top-k 文档"""
         # - 1. BM25
         bm25_results = self.bm25.retrieve(query, top_k=self.bm25_top_k)
 
         # ── 2. Vector retrieval
-        vector_raw = self.vectorstore.similarity_search_with_score(
-            query, k=self.vector_top_k
-        )
-        vector_results = [(doc, score) for doc, score in vector_raw]
+        vector_results = self._vector_results(query, query_vector)
 
         # - 3. RRF
         fused = reciprocal_rank_fusion([bm25_results, vector_results])
@@ -151,17 +241,16 @@ class HybridRetriever:
 
         return top_docs
 
-    def retrieve_with_scores(self, query: str) -> List[Dict[str, Any]]:
+    def retrieve_with_scores(
+        self, query: str, query_vector: Optional[Any] = None
+    ) -> List[Dict[str, Any]]:
         """
         检索并返回带引用溯源信息的结果列表
         每项：{document, rrf_score, source_info}
         source_info 包含：file_name、page、chunk_id 等
         """
         bm25_results = self.bm25.retrieve(query, top_k=self.bm25_top_k)
-        vector_raw = self.vectorstore.similarity_search_with_score(
-            query, k=self.vector_top_k
-        )
-        vector_results = [(doc, score) for doc, score in vector_raw]
+        vector_results = self._vector_results(query, query_vector)
 
         fused = reciprocal_rank_fusion([bm25_results, vector_results])
 
@@ -193,7 +282,5 @@ def _extract_filename(meta: Dict[str, Any]) -> str:
     for key in ("source", "file_path", "path", "filename", "file_name"):
         val = meta.get(key, "")
         if val:
-            import os
-
             return os.path.basename(str(val))
     return "未知来源"
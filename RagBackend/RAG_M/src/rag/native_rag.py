@@ -3,8 +3,8 @@ native_rag.py
 原生 RAG 流水线（不依赖 LangChain）
 使用：
   - 原生 FAISS 向量检索（通过 faiss-cpu）
-  - 内置 BM25 关键词检索 + RRF 融合（复用 hybrid_retriever.BM25）
-  - 直接调用 Ollama HTTP API 生成回答
+  - 内置 BM25 关键词检索 + RRF 融合（倒排索引，复用 bm25_index.InvertedBM25Index）
+  - 直接调用 Ollama HTTP API 生成回答（经 multi_model.llm_client 共享连接池）
   - 自行实现 Prompt 拼装、文本分块、文档加载
 
 与 LangChain 版本对比：
@@ -16,13 +16,67 @@ native_rag.py
 from __future__ import annotations
 
 import os
-import re
+import sys
 import json
-import math
 import pickle
 import pathlib
-import requests
-from typing import List, Dict, Any, Generator, Optional, Tuple
+import time
+from contextlib import closing
+from itertools import islice
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+import httpx
+import numpy as np
+
+_BACKEND_DIR = str(pathlib.Path(__file__).resolve().parents[3])
+if _BACKEND_DIR not in sys.path:
+    sys.path.append(_BACKEND_DIR)
+from multi_model.llm_client import get_llm_pool  # noqa: E402
+
+try:
+    from src.ingestion.parallel_loader import LoadStats, ParallelLoader
+    from src.rag.bm25_index import InvertedBM25Index, tokenize
+    from src.rag.rank_fusion import fuse_ranked
+    from src.vectorstore.ann_index import (
+        IndexSpec,
+        build_index,
+        index_kind,
+        needs_upgrade,
+        search_params,
+    )
+    from src.vectorstore.embedding_cache import (
+        cache_model_key,
+        default_embedding_cache,
+        default_query_cache,
+    )
+    from src.vectorstore.embedding_pipeline import BatchEmbedder
+except ImportError:
+    from ingestion.parallel_loader import LoadStats, ParallelLoader
+    from rag.bm25_index import InvertedBM25Index, tokenize
+    from rag.rank_fusion import fuse_ranked
+    from vectorstore.ann_index import (
+        IndexSpec,
+        build_index,
+        index_kind,
+        needs_upgrade,
+        search_params,
+    )
+    from vectorstore.embedding_cache import (
+        cache_model_key,
+        default_embedding_cache,
+        default_query_cache,
+    )
+    from vectorstore.embedding_pipeline import BatchEmbedder
 
 
 # ────────────────────────────────────────────────
@@ -49,6 +103,12 @@ class NativeDocument:
 
 SUPPORTED_EXTENSIONS = {".pdf", ".txt", ".md", ".docx", ".csv"}
 
+# 进度回调 on_page(file_path, page, n_pages)，page 从 1 开始
+PageCallback = Callable[[str, int, int], None]
+
+# 流式入库时每批编码并写入索引的文本块数，决定向量化阶段的内存上限
+INGEST_FLUSH_CHUNKS = int(os.getenv("RAG_INGEST_FLUSH_CHUNKS", "256"))
+
 
 def _load_txt(file_path: str) -> List[NativeDocument]:
     """加载纯文本 / Markdown"""
@@ -61,29 +121,35 @@ def _load_txt(file_path: str) -> List[NativeDocument]:
         return []
 
 
-def _load_pdf(file_path: str) -> List[NativeDocument]:
-    """加载 PDF（使用 pypdf）"""
+def _iter_pdf(
+    file_path: str, on_page: Optional[PageCallback] = None
+) -> Iterator[NativeDocument]:
+    """逐页读取 PDF（使用 pypdf），每页文本提取后立即产出，不保留整本书的页面列表"""
     try:
         import pypdf
-
-        docs = []
+    except ImportError:
+        print("[NativeRAG] pypdf 未安装，尝试用文本模式读取 PDF")
+        yield from _load_txt(file_path)
+        return
+    try:
         with open(file_path, "rb") as f:
             reader = pypdf.PdfReader(f)
-            for i, page in enumerate(reader.pages):
-                text = page.extract_text() or ""
+            n_pages = len(reader.pages)
+            for i in range(n_pages):
+                text = reader.pages[i].extract_text() or ""
+                if on_page is not None:
+                    on_page(file_path, i + 1, n_pages)
                 if text.strip():
-                    docs.append(
-                        NativeDocument(
-                            page_content=text, metadata={"source": file_path, "page": i}
-                        )
+                    yield NativeDocument(
+                        page_content=text, metadata={"source": file_path, "page": i}
                     )
-        return docs
-    except ImportError:
-        print("[NativeRAG] pypdf 未安装，尝试用文本模式读取 PDF")
-        return _load_txt(file_path)
     except Exception as e:
         print(f"[NativeRAG] 加载 PDF 失败 {file_path}: {e}")
-        return []
+
+
+def _load_pdf(file_path: str) -> List[NativeDocument]:
+    """加载 PDF（使用 pypdf）"""
+    return list(_iter_pdf(file_path))
 
 
 def _load_docx(file_path: str) -> List[NativeDocument]:
@@ -118,9 +184,29 @@ def _load_csv(file_path: str) -> List[NativeDocument]:
         return []
 
 
-def load_documents_from_dir(docs_dir: str) -> List[NativeDocument]:
-    """扫描目录，加载所有支持格式的文档"""
-    docs = []
+def iter_file_documents(
+    file_path: str, on_page: Optional[PageCallback] = None
+) -> Iterator[NativeDocument]:
+    """按扩展名加载单个文件；PDF 逐页产出，其余格式整篇为一页"""
+    ext = pathlib.Path(file_path).suffix.lower()
+    if ext == ".pdf":
+        yield from _iter_pdf(file_path, on_page)
+        return
+    if ext in (".txt", ".md"):
+        docs = _load_txt(file_path)
+    elif ext == ".docx":
+        docs = _load_docx(file_path)
+    elif ext == ".csv":
+        docs = _load_csv(file_path)
+    else:
+        return
+    if on_page is not None:
+        on_page(file_path, 1, 1)
+    yield from docs
+
+
+def list_supported_files(docs_dir: str) -> List[str]:
+    """目录下所有支持格式的文件，按路径排序（加载顺序与文件系统无关）"""
     IGNORE_DIRS = {
         "vectorstore",
         "native_vectorstore",
@@ -129,23 +215,64 @@ def load_documents_from_dir(docs_dir: str) -> List[NativeDocument]:
         "node_modules",
     }
 
+    paths = []
     for root, dirs, files in os.walk(docs_dir):
-        dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
-        for fname in files:
-            ext = pathlib.Path(fname).suffix.lower()
-            if ext not in SUPPORTED_EXTENSIONS:
+        dirs[:] = sorted(d for d in dirs if d not in IGNORE_DIRS)
+        for fname in sorted(files):
+            if pathlib.Path(fname).suffix.lower() in SUPPORTED_EXTENSIONS:
+                paths.append(os.path.join(root, fname))
+    return paths
+
+
+def _load_file_documents(file_path: str) -> List[NativeDocument]:
+    """进程池任务：解析单个文件的全部页"""
+    return list(iter_file_documents(file_path))
+
+
+def iter_documents_from_dir(
+    docs_dir: str,
+    on_page: Optional[PageCallback] = None,
+    workers: Optional[int] = None,
+    stats: Optional[LoadStats] = None,
+) -> Iterator[NativeDocument]:
+    """
+    扫描目录，逐页产出所有支持格式的文档。
+    on_page(file_path, page, n_pages) 在每页读取后回调，用于上报进度；
+    stats 传入 LoadStats 时记录解析吞吐。
+
+    文件较多 / 较大时由 ParallelLoader 分发到进程池并行解析（按文件顺序产出，
+    单文件超时或失败只跳过该文件）；否则在当前进程内逐页流式读取。
+    """
+    paths = list_supported_files(docs_dir)
+    loader = ParallelLoader(_load_file_documents, workers=workers)
+    if loader.pool_size(paths) > 1:
+        for result in loader.iter_load(paths, stats=stats):
+            if not result.ok:
+                print(f"[NativeRAG] 加载文件失败 {result.path}: {result.error}")
                 continue
-            file_path = os.path.join(root, fname)
-            print(f"[NativeRAG] 加载文件: {file_path}")
-            if ext in (".txt", ".md"):
-                docs.extend(_load_txt(file_path))
-            elif ext == ".pdf":
-                docs.extend(_load_pdf(file_path))
-            elif ext == ".docx":
-                docs.extend(_load_docx(file_path))
-            elif ext == ".csv":
-                docs.extend(_load_csv(file_path))
+            print(f"[NativeRAG] 加载文件: {result.path}")
+            n_pages = len(result.documents)
+            for i, doc in enumerate(result.documents, start=1):
+                if on_page is not None:
+                    on_page(result.path, i, n_pages)
+                yield doc
+        return
+
+    stats = stats if stats is not None else LoadStats()
+    t0 = time.perf_counter()
+    for file_path in paths:
+        print(f"[NativeRAG] 加载文件: {file_path}")
+        n_pages = 0
+        for doc in iter_file_documents(file_path, on_page):
+            n_pages += 1
+            yield doc
+        stats.record(file_path, n_pages, error=False)
+        stats.seconds = time.perf_counter() - t0
 
+
+def load_documents_from_dir(docs_dir: str) -> List[NativeDocument]:
+    """扫描目录，加载所有支持格式的文档"""
+    docs = list(iter_documents_from_dir(docs_dir))
     print(f"[NativeRAG] 共加载原始文档 {len(docs)} 页")
     return docs
 
@@ -155,11 +282,10 @@ def load_documents_from_dir(docs_dir: str) -> List[NativeDocument]:
 # ────────────────────────────────────────────────
 
 
-def split_documents(
-    docs: List[NativeDocument], chunk_size: int = 1000, chunk_overlap: int = 200
-) -> List[NativeDocument]:
-    """简单滑动窗口分块"""
-    chunks = []
+def iter_split_documents(
+    docs: Iterable[NativeDocument], chunk_size: int = 1000, chunk_overlap: int = 200
+) -> Iterator[NativeDocument]:
+    """简单滑动窗口分块（流式：每读入一页即切分产出，页文本随后即可释放）"""
     for doc in docs:
         text = doc.page_content
         start = 0
@@ -170,12 +296,18 @@ def split_documents(
             if chunk_text:
                 meta = dict(doc.metadata)
                 meta["chunk_index"] = chunk_idx
-                chunks.append(NativeDocument(page_content=chunk_text, metadata=meta))
+                yield NativeDocument(page_content=chunk_text, metadata=meta)
             chunk_idx += 1
             if end == len(text):
                 break
             start = end - chunk_overlap
 
+
+def split_documents(
+    docs: List[NativeDocument], chunk_size: int = 1000, chunk_overlap: int = 200
+) -> List[NativeDocument]:
+    """简单滑动窗口分块"""
+    chunks = list(iter_split_documents(docs, chunk_size, chunk_overlap))
     print(f"[NativeRAG] 分块完成，共 {len(chunks)} 个文本块")
     return chunks
 
@@ -188,13 +320,27 @@ def split_documents(
 class NativeVectorStore:
     """
     使用 sentence-transformers + faiss-cpu 实现的原生向量存储
+    index_spec 为知识库的 ANN 索引规格（见 vectorstore.ann_index），默认精确内积检索
     """
 
-    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
+    def __init__(
+        self,
+        model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+        index_spec: Optional[IndexSpec] = None,
+    ):
         self.model_name = model_name
+        self.index_spec = index_spec or IndexSpec()
         self._model = None
         self._index = None
         self._documents: List[NativeDocument] = []
+        # 入库编码：长度排序 batch，RAG_EMBED_WORKERS > 1 时分发到进程池；
+        # 未变化的 chunk 直接取持久化 embedding 缓存
+        self._embedder = BatchEmbedder(
+            model_name,
+            encode_fn=self._encode,
+            normalize=True,
+            cache=default_embedding_cache(),
+        )
 
     def _get_model(self):
         if self._model is None:
@@ -210,16 +356,53 @@ class NativeVectorStore:
 
     def build_index(self, documents: List[NativeDocument]) -> None:
         """构建 FAISS 索引"""
+        print(f"[NativeVectorStore] 对 {len(documents)} 个文本块计算向量...")
+        self.build_index_streaming(documents)
+
+    def build_index_streaming(
+        self,
+        chunks: Iterable[NativeDocument],
+        batch_size: int = INGEST_FLUSH_CHUNKS,
+        on_flush: Optional[Callable[[int], None]] = None,
+    ) -> int:
+        """
+        流式构建 FAISS 索引：从 chunks 迭代器每取 batch_size 个文本块编码一次并写入索引，
+        页面 / 文本块在上游按需生成，任何时刻只有一批文本在编码。
+        on_flush(n_chunks) 在每批写入后回调。返回文本块总数。
+
+        先写入精确的 flat 索引；全部写完后若规模超过 index_spec.train_threshold，
+        再以全量向量训练 ANN 索引（向量已 L2 归一化，内积即余弦）。
+        """
         import faiss
 
-        self._documents = documents
-        texts = [d.page_content for d in documents]
-        print(f"[NativeVectorStore] 对 {len(texts)} 个文本块计算向量...")
-        vectors = self._encode(texts).astype("float32")
-        dim = vectors.shape[1]
-        self._index = faiss.IndexFlatIP(dim)  # normalize
-        self._index.add(vectors)
-        print(f"[NativeVectorStore] FAISS 索引构建完成，维度={dim}")
+        self._documents = []
+        self._index = None
+        chunks = iter(chunks)
+        while True:
+            batch = list(islice(chunks, max(1, batch_size)))
+            if not batch:
+                break
+            vectors = self._embedder.embed([d.page_content for d in batch])
+            if self._index is None:
+                self._index = faiss.IndexFlatIP(vectors.shape[1])
+            self._index.add(vectors)
+            self._documents.extend(batch)
+            if on_flush is not None:
+                on_flush(len(self._documents))
+        self._assign_chunk_ids(self._documents)
+        if self._index is None:
+            return 0
+
+        if needs_upgrade(self.index_spec, self._index):
+            vectors = self._index.reconstruct_n(0, self._index.ntotal)
+            self._index = build_index(
+                self.index_spec, vectors, faiss.METRIC_INNER_PRODUCT
+            )
+        print(
+            f"[NativeVectorStore] FAISS 索引构建完成，{self._index.ntotal} 个文本块，"
+            f"维度={self._index.d}，类型={index_kind(self._index)}"
+        )
+        return len(self._documents)
 
     def save(self, save_path: str) -> None:
         """保存索引和文档到磁盘"""
@@ -230,7 +413,13 @@ class NativeVectorStore:
         with open(os.path.join(save_path, "native_docs.pkl"), "wb") as f:
             pickle.dump(self._documents, f)
         with open(os.path.join(save_path, "native_config.json"), "w") as f:
-            json.dump({"model_name": self.model_name}, f)
+            json.dump(
+                {
+                    "model_name": self.model_name,
+                    "ann_index": self.index_spec.to_config(),
+                },
+                f,
+            )
         print(f"[NativeVectorStore] 已保存到 {save_path}")
 
     @classmethod
@@ -245,30 +434,61 @@ class NativeVectorStore:
             obj = cls(
                 model_name=config.get(
                     "model_name", "sentence-transformers/all-MiniLM-L6-v2"
-                )
+                ),
+                index_spec=IndexSpec.from_config(config.get("ann_index")),
             )
         else:
             obj = cls()
         obj._index = faiss.read_index(os.path.join(load_path, "native.index"))
         with open(os.path.join(load_path, "native_docs.pkl"), "rb") as f:
             obj._documents = pickle.load(f)
+        cls._assign_chunk_ids(obj._documents)
         print(
             f"[NativeVectorStore] 已从 {load_path} 加载，共 {len(obj._documents)} 个文档块"
         )
         return obj
 
+    @staticmethod
+    def _assign_chunk_ids(documents: List[NativeDocument]) -> None:
+        """metadata["chunk_id"] = FAISS 行号（融合检索结果时用作整数 id）"""
+        for i, doc in enumerate(documents):
+            doc.metadata["chunk_id"] = i
+
     @classmethod
     def exists(cls, load_path: str) -> bool:
         return os.path.exists(
             os.path.join(load_path, "native.index")
         ) and os.path.exists(os.path.join(load_path, "native_docs.pkl"))
 
+    def query_vector(self, query: str) -> np.ndarray:
+        """query 向量（L2 归一化），经进程级 query 向量 LRU 缓存"""
+        return default_query_cache().get_or_compute(
+            cache_model_key(self.model_name, normalize=True),
+            query,
+            lambda q: self._encode([q])[0],
+        )
+
     def similarity_search(
-        self, query: str, top_k: int = 5
+        self,
+        query: str,
+        top_k: int = 5,
+        query_vector: Optional[Any] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
     ) -> List[Tuple[NativeDocument, float]]:
-        """向量相似度检索，返回 (doc, score) 列表"""
-        q_vec = self._encode([query]).astype("float32")
-        scores, indices = self._index.search(q_vec, top_k)
+        """
+        向量相似度检索，返回 (doc, score) 列表；query_vector 为预先算好的 query 向量。
+        nprobe / ef_search 覆盖 IVF / HNSW 索引的默认检索参数
+        """
+        if query_vector is None:
+            query_vector = self.query_vector(query)
+        q_vec = np.asarray(query_vector, dtype="float32").reshape(1, -1)
+        params = search_params(
+            self._index,
+            nprobe or self.index_spec.nprobe,
+            ef_search or self.index_spec.ef_search,
+        )
+        scores, indices = self._index.search(q_vec, top_k, params=params)
         results = []
         for score, idx in zip(scores[0], indices[0]):
             if idx < 0:
@@ -287,7 +507,7 @@ class NativeVectorStore:
 
 
 class NativeBM25:
-    """针对 NativeDocument 的内存 BM25"""
+    """针对 NativeDocument 的内存 BM25（倒排索引，见 bm25_index.InvertedBM25Index）"""
 
     def __init__(
         self, documents: List[NativeDocument], k1: float = 1.5, b: float = 0.75
@@ -295,63 +515,25 @@ class NativeBM25:
         self.k1 = k1
         self.b = b
         self.documents = documents
-        self.corpus = [self._tokenize(d.page_content) for d in documents]
-        self._build()
+        self.index = InvertedBM25Index((d.page_content for d in documents), k1, b)
+        self.idf: Dict[str, float] = self.index.idf
+        self.avgdl = self.index.avgdl
 
     @staticmethod
     def _tokenize(text: str) -> List[str]:
-        return re.findall(r"[\u4e00-\u9fff]|[a-z0-9]+", text.lower())
-
-    def _build(self):
-        N = len(self.corpus)
-        self.avgdl = sum(len(d) for d in self.corpus) / max(N, 1)
-        df: Dict[str, int] = {}
-        for tokens in self.corpus:
-            for t in set(tokens):
-                df[t] = df.get(t, 0) + 1
-        self.idf: Dict[str, float] = {
-            t: math.log((N - freq + 0.5) / (freq + 0.5) + 1) for t, freq in df.items()
-        }
+        return tokenize(text)
 
     def retrieve(
         self, query: str, top_k: int = 5
     ) -> List[Tuple[NativeDocument, float]]:
-        q_tokens = self._tokenize(query)
-        scores = []
-        for doc_tokens in self.corpus:
-            score = 0.0
-            tf_map: Dict[str, int] = {}
-            for t in doc_tokens:
-                tf_map[t] = tf_map.get(t, 0) + 1
-            dl = len(doc_tokens)
-            for t in q_tokens:
-                if t not in self.idf:
-                    continue
-                tf = tf_map.get(t, 0)
-                score += (
-                    self.idf[t]
-                    * tf
-                    * (self.k1 + 1)
-                    / (tf + self.k1 * (1 - self.b + self.b * dl / self.avgdl))
-                )
-            scores.append(score)
-        ranked = sorted(enumerate(scores), key=lambda x: x[1], reverse=True)[:top_k]
-        return [(self.documents[i], s) for i, s in ranked if s > 0]
+        return [(self.documents[i], s) for i, s in self.index.top_k(query, top_k)]
 
 
 def _rrf_fusion(
     ranked_lists: List[List[Tuple[NativeDocument, float]]], k: int = 60
 ) -> List[Tuple[NativeDocument, float]]:
-    """Reciprocal Rank Fusion"""
-    rrf_scores: Dict[str, float] = {}
-    doc_map: Dict[str, NativeDocument] = {}
-    for ranked in ranked_lists:
-        for rank, (doc, _) in enumerate(ranked, start=1):
-            key = doc.page_content[:200]
-            rrf_scores[key] = rrf_scores.get(key, 0.0) + 1.0 / (k + rank)
-            doc_map[key] = doc
-    fused = sorted(rrf_scores.items(), key=lambda x: x[1], reverse=True)
-    return [(doc_map[key], score) for key, score in fused]
+    """Reciprocal Rank Fusion（按 chunk_id 融合，见 rank_fusion.fuse_ranked）"""
+    return fuse_ranked(ranked_lists, k)
 
 
 # ────────────────────────────────────────────────
@@ -370,41 +552,38 @@ def _ollama_generate(
     直接调用 Ollama /api/generate，支持流式和非流式
     stream=True 时 yield 每个 token，stream=False 时一次性 yield 完整回答
     """
-    url = f"{host}/api/generate"
     payload = {"model": model, "prompt": prompt, "stream": stream}
+    pool = get_llm_pool()
 
     try:
-        resp = requests.post(url, json=payload, stream=stream, timeout=timeout)
-        resp.raise_for_status()
-    except requests.exceptions.ConnectionError:
+        if stream:
+            lines = pool.stream_lines_sync(
+                host, "/api/generate", json=payload, timeout=timeout
+            )
+            with closing(lines):
+                for line in lines:
+                    try:
+                        data = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    token = data.get("response", "")
+                    if token:
+                        yield token
+                    if data.get("done", False):
+                        break
+        else:
+            resp = pool.post_sync(host, "/api/generate", json=payload, timeout=timeout)
+            resp.raise_for_status()
+            try:
+                yield resp.json().get("response", "")
+            except Exception as e:
+                yield f"[ERROR] 解析 Ollama 响应失败: {e}"
+    except httpx.ConnectError:
         yield f"[ERROR] 无法连接 Ollama 服务（{host}），请确认服务已启动"
-        return
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         yield "[ERROR] Ollama 请求超时"
-        return
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         yield f"[ERROR] Ollama HTTP 错误: {e}"
-        return
-
-    if stream:
-        for line in resp.iter_lines():
-            if not line:
-                continue
-            try:
-                data = json.loads(line)
-                token = data.get("response", "")
-                if token:
-                    yield token
-                if data.get("done", False):
-                    break
-            except json.JSONDecodeError:
-                continue
-    else:
-        try:
-            data = resp.json()
-            yield data.get("response", "")
-        except Exception as e:
-            yield f"[ERROR] 解析 Ollama 响应失败: {e}"
 
 
 # ────────────────────────────────────────────────
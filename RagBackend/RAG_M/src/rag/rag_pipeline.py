@@ -21,7 +21,8 @@ from langchain.prompts import PromptTemplate
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
 from models.model_config import get_model_config
-from src.rag.hybrid_retriever import HybridRetriever
+from src.rag.hybrid_retriever import HybridRetriever, BM25
+from src.vectorstore.embedding_cache import query_vector
 
 # Retrieval strategy
 try:
@@ -96,6 +97,9 @@ class RAGPipeline:
         documents: Optional[List[Document]] = None,
         use_hybrid: bool = True,
         retrieval_config: Optional[dict] = None,  # Retrieval strategy
+        bm25: Optional[
+            BM25
+        ] = None,  # 预加载的 BM25（bm25.index），为空时按 documents 构建
     ):
         # Model config
         if llm_model is None:
@@ -122,6 +126,7 @@ class RAGPipeline:
             self._strategy_executor = RetrievalStrategyExecutor(
                 vectorstore=vectorstore,
                 documents=self.documents,
+                bm25=bm25 if use_hybrid else None,
             )
 
         # Hybrid retrieval fallback
@@ -136,6 +141,7 @@ class RAGPipeline:
             self._hybrid_retriever = HybridRetriever(
                 documents=self.documents,
                 vectorstore=vectorstore,
+                bm25=bm25,
             )
         elif (
             use_hybrid
@@ -156,7 +162,11 @@ class RAGPipeline:
             return self._hybrid_retriever.retrieve_with_scores(query)
 
         # fallbackVector retrieval
-        raw = self.vectorstore.similarity_search_with_score(query, k=4)
+        q_vec = query_vector(self.vectorstore, query)
+        if q_vec is None:
+            raw = self.vectorstore.similarity_search_with_score(query, k=4)
+        else:
+            raw = self.vectorstore.similarity_search_with_score_by_vector(q_vec, k=4)
         results = []
         for rank, (doc, score) in enumerate(raw, start=1):
             meta = doc.metadata or {}
@@ -0,0 +1,104 @@
+"""
+rank_fusion.py
+多路检索结果融合（RRF / 加权线性），按整数 chunk id 在 numpy 数组上累加得分
+
+每个候选文档块用一个整数标识（chunk_key）：
+  - metadata["chunk_id"]：LangChain 向量库为 FAISS IndexIDMap2 中的稳定 id，
+    原生向量库为文档块在 native_docs.pkl 中的位置
+  - 没有 chunk_id 的旧数据退化为整段文本的 hash（不再截取前 200 字，
+    开头相同的不同文档块不会被误合并）
+
+融合过程不构造字符串 key、不查字典：各路结果的 id 与得分拼成数组，
+np.unique + np.bincount 一次完成累加，支持任意多路（BM25 / 向量 / 标题检索 ...）。
+本模块只依赖 numpy，LangChain 版与原生版检索共用。
+"""
+
+from __future__ import annotations
+
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def chunk_key(doc: Any) -> int:
+    """文档块的整数 id：优先 metadata["chunk_id"]，否则为整段文本的 hash"""
+    meta = getattr(doc, "metadata", None) or {}
+    chunk_id = meta.get("chunk_id")
+    if chunk_id is not None:
+        return int(chunk_id)
+    return hash(doc.page_content)
+
+
+def rrf_scores(n: int, k: int = 60) -> np.ndarray:
+    """排名 1..n 的 RRF 得分 1 / (k + rank)"""
+    return 1.0 / (k + np.arange(1, n + 1, dtype=np.float64))
+
+
+def fuse_ids(
+    id_lists: Sequence[Sequence[int]],
+    score_lists: Sequence[Sequence[float]],
+    weights: Optional[Sequence[float]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    按 id 累加 weight * score，返回按融合得分降序排列的 (ids, scores)；
+    同分时保持 id 在输入中首次出现的顺序。
+    """
+    if weights is None:
+        weights = [1.0] * len(id_lists)
+    ids = np.concatenate(
+        [np.asarray(x, dtype=np.int64).reshape(-1) for x in id_lists]
+        or [np.empty(0, dtype=np.int64)]
+    )
+    contrib = np.concatenate(
+        [
+            w * np.asarray(s, dtype=np.float64).reshape(-1)
+            for s, w in zip(score_lists, weights)
+        ]
+        or [np.empty(0, dtype=np.float64)]
+    )
+    if ids.size == 0:
+        return ids, contrib
+    uniq, first, inverse = np.unique(ids, return_index=True, return_inverse=True)
+    totals = np.bincount(inverse, weights=contrib, minlength=uniq.size)
+    order = np.lexsort((first, -totals))
+    return uniq[order], totals[order]
+
+
+def _fuse(
+    lists: Sequence[Sequence[Tuple[Any, float]]],
+    score_lists: Sequence[Sequence[float]],
+    weights: Optional[Sequence[float]],
+) -> List[Tuple[Any, float]]:
+    id_lists = [[chunk_key(doc) for doc, _ in ranked] for ranked in lists]
+    ids, scores = fuse_ids(id_lists, score_lists, weights)
+    # 回查文档对象：同一 id 取首次出现的那一份
+    docs = {}
+    for keys, ranked in zip(id_lists, lists):
+        for key, (doc, _) in zip(keys, ranked):
+            docs.setdefault(key, doc)
+    return [(docs[i], s) for i, s in zip(ids.tolist(), scores.tolist())]
+
+
+def fuse_ranked(
+    ranked_lists: Sequence[Sequence[Tuple[Any, float]]],
+    k: int = 60,
+    weights: Optional[Sequence[float]] = None,
+) -> List[Tuple[Any, float]]:
+    """
+    Reciprocal Rank Fusion：ranked_lists 为多路 (doc, score) 排序结果，
+    只使用名次；weights 为各路权重（默认均为 1）。返回 (doc, rrf_score) 降序列表
+    """
+    return _fuse(ranked_lists, [rrf_scores(len(r), k) for r in ranked_lists], weights)
+
+
+def fuse_scored(
+    scored_lists: Sequence[Sequence[Tuple[Any, float]]],
+    weights: Optional[Sequence[float]] = None,
+) -> List[Tuple[Any, float]]:
+    """
+    加权线性融合：score = Σ weight_i * score_i，各路得分需事先归一化到同一量纲。
+    返回 (doc, fused_score) 降序列表
+    """
+    return _fuse(
+        scored_lists, [[s for _, s in scored] for scored in scored_lists], weights
+    )
@@ -0,0 +1,224 @@
+"""
+ann_index.py
+按知识库配置选择 FAISS 索引类型（flat / IVF-Flat / IVF-PQ / HNSW）
+
+知识库 knowledge_data.json 中的 "ann_index" 字段描述索引规格，例如：
+  {"type": "hnsw", "hnsw_m": 32, "ef_search": 64}
+  {"type": "ivf_pq", "nlist": 4096, "pq_m": 48, "nprobe": 32, "train_threshold": 50000}
+
+  - 文档块数低于 train_threshold 时始终使用精确的 flat 索引（小库暴力检索更快、召回 100%），
+    超过阈值后自动训练并切换到 ANN 索引（VectorStoreManager.add_documents 追加时同样检查）
+  - nlist 为 0 时按 4·sqrt(N) 自动选取；训练样本最多 nlist × 64 条
+  - nprobe / ef_search 为默认检索参数，单次查询可通过 search_params() 覆盖
+  - 返回的索引不带 id 映射，LangChain 向量库外层再包 IndexIDMap2（稳定 chunk_id）
+
+HNSW 不支持 remove_ids：删除 chunk 时由调用方用 rebuild() 以剩余向量重建；
+IVF-PQ 的 reconstruct 是有损的，重建后的编码相当于二次量化。
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# IVF 训练：每个聚类中心至少 39 个样本（faiss 的建议下限），最多取 64 个
+_MIN_POINTS_PER_CENTROID = 39
+_MAX_POINTS_PER_CENTROID = 64
+
+
+@dataclass
+class IndexSpec:
+    type: str = "flat"
+    nlist: int = 0  # IVF 聚类中心数，0 = 自动
+    pq_m: int = 0  # PQ 子空间数，0 = 自动（dim 的约数，每个子空间约 8 维）
+    pq_bits: int = 8
+    hnsw_m: int = 32
+    ef_construction: int = 200
+    nprobe: int = 16
+    ef_search: int = 64
+    train_threshold: int = 10000
+
+    def __post_init__(self):
+        if self.type not in INDEX_TYPES:
+            raise ValueError(f"未知的索引类型 {self.type!r}，可选: {INDEX_TYPES}")
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> "IndexSpec":
+        """从知识库配置（knowledge_data.json 整体或其中的 ann_index 字段）解析"""
+        if not config:
+            return cls()
+        raw = config.get("ann_index", config) if isinstance(config, dict) else config
+        if isinstance(raw, str):
+            raw = {"type": raw}
+        if not isinstance(raw, dict):
+            return cls()
+        fields = cls.__dataclass_fields__
+        kwargs = {k: v for k, v in raw.items() if k in fields}
+        try:
+            return cls(**kwargs)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"[ANN] 索引配置无效，使用 flat: {e}")
+            return cls()
+
+    @classmethod
+    def from_kb_dir(cls, docs_dir: Optional[str]) -> "IndexSpec":
+        """读取知识库目录下 knowledge_data.json 的 ann_index 字段，缺失时为 flat"""
+        if not docs_dir:
+            return cls()
+        config_path = os.path.join(docs_dir, "knowledge_data.json")
+        try:
+            with open(config_path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        except (OSError, ValueError):
+            return cls()
+        return cls.from_config(config.get("ann_index"))
+
+    def to_config(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def effective_type(self, n: int) -> str:
+        """当前规模下实际使用的索引类型"""
+        if self.type == "flat" or n < self.train_threshold:
+            return "flat"
+        return self.type
+
+    def nlist_for(self, n: int) -> int:
+        nlist = self.nlist or int(4 * math.sqrt(max(n, 1)))
+        # 保证每个中心有足够的训练样本
+        return max(1, min(nlist, n // _MIN_POINTS_PER_CENTROID))
+
+    def pq_m_for(self, dim: int) -> int:
+        if self.pq_m and dim % self.pq_m == 0:
+            return self.pq_m
+        m = max(1, dim // 8)
+        while dim % m:
+            m -= 1
+        return m
+
+
+def build_index(
+    spec: IndexSpec, vectors: np.ndarray, metric: int, add: bool = True
+) -> faiss.Index:
+    """
+    按 spec 构建并训练索引；add=True 时按行顺序加入 vectors（id 即行号）。
+    metric: faiss.METRIC_L2 / faiss.METRIC_INNER_PRODUCT
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    kind = spec.effective_type(n)
+
+    if kind == "flat":
+        index = faiss.IndexFlat(dim, metric)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, spec.hnsw_m, metric)
+        index.hnsw.efConstruction = spec.ef_construction
+        index.hnsw.efSearch = spec.ef_search
+    else:
+        nlist = spec.nlist_for(n)
+        quantizer = faiss.IndexFlat(dim, metric)
+        if kind == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+        else:
+            index = faiss.IndexIVFPQ(
+                quantizer, dim, nlist, spec.pq_m_for(dim), spec.pq_bits, metric
+            )
+        index.nprobe = spec.nprobe
+        sample = vectors
+        limit = nlist * _MAX_POINTS_PER_CENTROID
+        if n > limit:
+            rows = np.random.default_rng(0).choice(n, limit, replace=False)
+            sample = vectors[np.sort(rows)]
+        logger.info(f"[ANN] 训练 {kind}（nlist={nlist}）：{len(sample)} 条样本")
+        index.train(sample)
+
+    if add and n:
+        index.add(vectors)
+    logger.info(f"[ANN] 构建 {kind} 索引：{n} 条向量，dim={dim}")
+    return index
+
+
+def index_kind(index: faiss.Index) -> str:
+    """索引实际类型（穿透 IndexIDMap2 等包装）"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def supports_remove(index: faiss.Index) -> bool:
+    return index_kind(index) != "hnsw"
+
+
+def search_params(
+    index: faiss.Index,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    sel: Optional[faiss.IDSelector] = None,
+) -> Optional[faiss.SearchParameters]:
+    """单次查询的检索参数（线程安全，不修改索引本身）；无需特殊参数时返回 None"""
+    kind = index_kind(index)
+    if kind in ("ivf_flat", "ivf_pq") and nprobe:
+        params = faiss.SearchParametersIVF(nprobe=int(nprobe))
+    elif kind == "hnsw" and ef_search:
+        params = faiss.SearchParametersHNSW(efSearch=int(ef_search))
+    elif sel is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if sel is not None:
+        params.sel = sel
+    return params
+
+
+def reconstruct_all(index: faiss.Index) -> Tuple[np.ndarray, np.ndarray]:
+    """取出 IndexIDMap2 中的全部 (ids, vectors)，用于升级 / 重建索引"""
+    ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.make_direct_map()
+    vectors = inner.reconstruct_n(0, inner.ntotal) if inner.ntotal else None
+    if vectors is None:
+        vectors = np.empty((0, index.d), dtype=np.float32)
+    return ids, vectors
+
+
+def rebuild(
+    spec: IndexSpec,
+    index: faiss.Index,
+    metric: int,
+    drop_ids: Optional[np.ndarray] = None,
+) -> faiss.IndexIDMap2:
+    """按 spec 重建 IndexIDMap2（可同时剔除 drop_ids），chunk_id 保持不变"""
+    ids, vectors = reconstruct_all(index)
+    if drop_ids is not None and len(drop_ids):
+        keep = ~np.isin(ids, drop_ids)
+        ids, vectors = ids[keep], vectors[keep]
+    rebuilt = faiss.IndexIDMap2(build_index(spec, vectors, metric, add=False))
+    if len(ids):
+        rebuilt.add_with_ids(vectors, ids)
+    return rebuilt
+
+
+def needs_upgrade(spec: IndexSpec, index: faiss.Index) -> bool:
+    """库规模已超过训练阈值，但仍是 flat 索引"""
+    return (
+        spec.type != "flat"
+        and index.ntotal >= spec.train_threshold
+        and index_kind(index) == "flat"
+    )
@@ -0,0 +1,252 @@
+"""
+embedding_cache.py
+chunk 级持久化 embedding 缓存（SQLite，WAL 模式）
+
+  key = (模型标识, 规范化文本的 SHA256)，value = float32 向量字节
+
+规范化：NFKC + 折叠空白，仅影响哈希，不改变实际编码的文本。
+命中缓存的 chunk 不再走模型推理：文档更新时未改动的段落、
+切换 embedding 模型的试跑（同一模型第二次起）都直接复用已有向量。
+
+另有进程内 query 向量 LRU（QueryEmbeddingCache）：key = (模型标识, 规范化 query)，
+一次请求内向量 / 混合 / RRF / MMR 各路检索共享同一个 query 向量，热门问题跨请求复用。
+模型标识带上是否 L2 归一化（cache_model_key），原生路径（归一化）与 LangChain 路径
+（embed_query 原始向量）即使模型名相同也不共用缓存。
+
+配置（环境变量）：
+  RAG_EMBED_CACHE             设为 0 关闭缓存，默认开启
+  RAG_EMBED_CACHE_PATH        SQLite 文件路径，默认 RagBackend/metadata/embedding_cache.db
+  RAG_QUERY_EMBED_CACHE_SIZE  query 向量 LRU 条目数，默认 2048；0 表示不缓存
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_BACKEND_DIR = Path(__file__).resolve().parents[3]
+DEFAULT_CACHE_PATH = str(_BACKEND_DIR / "metadata" / "embedding_cache.db")
+
+# SQLite 单条语句的参数上限（旧版本为 999）
+_SQL_BATCH = 500
+
+_QUERY_CACHE_SIZE = int(os.getenv("RAG_QUERY_EMBED_CACHE_SIZE", "2048"))
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """(model, text_hash) -> 向量 的持久化缓存，线程安全"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model     TEXT    NOT NULL,
+                text_hash TEXT    NOT NULL,
+                dim       INTEGER NOT NULL,
+                vector    BLOB    NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.commit()
+
+    def get_many(self, model: str, hashes: Iterable[str]) -> Dict[str, np.ndarray]:
+        """批量查询，返回命中的 {text_hash: vector}"""
+        keys = list(dict.fromkeys(hashes))
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for i in range(0, len(keys), _SQL_BATCH):
+                part = keys[i : i + _SQL_BATCH]
+                rows = self._conn.execute(
+                    "SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({','.join('?' * len(part))})",
+                    [model, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model: str, hashes: Sequence[str], vectors: np.ndarray) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        rows = [
+            (model, h, int(v.shape[0]), v.tobytes()) for h, v in zip(hashes, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, dim, vector) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def count(self, model: Optional[str] = None) -> int:
+        with self._lock:
+            if model is None:
+                row = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            else:
+                row = self._conn.execute(
+                    "SELECT COUNT(*) FROM embeddings WHERE model = ?", (model,)
+                ).fetchone()
+        return int(row[0])
+
+    def models(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT model FROM embeddings"
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def drop_model(self, model: str) -> int:
+        """删除某个模型的全部缓存（模型下线后回收空间），返回删除条数"""
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM embeddings WHERE model = ?", (model,))
+            self._conn.commit()
+        return cur.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache: Optional[EmbeddingCache] = None
+_default_lock = threading.Lock()
+
+
+def default_embedding_cache() -> Optional[EmbeddingCache]:
+    """进程级共享缓存实例；RAG_EMBED_CACHE=0 或打开失败时返回 None（不缓存）"""
+    global _default_cache
+    if os.getenv("RAG_EMBED_CACHE", "1") == "0":
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            path = os.getenv("RAG_EMBED_CACHE_PATH", DEFAULT_CACHE_PATH)
+            try:
+                _default_cache = EmbeddingCache(path)
+            except sqlite3.Error as e:
+                print(
+                    f"[EmbeddingCache] 打开缓存失败（{e}），本进程不使用 embedding 缓存"
+                )
+                return None
+        return _default_cache
+
+
+# ─────────────────────────────────────────────────────────────────
+# query 向量 LRU
+# ─────────────────────────────────────────────────────────────────
+
+
+class QueryEmbeddingCache:
+    """(model, 规范化 query) -> 向量 的进程内 LRU，线程安全；返回的向量只读"""
+
+    def __init__(self, max_entries: int = _QUERY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(
+        self, model: str, query: str, compute: Callable[[str], Any]
+    ) -> np.ndarray:
+        """命中直接返回；未命中调用 compute(query) 编码后写入（编码在锁外进行）"""
+        key = (model, normalize_text(query))
+        with self._lock:
+            vec = self._entries.get(key)
+            if vec is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vec
+            self.misses += 1
+
+        vec = np.array(compute(query), dtype=np.float32).reshape(-1)
+        vec.setflags(write=False)
+        if self.max_entries > 0:
+            with self._lock:
+                self._entries[key] = vec
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return vec
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+_query_cache = QueryEmbeddingCache()
+
+
+def default_query_cache() -> QueryEmbeddingCache:
+    """进程级共享的 query 向量缓存"""
+    return _query_cache
+
+
+def cache_model_key(model_name: str, normalize: bool) -> str:
+    """缓存用的模型标识：同一模型归一化与否的向量不同，不能混用"""
+    return f"{model_name}|norm={int(normalize)}"
+
+
+def embedding_model_name(embeddings: Any) -> Optional[str]:
+    """
+    embedding 对象的缓存模型标识（HuggingFaceEmbeddings.model_name 等 + 是否归一化），
+    取不到模型名时返回 None
+    """
+    for attr in ("model_name", "model"):
+        name = getattr(embeddings, attr, None)
+        if isinstance(name, str) and name:
+            encode_kwargs = getattr(embeddings, "encode_kwargs", None) or {}
+            normalize = bool(encode_kwargs.get("normalize_embeddings", False))
+            return cache_model_key(name, normalize)
+    return None
+
+
+def embed_query(embeddings: Any, query: str) -> np.ndarray:
+    """embeddings.embed_query 的缓存版本；模型无法识别时直接编码、不缓存"""
+    model = embedding_model_name(embeddings)
+    if model is None:
+        return np.asarray(embeddings.embed_query(query), dtype=np.float32)
+    return _query_cache.get_or_compute(model, query, embeddings.embed_query)
+
+
+def query_vector(vectorstore: Any, query: str) -> Optional[np.ndarray]:
+    """
+    LangChain 向量库的 query 向量，经 default_query_cache 缓存。
+    无法识别 embedding 模型时返回 None（不同模型的向量不能混用），调用方按文本检索。
+    """
+    model = embedding_model_name(getattr(vectorstore, "embedding_function", None))
+    if model is None:
+        return None
+    return _query_cache.get_or_compute(model, query, vectorstore._embed_query)
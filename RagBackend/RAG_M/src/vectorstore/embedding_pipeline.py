@@ -0,0 +1,266 @@
+"""
+embedding_pipeline.py
+入库编码阶段：批量 / 多进程 embedding
+
+  解析 → 分块 → 编码（BatchEmbedder） → 写入（每个批任务只写一次 FAISS）
+
+  - 按文本长度排序后切 batch，同一 batch 内长度相近，padding 最少
+  - workers > 1 时 batch 分发到 CPU 进程池（spawn，每个进程各自加载一份模型，
+    torch 线程数按进程数均分），进程池按 (模型, workers) 复用
+  - 结果按输入顺序还原，并统计吞吐（chunks/s）
+  - 可选 EmbeddingCache：命中缓存的 chunk 跳过推理，只编码未命中部分
+
+配置（环境变量）：
+  RAG_EMBED_BATCH_SIZE  每个 batch 的 chunk 数，默认 64
+  RAG_EMBED_WORKERS     编码进程数，默认 1（进程内编码，复用已加载的模型）
+"""
+
+from __future__ import annotations
+
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from .embedding_cache import EmbeddingCache, cache_model_key, text_hash
+except ImportError:
+    from vectorstore.embedding_cache import EmbeddingCache, cache_model_key, text_hash
+
+try:
+    from monitoring.metrics import STATS as _METRICS
+except ImportError:  # 单独运行 RAG_M 时没有监控模块
+    _METRICS = None
+
+DEFAULT_BATCH_SIZE = int(os.getenv("RAG_EMBED_BATCH_SIZE", "64"))
+DEFAULT_WORKERS = int(os.getenv("RAG_EMBED_WORKERS", "1"))
+
+
+def length_sorted_batches(texts: Sequence[str], batch_size: int) -> List[List[int]]:
+    """按长度降序切分 batch，返回每个 batch 的原始下标（长 batch 先发，进程池负载更均衡）"""
+    batch_size = max(1, batch_size)
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    return [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+# ─────────────────────────────────────────────────────────────────
+# 进程池（子进程内常驻模型）
+# ─────────────────────────────────────────────────────────────────
+
+_worker_model = None
+_worker_normalize = False
+
+
+def _init_worker(model_name: str, normalize: bool, threads: int) -> None:
+    global _worker_model, _worker_normalize
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    from sentence_transformers import SentenceTransformer
+
+    _worker_model = SentenceTransformer(model_name)
+    _worker_normalize = normalize
+
+
+def _encode_batch(texts: List[str]) -> np.ndarray:
+    vectors = _worker_model.encode(
+        texts,
+        batch_size=len(texts),
+        show_progress_bar=False,
+        normalize_embeddings=_worker_normalize,
+    )
+    return np.asarray(vectors, dtype=np.float32)
+
+
+_pools: Dict[Tuple[str, bool, int], ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(model_name: str, normalize: bool, workers: int) -> ProcessPoolExecutor:
+    key = (model_name, normalize, workers)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(model_name, normalize, threads),
+            )
+            _pools[key] = pool
+            print(
+                f"[BatchEmbedder] 启动编码进程池: {model_name}, "
+                f"workers={workers}, threads/worker={threads}"
+            )
+        return pool
+
+
+def _drop_pool(model_name: str, normalize: bool, workers: int) -> None:
+    with _pools_lock:
+        pool = _pools.pop((model_name, normalize, workers), None)
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pools() -> None:
+    """关闭所有编码进程池（进程退出时自动调用）"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(shutdown_pools)
+
+
+# ─────────────────────────────────────────────────────────────────
+# BatchEmbedder
+# ─────────────────────────────────────────────────────────────────
+
+
+@dataclass
+class EmbeddingStats:
+    chunks: int
+    batches: int
+    seconds: float
+    workers: int
+    cache_hits: int = 0
+
+    @property
+    def chunks_per_sec(self) -> float:
+        return self.chunks / self.seconds if self.seconds > 0 else 0.0
+
+
+class BatchEmbedder:
+    """
+    批量编码器。
+
+    Args:
+        model_name: sentence-transformers 模型名（多进程模式下子进程据此加载模型）
+        encode_fn:  进程内编码函数 texts -> vectors；为空时按 model_name 懒加载模型
+        batch_size: 每个 batch 的 chunk 数
+        workers:    编码进程数，<= 1 时在当前进程内编码
+        normalize:  是否 L2 归一化（需与查询侧 embedding 保持一致）
+        cache:      可选的持久化 embedding 缓存，按 (模型, 规范化文本哈希) 复用向量
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        encode_fn: Optional[Callable[[List[str]], Sequence]] = None,
+        batch_size: Optional[int] = None,
+        workers: Optional[int] = None,
+        normalize: bool = False,
+        cache: Optional[EmbeddingCache] = None,
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size or DEFAULT_BATCH_SIZE
+        self.workers = max(1, workers if workers is not None else DEFAULT_WORKERS)
+        self.normalize = normalize
+        self._encode_fn = encode_fn
+        self.cache = cache
+        self.cache_model = cache_model_key(model_name, normalize)
+        self._model = None
+        self.last_stats: Optional[EmbeddingStats] = None
+
+    def _encode_local(self, texts: List[str]) -> Sequence:
+        if self._encode_fn is not None:
+            return self._encode_fn(texts)
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+
+            self._model = SentenceTransformer(self.model_name)
+        return self._model.encode(
+            texts,
+            batch_size=len(texts),
+            show_progress_bar=False,
+            normalize_embeddings=self.normalize,
+        )
+
+    def _encode_batches(self, texts: List[str]):
+        """长度排序分 batch 编码，返回 (矩阵, batch 数, 实际使用的进程数)"""
+        batches = length_sorted_batches(texts, self.batch_size)
+        payloads = ([texts[i] for i in batch] for batch in batches)
+        use_pool = self.workers > 1 and len(batches) > 1
+
+        if use_pool:
+            pool = _get_pool(self.model_name, self.normalize, self.workers)
+            results = pool.map(_encode_batch, payloads)
+        else:
+            results = map(self._encode_local, payloads)
+
+        out: Optional[np.ndarray] = None
+        try:
+            for batch, vectors in zip(batches, results):
+                vectors = np.asarray(vectors, dtype=np.float32)
+                if out is None:
+                    out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+                out[batch] = vectors
+        except Exception:
+            if use_pool:
+                # 子进程崩溃后进程池不可再用，下次调用重新创建
+                _drop_pool(self.model_name, self.normalize, self.workers)
+            raise
+        return out, len(batches), self.workers if use_pool else 1
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """编码 texts，返回 (len(texts), dim) float32 矩阵，行顺序与输入一致"""
+        t0 = time.perf_counter()
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        keys: List = list(range(len(texts)))
+        cached: Dict = {}
+        if self.cache is not None:
+            keys = [text_hash(t) for t in texts]
+            cached = self.cache.get_many(self.cache_model, keys)
+
+        # 只编码缓存未命中的文本，同一批内重复文本只编码一次
+        pending: Dict = {}
+        todo: List[str] = []
+        for i, key in enumerate(keys):
+            if key not in cached and key not in pending:
+                pending[key] = len(todo)
+                todo.append(texts[i])
+
+        encoded = np.zeros((0, 0), dtype=np.float32)
+        n_batches, workers = 0, 1
+        if todo:
+            encoded, n_batches, workers = self._encode_batches(todo)
+            if self.cache is not None:
+                self.cache.put_many(self.cache_model, list(pending), encoded)
+
+        dim = encoded.shape[1] if todo else next(iter(cached.values())).shape[0]
+        out = np.empty((len(texts), dim), dtype=np.float32)
+        for i, key in enumerate(keys):
+            row = pending.get(key)
+            out[i] = encoded[row] if row is not None else cached[key]
+
+        stats = EmbeddingStats(
+            chunks=len(texts),
+            batches=n_batches,
+            seconds=time.perf_counter() - t0,
+            workers=workers,
+            cache_hits=len(texts) - sum(1 for k in keys if k in pending),
+        )
+        self.last_stats = stats
+        if _METRICS is not None:
+            _METRICS.record_stage("embedding", stats.seconds * 1000)
+        print(
+            f"[BatchEmbedder] {stats.chunks} chunks / {stats.batches} batches, "
+            f"cache hits {stats.cache_hits}, {stats.seconds:.1f}s, "
+            f"{stats.chunks_per_sec:.1f} chunks/s (workers={stats.workers})"
+        )
+        return out
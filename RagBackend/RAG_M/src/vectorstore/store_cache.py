@@ -0,0 +1,229 @@
+"""
+store_cache.py
+进程级向量库缓存 + 向量库目录的读写锁 / 代数（generation）
+
+  - VectorStoreCache      LRU 缓存 (FAISS 对象, docstore 文档列表, BM25)，按 docs_dir 为 key，
+                          受内存预算约束；每次命中都会比对目录签名，文件变化即重新加载
+  - vectorstore_lock      目录级读写锁（fcntl.flock，跨进程）；读者加载时持共享锁，
+                          写者替换 index.faiss / index.pkl / bm25.index 时持排他锁
+  - vectorstore_transaction  写者入口：排他锁内完成写入，退出时递增 generation 文件
+
+缓存条目是不可变快照：新版本加载完成后才替换旧条目，
+正在使用旧条目的查询继续持有旧对象引用，不会看到写了一半的索引。
+"""
+
+from __future__ import annotations
+
+import contextlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+LOCK_FILENAME = ".lock"
+GENERATION_FILENAME = "generation"
+_SIGNATURE_FILES = (
+    "index.faiss",
+    "index.pkl",
+    "bm25.index",
+    "deleted.bitmap",
+    GENERATION_FILENAME,
+)
+
+_DEFAULT_BUDGET_MB = int(os.getenv("RAG_STORE_CACHE_MB", "2048"))
+
+
+# ─────────────────────────────────────────────────────────────────
+# 目录锁 / generation
+# ─────────────────────────────────────────────────────────────────
+
+_held = threading.local()
+_fallback_locks: Dict[str, threading.RLock] = {}
+_fallback_guard = threading.Lock()
+
+
+@contextlib.contextmanager
+def vectorstore_lock(path: str, exclusive: bool = False):
+    """
+    向量库目录读写锁。同一线程内可重入（已持有时直接通过，不做锁升级，
+    因此需要排他锁的写者应最先获取排他锁）。
+    无 fcntl 的平台退化为进程内互斥锁。
+    """
+    path = os.path.abspath(path)
+    held: Dict[str, int] = getattr(_held, "paths", None)
+    if held is None:
+        held = _held.paths = {}
+    if path in held:
+        held[path] += 1
+        try:
+            yield
+        finally:
+            held[path] -= 1
+        return
+
+    if fcntl is None:
+        with _fallback_guard:
+            lock = _fallback_locks.setdefault(path, threading.RLock())
+        with lock:
+            held[path] = 1
+            try:
+                yield
+            finally:
+                del held[path]
+        return
+
+    os.makedirs(path, exist_ok=True)
+    fd = os.open(os.path.join(path, LOCK_FILENAME), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        held[path] = 1
+        try:
+            yield
+        finally:
+            del held[path]
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def read_generation(path: str) -> int:
+    try:
+        with open(os.path.join(path, GENERATION_FILENAME), "r") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def bump_generation(path: str) -> int:
+    """generation + 1（临时文件 + os.replace），应在排他锁内调用"""
+    gen = read_generation(path) + 1
+    target = os.path.join(path, GENERATION_FILENAME)
+    tmp = target + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(str(gen))
+    os.replace(tmp, target)
+    return gen
+
+
+@contextlib.contextmanager
+def vectorstore_transaction(path: str):
+    """写者入口：排他锁内写入，成功后递增 generation 使所有进程的缓存失效"""
+    with vectorstore_lock(path, exclusive=True):
+        yield
+        bump_generation(path)
+
+
+def store_signature(path: str) -> Tuple:
+    """目录签名：各索引文件的 (mtime_ns, size)，缺失记为 None"""
+    sig = []
+    for name in _SIGNATURE_FILES:
+        try:
+            st = os.stat(os.path.join(path, name))
+            sig.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            sig.append(None)
+    return tuple(sig)
+
+
+# ─────────────────────────────────────────────────────────────────
+# LRU 缓存
+# ─────────────────────────────────────────────────────────────────
+
+
+@dataclass(frozen=True)
+class CachedStore:
+    vectorstore: Any
+    documents: List[Any]
+    bm25: Any
+    signature: Tuple
+    nbytes: int
+
+
+def estimate_store_bytes(vectorstore, documents, bm25_path: Optional[str]) -> int:
+    """粗略估算常驻内存：向量矩阵 + 文本 + BM25 文件大小"""
+    total = 0
+    index = getattr(vectorstore, "index", None)
+    if index is not None:
+        total += int(getattr(index, "ntotal", 0)) * int(getattr(index, "d", 0)) * 4
+    total += sum(sys.getsizeof(getattr(d, "page_content", "")) for d in documents)
+    if bm25_path and os.path.exists(bm25_path):
+        total += os.path.getsize(bm25_path)
+    return total
+
+
+class VectorStoreCache:
+    """
+    docs_dir -> CachedStore 的 LRU，总大小不超过 budget_bytes（至少保留最近一个条目）。
+    loader(docs_dir) 返回 CachedStore，由调用方在共享锁内完成加载。
+    """
+
+    def __init__(self, budget_bytes: int = _DEFAULT_BUDGET_MB * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self._entries: "OrderedDict[str, CachedStore]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(
+        self,
+        key: str,
+        store_path: str,
+        loader: Callable[[str], CachedStore],
+    ) -> CachedStore:
+        signature = store_signature(store_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.signature == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # 同一 key 只允许一个线程加载，其余线程等待后复用结果
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry.signature == store_signature(store_path):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                self.misses += 1
+
+            entry = loader(key)
+
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                self._evict()
+            return entry
+
+    def _evict(self) -> None:
+        total = sum(e.nbytes for e in self._entries.values())
+        while total > self.budget_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            total -= old.nbytes
+            self.evictions += 1
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(e.nbytes for e in self._entries.values()),
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,102 @@
+"""
+tombstones.py
+软删除位图：按 chunk_id（FAISS IndexIDMap2 中的 id）记录已废弃的向量
+
+  - 每个向量库目录一个 deleted.bitmap（bit i = 1 表示 chunk_id i 已废弃）
+  - soft_delete / remove_file / 文档更新时置位，compaction 移除向量后清位
+  - 查询时转成 faiss.IDSelectorNot(IDSelectorBitmap)，由 FAISS 在检索内部跳过废弃向量，
+    top-k 只在有效向量中计算，不需要检索后再按 metadata 字符串过滤
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Iterable, Optional
+
+import numpy as np
+
+TOMBSTONE_FILENAME = "deleted.bitmap"
+
+
+class DeletionBitmap:
+    """chunk_id -> 是否废弃 的位图（little-endian 位序，与 faiss.IDSelectorBitmap 一致）"""
+
+    def __init__(self, bits: Optional[np.ndarray] = None):
+        self._bits = (
+            np.zeros(0, dtype=np.uint8) if bits is None else bits.astype(np.uint8)
+        )
+        self._count = int(np.unpackbits(self._bits).sum()) if len(self._bits) else 0
+
+    # ── 持久化 ─────────────────────────────────────────────────
+
+    @classmethod
+    def load(cls, store_dir: str) -> "DeletionBitmap":
+        """读取目录下的位图，文件不存在时返回空位图"""
+        path = os.path.join(store_dir, TOMBSTONE_FILENAME)
+        if not os.path.exists(path):
+            return cls()
+        return cls(np.fromfile(path, dtype=np.uint8))
+
+    def save(self, store_dir: str) -> None:
+        """临时文件 + os.replace 原子写入；位图为空时删除文件"""
+        path = os.path.join(store_dir, TOMBSTONE_FILENAME)
+        if self._count == 0:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        tmp = path + ".tmp"
+        self._bits.tofile(tmp)
+        os.replace(tmp, path)
+
+    # ── 读写 ───────────────────────────────────────────────────
+
+    def _ids(self, ids: Iterable[int]) -> np.ndarray:
+        arr = np.fromiter((int(i) for i in ids), dtype=np.int64)
+        return arr[arr >= 0]
+
+    def mark(self, ids: Iterable[int]) -> None:
+        arr = self._ids(ids)
+        if not len(arr):
+            return
+        need = int(arr.max() >> 3) + 1
+        if need > len(self._bits):
+            grown = np.zeros(max(need, 2 * len(self._bits)), dtype=np.uint8)
+            grown[: len(self._bits)] = self._bits
+            self._bits = grown
+        np.bitwise_or.at(self._bits, arr >> 3, (1 << (arr & 7)).astype(np.uint8))
+        self._count = int(np.unpackbits(self._bits).sum())
+
+    def unmark(self, ids: Iterable[int]) -> None:
+        arr = self._ids(ids)
+        arr = arr[(arr >> 3) < len(self._bits)]
+        if not len(arr):
+            return
+        np.bitwise_and.at(self._bits, arr >> 3, (~(1 << (arr & 7))).astype(np.uint8))
+        self._count = int(np.unpackbits(self._bits).sum())
+
+    def mask(self, ids: np.ndarray) -> np.ndarray:
+        """向量化判断：返回与 ids 等长的 bool 数组（True 表示已废弃，负数 id 视为未废弃）"""
+        ids = np.asarray(ids, dtype=np.int64)
+        valid = (ids >= 0) & ((ids >> 3) < len(self._bits))
+        out = np.zeros(ids.shape, dtype=bool)
+        v = ids[valid]
+        out[valid] = (self._bits[v >> 3] >> (v & 7)) & 1 == 1
+        return out
+
+    def __contains__(self, chunk_id: int) -> bool:
+        return bool(self.mask(np.array([chunk_id]))[0])
+
+    def __len__(self) -> int:
+        return self._count
+
+    # ── FAISS ──────────────────────────────────────────────────
+
+    def selector(self):
+        """返回排除废弃 id 的 faiss.IDSelector（持有位图引用，保证缓冲区存活）"""
+        import faiss
+
+        bits = np.ascontiguousarray(self._bits)
+        inner = faiss.IDSelectorBitmap(len(bits), faiss.swig_ptr(bits))
+        sel = faiss.IDSelectorNot(inner)
+        sel.referenced_objects = [inner, bits]
+        return sel
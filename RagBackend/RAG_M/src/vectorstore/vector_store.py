@@ -1,17 +1,51 @@
+import operator
 import os
+import uuid
 import warnings
-from typing import List, Optional
+from typing import Any, Iterable, List, Optional, Tuple
 
+import faiss
+import numpy as np
 from dotenv import load_dotenv
 from langchain.docstore.document import Document
 from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import (
+    DistanceStrategy,
+    maximal_marginal_relevance,
+)
 
 import sys
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 from models.model_config import get_model_config
 
+try:
+    from .ann_index import (
+        IndexSpec,
+        index_kind,
+        needs_upgrade,
+        rebuild,
+        search_params,
+    )
+    from .embedding_cache import default_embedding_cache
+    from .embedding_pipeline import BatchEmbedder
+    from .store_cache import vectorstore_transaction
+    from .tombstones import TOMBSTONE_FILENAME, DeletionBitmap
+except ImportError:
+    from vectorstore.ann_index import (
+        IndexSpec,
+        index_kind,
+        needs_upgrade,
+        rebuild,
+        search_params,
+    )
+    from vectorstore.embedding_cache import default_embedding_cache
+    from vectorstore.embedding_pipeline import BatchEmbedder
+    from vectorstore.store_cache import vectorstore_transaction
+    from vectorstore.tombstones import TOMBSTONE_FILENAME, DeletionBitmap
+
 import json
 
 
@@ -21,13 +55,178 @@ load_dotenv()
 
 # VECTORSTORE_PATH = os.getenv("VECTORSTORE_PATH")
 
+# Index metadata saved next to index.faiss / index.pkl
+INDEX_META_FILENAME = "index_meta.json"
+
+
+def _read_next_chunk_id(store_dir: str) -> Optional[int]:
+    """Persisted chunk id counter of a store directory (None if absent)"""
+    path = os.path.join(store_dir, INDEX_META_FILENAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return int(json.load(f)["next_chunk_id"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+class TombstoneFAISS(FAISS):
+    """
+    FAISS store that skips soft-deleted chunks inside the index search.
+
+    `tombstones` (a DeletionBitmap keyed by chunk id) is turned into a
+    faiss IDSelector, so top-k is computed over live vectors only and
+    stays correct no matter how many chunks are tombstoned. Index types
+    without selector support fall back to over-fetching k + #deleted and
+    masking the result with the bitmap.
+
+    For IVF / HNSW indexes (see ann_index), `nprobe` / `ef_search` are the
+    default search parameters; both can be overridden per query through
+    the search kwargs of the same name.
+
+    MMR search fetches its fetch_k candidates through the same live-only
+    search, so deleted chunks never reach the diversity re-ranking.
+
+    `next_chunk_id` is the monotonic chunk id counter; save_local writes it
+    to index_meta.json so ids freed by compaction are never handed out again.
+    """
+
+    tombstones: Optional[DeletionBitmap] = None
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    next_chunk_id: Optional[int] = None
+
+    def save_local(self, folder_path: str, index_name: str = "index") -> None:
+        super().save_local(folder_path, index_name)
+        if self.next_chunk_id is None:
+            return
+        path = os.path.join(folder_path, INDEX_META_FILENAME)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"next_chunk_id": int(self.next_chunk_id)}, f)
+        os.replace(tmp, path)
+
+    def _search_live(
+        self,
+        vector: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ):
+        tombstones = self.tombstones
+        if not tombstones:
+            params = search_params(self.index, nprobe, ef_search)
+            return self.index.search(vector, k, params=params)
+        try:
+            params = search_params(self.index, nprobe, ef_search, tombstones.selector())
+            return self.index.search(vector, k, params=params)
+        except (RuntimeError, TypeError):
+            fetch = min(self.index.ntotal, k + len(tombstones))
+            params = search_params(self.index, nprobe, ef_search)
+            scores, indices = self.index.search(vector, fetch, params=params)
+            dead = tombstones.mask(indices[0])
+            keep = np.flatnonzero(~dead)[:k]
+            return scores[:, keep], indices[:, keep]
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Any] = None,
+        fetch_k: int = 20,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        nprobe = kwargs.pop("nprobe", None) or self.nprobe
+        ef_search = kwargs.pop("ef_search", None) or self.ef_search
+        if not self.tombstones and search_params(self.index, nprobe, ef_search) is None:
+            return super().similarity_search_with_score_by_vector(
+                embedding, k=k, filter=filter, fetch_k=fetch_k, **kwargs
+            )
+
+        vector = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vector)
+        scores, indices = self._search_live(
+            vector, k if filter is None else fetch_k, nprobe, ef_search
+        )
+        filter_func = self._create_filter_func(filter) if filter is not None else None
+
+        docs = []
+        for j, i in enumerate(indices[0]):
+            if i == -1:
+                continue
+            _id = self.index_to_docstore_id[i]
+            doc = self.docstore.search(_id)
+            if not isinstance(doc, Document):
+                raise ValueError(f"Could not find document for id {_id}, got {doc}")
+            if filter_func is None or filter_func(doc.metadata):
+                docs.append((doc, scores[0][j]))
+
+        score_threshold = kwargs.get("score_threshold")
+        if score_threshold is not None:
+            cmp = (
+                operator.ge
+                if self.distance_strategy
+                in (DistanceStrategy.MAX_INNER_PRODUCT, DistanceStrategy.JACCARD)
+                else operator.le
+            )
+            docs = [(doc, sim) for doc, sim in docs if cmp(sim, score_threshold)]
+        return docs[:k]
+
+    def max_marginal_relevance_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        *,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        filter: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        nprobe = kwargs.pop("nprobe", None) or self.nprobe
+        ef_search = kwargs.pop("ef_search", None) or self.ef_search
+
+        vector = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vector)
+        scores, indices = self._search_live(
+            vector, fetch_k if filter is None else fetch_k * 2, nprobe, ef_search
+        )
+        filter_func = self._create_filter_func(filter) if filter is not None else None
+
+        candidates = []
+        for j, i in enumerate(indices[0]):
+            if i == -1:
+                continue
+            _id = self.index_to_docstore_id[i]
+            doc = self.docstore.search(_id)
+            if not isinstance(doc, Document):
+                raise ValueError(f"Could not find document for id {_id}, got {doc}")
+            if filter_func is None or filter_func(doc.metadata):
+                candidates.append((doc, scores[0][j], int(i)))
+        if not candidates:
+            return []
+
+        embeddings = [self.index.reconstruct(i) for _, _, i in candidates]
+        selected = maximal_marginal_relevance(
+            np.array([embedding], dtype=np.float32),
+            embeddings,
+            k=k,
+            lambda_mult=lambda_mult,
+        )
+        return [candidates[j][:2] for j in selected]
+
 
 class VectorStoreManager:
     """Manager for creating and loading FAISS vector stores"""
 
+    # Per-KB ANN index spec ("ann_index" in knowledge_data.json)
+    index_spec: IndexSpec = IndexSpec()
+
     def __init__(self, docs_dir: str = None):
         """Initialize vector store manager with embedding model from config file"""
         self._embeddings: Optional[HuggingFaceEmbeddings] = None
+        self._embedder: Optional[BatchEmbedder] = None
+        self.index_spec = IndexSpec.from_kb_dir(docs_dir)
         # Config file
         self._embedding_model = self._load_embedding_config(docs_dir)
         if not self._embedding_model:
@@ -65,7 +264,163 @@ class VectorStoreManager:
             self._embeddings = HuggingFaceEmbeddings(model_name=self._embedding_model)
         return self._embeddings
 
-    def create_vectorstore(self, documents: List[Document], save_path: str) -> FAISS:
+    @property
+    def embedder(self) -> BatchEmbedder:
+        """Batched (optionally multi-process) encoder used for ingestion.
+        Unchanged chunks are served from the persistent embedding cache."""
+        if self._embedder is None:
+            self._embedder = BatchEmbedder(
+                self._embedding_model,
+                encode_fn=lambda texts: self.embeddings.embed_documents(texts),
+                cache=default_embedding_cache(),
+            )
+        return self._embedder
+
+    def embed_documents(self, documents: List[Document]) -> np.ndarray:
+        """Encode document chunks in length-sorted batches (row order preserved)"""
+        return self.embedder.embed([d.page_content for d in documents])
+
+    # ── Stable chunk ids ──────────────────────────────────────────
+    # Stores are backed by faiss.IndexIDMap2: every chunk gets an int64 id
+    # (also kept in metadata["chunk_id"]) that survives appends and
+    # removals, so deleting a document is a remove_ids() on its chunk ids
+    # instead of a full rebuild. index_to_docstore_id is keyed by that id.
+    # Ids are never reused: the counter only grows and is persisted in
+    # index_meta.json, so compaction removing the highest ids (or emptying
+    # the store) does not hand them out again.
+
+    @staticmethod
+    def is_id_mapped(vectorstore: FAISS) -> bool:
+        return isinstance(vectorstore.index, faiss.IndexIDMap2)
+
+    @staticmethod
+    def ensure_id_map(vectorstore: FAISS) -> bool:
+        """
+        Convert a legacy position-indexed store to IndexIDMap2 in place
+        (vectors are reconstructed, nothing is re-embedded). The existing
+        positions become the chunk ids. Returns True if a conversion happened.
+        """
+        if VectorStoreManager.is_id_mapped(vectorstore):
+            return False
+        index = vectorstore.index
+        positions = sorted(vectorstore.index_to_docstore_id)
+        id_map = faiss.IndexIDMap2(faiss.IndexFlat(index.d, index.metric_type))
+        if index.ntotal:
+            vectors = index.reconstruct_n(0, index.ntotal)
+            id_map.add_with_ids(vectors, np.asarray(positions, dtype=np.int64))
+        vectorstore.index = id_map
+        for pos in positions:
+            doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[pos])
+            if isinstance(doc, Document):
+                doc.metadata["chunk_id"] = int(pos)
+        print(f"Converted vector store to IndexIDMap2 ({len(positions)} chunks)")
+        return True
+
+    @staticmethod
+    def _next_chunk_id(vectorstore: FAISS) -> int:
+        mapping = vectorstore.index_to_docstore_id
+        counter = getattr(vectorstore, "next_chunk_id", None) or 0
+        return max(counter, max(mapping) + 1 if mapping else 0)
+
+    def add_documents(
+        self,
+        vectorstore: FAISS,
+        documents: List[Document],
+        vectors: Optional[np.ndarray] = None,
+    ) -> List[int]:
+        """
+        Append documents using precomputed or batched vectors.
+        Assigns and returns their chunk ids (also written to metadata["chunk_id"]).
+        """
+        if vectors is None:
+            vectors = self.embed_documents(documents)
+        self.ensure_id_map(vectorstore)
+
+        vectors = np.array(vectors, dtype=np.float32)
+        if vectorstore._normalize_L2:
+            faiss.normalize_L2(vectors)
+        start = self._next_chunk_id(vectorstore)
+        chunk_ids = list(range(start, start + len(documents)))
+        vectorstore.index.add_with_ids(vectors, np.asarray(chunk_ids, dtype=np.int64))
+        vectorstore.next_chunk_id = start + len(documents)
+
+        stored = {}
+        for chunk_id, doc in zip(chunk_ids, documents):
+            doc.metadata["chunk_id"] = chunk_id
+            doc_id = getattr(doc, "id", None) or str(uuid.uuid4())
+            stored[doc_id] = Document(
+                id=doc_id, page_content=doc.page_content, metadata=doc.metadata
+            )
+            vectorstore.index_to_docstore_id[chunk_id] = doc_id
+        vectorstore.docstore.add(stored)
+        self.apply_index_spec(vectorstore)
+        return chunk_ids
+
+    # ── ANN index (see ann_index) ─────────────────────────────────
+    # Stores start as exact IndexFlat; once the chunk count passes the
+    # KB's train_threshold the index is trained and rebuilt as IVF / PQ /
+    # HNSW in place. Chunk ids are preserved by the rebuild.
+
+    def apply_index_spec(self, vectorstore: FAISS) -> bool:
+        """Upgrade a flat store to the KB's ANN index once it is large enough.
+        Returns True if the index was rebuilt."""
+        spec = self.index_spec
+        if isinstance(vectorstore, TombstoneFAISS):
+            vectorstore.nprobe = spec.nprobe
+            vectorstore.ef_search = spec.ef_search
+        # Only flat -> ANN happens automatically; changing the type of an
+        # existing ANN store requires re-ingesting the KB
+        if not needs_upgrade(spec, vectorstore.index):
+            return False
+        vectorstore.index = rebuild(
+            spec, vectorstore.index, vectorstore.index.metric_type
+        )
+        print(
+            f"Trained {spec.type} index for {vectorstore.index.ntotal} chunks "
+            f"(threshold {spec.train_threshold})"
+        )
+        return True
+
+    def remove_chunks(self, vectorstore: FAISS, chunk_ids: Iterable[int]) -> int:
+        """Remove chunks by id (no re-embedding). Returns the number removed."""
+        mapping = vectorstore.index_to_docstore_id
+        ids = sorted({int(i) for i in chunk_ids if int(i) in mapping})
+        if not ids:
+            return 0
+        self.ensure_id_map(vectorstore)
+        id_array = np.asarray(ids, dtype=np.int64)
+        kind = index_kind(vectorstore.index)
+        if kind == "hnsw":
+            # HNSW has no remove_ids: rebuild from the remaining vectors
+            spec = (
+                self.index_spec
+                if self.index_spec.type == kind
+                else IndexSpec(type=kind, train_threshold=0)
+            )
+            before = vectorstore.index.ntotal
+            vectorstore.index = rebuild(
+                spec, vectorstore.index, vectorstore.index.metric_type, id_array
+            )
+            removed = before - vectorstore.index.ntotal
+        else:
+            removed = vectorstore.index.remove_ids(id_array)
+        vectorstore.docstore.delete([mapping.pop(i) for i in ids])
+        return int(removed)
+
+    def _empty_vectorstore(self, dim: int) -> FAISS:
+        return TombstoneFAISS(
+            embedding_function=self.embeddings,
+            index=faiss.IndexIDMap2(faiss.IndexFlatL2(dim)),
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={},
+        )
+
+    def create_vectorstore(
+        self,
+        documents: List[Document],
+        save_path: str,
+        vectors: Optional[np.ndarray] = None,
+    ) -> FAISS:
         """Create and save a FAISS vector store from documents"""
         if not documents:
             raise ValueError("No documents provided to create vector store")
@@ -76,7 +431,13 @@ class VectorStoreManager:
         try:
             # Vector store
             print(f"Creating FAISS vector store with {len(documents)} documents...")
-            vectorstore = FAISS.from_documents(documents, self.embeddings)
+            if vectors is None:
+                vectors = self.embed_documents(documents)
+            vectorstore = self._empty_vectorstore(int(np.shape(vectors)[1]))
+            # Continue the directory's counter: a rebuilt store must not
+            # reuse ids of chunks that existed before
+            vectorstore.next_chunk_id = _read_next_chunk_id(save_path)
+            self.add_documents(vectorstore, documents, vectors)
 
             # Vector store
             print(f"Ensuring save directory exists: {save_path}")
@@ -99,13 +460,22 @@ class VectorStoreManager:
             # Temporary directory
             print(f"Saving vector store to temporary directory: {temp_dir}")
             vectorstore.save_local(temp_dir)
+            self._save_bm25_index(documents, temp_dir)
 
             import shutil
 
-            for file in os.listdir(temp_dir):
-                src = os.path.join(temp_dir, file)
-                dst = os.path.join(save_path, file)
-                shutil.move(src, dst)
+            # Swap files in under the exclusive directory lock so cached
+            # readers never load a mixed old/new index set
+            with vectorstore_transaction(save_path):
+                for file in os.listdir(temp_dir):
+                    src = os.path.join(temp_dir, file)
+                    dst = os.path.join(save_path, file)
+                    shutil.move(src, dst)
+                # An old deletion bitmap refers to chunks that are not in
+                # the new store
+                tombstone_path = os.path.join(save_path, TOMBSTONE_FILENAME)
+                if os.path.exists(tombstone_path):
+                    os.remove(tombstone_path)
 
             # Temporary directory
             shutil.rmtree(temp_dir)
@@ -132,6 +502,22 @@ class VectorStoreManager:
                 print(f"Contents of save directory: {os.listdir(save_path)}")
             raise
 
+    @staticmethod
+    def _save_bm25_index(documents: List[Document], save_path: str) -> None:
+        """Persist the lexical index next to index.faiss (same order as the FAISS ids)"""
+        try:
+            try:
+                from src.rag.bm25_index import BM25_INDEX_FILENAME, InvertedBM25Index
+            except ImportError:
+                from rag.bm25_index import BM25_INDEX_FILENAME, InvertedBM25Index
+
+            index = InvertedBM25Index(d.page_content for d in documents)
+            index.save(os.path.join(save_path, BM25_INDEX_FILENAME))
+            print(f"BM25 index saved ({len(index)} chunks, {index.vocab_size} terms)")
+        except Exception as e:
+            # Query side rebuilds a missing/stale bm25.index on demand
+            print(f"Warning: failed to save BM25 index: {str(e)}")
+
     def initialize_vectorstore(self, save_path: str):
         """Initialize an empty vector store with required files"""
         save_path = os.path.abspath(os.path.normpath(save_path))
@@ -205,9 +591,14 @@ class VectorStoreManager:
             )
 
         try:
-            return FAISS.load_local(
+            vectorstore = TombstoneFAISS.load_local(
                 load_path, self.embeddings, allow_dangerous_deserialization=True
             )
+            vectorstore.tombstones = DeletionBitmap.load(load_path)
+            vectorstore.next_chunk_id = _read_next_chunk_id(load_path)
+            vectorstore.nprobe = self.index_spec.nprobe
+            vectorstore.ef_search = self.index_spec.ef_search
+            return vectorstore
         except RuntimeError as e:
             raise RuntimeError(
                 f"Failed to load vector store from {load_path}. Error: {str(e)}"
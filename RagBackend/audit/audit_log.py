@@ -1,11 +1,33 @@
 """
 审计日志模块
 记录用户操作行为（API调用、文件上传、查询、删除等），写入 SQLite 文件
+
+写入路径（AuditLogWriter）：
+  - 中间件 / write_audit_log 只把事件放入有界内存队列，请求路径上不做 SQLite I/O
+  - 后台写线程攒批：每批最多 AUDIT_BATCH_SIZE 条或等待 AUDIT_FLUSH_INTERVAL_MS，
+    一个事务多行 INSERT；数据库使用 WAL 模式，查询接口读取时不阻塞写入
+  - JWT 解码、操作类型 / 资源推断也在写线程中完成（同一 token 的解码结果有缓存）
+  - 队列满时按 AUDIT_QUEUE_POLICY 处理：
+      drop  丢弃新事件并计数（默认，审计日志不影响业务延迟）
+      block 等待最多 AUDIT_BLOCK_TIMEOUT_MS 的队列空位（async 调用方在线程中等待），
+            仍满则丢弃
+  - 应用关闭（shutdown 事件 / 进程退出）时写完队列中剩余事件
+
+配置（环境变量）：
+  AUDIT_QUEUE_SIZE         队列容量，默认 10000
+  AUDIT_BATCH_SIZE         每个事务最多写入条数，默认 500
+  AUDIT_FLUSH_INTERVAL_MS  攒批等待上限（毫秒），默认 200
+  AUDIT_QUEUE_POLICY       队列满时的策略 drop / block，默认 drop
+  AUDIT_BLOCK_TIMEOUT_MS   block 策略的最长等待（毫秒），默认 50
 """
 
 from fastapi import APIRouter, Request, Query, HTTPException
-from typing import Optional
+from typing import Any, Dict, List, Optional
+import asyncio
+import atexit
+import queue
 import sqlite3
+import threading
 import time
 import os
 import logging
@@ -17,6 +39,34 @@ router = APIRouter()
 # - Audit log -
 AUDIT_DB_PATH = Path(__file__).parent.parent / "metadata" / "audit_log.db"
 
+QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+FLUSH_INTERVAL_MS = float(os.getenv("AUDIT_FLUSH_INTERVAL_MS", "200"))
+QUEUE_POLICY = os.getenv("AUDIT_QUEUE_POLICY", "drop").lower()
+BLOCK_TIMEOUT_MS = float(os.getenv("AUDIT_BLOCK_TIMEOUT_MS", "50"))
+
+# 与 audit_logs 表列顺序一致（不含自增 id）
+_COLUMNS = (
+    "timestamp",
+    "user_id",
+    "user_email",
+    "action",
+    "resource_type",
+    "resource_id",
+    "resource_name",
+    "ip_address",
+    "user_agent",
+    "request_path",
+    "request_method",
+    "status_code",
+    "detail",
+    "duration_ms",
+)
+_INSERT_SQL = (
+    f"INSERT INTO audit_logs ({', '.join(_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in _COLUMNS)})"
+)
+
 
 def _get_conn():
     conn = sqlite3.connect(str(AUDIT_DB_PATH))
@@ -24,44 +74,315 @@ def _get_conn():
     return conn
 
 
+def _create_schema(conn: sqlite3.Connection) -> None:
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS audit_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp REAL NOT NULL,
+            user_id TEXT,
+            user_email TEXT,
+            action TEXT NOT NULL,
+            resource_type TEXT,
+            resource_id TEXT,
+            resource_name TEXT,
+            ip_address TEXT,
+            user_agent TEXT,
+            request_path TEXT,
+            request_method TEXT,
+            status_code INTEGER,
+            detail TEXT,
+            duration_ms REAL
+        )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_audit_timestamp ON audit_logs(timestamp)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_user ON audit_logs(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_action ON audit_logs(action)")
+    conn.commit()
+
+
 def ensure_audit_table():
-    """确保审计日志表存在"""
+    """确保审计日志表存在（并切换为 WAL 模式）"""
     try:
         with _get_conn() as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS audit_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp REAL NOT NULL,
-                    user_id TEXT,
-                    user_email TEXT,
-                    action TEXT NOT NULL,
-                    resource_type TEXT,
-                    resource_id TEXT,
-                    resource_name TEXT,
-                    ip_address TEXT,
-                    user_agent TEXT,
-                    request_path TEXT,
-                    request_method TEXT,
-                    status_code INTEGER,
-                    detail TEXT,
-                    duration_ms REAL
-                )
-            """)
-            conn.execute(
-                "CREATE INDEX IF NOT EXISTS idx_audit_timestamp ON audit_logs(timestamp)"
-            )
-            conn.execute(
-                "CREATE INDEX IF NOT EXISTS idx_audit_user ON audit_logs(user_id)"
-            )
-            conn.execute(
-                "CREATE INDEX IF NOT EXISTS idx_audit_action ON audit_logs(action)"
-            )
-            conn.commit()
+            _create_schema(conn)
         logger.info("审计日志表初始化完成")
     except Exception as e:
         logger.warning(f"审计日志表初始化失败: {e}")
 
 
+# - JWT -
+_USER_CACHE_SIZE = 1024
+
+
+def _decode_user(token: str) -> dict:
+    """解码 JWT，返回 user_id / user_email；解码失败时均为 None"""
+    user = {"user_id": None, "user_email": None}
+    try:
+        import jwt as jwt_lib
+
+        secret = os.getenv("JWT_SECRET", "changeme_jwt_secret")
+        payload = jwt_lib.decode(token, secret, algorithms=["HS256"])
+        user["user_id"] = str(payload.get("user_id") or payload.get("sub", ""))
+        user["user_email"] = payload.get("email", "")
+    except Exception:
+        pass
+    return user
+
+
+def _extract_user_from_request(request: Request) -> dict:
+    """从 Authorization header 的 JWT 中提取用户信息"""
+    auth = request.headers.get("Authorization", "")
+    if auth.startswith("Bearer "):
+        return _decode_user(auth[7:])
+    return {"user_id": None, "user_email": None}
+
+
+# ─────────────────────────────────────────────────────────────────
+# 后台批量写入
+# ─────────────────────────────────────────────────────────────────
+
+_STOP = object()
+
+
+class AuditLogWriter:
+    """
+    有界队列 + 单个写线程。
+
+    事件为 dict（键见 _COLUMNS），另可带：
+      token  Bearer token，写线程解码出 user_id / user_email
+      action 为 None 时按 request_method / request_path 推断，资源类型 / ID 同理
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[Path] = None,
+        queue_size: int = QUEUE_SIZE,
+        batch_size: int = BATCH_SIZE,
+        flush_interval_ms: float = FLUSH_INTERVAL_MS,
+        policy: str = QUEUE_POLICY,
+        block_timeout_ms: float = BLOCK_TIMEOUT_MS,
+    ):
+        if policy not in ("drop", "block"):
+            logger.warning(f"未知的 AUDIT_QUEUE_POLICY={policy}，使用 drop")
+            policy = "drop"
+        self.db_path = Path(db_path) if db_path else AUDIT_DB_PATH
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval_ms) / 1000
+        self.policy = policy
+        self.block_timeout = max(0.0, block_timeout_ms) / 1000
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, queue_size))
+        self._users: Dict[str, dict] = {}
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    # - 入队（请求路径） -
+    def submit(self, event: Dict[str, Any]) -> bool:
+        """事件入队；block 策略下最多阻塞 block_timeout。返回 False 表示已丢弃"""
+        if not self._ensure_started():
+            return self._drop()
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            pass
+        if self.policy == "block":
+            try:
+                self._queue.put(event, timeout=self.block_timeout)
+                return True
+            except queue.Full:
+                pass
+        return self._drop()
+
+    async def asubmit(self, event: Dict[str, Any]) -> bool:
+        """submit 的 async 版本：队列未满时直接入队，block 策略的等待不占用 event loop"""
+        if not self._ensure_started():
+            return self._drop()
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            if self.policy != "block":
+                return self._drop()
+        return await asyncio.to_thread(self.submit, event)
+
+    def _drop(self) -> bool:
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            logger.warning(f"审计日志队列已满或已关闭，累计丢弃 {self.dropped} 条")
+        return False
+
+    def _ensure_started(self) -> bool:
+        if self._thread is not None:
+            return not self._closed
+        with self._lock:
+            if self._closed:
+                return False
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="audit-log-writer", daemon=True
+                )
+                self._thread.start()
+        return True
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待此前入队的事件全部写入；写线程未启动时直接返回"""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """停止接收新事件，写完队列中的剩余事件后退出写线程"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning("审计日志队列关闭超时，剩余事件可能丢失")
+            return
+        thread.join(timeout)
+
+    # - 写线程 -
+    def _run(self) -> None:
+        conn: Optional[sqlite3.Connection] = None
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            batch: List[Dict[str, Any]] = []
+            markers: List[threading.Event] = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    markers.append(item)
+                else:
+                    batch.append(item)
+                if len(batch) >= self.batch_size:
+                    conn = self._write(conn, batch)
+                    batch = []
+                    if not stop:
+                        break
+                try:
+                    if stop:
+                        # 关闭时不再等待，写完队列中已有的事件
+                        item = self._queue.get_nowait()
+                        continue
+                    timeout = deadline - time.monotonic()
+                    if markers or timeout <= 0:
+                        break
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            if batch:
+                conn = self._write(conn, batch)
+            for marker in markers:
+                marker.set()
+        if conn is not None:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        _create_schema(conn)
+        # WAL 下 NORMAL 只在 checkpoint 时 fsync，进程崩溃不会损坏数据库
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _write(
+        self, conn: Optional[sqlite3.Connection], batch: List[Dict[str, Any]]
+    ) -> Optional[sqlite3.Connection]:
+        """一个事务写入 batch；失败时记数并丢弃该批，下次重新连接"""
+        try:
+            if conn is None:
+                conn = self._connect()
+            rows = [self._row(event) for event in batch]
+            with conn:
+                conn.executemany(_INSERT_SQL, rows)
+            self.written += len(rows)
+            self.batches += 1
+            return conn
+        except Exception as e:
+            self.failed += len(batch)
+            logger.warning(f"写入审计日志失败（不影响业务），丢弃 {len(batch)} 条: {e}")
+            if conn is not None:
+                conn.close()
+            return None
+
+    def _row(self, event: Dict[str, Any]) -> tuple:
+        token = event.get("token")
+        if token and not event.get("user_id"):
+            user = self._users.get(token)
+            if user is None:
+                if len(self._users) >= _USER_CACHE_SIZE:
+                    self._users.clear()
+                user = self._users[token] = _decode_user(token)
+            event = {**event, **user}
+        if not event.get("action"):
+            method = event.get("request_method") or ""
+            path = event.get("request_path") or ""
+            resource_type, resource_id = _infer_resource(path)
+            event = {
+                **event,
+                "action": _infer_action(method, path),
+                "resource_type": event.get("resource_type") or resource_type,
+                "resource_id": event.get("resource_id") or resource_id,
+            }
+        return tuple(event.get(c) for c in _COLUMNS)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "avg_batch_size": round(self.written / self.batches, 2)
+            if self.batches
+            else 0.0,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "policy": self.policy,
+        }
+
+
+_writer: Optional[AuditLogWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_audit_writer() -> AuditLogWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = AuditLogWriter()
+    return _writer
+
+
+def shutdown_audit_writer(timeout: float = 10.0) -> None:
+    """写完队列中剩余的审计事件（应用 shutdown 事件 / 进程退出时调用）"""
+    if _writer is not None:
+        _writer.close(timeout)
+
+
+atexit.register(shutdown_audit_writer)
+
+
 def write_audit_log(
     action: str,
     user_id: str = None,
@@ -77,71 +398,73 @@ def write_audit_log(
     detail: str = None,
     duration_ms: float = None,
 ):
-    """写入一条审计记录（非阻塞，失败不抛出）"""
-    try:
-        with _get_conn() as conn:
-            conn.execute(
-                """
-                INSERT INTO audit_logs (
-                    timestamp, user_id, user_email, action, resource_type, resource_id,
-                    resource_name, ip_address, user_agent, request_path, request_method,
-                    status_code, detail, duration_ms
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-                (
-                    time.time(),
-                    user_id,
-                    user_email,
-                    action,
-                    resource_type,
-                    resource_id,
-                    resource_name,
-                    ip_address,
-                    user_agent,
-                    request_path,
-                    request_method,
-                    status_code,
-                    detail,
-                    duration_ms,
-                ),
-            )
-            conn.commit()
-    except Exception as e:
-        logger.debug(f"写入审计日志失败（不影响业务）: {e}")
+    """写入一条审计记录（入队后由后台线程批量写入，失败不抛出）"""
+    get_audit_writer().submit(
+        {
+            "timestamp": time.time(),
+            "user_id": user_id,
+            "user_email": user_email,
+            "action": action,
+            "resource_type": resource_type,
+            "resource_id": resource_id,
+            "resource_name": resource_name,
+            "ip_address": ip_address,
+            "user_agent": user_agent,
+            "request_path": request_path,
+            "request_method": request_method,
+            "status_code": status_code,
+            "detail": detail,
+            "duration_ms": duration_ms,
+        }
+    )
 
 
-# - JWT -
-def _extract_user_from_request(request: Request) -> dict:
-    """从 Authorization header 的 JWT 中提取用户信息"""
-    user = {"user_id": None, "user_email": None}
-    try:
-        auth = request.headers.get("Authorization", "")
-        if auth.startswith("Bearer "):
-            import PyJWT as jwt_lib
-
-            token = auth[7:]
-            secret = os.getenv("JWT_SECRET", "default_secret")
-            payload = jwt_lib.decode(token, secret, algorithms=["HS256"])
-            user["user_id"] = str(payload.get("user_id") or payload.get("sub", ""))
-            user["user_email"] = payload.get("email", "")
-    except Exception:
-        pass
-    return user
+# - FastAPI Middleware API -
+DEFAULT_SKIP_PATHS = ["/static", "/docs", "/openapi.json", "/redoc", "/"]
+
+
+class PathSkipper:
+    """不记录审计日志的路径：按前缀匹配，"/" 只匹配根路径本身（否则所有请求都会被跳过）"""
+
+    def __init__(self, skip_paths: list = None):
+        skip_paths = skip_paths or DEFAULT_SKIP_PATHS
+        self._exact = {p for p in skip_paths if p == "/"}
+        self._prefixes = tuple(p for p in skip_paths if p != "/")
+
+    def __call__(self, path: str) -> bool:
+        return path in self._exact or path.startswith(self._prefixes)
+
+
+def request_event(
+    method: str,
+    path: str,
+    ip: str,
+    user_agent: Optional[str],
+    token: Optional[str],
+    status_code: int,
+    duration_ms: float,
+) -> Dict[str, Any]:
+    """中间件入队的请求事件；用户、操作类型与资源由写线程补全"""
+    return {
+        "timestamp": time.time(),
+        "token": token,
+        "ip_address": ip,
+        "user_agent": user_agent or None,
+        "request_path": path,
+        "request_method": method,
+        "status_code": status_code,
+        "duration_ms": round(duration_ms, 2),
+    }
 
 
-# - FastAPI Middleware API -
 class AuditMiddleware:
-    """ASGI 中间件，自动记录 API 调用审计日志"""
+    """ASGI 中间件，自动记录 API 调用审计日志（只入队，不在请求路径上写库）"""
 
-    def __init__(self, app, skip_paths: list = None):
+    def __init__(self, app, skip_paths: list = None, writer: AuditLogWriter = None):
         self.app = app
-        self.skip_paths = skip_paths or [
-            "/static",
-            "/docs",
-            "/openapi.json",
-            "/redoc",
-            "/",
-        ]
+        self.skip_paths = skip_paths or DEFAULT_SKIP_PATHS
+        self._skip = PathSkipper(self.skip_paths)
+        self.writer = writer
 
     async def __call__(self, scope, receive, send):
         if scope["type"] != "http":
@@ -149,38 +472,24 @@ class AuditMiddleware:
             return
 
         path = scope.get("path", "")
-        if any(path.startswith(p) for p in self.skip_paths):
+        if self._skip(path):
             await self.app(scope, receive, send)
             return
 
-        start_time = time.time()
+        start = time.perf_counter()
         method = scope.get("method", "")
 
         # IP
         client = scope.get("client")
         ip = client[0] if client else "unknown"
 
-        # headers
-        headers = dict(scope.get("headers", []))
-        user_agent = headers.get(b"user-agent", b"").decode("utf-8", errors="ignore")
-        auth_header = headers.get(b"authorization", b"").decode(
-            "utf-8", errors="ignore"
-        )
-
-        user_info = {"user_id": None, "user_email": None}
-        if auth_header.startswith("Bearer "):
-            try:
-                import PyJWT as jwt_lib
-
-                token = auth_header[7:]
-                secret = os.getenv("JWT_SECRET", "default_secret")
-                payload = jwt_lib.decode(token, secret, algorithms=["HS256"])
-                user_info["user_id"] = str(
-                    payload.get("user_id") or payload.get("sub", "")
-                )
-                user_info["user_email"] = payload.get("email", "")
-            except Exception:
-                pass
+        # headers：只取需要的两个，JWT 留给写线程解码
+        user_agent = token = None
+        for name, value in scope.get("headers", ()):
+            if name == b"user-agent":
+                user_agent = value[:200].decode("utf-8", errors="ignore")
+            elif name == b"authorization" and value.startswith(b"Bearer "):
+                token = value[7:].decode("utf-8", errors="ignore")
 
         status_code = 500
 
@@ -193,21 +502,17 @@ class AuditMiddleware:
         try:
             await self.app(scope, receive, send_wrapper)
         finally:
-            duration_ms = (time.time() - start_time) * 1000
-            action = _infer_action(method, path)
-            resource_type, resource_id = _infer_resource(path)
-            write_audit_log(
-                action=action,
-                user_id=user_info["user_id"],
-                user_email=user_info["user_email"],
-                resource_type=resource_type,
-                resource_id=resource_id,
-                ip_address=ip,
-                user_agent=user_agent[:200] if user_agent else None,
-                request_path=path,
-                request_method=method,
-                status_code=status_code,
-                duration_ms=round(duration_ms, 2),
+            writer = self.writer or get_audit_writer()
+            await writer.asubmit(
+                request_event(
+                    method,
+                    path,
+                    ip,
+                    user_agent,
+                    token,
+                    status_code,
+                    (time.perf_counter() - start) * 1000,
+                )
             )
 
 
@@ -288,6 +593,9 @@ async def get_audit_logs(
         where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
         offset = (page - 1) * page_size
 
+        # 先写完队列中的事件，刚发生的操作也能查到
+        await asyncio.to_thread(get_audit_writer().flush, 1.0)
+
         with _get_conn() as conn:
             total = conn.execute(
                 f"SELECT COUNT(*) FROM audit_logs {where}", params
@@ -309,8 +617,9 @@ async def get_audit_logs(
 
 @router.get("/api/audit/stats")
 async def audit_stats():
-    """审计日志统计摘要"""
+    """审计日志统计摘要（含后台写入队列状态）"""
     try:
+        await asyncio.to_thread(get_audit_writer().flush, 1.0)
         with _get_conn() as conn:
             total = conn.execute("SELECT COUNT(*) FROM audit_logs").fetchone()[0]
             today_start = time.time() - 86400
@@ -328,6 +637,7 @@ async def audit_stats():
             "today_logs": today,
             "top_actions": [dict(r) for r in top_actions],
             "top_users": [dict(r) for r in top_users],
+            "writer": get_audit_writer().stats(),
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取审计统计失败: {e}")
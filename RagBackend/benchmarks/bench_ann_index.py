@@ -0,0 +1,156 @@
+"""
+bench_ann_index.py
+ANN 索引基准：flat / IVF-Flat / IVF-PQ / HNSW 的 recall@k 与单次查询延迟 p50 / p95
+
+  - 以 flat 精确检索结果为基准计算 recall@k
+  - IVF 扫描 nprobe，HNSW 扫描 efSearch（均为单次查询参数，不重建索引）
+  - 向量默认为合成的聚类数据（--n / --dim）；--vectorstore 指定知识库向量库目录
+    （含 index.faiss）时从中取出真实向量，查询向量为库内向量加噪声
+
+运行方式：
+  cd RagBackend && python benchmarks/bench_ann_index.py
+  cd RagBackend && python benchmarks/bench_ann_index.py --n 200000 --dim 384
+  cd RagBackend && python benchmarks/bench_ann_index.py --vectorstore local-KLB-files/<kb>/vectorstore
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import pathlib
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+BACKEND_ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT / "RAG_M" / "src"))
+
+import faiss  # noqa: E402
+
+from vectorstore.ann_index import (  # noqa: E402
+    IndexSpec,
+    build_index,
+    reconstruct_all,
+    search_params,
+)
+
+
+def synthetic(n: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype("float32")
+    vectors = centers[rng.integers(0, clusters, size=n)]
+    vectors += 0.3 * rng.normal(size=(n, dim)).astype("float32")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def load_vectors(path: str) -> np.ndarray:
+    index = faiss.read_index(os.path.join(path, "index.faiss"))
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        _, vectors = reconstruct_all(faiss.downcast_index(index))
+    else:
+        vectors = index.reconstruct_n(0, index.ntotal)
+    return np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+def _pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def measure(
+    index: faiss.Index,
+    queries: np.ndarray,
+    k: int,
+    truth: Optional[np.ndarray],
+    params=None,
+) -> Dict[str, float]:
+    lat = []
+    found = np.empty((len(queries), k), dtype=np.int64)
+    for i, q in enumerate(queries):
+        t0 = time.perf_counter()
+        _, idx = index.search(q[None, :], k, params=params)
+        lat.append((time.perf_counter() - t0) * 1000)
+        found[i] = idx[0]
+    recall = 1.0
+    if truth is not None:
+        hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+        recall = hits / truth.size
+    return {"recall": recall, "p50": statistics.median(lat), "p95": _pct(lat, 95)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ANN 索引 recall / 延迟基准")
+    parser.add_argument("--n", type=int, default=100000, help="合成向量条数")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--vectorstore", default="", help="知识库向量库目录")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument(
+        "--types", nargs="+", default=["ivf_flat", "ivf_pq", "hnsw"], help="索引类型"
+    )
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--threads", type=int, default=1, help="faiss OpenMP 线程数")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    if args.vectorstore:
+        base = load_vectors(args.vectorstore)
+        rng = np.random.default_rng(1)
+        rows = rng.choice(len(base), min(args.queries, len(base)), replace=False)
+        queries = base[rows] + 0.05 * rng.normal(size=(len(rows), base.shape[1]))
+        queries = queries.astype("float32")
+        source = args.vectorstore
+    else:
+        base = synthetic(args.n, args.dim, args.clusters, seed=0)
+        queries = synthetic(args.queries, args.dim, args.clusters, seed=0)
+        queries += 0.05 * np.random.default_rng(1).normal(size=queries.shape).astype(
+            "float32"
+        )
+        source = f"synthetic({args.clusters} clusters)"
+    metric = faiss.METRIC_INNER_PRODUCT
+    print(
+        f"vectors={len(base)}, dim={base.shape[1]}, source={source}, "
+        f"queries={len(queries)}, k={args.k}, threads={args.threads}"
+    )
+
+    flat = build_index(IndexSpec(), base, metric)
+    _, truth = flat.search(queries, args.k)
+
+    print(
+        f"{'index':>9} | {'param':>12} | {'build(s)':>8} | {'recall@k':>8} | "
+        f"{'p50(ms)':>8} | {'p95(ms)':>8}"
+    )
+    print("-" * 70)
+    r = measure(flat, queries, args.k, None)
+    print(
+        f"{'flat':>9} | {'-':>12} | {'-':>8} | {r['recall']:8.3f} | "
+        f"{r['p50']:8.3f} | {r['p95']:8.3f}"
+    )
+    for kind in args.types:
+        spec = IndexSpec(type=kind, train_threshold=0)
+        t0 = time.perf_counter()
+        index = build_index(spec, base, metric)
+        build_s = time.perf_counter() - t0
+        if kind == "hnsw":
+            sweep = [("efSearch", ef, {"ef_search": ef}) for ef in args.ef_search]
+        else:
+            sweep = [("nprobe", p, {"nprobe": p}) for p in args.nprobe]
+        for name, value, kwargs in sweep:
+            r = measure(
+                index, queries, args.k, truth, params=search_params(index, **kwargs)
+            )
+            label = f"{name}={value}"
+            print(
+                f"{kind:>9} | {label:>12} | {build_s:8.2f} | {r['recall']:8.3f} | "
+                f"{r['p50']:8.3f} | {r['p95']:8.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+bench_audit_log.py
+审计日志写入基准：每请求一次 SQLite 连接 + INSERT + commit（原实现）vs 入队后台批量写入
+
+  - 统计请求路径上的单次耗时 p50 / p95（原实现为整个 INSERT + commit，新实现为入队）
+  - 统计后台写线程把全部事件落盘的总耗时与吞吐
+  - 数据库放在临时目录（--db-dir 可指定，例如与 metadata/ 同一块磁盘以反映真实 fsync 开销）
+
+运行方式：
+  cd RagBackend && python benchmarks/bench_audit_log.py
+  cd RagBackend && python benchmarks/bench_audit_log.py --events 20000 --batch-size 500
+"""
+
+from __future__ import annotations
+
+import argparse
+import pathlib
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from typing import List
+
+BACKEND_ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT))
+
+from audit.audit_log import (  # noqa: E402
+    _COLUMNS,
+    _INSERT_SQL,
+    AuditLogWriter,
+    _create_schema,
+)
+
+
+def _event(i: int) -> dict:
+    return {
+        "timestamp": time.time(),
+        "action": "READ",
+        "ip_address": "127.0.0.1",
+        "user_agent": "bench",
+        "request_path": f"/api/knowledge/{i}",
+        "request_method": "GET",
+        "status_code": 200,
+        "duration_ms": 1.0,
+    }
+
+
+def _pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def bench_sync(db_path: pathlib.Path, n: int) -> List[float]:
+    """原实现：每条事件新建连接、INSERT、commit（默认 rollback journal）"""
+    with sqlite3.connect(str(db_path)) as conn:
+        _create_schema(conn)
+        conn.execute("PRAGMA journal_mode=DELETE")
+    lat = []
+    for i in range(n):
+        event = _event(i)
+        t0 = time.perf_counter()
+        with sqlite3.connect(str(db_path)) as conn:
+            conn.execute(_INSERT_SQL, tuple(event.get(c) for c in _COLUMNS))
+            conn.commit()
+        lat.append((time.perf_counter() - t0) * 1e6)
+    return lat
+
+
+def bench_queue(db_path: pathlib.Path, n: int, batch_size: int, interval_ms: float):
+    writer = AuditLogWriter(
+        db_path, queue_size=n + 1, batch_size=batch_size, flush_interval_ms=interval_ms
+    )
+    writer.submit(_event(-1))  # 启动写线程并建表
+    writer.flush()
+    lat = []
+    t_start = time.perf_counter()
+    for i in range(n):
+        event = _event(i)
+        t0 = time.perf_counter()
+        writer.submit(event)
+        lat.append((time.perf_counter() - t0) * 1e6)
+    writer.close()
+    return lat, time.perf_counter() - t_start, writer.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="审计日志写入基准")
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--flush-interval-ms", type=float, default=200)
+    parser.add_argument("--db-dir", default="", help="数据库目录，默认临时目录")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.db_dir or None) as tmp:
+        tmp = pathlib.Path(tmp)
+        t0 = time.perf_counter()
+        sync_lat = bench_sync(tmp / "sync.db", args.events)
+        sync_total = time.perf_counter() - t0
+        queue_lat, queue_total, stats = bench_queue(
+            tmp / "queue.db", args.events, args.batch_size, args.flush_interval_ms
+        )
+
+    print(f"events={args.events}, batch_size={args.batch_size}")
+    print(
+        f"{'mode':>12} | {'p50(us)':>9} | {'p95(us)':>9} | {'mean(us)':>9} | "
+        f"{'total(s)':>8} | {'events/s':>9}"
+    )
+    print("-" * 70)
+    for name, lat, total in (
+        ("sync insert", sync_lat, sync_total),
+        ("queue+batch", queue_lat, queue_total),
+    ):
+        print(
+            f"{name:>12} | {statistics.median(lat):9.1f} | {_pct(lat, 95):9.1f} | "
+            f"{statistics.mean(lat):9.1f} | {total:8.2f} | {len(lat) / total:9.0f}"
+        )
+    print(f"writer: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+bench_bm25.py
+BM25 基准测试：倒排索引（InvertedBM25Index）vs 原逐文档扫描实现
+
+语料为合成数据（Zipf 分布的中文单字 + 英文词），每个规模分别统计：
+  - 索引构建耗时
+  - 查询延迟 p50 / p95（倒排索引 top-k）
+  - 原全量扫描实现的单次查询延迟（超过 --scan-max 的规模跳过）
+
+运行方式：
+  cd RagBackend && python benchmarks/bench_bm25.py
+  cd RagBackend && python benchmarks/bench_bm25.py --sizes 10000 100000 --queries 50
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import pathlib
+import random
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+BACKEND_ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT / "RAG_M" / "src"))
+
+from rag.bm25_index import InvertedBM25Index, tokenize  # noqa: E402
+
+_CJK = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+_EN = [f"w{i}" for i in range(20000)]
+
+
+def _zipf_weights(n: int, s: float = 1.1) -> List[float]:
+    return [1.0 / (i + 1) ** s for i in range(n)]
+
+
+def make_corpus(n_docs: int, doc_len: int, seed: int = 42) -> List[str]:
+    rng = random.Random(seed)
+    cjk_w = _zipf_weights(len(_CJK))
+    en_w = _zipf_weights(len(_EN))
+    docs = []
+    for _ in range(n_docs):
+        n_cjk = doc_len * 3 // 4
+        parts = rng.choices(_CJK, cjk_w, k=n_cjk)
+        parts += [" " + w + " " for w in rng.choices(_EN, en_w, k=doc_len - n_cjk)]
+        docs.append("".join(parts))
+    return docs
+
+
+def make_queries(n: int, seed: int = 7) -> List[str]:
+    rng = random.Random(seed)
+    return [
+        "".join(rng.choices(_CJK[:800], k=4)) + " " + rng.choice(_EN[:2000])
+        for _ in range(n)
+    ]
+
+
+def scan_top_k(corpus: List[List[str]], query: str, k: int = 5, k1=1.5, b=0.75):
+    """原 BM25.get_scores 的逐文档扫描实现（基线）"""
+    n = len(corpus)
+    avgdl = sum(len(d) for d in corpus) / max(n, 1)
+    df: Dict[str, int] = {}
+    for doc in corpus:
+        for t in set(doc):
+            df[t] = df.get(t, 0) + 1
+    idf = {t: math.log((n - f + 0.5) / (f + 0.5) + 1) for t, f in df.items()}
+
+    def _scores():
+        q_tokens = tokenize(query)
+        out = []
+        for doc in corpus:
+            tf_map: Dict[str, int] = {}
+            for t in doc:
+                tf_map[t] = tf_map.get(t, 0) + 1
+            s = 0.0
+            for t in q_tokens:
+                if t not in idf:
+                    continue
+                tf = tf_map.get(t, 0)
+                s += idf[t] * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(doc) / avgdl))
+            out.append(s)
+        return out
+
+    t0 = time.perf_counter()
+    scores = _scores()
+    sorted(enumerate(scores), key=lambda x: x[1], reverse=True)[:k]
+    return time.perf_counter() - t0
+
+
+def _pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run(sizes: List[int], n_queries: int, doc_len: int, scan_max: int, top_k: int):
+    queries = make_queries(n_queries)
+    print(
+        f"{'docs':>9} | {'build(s)':>9} | {'vocab':>7} | {'p50(ms)':>8} | "
+        f"{'p95(ms)':>8} | {'scan(ms)':>9} | {'speedup':>8}"
+    )
+    print("-" * 78)
+    for n in sizes:
+        docs = make_corpus(n, doc_len)
+
+        t0 = time.perf_counter()
+        index = InvertedBM25Index(docs)
+        build_s = time.perf_counter() - t0
+
+        lat = []
+        for q in queries:
+            t0 = time.perf_counter()
+            index.top_k(q, k=top_k)
+            lat.append((time.perf_counter() - t0) * 1000)
+        p50, p95 = statistics.median(lat), _pct(lat, 95)
+
+        scan_ms = None
+        if n <= scan_max:
+            corpus = [tokenize(d) for d in docs]
+            scan_ms = scan_top_k(corpus, queries[0], k=top_k) * 1000
+
+        scan_col = f"{scan_ms:9.1f}" if scan_ms is not None else f"{'skip':>9}"
+        speedup = f"{scan_ms / p50:7.0f}x" if scan_ms is not None else f"{'-':>8}"
+        print(
+            f"{n:>9} | {build_s:9.2f} | {index.vocab_size:>7} | {p50:8.2f} | "
+            f"{p95:8.2f} | {scan_col} | {speedup}"
+        )
+        del docs, index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BM25 倒排索引基准测试")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument(
+        "--doc-len", type=int, default=80, help="每个 chunk 的 token 数"
+    )
+    parser.add_argument(
+        "--scan-max", type=int, default=100_000, help="超过该规模不跑扫描基线"
+    )
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+    run(args.sizes, args.queries, args.doc_len, args.scan_max, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+bench_chat_concurrency.py
+/send-message 并发压测：原同步 requests.post 实现 vs 共享异步连接池（multi_model.llm_client）
+
+本地线程 HTTP 服务模拟 Ollama（每个请求固定延迟 --latency 秒，相当于一次生成），
+FastAPI 应用通过 httpx.ASGITransport 在同一事件循环内调用，统计：
+  - N 个并发对话的总耗时与吞吐（chats/s）
+  - 对话延迟 p50 / p95
+  - 压测期间轻量接口（/ping，每 50ms 一次）的延迟 —— 反映事件循环是否被阻塞
+
+对照组 legacy 为改造前的写法：async 路由内直接调用同步 requests.post。
+
+运行方式：
+  cd RagBackend && python benchmarks/bench_chat_concurrency.py
+  cd RagBackend && python benchmarks/bench_chat_concurrency.py --chats 64 --latency 0.5 --host-concurrency 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+BACKEND_ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT))
+
+
+def start_fake_ollama(latency: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            time.sleep(latency)
+            data = json.dumps({"message": {"content": "ok"}}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def build_app(ollama_url: str):
+    import requests
+    from fastapi import FastAPI
+
+    from chat_units.chat_management.chat_send import router
+
+    app = FastAPI()
+    app.include_router(router)
+
+    @app.post("/legacy-send-message")
+    async def legacy_send_message(body: Dict):
+        # 改造前的实现：同步 requests.post 阻塞事件循环
+        resp = requests.post(
+            f"{ollama_url}/api/chat",
+            json={"model": body["model"], "messages": [], "stream": False},
+            timeout=60,
+        )
+        return {"reply": resp.json()["message"]["content"]}
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    return app
+
+
+def _pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def run_case(app, path: str, ollama_url: str, n_chats: int) -> Dict:
+    import httpx
+
+    body = {
+        "message": "你好",
+        "model": "qwen2:0.5b",
+        "ollamaSettings": {"serverUrl": ollama_url, "timeout": 120},
+    }
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=600
+    ) as client:
+        chat_lat: List[float] = []
+        ping_lat: List[float] = []
+        done = asyncio.Event()
+
+        async def chat():
+            t0 = time.perf_counter()
+            resp = await client.post(path, json=body)
+            resp.raise_for_status()
+            chat_lat.append(time.perf_counter() - t0)
+
+        async def pinger():
+            # 从「计划发出」时刻计时：事件循环被阻塞时 sleep 唤醒推迟，也计入延迟
+            while not done.is_set():
+                t0 = time.perf_counter()
+                await asyncio.sleep(0.05)
+                await client.get("/ping")
+                ping_lat.append((time.perf_counter() - t0 - 0.05) * 1000)
+
+        ping_task = asyncio.create_task(pinger())
+        t0 = time.perf_counter()
+        await asyncio.gather(*[chat() for _ in range(n_chats)])
+        total = time.perf_counter() - t0
+        done.set()
+        await ping_task
+
+    return {
+        "total_s": total,
+        "chats_per_s": n_chats / total,
+        "p50_s": statistics.median(chat_lat),
+        "p95_s": _pct(chat_lat, 95),
+        "ping_p95_ms": _pct(ping_lat, 95) if ping_lat else float("nan"),
+        "ping_max_ms": max(ping_lat) if ping_lat else float("nan"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/send-message 并发压测")
+    parser.add_argument("--chats", type=int, default=32, help="并发对话数")
+    parser.add_argument(
+        "--latency", type=float, default=0.3, help="模拟 Ollama 单次生成耗时（秒）"
+    )
+    parser.add_argument(
+        "--host-concurrency",
+        type=int,
+        default=8,
+        help="连接池每个 host 的并发上限（LLM_HOST_CONCURRENCY）",
+    )
+    args = parser.parse_args()
+
+    os.environ["LLM_HOST_CONCURRENCY"] = str(args.host_concurrency)
+    server = start_fake_ollama(args.latency)
+    ollama_url = f"http://127.0.0.1:{server.server_address[1]}"
+    app = build_app(ollama_url)
+
+    print(
+        f"chats={args.chats}, 模拟生成耗时={args.latency}s, "
+        f"host 并发上限={args.host_concurrency}"
+    )
+    print(
+        f"{'impl':>8} | {'total(s)':>8} | {'chats/s':>8} | {'p50(s)':>7} | "
+        f"{'p95(s)':>7} | {'ping p95(ms)':>12} | {'ping max(ms)':>12}"
+    )
+    print("-" * 82)
+    for name, path in (("legacy", "/legacy-send-message"), ("pooled", "/send-message")):
+        r = asyncio.run(run_case(app, path, ollama_url, args.chats))
+        print(
+            f"{name:>8} | {r['total_s']:8.2f} | {r['chats_per_s']:8.2f} | "
+            f"{r['p50_s']:7.2f} | {r['p95_s']:7.2f} | {r['ping_p95_ms']:12.1f} | "
+            f"{r['ping_max_ms']:12.1f}"
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
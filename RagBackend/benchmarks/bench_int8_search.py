@@ -0,0 +1,249 @@
+"""
+bench_int8_search.py
+INT8VectorStore 检索基准测试：分块 int8 打分 vs faiss.IndexFlatIP（float32 精确内积）
+
+每个后端在独立子进程中运行（峰值 RSS 互不干扰），统计：
+  - 建库后常驻内存（VmRSS）
+  - 检索阶段峰值内存（建库完成后清零 VmHWM 再查询，Linux 下可用）
+  - 单查询延迟 p50 / p95、批量查询吞吐（queries/s）
+  - int8 相对 IndexFlatIP 的 recall@k
+
+后端：
+  int8     INT8VectorStore.search / search_batch（分块 GEMM + argpartition）
+  mmap     同上，但先 save 为 segment 目录再 load（向量以只读 memmap 打开）
+  flat     faiss.IndexFlatIP（向量预先 L2 归一化）
+  legacy   旧实现：每次查询整体反量化 + 逐行归一化（规模超过 --legacy-max 时跳过）
+
+运行方式：
+  cd RagBackend && python benchmarks/bench_int8_search.py
+  cd RagBackend && python benchmarks/bench_int8_search.py --sizes 100000 1000000 --dim 384
+"""
+
+from __future__ import annotations
+
+import argparse
+import atexit
+import gc
+import json
+import os
+import pathlib
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+BACKEND_ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT))
+
+_GEN_CHUNK = 100_000
+
+
+def _proc_status_mb(field: str) -> float:
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _reset_peak_rss() -> bool:
+    """写 /proc/self/clear_refs = 5 清零 VmHWM，之后的峰值只反映检索阶段"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _vector_chunks(n: int, dim: int, seed: int = 42):
+    rng = np.random.default_rng(seed)
+    for start in range(0, n, _GEN_CHUNK):
+        yield rng.standard_normal((min(_GEN_CHUNK, n - start), dim)).astype(np.float32)
+
+
+def _queries(n: int, dim: int) -> np.ndarray:
+    return np.random.default_rng(7).standard_normal((n, dim)).astype(np.float32)
+
+
+def _pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def _legacy_search(
+    vecs: np.ndarray, scales: np.ndarray, q: np.ndarray, top_k: int
+) -> np.ndarray:
+    """旧版 INT8VectorStore.search 的打分方式（基线）"""
+    q_norm = q / (np.linalg.norm(q) + 1e-9)
+    float_vecs = vecs.astype(np.float32) * scales[:, np.newaxis]
+    norms = np.linalg.norm(float_vecs, axis=1, keepdims=True) + 1e-9
+    scores = (float_vecs / norms) @ q_norm
+    return np.argsort(scores)[::-1][:top_k]
+
+
+def run_backend(backend: str, n: int, dim: int, n_queries: int, top_k: int) -> Dict:
+    queries = _queries(n_queries, dim)
+
+    if backend == "flat":
+        import faiss
+
+        index = faiss.IndexFlatIP(dim)
+        for chunk in _vector_chunks(n, dim):
+            faiss.normalize_L2(chunk)
+            index.add(chunk)
+        q = queries.copy()
+        faiss.normalize_L2(q)
+
+        def single(i):
+            return index.search(q[i : i + 1], top_k)[1][0]
+
+        def batch():
+            return index.search(q, top_k)[1]
+
+    else:
+        from document_processing.semantic_splitter import INT8VectorStore
+
+        store = INT8VectorStore(dim=dim)
+        for chunk in _vector_chunks(n, dim):
+            store.add([""] * len(chunk), chunk, [{}] * len(chunk))
+        if backend == "mmap":
+            tmp_dir = tempfile.mkdtemp(prefix="int8_bench_")
+            atexit.register(shutil.rmtree, tmp_dir, ignore_errors=True)
+            store.save(tmp_dir)
+            del store
+            gc.collect()
+            store = INT8VectorStore(dim=dim)
+            store.load(tmp_dir)
+
+        if backend == "legacy":
+            vecs = np.concatenate([seg.vecs for seg in store._segments])
+            scales = np.concatenate([seg.scales for seg in store._segments])
+
+            def single(i):
+                return _legacy_search(vecs, scales, queries[i], top_k)
+
+            def batch():
+                return np.stack([single(i) for i in range(len(queries))])
+
+        else:
+
+            def single(i):
+                return [r["index"] for r in store.search(queries[i], top_k, -1.0)]
+
+            def batch():
+                return np.array(
+                    [
+                        [r["index"] for r in hits]
+                        for hits in store.search_batch(queries, top_k, -1.0)
+                    ]
+                )
+
+    build_rss = _proc_status_mb("VmRSS")
+    peak_tracked = _reset_peak_rss()
+
+    lat = []
+    for i in range(len(queries)):
+        t0 = time.perf_counter()
+        single(i)
+        lat.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    ids = batch()
+    batch_s = time.perf_counter() - t0
+
+    return {
+        "build_rss_mb": build_rss,
+        "search_peak_mb": _proc_status_mb("VmHWM") if peak_tracked else None,
+        "p50_ms": statistics.median(lat),
+        "p95_ms": _pct(lat, 95),
+        "batch_qps": len(queries) / batch_s if batch_s > 0 else 0.0,
+        "ids": np.asarray(ids).tolist(),
+    }
+
+
+def _spawn(backend: str, n: int, args) -> Dict:
+    cmd = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--worker",
+        backend,
+        "--sizes",
+        str(n),
+        "--dim",
+        str(args.dim),
+        "--queries",
+        str(args.queries),
+        "--top-k",
+        str(args.top_k),
+    ]
+    out = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _recall(truth: List[List[int]], got: List[List[int]]) -> float:
+    hits = sum(len(set(t) & set(g)) for t, g in zip(truth, got))
+    return hits / max(1, sum(len(t) for t in truth))
+
+
+def run(args):
+    print(
+        f"{'vectors':>9} | {'backend':>7} | {'rss(MB)':>8} | {'peak(MB)':>8} | "
+        f"{'p50(ms)':>8} | {'p95(ms)':>8} | {'batch q/s':>9} | {'recall':>6}"
+    )
+    print("-" * 84)
+    for n in args.sizes:
+        backends = ["flat", "int8", "mmap"]
+        if n <= args.legacy_max:
+            backends.append("legacy")
+        results = {b: _spawn(b, n, args) for b in backends}
+        truth = results["flat"]["ids"]
+        for b in backends:
+            r = results[b]
+            peak = (
+                f"{r['search_peak_mb']:8.0f}"
+                if r["search_peak_mb"] is not None
+                else f"{'-':>8}"
+            )
+            print(
+                f"{n:>9} | {b:>7} | {r['build_rss_mb']:8.0f} | {peak} | "
+                f"{r['p50_ms']:8.2f} | {r['p95_ms']:8.2f} | {r['batch_qps']:9.1f} | "
+                f"{_recall(truth, r['ids']):6.3f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="INT8VectorStore 检索基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=64)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument(
+        "--legacy-max", type=int, default=200_000, help="超过该规模不跑旧实现基线"
+    )
+    parser.add_argument(
+        "--worker", choices=["int8", "mmap", "flat", "legacy"], help=argparse.SUPPRESS
+    )
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_backend(
+            args.worker, args.sizes[0], args.dim, args.queries, args.top_k
+        )
+        print(json.dumps(result))
+        return
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
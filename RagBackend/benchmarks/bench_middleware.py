@@ -0,0 +1,175 @@
+"""
+bench_middleware.py
+中间件单请求开销基准：原 BaseHTTPMiddleware 叠加栈 vs 合并的纯 ASGI ObservabilityMiddleware
+
+  - none      不加中间件（基线）
+  - legacy    原实现复刻：TraceMiddleware + 指标中间件（均为 BaseHTTPMiddleware）+ AuditMiddleware
+  - combined  monitoring.observability.ObservabilityMiddleware（一次完成 trace / 指标 / 审计入队）
+
+直接以 ASGI 调用驱动应用（不经网络栈），统计 JSON 接口与 SSE 接口的单请求耗时 p50 / p95，
+以及相对 none 的额外开销。审计数据库放在临时目录，access 日志不输出。
+
+运行方式：
+  cd RagBackend && python benchmarks/bench_middleware.py
+  cd RagBackend && python benchmarks/bench_middleware.py --requests 20000 --chunks 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, List
+
+BACKEND_ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT))
+
+from fastapi import FastAPI, Request  # noqa: E402
+from fastapi.responses import StreamingResponse  # noqa: E402
+from starlette.middleware.base import BaseHTTPMiddleware  # noqa: E402
+
+from audit.audit_log import AuditLogWriter, AuditMiddleware  # noqa: E402
+from monitoring.metrics import STATS, route_template  # noqa: E402
+from monitoring.observability import ObservabilityMiddleware  # noqa: E402
+from trace_logging import _trace_id_var  # noqa: E402
+
+
+# ── 原实现复刻（BaseHTTPMiddleware）────────────────────────────────
+class LegacyTraceMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        trace_id = request.headers.get("X-Trace-Id") or uuid.uuid4().hex[:8]
+        token = _trace_id_var.set(trace_id)
+        start = time.perf_counter()
+        try:
+            response = await call_next(request)
+            response.headers["X-Trace-Id"] = trace_id
+            logging.getLogger("access").info(
+                "%s %s %d %.1fms",
+                request.method,
+                request.url.path,
+                response.status_code,
+                (time.perf_counter() - start) * 1000,
+            )
+            return response
+        finally:
+            _trace_id_var.reset(token)
+
+
+class LegacyMetricsMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        start = time.perf_counter()
+        response = await call_next(request)
+        STATS.record_request(
+            route_template(request.scope),
+            request.method,
+            response.status_code,
+            (time.perf_counter() - start) * 1000,
+        )
+        return response
+
+
+def build_app(stack: str, writer: AuditLogWriter, chunks: int) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/api/kb/{kb_id}")
+    async def kb(kb_id: str):
+        return {"kb": kb_id}
+
+    @app.get("/api/RAG/query")
+    async def sse():
+        async def events():
+            for i in range(chunks):
+                yield f"data: {i}\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    if stack == "legacy":
+        app.add_middleware(LegacyTraceMiddleware)
+        app.add_middleware(AuditMiddleware, writer=writer)
+        app.add_middleware(LegacyMetricsMiddleware)
+    elif stack == "combined":
+        app.add_middleware(ObservabilityMiddleware, audit_writer=writer)
+    return app
+
+
+async def run_requests(app: FastAPI, path: str, n: int) -> List[float]:
+    async def receive():
+        # 请求无 body；StreamingResponse 会一直 receive 等待客户端断开
+        await asyncio.Event().wait()
+
+    async def send(message):
+        pass
+
+    headers = [(b"authorization", b"Bearer x"), (b"user-agent", b"bench")]
+    lat = []
+    for _ in range(n):
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": headers,
+            "client": ("127.0.0.1", 1234),
+            "server": ("bench", 80),
+        }
+        t0 = time.perf_counter()
+        await app(scope, receive, send)
+        lat.append((time.perf_counter() - t0) * 1e6)
+    return lat
+
+
+def _pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="中间件单请求开销基准")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--chunks", type=int, default=10, help="SSE 接口的事件数")
+    parser.add_argument("--warmup", type=int, default=200)
+    args = parser.parse_args()
+
+    logging.getLogger("access").setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = AuditLogWriter(pathlib.Path(tmp) / "audit.db")
+        results: Dict[str, Dict[str, List[float]]] = {}
+        for stack in ("none", "legacy", "combined"):
+            app = build_app(stack, writer, args.chunks)
+            results[stack] = {}
+            for label, path in (("json", "/api/kb/abc"), ("sse", "/api/RAG/query")):
+                asyncio.run(run_requests(app, path, args.warmup))
+                results[stack][label] = asyncio.run(
+                    run_requests(app, path, args.requests)
+                )
+        writer.close()
+
+    print(f"requests={args.requests}, sse_chunks={args.chunks}")
+    print(
+        f"{'stack':>9} | {'endpoint':>8} | {'p50(us)':>8} | {'p95(us)':>8} | "
+        f"{'overhead p50(us)':>16}"
+    )
+    print("-" * 62)
+    for stack, by_path in results.items():
+        for label, lat in by_path.items():
+            base = statistics.median(results["none"][label])
+            p50 = statistics.median(lat)
+            print(
+                f"{stack:>9} | {label:>8} | {p50:8.1f} | {_pct(lat, 95):8.1f} | "
+                f"{p50 - base:16.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+bench_rerank.py
+精排阶段延迟基准：20 / 50 / 100 个候选的 rerank 延迟 p50 / p95
+
+对比：
+  lexical   词法重排（retrieval_strategy._lightweight_rerank，降级路径）
+  cold      cross-encoder 一次批量推理（每轮清空分数缓存）
+  cached    cross-encoder 分数缓存全部命中（同一问题重复提问）
+
+并发（--concurrency C）：C 个客户端同时经 RerankService 请求精排（每次 --service-candidates 个候选，
+分数缓存关闭），对比不等待（max_wait=0，基本逐请求推理）与微批（--max-wait-ms）的吞吐。
+
+候选为合成的中文段落（--passage-chars 控制长度）。cross-encoder 需要 transformers + torch，
+或 onnxruntime + 导出的 ONNX 模型（--onnx）；依赖缺失时只输出 lexical 一行。
+
+运行方式：
+  cd RagBackend && python benchmarks/bench_rerank.py
+  cd RagBackend && python benchmarks/bench_rerank.py --model BAAI/bge-reranker-base --int8
+  cd RagBackend && python benchmarks/bench_rerank.py --onnx /models/bge-reranker-base-int8.onnx
+  cd RagBackend && python benchmarks/bench_rerank.py --concurrency 16 --max-wait-ms 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import pathlib
+import random
+import statistics
+import sys
+import threading
+import time
+from typing import Callable, Dict, List
+
+BACKEND_ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT))
+sys.path.insert(0, str(BACKEND_ROOT / "RAG_M"))
+
+_VOCAB = (
+    "年假 申请 流程 报销 发票 审批 工龄 计算 加班 调休 合同 试用期 社保 公积金 "
+    "考勤 出差 补贴 培训 绩效 晋升 离职 交接 保密 协议 设备 领用 会议室 预定"
+).split()
+
+
+def make_passages(n: int, chars: int, rng: random.Random) -> List[str]:
+    passages = []
+    for _ in range(n):
+        words: List[str] = []
+        while sum(len(w) for w in words) < chars:
+            words.append(rng.choice(_VOCAB))
+        passages.append("，".join(words)[:chars])
+    return passages
+
+
+def _pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def measure(fn: Callable[[], object], rounds: int) -> Dict[str, float]:
+    fn()  # 预热
+    lat = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        lat.append((time.perf_counter() - t0) * 1000)
+    return {"p50": statistics.median(lat), "p95": _pct(lat, 95)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="rerank 延迟基准")
+    parser.add_argument("--candidates", type=int, nargs="+", default=[20, 50, 100])
+    parser.add_argument("--rounds", type=int, default=20, help="每种配置的测量轮数")
+    parser.add_argument("--passage-chars", type=int, default=300)
+    parser.add_argument("--model", default=None, help="cross-encoder 模型名")
+    parser.add_argument("--onnx", default="", help="ONNX 模型路径（可为 int8 量化版）")
+    parser.add_argument("--int8", action="store_true", help="torch 动态 int8 量化")
+    parser.add_argument("--threads", type=int, default=None, help="推理线程数")
+    parser.add_argument("--concurrency", type=int, default=0, help="并发客户端数")
+    parser.add_argument("--service-candidates", type=int, default=10)
+    parser.add_argument(
+        "--service-requests", type=int, default=20, help="每客户端请求数"
+    )
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    from langchain.docstore.document import Document
+
+    from document_processing.retrieval_strategy import _lightweight_rerank
+    from rag_enhancement.cross_encoder import DEFAULT_MODEL, CrossEncoderScorer
+
+    kwargs = {"model_name": args.model or DEFAULT_MODEL, "onnx_path": args.onnx}
+    kwargs["int8"] = args.int8
+    if args.threads:
+        kwargs["threads"] = args.threads
+    scorer = CrossEncoderScorer(**kwargs)
+    if not scorer.available():
+        print(f"cross-encoder 不可用（{scorer.stats()['model']}），只测词法重排")
+        scorer = None
+
+    rng = random.Random(0)
+    query = "年假怎么申请，需要哪些审批"
+    backend = "onnx" if args.onnx else ("torch-int8" if args.int8 else "torch")
+    print(
+        f"query={query!r}, passage={args.passage_chars} 字, rounds={args.rounds}, "
+        f"backend={backend if scorer else '-'}"
+    )
+    print(f"{'n':>5} | {'impl':>8} | {'p50(ms)':>9} | {'p95(ms)':>9}")
+    print("-" * 42)
+    for n in args.candidates:
+        passages = make_passages(n, args.passage_chars, rng)
+        items = [
+            {"document": Document(page_content=p), "source_info": {}} for p in passages
+        ]
+        keys = list(range(n))
+        cases = [
+            ("lexical", lambda: _lightweight_rerank(query, list(items), top_n=5)),
+        ]
+        if scorer is not None:
+
+            def cold():
+                scorer.clear_cache()
+                scorer.score(query, passages, keys)
+
+            cases.append(("cold", cold))
+            cases.append(("cached", lambda: scorer.score(query, passages, keys)))
+        for name, fn in cases:
+            r = measure(fn, args.rounds)
+            print(f"{n:>5} | {name:>8} | {r['p50']:9.2f} | {r['p95']:9.2f}")
+    if scorer is not None:
+        print(f"每对推理耗时 EWMA: {scorer.stats()['pair_ms']} ms")
+    if scorer is not None and args.concurrency > 0:
+        bench_service(args, kwargs, query, rng)
+
+
+def bench_service(args, scorer_kwargs: Dict, query: str, rng: random.Random):
+    from rag_enhancement.cross_encoder import CrossEncoderScorer
+    from rag_enhancement.reranker import RerankService
+
+    # 共用一份已加载的模型，关闭分数缓存，每次请求都真实推理
+    scorer = CrossEncoderScorer(**scorer_kwargs, cache_size=0)
+    scorer.available()
+    passages = make_passages(args.service_candidates, args.passage_chars, rng)
+    print(
+        f"\n并发 {args.concurrency} 客户端 × {args.service_requests} 请求，"
+        f"每请求 {len(passages)} 个候选"
+    )
+    print(f"{'max_wait':>9} | {'req/s':>8} | {'pairs/s':>9} | {'avg batch':>9}")
+    print("-" * 46)
+    for wait_ms in (0.0, args.max_wait_ms):
+        service = RerankService(max_wait_ms=wait_ms, scorer_factory=lambda name: scorer)
+        service.score(query, passages)  # 预热
+
+        def client(i):
+            for j in range(args.service_requests):
+                service.score(f"{query} {i}-{j}", passages)
+
+        threads = [
+            threading.Thread(target=client, args=(i,)) for i in range(args.concurrency)
+        ]
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - t0
+        n_req = args.concurrency * args.service_requests
+        stats = next(iter(service.stats()["models"].values()))
+        print(
+            f"{wait_ms:>7.1f}ms | {n_req / elapsed:8.1f} | "
+            f"{n_req * len(passages) / elapsed:9.1f} | {stats['avg_batch_pairs']:9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -9,13 +9,19 @@ chat_send.py — 对话消息发送接口（多模型统一路由版）
   - model 字段以 "cloud:" 开头 → 提取真实 model_id 走云端
   - 否则按 model_id 在 _MODEL_CATALOG 中查找 provider
   - 未匹配 → 仍走 Ollama（兼容旧行为）
+
+模型请求经 multi_model.llm_client 共享连接池发出（异步、不阻塞事件循环，
+按 host 限制并发），客户端断开时取消进行中的生成。
 """
 
+import asyncio
 import os
 import logging
 import sys
 from pathlib import Path
-from fastapi import APIRouter, HTTPException
+import httpx
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
 from pydantic import BaseModel
 from typing import List, Optional
 
@@ -27,6 +33,12 @@ _backend_root = str(Path(__file__).resolve().parent.parent.parent)
 if _backend_root not in sys.path:
     sys.path.insert(0, _backend_root)
 
+from multi_model.llm_client import (  # noqa: E402
+    ClientDisconnected,
+    cancel_on_disconnect,
+    get_llm_pool,
+)
+
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 DEFAULT_MODEL = os.getenv("MODEL", "qwen2:0.5b")
 
@@ -109,26 +121,76 @@ async def _call_cloud_model(
         )
 
     try:
-        reply = await _collect_stream(
-            stream_fn(model_id, messages, temperature=0.7, max_tokens=2048)
+        # 并发名额由共享连接池按 provider host 限制，排队 + 生成总时长不超过 timeout
+        reply = await asyncio.wait_for(
+            _collect_stream(
+                stream_fn(model_id, messages, temperature=0.7, max_tokens=2048)
+            ),
+            timeout,
         )
         if not reply:
             raise HTTPException(status_code=500, detail="云端模型返回空回复")
         return reply
     except HTTPException:
         raise
+    except (asyncio.TimeoutError, httpx.TimeoutException):
+        raise HTTPException(status_code=504, detail=f"云端模型响应超时（{timeout}s）")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"云端模型调用失败: {e}")
 
 
+async def _call_ollama(
+    server_url: str, model_id: str, messages: list, timeout: int
+) -> str:
+    """通过共享连接池调用 Ollama /api/chat（非流式）"""
+    try:
+        logger.info(
+            f"[chat_send] Ollama: {server_url}, model={model_id}, 消息数={len(messages)}"
+        )
+        response = await get_llm_pool().post(
+            server_url,
+            "/api/chat",
+            json={"model": model_id, "messages": messages, "stream": False},
+            timeout=timeout,
+        )
+
+        if response.status_code != 200:
+            err_text = response.text or ""
+            if "more system memory" in err_text or "memory" in err_text.lower():
+                detail = f"模型 [{model_id}] 所需内存不足，请关闭其他程序或换用更小的模型（如 qwen2:0.5b）"
+            elif "model" in err_text.lower() and "not found" in err_text.lower():
+                detail = f"模型 [{model_id}] 未安装，请先执行: ollama pull {model_id}"
+            else:
+                detail = f"Ollama 服务错误（状态码 {response.status_code}）: {err_text[:200]}"
+            raise HTTPException(status_code=500, detail=detail)
+
+        data = response.json()
+        reply = data.get("message", {}).get("content", "")
+        if not reply:
+            reply = data.get("response", "（模型无回复）")
+
+        logger.info(f"[chat_send] Ollama 回复成功，长度: {len(reply)}")
+        return reply
+
+    except httpx.ConnectError:
+        raise HTTPException(
+            status_code=500,
+            detail=f"连接 Ollama 失败，请检查服务是否在运行: {server_url}",
+        )
+    except httpx.TimeoutException:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Ollama 响应超时（{timeout}s），请尝试更换更小的模型或增加超时时间",
+        )
+
+
 @router.post("/send-message")
-async def send_message(req: SendMessageRequest):
+async def send_message(req: SendMessageRequest, request: Request):
     """
     发送消息到 AI 模型，返回回复。
     自动识别本地 Ollama 模型和云端模型（DeepSeek / OpenAI / 混元）。
+    客户端断开连接时取消生成，不再占用模型并发名额。
     """
-    import requests as sync_requests
-
     raw_model = req.model or DEFAULT_MODEL
     model_id, provider = _resolve_model(raw_model)
 
@@ -146,7 +208,13 @@ async def send_message(req: SendMessageRequest):
     # - Cloud model -
     if provider in ("deepseek", "openai", "hunyuan", "bailian", "xinghuo"):
         logger.info(f"[chat_send] 云端模型: provider={provider}, model={model_id}")
-        reply = await _call_cloud_model(model_id, provider, messages)
+        try:
+            reply = await cancel_on_disconnect(
+                request, _call_cloud_model(model_id, provider, messages)
+            )
+        except ClientDisconnected:
+            logger.info(f"[chat_send] 客户端已断开，取消云端请求: {model_id}")
+            return Response(status_code=499)
         return {"reply": reply, "model": model_id, "provider": provider}
 
     # ── Ollama Local model ──────────────────────────────────────
@@ -162,43 +230,13 @@ async def send_message(req: SendMessageRequest):
     )
 
     try:
-        logger.info(
-            f"[chat_send] Ollama: {server_url}, model={model_id}, 消息数={len(messages)}"
-        )
-        response = sync_requests.post(
-            f"{server_url}/api/chat",
-            json={"model": model_id, "messages": messages, "stream": False},
-            timeout=timeout,
+        reply = await cancel_on_disconnect(
+            request, _call_ollama(server_url, model_id, messages, timeout)
         )
-
-        if response.status_code != 200:
-            err_text = response.text or ""
-            if "more system memory" in err_text or "memory" in err_text.lower():
-                detail = f"模型 [{model_id}] 所需内存不足，请关闭其他程序或换用更小的模型（如 qwen2:0.5b）"
-            elif "model" in err_text.lower() and "not found" in err_text.lower():
-                detail = f"模型 [{model_id}] 未安装，请先执行: ollama pull {model_id}"
-            else:
-                detail = f"Ollama 服务错误（状态码 {response.status_code}）: {err_text[:200]}"
-            raise HTTPException(status_code=500, detail=detail)
-
-        data = response.json()
-        reply = data.get("message", {}).get("content", "")
-        if not reply:
-            reply = data.get("response", "（模型无回复）")
-
-        logger.info(f"[chat_send] Ollama 回复成功，长度: {len(reply)}")
         return {"reply": reply, "model": model_id, "provider": "ollama"}
-
-    except sync_requests.exceptions.ConnectionError:
-        raise HTTPException(
-            status_code=500,
-            detail=f"连接 Ollama 失败，请检查服务是否在运行: {server_url}",
-        )
-    except sync_requests.exceptions.Timeout:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Ollama 响应超时（{timeout}s），请尝试更换更小的模型或增加超时时间",
-        )
+    except ClientDisconnected:
+        logger.info(f"[chat_send] 客户端已断开，取消 Ollama 请求: {model_id}")
+        return Response(status_code=499)
     except HTTPException:
         raise
     except Exception as e:
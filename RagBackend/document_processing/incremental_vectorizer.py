@@ -3,7 +3,7 @@ incremental_vectorizer.py
 增量向量化管理器
 
 核心思路：
-  1. 维护一个 JSON 索引文件，记录每个已向量化文档的 SHA256 哈希值
+  1. 维护一个 SQLite 哈希索引（WAL），记录每个已向量化文档的 SHA256 哈希值
   2. 上传新文档时，比对哈希：
      - 未出现过 → 全量向量化并入库
      - 哈希相同 → 跳过（已是最新，无需重复计算）
@@ -23,10 +23,14 @@ incremental_vectorizer.py
 
 from __future__ import annotations
 
+import contextlib
 import hashlib
 import json
 import os
+import sqlite3
 import sys
+import threading
+import time
 import logging
 from datetime import datetime
 from pathlib import Path
@@ -48,6 +52,13 @@ sys.path.insert(0, str(_BACKEND_DIR / "RAG_M"))
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 
+try:
+    from RAG_M.src.vectorstore.store_cache import vectorstore_transaction
+    from RAG_M.src.vectorstore.tombstones import TOMBSTONE_FILENAME, DeletionBitmap
+except ImportError:
+    from src.vectorstore.store_cache import vectorstore_transaction
+    from src.vectorstore.tombstones import TOMBSTONE_FILENAME, DeletionBitmap
+
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
@@ -66,11 +77,12 @@ os.makedirs(HASH_INDEX_ROOT, exist_ok=True)
 
 class HashIndex:
     """
-    每个知识库对应一个 JSON 文件，记录结构：
+    每个知识库对应一个 SQLite 文件（WAL 模式），每个文档一行，record 列为 JSON：
     {
       "doc_id_or_filepath": {
         "file_hash": "sha256...",
-        "chunk_ids": ["chunk_0", "chunk_1", ...],
+        "chunk_ids": [120, 121, ...],   <- 稳定 chunk_id（FAISS IndexIDMap2 中的 id）
+        "stale_chunk_ids": [7, 8],      <- 文档更新后遗留的旧 chunk，compaction 时移除
         "vectorized_at": "2026-03-25T14:30:00",
         "chunk_count": 12,
         "deleted": false          <- 软删除标记：true 表示已废弃，查询时过滤
@@ -78,71 +90,187 @@ class HashIndex:
       ...
     }
 
+    存储：
+    - 每次 set / soft_delete / delete 只改一行（O(1)），不再整文件重写 JSON
+    - batch() 内的多次修改合并为一个事务提交（批量入库、compaction）
+    - 写事务使用 BEGIN IMMEDIATE，跨进程由 SQLite 文件锁串行化，busy_timeout 等待
+    - deleted / has_stale 为独立列并建索引，废弃列表与 compaction 计数不用扫描全部记录
+    - 首次打开时自动导入旧版 {kb_id}_hash_index.json
+
     软删除机制：
     - 文档更新/删除时，先将旧记录标记 deleted=true（不立即重建向量库）
-    - 查询时通过 get_deleted_keys() 获取废弃列表，在向量检索后过滤
+    - 废弃 chunk 的 chunk_id 同步写入向量库目录的 deleted.bitmap，
+      查询时由 FAISS IDSelector 在检索内部跳过（见 vectorstore/tombstones.py）
     - 当 deleted 条目累积超过 _COMPACTION_THRESHOLD，触发 compact()，
-      一次性重建向量库并清理废弃记录，将全量重建代价均摊到每N次操作
+      按 chunk_id 对向量库 remove_ids 并清理废弃记录（代价 O(废弃数)，无需重新编码）
     """
 
     def __init__(self, kb_id: str):
         self.kb_id = kb_id
-        self.index_path = os.path.join(HASH_INDEX_ROOT, f"{kb_id}_hash_index.json")
-        self._data: Dict[str, dict] = self._load()
+        self.db_path = os.path.join(HASH_INDEX_ROOT, f"{kb_id}_hash_index.db")
+        self.legacy_json_path = os.path.join(
+            HASH_INDEX_ROOT, f"{kb_id}_hash_index.json"
+        )
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._conn = sqlite3.connect(
+            self.db_path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS records (
+                doc_key   TEXT PRIMARY KEY,
+                record    TEXT    NOT NULL,
+                deleted   INTEGER NOT NULL DEFAULT 0,
+                has_stale INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_records_deleted ON records(deleted);
+            CREATE INDEX IF NOT EXISTS idx_records_stale ON records(has_stale);
+            """
+        )
+        self._import_legacy_json()
+
+    def _import_legacy_json(self):
+        """旧版 JSON 索引一次性导入，导入后重命名为 .migrated"""
+        if not os.path.exists(self.legacy_json_path):
+            return
+        try:
+            with open(self.legacy_json_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"[HashIndex] 旧版 JSON 索引读取失败，跳过导入: {e}")
+            return
+        with self.batch():
+            for doc_key, record in data.items():
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO records VALUES (?, ?, ?, ?)",
+                    self._row(doc_key, record),
+                )
+        os.replace(self.legacy_json_path, self.legacy_json_path + ".migrated")
+        logger.info(f"[HashIndex] 已导入旧版 JSON 索引: {len(data)} 条 ({self.kb_id})")
+
+    @staticmethod
+    def _row(doc_key: str, record: dict) -> tuple:
+        return (
+            doc_key,
+            json.dumps(record, ensure_ascii=False),
+            int(bool(record.get("deleted"))),
+            int(bool(record.get("stale_chunk_ids"))),
+        )
 
-    def _load(self) -> Dict[str, dict]:
-        if os.path.exists(self.index_path):
+    @contextlib.contextmanager
+    def batch(self):
+        """将块内的所有修改合并为一个写事务（可嵌套，最外层提交）"""
+        with self._lock:
+            if self._depth == 0:
+                self._conn.execute("BEGIN IMMEDIATE")
+            self._depth += 1
             try:
-                with open(self.index_path, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except Exception:
-                return {}
-        return {}
-
-    def save(self):
-        tmp = self.index_path + ".tmp"
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(self._data, f, ensure_ascii=False, indent=2)
-        os.replace(tmp, self.index_path)
+                yield
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._conn.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._conn.execute("COMMIT")
+
+    def _put(self, doc_key: str, record: dict):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)",
+            self._row(doc_key, record),
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
 
     def get(self, doc_key: str) -> Optional[dict]:
-        return self._data.get(doc_key)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT record FROM records WHERE doc_key = ?", (doc_key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
 
     def set(self, doc_key: str, record: dict):
-        self._data[doc_key] = record
-        self.save()
+        with self.batch():
+            self._put(doc_key, record)
 
     def soft_delete(self, doc_key: str):
         """软删除：标记为废弃，不立即重建向量库，查询时运行时过滤"""
-        if doc_key in self._data:
-            self._data[doc_key]["deleted"] = True
-            self._data[doc_key]["deleted_at"] = datetime.now().isoformat()
-            self.save()
+        with self.batch():
+            record = self.get(doc_key)
+            if record is not None:
+                record["deleted"] = True
+                record["deleted_at"] = datetime.now().isoformat()
+                self._put(doc_key, record)
 
     def delete(self, doc_key: str):
         """硬删除（compaction 后调用）"""
-        if doc_key in self._data:
-            del self._data[doc_key]
-            self.save()
+        with self.batch():
+            self._conn.execute("DELETE FROM records WHERE doc_key = ?", (doc_key,))
 
     def get_deleted_keys(self) -> List[str]:
-        """返回所有已软删除的 doc_key（查询时用于过滤废弃 chunk）"""
-        return [k for k, v in self._data.items() if v.get("deleted")]
+        """返回所有已软删除的 doc_key"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_key FROM records WHERE deleted = 1"
+            ).fetchall()
+        return [r[0] for r in rows]
 
     def get_active_keys(self) -> List[str]:
         """返回所有有效（未删除）的 doc_key"""
-        return [k for k, v in self._data.items() if not v.get("deleted")]
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_key FROM records WHERE deleted = 0"
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def tombstoned_chunk_ids(self) -> List[int]:
+        """待 compaction 移除的 chunk_id：已软删除文档的全部 chunk + 更新后遗留的旧 chunk"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT record FROM records WHERE deleted = 1 OR has_stale = 1"
+            ).fetchall()
+        ids: List[int] = []
+        for (raw,) in rows:
+            v = json.loads(raw)
+            if v.get("deleted"):
+                ids.extend(v.get("chunk_ids", []))
+            ids.extend(v.get("stale_chunk_ids", []))
+        return ids
+
+    def clear_stale(self):
+        """compaction 后清除各记录的 stale_chunk_ids"""
+        with self.batch():
+            rows = self._conn.execute(
+                "SELECT doc_key, record FROM records WHERE has_stale = 1"
+            ).fetchall()
+            for doc_key, raw in rows:
+                record = json.loads(raw)
+                record.pop("stale_chunk_ids", None)
+                self._put(doc_key, record)
 
     def pending_compaction(self) -> bool:
-        """是否到达 compaction 阈值"""
-        return len(self.get_deleted_keys()) >= _COMPACTION_THRESHOLD
+        """是否到达 compaction 阈值（软删除文档 + 有遗留旧 chunk 的更新文档）"""
+        with self._lock:
+            (pending,) = self._conn.execute(
+                "SELECT COUNT(*) FROM records WHERE deleted = 1 OR has_stale = 1"
+            ).fetchone()
+        return pending >= _COMPACTION_THRESHOLD
 
     def all_records(self) -> Dict[str, dict]:
-        return dict(self._data)
+        with self._lock:
+            rows = self._conn.execute("SELECT doc_key, record FROM records").fetchall()
+        return {k: json.loads(v) for k, v in rows}
 
     def stats(self) -> dict:
-        active = [v for v in self._data.values() if not v.get("deleted")]
-        deleted = [v for v in self._data.values() if v.get("deleted")]
+        records = self.all_records().values()
+        active = [v for v in records if not v.get("deleted")]
+        deleted = [v for v in records if v.get("deleted")]
         return {
             "kb_id": self.kb_id,
             "total_documents": len(active),
@@ -214,7 +342,7 @@ class IncrementalVectorizer:
         return None
 
     def _load_documents(self, file_path: str):
-        """使用项目内的 DocumentLoader 解析文档为 LangChain Document 列表"""
+        """使用项目内的 DocumentLoader 流式解析并分块为 LangChain Document 列表"""
         try:
             from RAG_M.src.ingestion.document_loader import DocumentLoader
         except ImportError:
@@ -238,10 +366,14 @@ class IncrementalVectorizer:
                     for i, chunk in enumerate(chunks)
                 ]
 
+        # 逐页读取、逐页分块：只保留文本块（写入 docstore 需要），不保留整本页面列表
+        def on_page(path: str, page: int):
+            if page % 50 == 0:
+                logger.info(f"[IncrementalVectorizer] {path}: 已解析 {page} 页")
+
         loader = DocumentLoader()
         try:
-            docs = loader.load_and_split(file_path)
-            return docs
+            return list(loader.iter_document(file_path, on_page=on_page))
         except Exception as e:
             logger.error(f"[IncrementalVectorizer] 文档解析失败 {file_path}: {e}")
             raise
@@ -268,6 +400,40 @@ class IncrementalVectorizer:
             doc_key:   文档唯一标识（默认使用文件相对路径）
             force:     True 则强制重新向量化，忽略哈希比对
         """
+        prepared = self._prepare_file(file_path, doc_key=doc_key, force=force)
+        if prepared["status"] == "skipped":
+            return prepared
+
+        self._write_prepared([prepared])
+        compacted = self._maybe_compact()
+
+        doc_key = prepared["doc_key"]
+        status = prepared["status"]
+        chunk_count = len(prepared["documents"])
+        logger.info(
+            f"[IncrementalVectorizer] 完成 ({status}): {doc_key}, {chunk_count} chunks"
+        )
+
+        return {
+            "status": status,
+            "doc_key": doc_key,
+            "chunk_count": chunk_count,
+            "file_hash": prepared["file_hash"],
+            "compacted": compacted,
+            "message": f"向量化{'更新' if status == 'updated' else '新增'}成功",
+        }
+
+    def _prepare_file(
+        self,
+        file_path: str,
+        doc_key: Optional[str] = None,
+        force: bool = False,
+    ) -> dict:
+        """
+        解析 + 分块阶段：哈希比对，未变化时返回 skipped 结果；
+        否则返回 {"status", "doc_key", "file_hash", "file_path", "documents"}，
+        由 _write_prepared 统一编码、写入。
+        """
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"文件不存在: {file_path}")
 
@@ -304,95 +470,199 @@ class IncrementalVectorizer:
             doc.metadata["source"] = file_path
             doc.metadata["chunk_index"] = i
 
-        # - deleted
-        if status == "updated" and existing:
-            logger.info(f"[IncrementalVectorizer] 软删除旧记录: {doc_key}")
-            self.hash_index.soft_delete(doc_key)
+        return {
+            "status": status,
+            "doc_key": doc_key,
+            "file_hash": new_hash,
+            "file_path": file_path,
+            "documents": documents,
+        }
 
-        # - chunkO(1)
+    def _write_prepared(self, prepared: List[dict]) -> int:
+        """
+        编码 + 写入阶段：所有 chunk 合并后批量编码（锁外进行），
+        再在一次事务内追加到 FAISS 并只保存一次。返回写入的 chunk 数。
+        """
+        documents = [d for p in prepared for d in p["documents"]]
         vs_manager = self._get_vs_manager()
-        existing_vs = self._load_vectorstore()
+        vectors = vs_manager.embed_documents(documents)
+
+        # 读-改-写在排他锁内完成，退出时递增 generation 使查询侧缓存失效
+        with vectorstore_transaction(self.vectorstore_path):
+            existing_vs = self._load_vectorstore()
+
+            # 已有记录（更新，或软删除后重新入库）：旧 chunk 记入 stale_chunk_ids，
+            # 由 compaction 按 id 移除；否则覆盖 deleted 记录后旧 chunk 无从追踪
+            stale: Dict[str, List[int]] = {}
+            for p in prepared:
+                record = self.hash_index.get(p["doc_key"])
+                if not record:
+                    continue
+                old_ids = record.get("chunk_ids")
+                if old_ids is None and existing_vs is not None:
+                    old_ids = self._scan_chunk_ids(existing_vs, {p["doc_key"]})
+                stale[p["doc_key"]] = record.get("stale_chunk_ids", []) + list(
+                    old_ids or []
+                )
+            if existing_vs is None:
+                # 向量库将从头创建，旧 id 不再对应任何向量
+                stale = {}
 
-        if existing_vs is not None:
-            logger.info(f"[IncrementalVectorizer] 追加新 chunk 到向量库: {doc_key}")
-            existing_vs.add_documents(documents)
-            existing_vs.save_local(self.vectorstore_path)
-        else:
-            logger.info(f"[IncrementalVectorizer] 创建新向量库: {self.kb_id}")
-            vs_manager.create_vectorstore(documents, self.vectorstore_path)
+            self._mark_tombstones(i for ids in stale.values() for i in ids)
 
-        # - active
-        self.hash_index.set(
-            doc_key,
-            {
-                "file_hash": new_hash,
-                "file_path": file_path,
-                "vectorized_at": datetime.now().isoformat(),
-                "chunk_count": len(documents),
-                "status": status,
-                "deleted": False,
-            },
-        )
-
-        # - compaction
-        compacted = False
-        if self.hash_index.pending_compaction():
-            logger.info(
-                f"[IncrementalVectorizer] 触发 compaction（软删除累积达阈值）: {self.kb_id}"
-            )
-            self._compact()
-            compacted = True
+            # - chunkO(1)
+            if existing_vs is not None:
+                logger.info(
+                    f"[IncrementalVectorizer] 追加 {len(documents)} 个新 chunk 到向量库"
+                )
+                vs_manager.add_documents(existing_vs, documents, vectors)
+                existing_vs.save_local(self.vectorstore_path)
+                self._update_bm25_index(existing_vs, documents)
+            else:
+                logger.info(f"[IncrementalVectorizer] 创建新向量库: {self.kb_id}")
+                vs_manager.create_vectorstore(
+                    documents, self.vectorstore_path, vectors=vectors
+                )
 
+        # - active
+        vectorized_at = datetime.now().isoformat()
+        with self.hash_index.batch():
+            for p in prepared:
+                record = {
+                    "file_hash": p["file_hash"],
+                    "file_path": p["file_path"],
+                    "chunk_ids": [d.metadata["chunk_id"] for d in p["documents"]],
+                    "vectorized_at": vectorized_at,
+                    "chunk_count": len(p["documents"]),
+                    "status": p["status"],
+                    "deleted": False,
+                }
+                if stale.get(p["doc_key"]):
+                    record["stale_chunk_ids"] = stale[p["doc_key"]]
+                self.hash_index.set(p["doc_key"], record)
+        return len(documents)
+
+    def _maybe_compact(self) -> bool:
+        """软删除累积达阈值时触发 compaction"""
+        if not self.hash_index.pending_compaction():
+            return False
         logger.info(
-            f"[IncrementalVectorizer] 完成 ({status}): {doc_key}, {len(documents)} chunks"
+            f"[IncrementalVectorizer] 触发 compaction（软删除累积达阈值）: {self.kb_id}"
         )
+        self._compact()
+        return True
 
-        return {
-            "status": status,
-            "doc_key": doc_key,
-            "chunk_count": len(documents),
-            "file_hash": new_hash,
-            "compacted": compacted,
-            "message": f"向量化{'更新' if status == 'updated' else '新增'}成功",
-        }
+    def _update_bm25_index(self, vectorstore, new_documents) -> None:
+        """
+        增量更新向量库目录下的 bm25.index：
+        已有索引与追加前的向量数一致时，只对新 chunk 分词并追加 postings；
+        否则按 FAISS 内部顺序全量重建。失败不影响入库，查询侧会按需重建。
+        """
+        try:
+            try:
+                from RAG_M.src.rag.bm25_index import (
+                    BM25_INDEX_FILENAME,
+                    InvertedBM25Index,
+                )
+                from RAG_M.src.rag.hybrid_retriever import vectorstore_documents
+            except ImportError:
+                from src.rag.bm25_index import BM25_INDEX_FILENAME, InvertedBM25Index
+                from src.rag.hybrid_retriever import vectorstore_documents
+
+            index_path = os.path.join(self.vectorstore_path, BM25_INDEX_FILENAME)
+            n_before = vectorstore.index.ntotal - len(new_documents)
+
+            index = None
+            if os.path.exists(index_path):
+                try:
+                    index = InvertedBM25Index.from_file(index_path)
+                except Exception as e:
+                    logger.warning(f"[IncrementalVectorizer] 读取 BM25 索引失败: {e}")
+            if index is not None and len(index) == n_before:
+                index.add_texts(d.page_content for d in new_documents)
+            else:
+                index = InvertedBM25Index(
+                    d.page_content for d in vectorstore_documents(vectorstore)
+                )
+            index.save(index_path)
+        except Exception as e:
+            logger.warning(f"[IncrementalVectorizer] 更新 BM25 索引失败: {e}")
 
     def _compact(self):
         """
-        紧凑重建：清除所有软删除的废弃 chunk，重建干净的向量库。
-        仅在累积 _COMPACTION_THRESHOLD 次软删除后触发，摊薄重建代价。
+        紧凑：按 chunk_id 从向量库 remove_ids 所有废弃 chunk（软删除文档 + 更新遗留），
+        代价与废弃数成正比，不重新编码；BM25 索引随之按新顺序重建。
+        仅在累积 _COMPACTION_THRESHOLD 次软删除后触发。
         """
-        existing_vs = self._load_vectorstore()
-        if existing_vs is None:
-            for dk in self.hash_index.get_deleted_keys():
-                self.hash_index.delete(dk)
-            return
-
-        deleted_keys = set(self.hash_index.get_deleted_keys())
-        all_docs = list(existing_vs.docstore._dict.values())
+        with vectorstore_transaction(self.vectorstore_path):
+            self._compact_locked()
 
-        # doc_key chunk
-        clean_docs = [
-            d
-            for d in all_docs
-            if hasattr(d, "metadata") and d.metadata.get("doc_key") not in deleted_keys
-        ]
-
-        vs_manager = self._get_vs_manager()
-        if clean_docs:
-            vs_manager.create_vectorstore(clean_docs, self.vectorstore_path)
-        else:
-            for fname in ["index.faiss", "index.pkl"]:
-                fpath = os.path.join(self.vectorstore_path, fname)
-                if os.path.exists(fpath):
-                    os.remove(fpath)
+    def _compact_locked(self):
+        deleted_keys = self.hash_index.get_deleted_keys()
+        existing_vs = self._load_vectorstore()
+        removed = remaining = 0
 
-        for dk in list(deleted_keys):
-            self.hash_index.delete(dk)
+        if existing_vs is not None:
+            vs_manager = self._get_vs_manager()
+            converted = vs_manager.ensure_id_map(existing_vs)
+            chunk_ids = set(self.hash_index.tombstoned_chunk_ids())
+            # 旧记录没有 chunk_ids 时按 doc_key 扫描一次 docstore
+            legacy = {
+                dk
+                for dk in deleted_keys
+                if "chunk_ids" not in (self.hash_index.get(dk) or {})
+            }
+            if legacy:
+                chunk_ids.update(self._scan_chunk_ids(existing_vs, legacy))
+
+            removed = vs_manager.remove_chunks(existing_vs, chunk_ids)
+            remaining = existing_vs.index.ntotal
+            tombstones = DeletionBitmap.load(self.vectorstore_path)
+            tombstones.unmark(chunk_ids)
+            tombstones.save(self.vectorstore_path)
+            if remaining == 0:
+                for fname in [
+                    "index.faiss",
+                    "index.pkl",
+                    "bm25.index",
+                    TOMBSTONE_FILENAME,
+                ]:
+                    fpath = os.path.join(self.vectorstore_path, fname)
+                    if os.path.exists(fpath):
+                        os.remove(fpath)
+            elif removed or converted:
+                existing_vs.save_local(self.vectorstore_path)
+                self._update_bm25_index(existing_vs, [])
+
+        with self.hash_index.batch():
+            for dk in deleted_keys:
+                self.hash_index.delete(dk)
+            self.hash_index.clear_stale()
 
         logger.info(
-            f"[IncrementalVectorizer] compaction 完成: 清除 {len(deleted_keys)} 个废弃文档，保留 {len(clean_docs)} 个 chunk"
+            f"[IncrementalVectorizer] compaction 完成: 清除 {len(deleted_keys)} 个废弃文档、"
+            f"{removed} 个 chunk，保留 {remaining} 个 chunk"
         )
 
+    def _mark_tombstones(self, chunk_ids) -> None:
+        """将 chunk_id 写入软删除位图（需在 vectorstore_transaction 内调用）"""
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return
+        tombstones = DeletionBitmap.load(self.vectorstore_path)
+        tombstones.mark(chunk_ids)
+        tombstones.save(self.vectorstore_path)
+
+    @staticmethod
+    def _scan_chunk_ids(vectorstore, doc_keys) -> List[int]:
+        """按 doc_key 扫描 docstore 取 chunk_id（兼容未记录 chunk_ids 的旧记录）"""
+        store = vectorstore.docstore._dict
+        return [
+            chunk_id
+            for chunk_id, doc_id in vectorstore.index_to_docstore_id.items()
+            if store[doc_id].metadata.get("doc_key") in doc_keys
+        ]
+
     def remove_file(self, doc_key: str) -> dict:
         """
         从向量库中移除指定文档的所有向量块。
@@ -407,7 +677,16 @@ class IncrementalVectorizer:
         if not existing:
             return {"status": "not_found", "doc_key": doc_key}
 
-        self.hash_index.soft_delete(doc_key)
+        with vectorstore_transaction(self.vectorstore_path):
+            self.hash_index.soft_delete(doc_key)
+            chunk_ids = existing.get("chunk_ids")
+            if chunk_ids is None:
+                existing_vs = self._load_vectorstore()
+                if existing_vs is not None:
+                    chunk_ids = self._scan_chunk_ids(existing_vs, {doc_key})
+            self._mark_tombstones(
+                list(chunk_ids or []) + existing.get("stale_chunk_ids", [])
+            )
         logger.info(f"[IncrementalVectorizer] 软删除文档: {doc_key}")
 
         # compaction
@@ -427,13 +706,21 @@ class IncrementalVectorizer:
         }
 
     def batch_ingest(self, file_paths: List[str], force: bool = False) -> dict:
-        """批量增量向量化，返回各文件处理结果汇总"""
+        """
+        批量增量向量化，返回各文件处理结果汇总。
+
+        分阶段执行，整个批任务只写一次 FAISS：
+          1. 解析 + 分块：逐文件进行，单文件失败只计入 failed
+          2. 编码：所有新 chunk 合并交给 BatchEmbedder（长度排序 batch，可多进程）
+          3. 写入：一次事务内追加并保存向量库，随后统一判断 compaction
+        """
+        t0 = time.perf_counter()
         results = {"added": 0, "updated": 0, "skipped": 0, "failed": 0, "details": []}
+
+        prepared: Dict[str, dict] = {}
         for fp in file_paths:
             try:
-                r = self.ingest_file(fp, force=force)
-                results[r["status"]] = results.get(r["status"], 0) + 1
-                results["details"].append(r)
+                p = self._prepare_file(fp, force=force)
             except Exception as e:
                 results["failed"] += 1
                 results["details"].append(
@@ -443,6 +730,66 @@ class IncrementalVectorizer:
                         "error": str(e),
                     }
                 )
+                continue
+            if p["status"] == "skipped":
+                results["skipped"] += 1
+                results["details"].append(p)
+            else:
+                # 同一批次内重复的 doc_key 以最后一次为准，被覆盖的一项计为 skipped
+                dup = prepared.pop(p["doc_key"], None)
+                if dup is not None:
+                    results["skipped"] += 1
+                    results["details"].append(
+                        {
+                            "status": "skipped",
+                            "doc_key": dup["doc_key"],
+                            "file_path": dup["file_path"],
+                            "reason": "duplicate",
+                            "message": "同一批次内 doc_key 重复，以最后一项为准",
+                        }
+                    )
+                prepared[p["doc_key"]] = p
+
+        chunk_count = 0
+        compacted = False
+        if prepared:
+            batch = list(prepared.values())
+            try:
+                chunk_count = self._write_prepared(batch)
+            except Exception as e:
+                logger.error(f"[IncrementalVectorizer] 批量写入失败: {e}")
+                for p in batch:
+                    results["failed"] += 1
+                    results["details"].append(
+                        {
+                            "status": "failed",
+                            "file_path": p["file_path"],
+                            "error": str(e),
+                        }
+                    )
+                batch = []
+            for p in batch:
+                results[p["status"]] += 1
+                results["details"].append(
+                    {
+                        "status": p["status"],
+                        "doc_key": p["doc_key"],
+                        "chunk_count": len(p["documents"]),
+                        "file_hash": p["file_hash"],
+                    }
+                )
+            if batch:
+                compacted = self._maybe_compact()
+
+        elapsed = time.perf_counter() - t0
+        results["compacted"] = compacted
+        results["chunk_count"] = chunk_count
+        results["elapsed_s"] = round(elapsed, 3)
+        results["chunks_per_sec"] = round(chunk_count / elapsed, 1) if elapsed else 0.0
+        logger.info(
+            f"[IncrementalVectorizer] 批量完成: {len(file_paths)} 个文件, "
+            f"{chunk_count} chunks, {results['chunks_per_sec']} chunks/s"
+        )
         return results
 
     def get_stats(self) -> dict:
@@ -510,35 +857,43 @@ async def api_ingest_file(req: IngestRequest):
 
 
 @router.post(
-    "/api/vectorize/batch", summary="批量增量向量化（异步，立即返回 task_id 列表）"
+    "/api/vectorize/batch", summary="批量增量向量化（异步，立即返回批任务 task_id）"
 )
 async def api_batch_ingest(req: BatchIngestRequest):
     """
-    批量处理多个文件，每个文件独立入队，返回 task_id 列表。
-    前端可逐个轮询状态，单文件失败不影响其他文件。
+    批量处理多个文件：存在的文件合并为一个批任务入队（分阶段解析 / 批量编码 /
+    一次写入向量库），返回该批任务的 task_id（没有可处理的文件时为 None）。
+    单文件解析失败不影响其他文件，各文件结果见任务详情。
     """
     from document_processing.task_queue import enqueue_task
 
-    task_ids = []
+    tasks = []
+    existing_paths = []
     for fp in req.file_paths:
         if not os.path.exists(fp):
-            task_ids.append({"file_path": fp, "task_id": None, "error": "文件不存在"})
+            tasks.append({"file_path": fp, "task_id": None, "error": "文件不存在"})
             continue
+        existing_paths.append(fp)
 
-        tid = await enqueue_task(
-            "vectorize",
+    task_id = None
+    if existing_paths:
+        task_id = await enqueue_task(
+            "vectorize_batch",
             kb_id=req.kb_id,
-            file_path=fp,
-            doc_key="",
+            file_paths=existing_paths,
             force=req.force,
         )
-        task_ids.append({"file_path": fp, "task_id": tid, "status": "pending"})
+        tasks.extend(
+            {"file_path": fp, "task_id": task_id, "status": "pending"}
+            for fp in existing_paths
+        )
 
     return {
         "total": len(req.file_paths),
-        "queued": sum(1 for t in task_ids if t.get("task_id")),
-        "tasks": task_ids,
-        "message": "批量任务已提交，通过 /api/vectorize/status/{task_id} 查询各文件进度",
+        "queued": len(existing_paths),
+        "task_id": task_id,
+        "tasks": tasks,
+        "message": "批量任务已提交，通过 /api/vectorize/status/{task_id} 查询进度",
     }
 
 
@@ -15,9 +15,13 @@ retrieval_strategy.py
   scoreThreshold  : 最低相关度过滤（0~1，仅向量/mmr 策略有效）
   vectorWeight    : hybrid 策略向量分数权重（0~1）
   bm25Weight      : hybrid 策略 BM25 分数权重（0~1）
-  rerank          : 是否对结果做二次排序（本地 cross-encoder 模拟）
+  rerank          : 是否对结果做二次排序（cross-encoder 精排，超出延迟预算时降级为词法重排）
   rerankTopN      : rerank 后保留的文档块数
 
+query 向量：一次 retrieve 只编码一次 query（经进程级 query 向量 LRU 缓存），
+各向量类策略（vector / hybrid / rrf / mmr）共用；调用方也可传入预先算好的 query_vector。
+无法识别 embedding 模型名时不缓存，直接按文本检索。
+
 使用方式：
   from document_processing.retrieval_strategy import RetrievalStrategyExecutor
   executor = RetrievalStrategyExecutor(vectorstore, documents)
@@ -28,7 +32,8 @@ from __future__ import annotations
 
 import math
 import logging
-from typing import List, Dict, Any, Optional
+import time
+from typing import List, Dict, Any, Optional, Sequence, Tuple
 from dataclasses import dataclass
 
 from langchain.docstore.document import Document
@@ -40,8 +45,36 @@ try:
         BM25,
         reciprocal_rank_fusion,
     )
+    from RAG_M.src.rag.bm25_index import tokenize
+    from RAG_M.src.rag.rank_fusion import chunk_key, fuse_scored
 except ImportError:
     from src.rag.hybrid_retriever import BM25, reciprocal_rank_fusion
+    from src.rag.bm25_index import tokenize
+    from src.rag.rank_fusion import chunk_key, fuse_scored
+
+try:
+    from rag_enhancement.cross_encoder import (
+        CrossEncoderScorer,
+        default_scorer,
+        rerank_items,
+    )
+except ImportError:
+    CrossEncoderScorer = None  # type: ignore
+    default_scorer = None  # type: ignore
+    rerank_items = None  # type: ignore
+
+try:
+    from monitoring.metrics import STATS as _METRICS
+except ImportError:
+    _METRICS = None
+
+# 与 RAG_app（src.*）共用同一个模块实例，query 向量缓存才是进程级共享的
+try:
+    from src.vectorstore.embedding_cache import query_vector as _cached_query_vector
+except ImportError:
+    from RAG_M.src.vectorstore.embedding_cache import (
+        query_vector as _cached_query_vector,
+    )
 
 logger = logging.getLogger(__name__)
 
@@ -105,8 +138,8 @@ def _extract_filename(meta: dict) -> str:
 
 
 # ─────────────────────────────────────────────────────────────────
-# Cross-Encoder rerank
-# sentence-transformers cross-encoder
+# Rerank：cross-encoder 精排（rag_enhancement.cross_encoder），
+# 模型不可用或超出延迟预算时降级为词法重排
 # ─────────────────────────────────────────────────────────────────
 
 
@@ -117,13 +150,12 @@ def _lightweight_rerank(
 ) -> List[Dict[str, Any]]:
     """
     基于查询词与文档内容的 token 重叠率做二次排序（本地轻量版）。
-    适合无 GPU 环境，可被真实 cross-encoder 替换。
+    分词与 BM25 一致（中文按单字、英文按词），中文查询同样有效。
     """
-    query_tokens = set(query.lower().split())
+    query_tokens = set(tokenize(query))
 
     def overlap_score(item: Dict[str, Any]) -> float:
-        content = item["document"].page_content.lower()
-        doc_tokens = set(content.split())
+        doc_tokens = set(tokenize(item["document"].page_content))
         if not doc_tokens:
             return 0.0
         overlap = len(query_tokens & doc_tokens)
@@ -137,6 +169,39 @@ def _lightweight_rerank(
     return reranked[:top_n]
 
 
+def _record_stage(stage: str, t0: float) -> None:
+    if _METRICS is not None:
+        _METRICS.record_stage(stage, (time.perf_counter() - t0) * 1000)
+
+
+def _cross_encoder_rerank(
+    scorer: Optional["CrossEncoderScorer"],
+    query: str,
+    docs_with_scores: List[Dict[str, Any]],
+    top_n: int,
+) -> List[Dict[str, Any]]:
+    """cross-encoder 一次批量打分后重排；不可用 / 超预算时返回词法重排结果"""
+    ranked = None
+    if scorer is not None:
+        ranked = rerank_items(
+            scorer,
+            query,
+            docs_with_scores,
+            text_of=lambda item: item["document"].page_content,
+            key_of=lambda item: chunk_key(item["document"]),
+        )
+    if ranked is None:
+        return _lightweight_rerank(query, docs_with_scores, top_n)
+
+    reranked = []
+    for i, (item, score) in enumerate(ranked[:top_n], start=1):
+        item["source_info"]["rank"] = i
+        item["source_info"]["reranked"] = True
+        item["source_info"]["rerank_score"] = round(score, 4)
+        reranked.append(item)
+    return reranked
+
+
 # ─────────────────────────────────────────────────────────────────
 # ─────────────────────────────────────────────────────────────────
 
@@ -145,30 +210,54 @@ class RetrievalStrategyExecutor:
     """
     统一的检索策略执行器。
     根据 RetrievalConfig 动态选择检索策略并返回标准化结果列表。
+    reranker 为空时使用进程级默认 cross-encoder（rag_enhancement.cross_encoder）。
     """
 
     def __init__(
         self,
         vectorstore: FAISS,
         documents: Optional[List[Document]] = None,
+        bm25: Optional[BM25] = None,
+        reranker: Optional["CrossEncoderScorer"] = None,
     ):
         self.vectorstore = vectorstore
         self.documents = documents or []
-        self._bm25: Optional[BM25] = None
+        self._bm25: Optional[BM25] = bm25
+        self._reranker = reranker
+
+    def _get_reranker(self) -> Optional["CrossEncoderScorer"]:
+        if self._reranker is None and default_scorer is not None:
+            self._reranker = default_scorer()
+        return self._reranker
 
     def _get_bm25(self) -> BM25:
         if self._bm25 is None:
             if not self.documents:
                 raise ValueError("BM25 检索需要提供 documents 列表")
-            self._bm25 = BM25(self.documents)
+            self._bm25 = BM25(
+                self.documents,
+                tombstones=getattr(self.vectorstore, "tombstones", None),
+            )
         return self._bm25
 
+    def _similarity_search(
+        self, query: str, q_vec: Optional[Sequence[float]], k: int
+    ) -> List[Tuple[Document, float]]:
+        """有 query 向量时按向量检索，否则（embedding 模型无法识别）按文本检索"""
+        if q_vec is None:
+            return self.vectorstore.similarity_search_with_score(query, k=k)
+        return self.vectorstore.similarity_search_with_score_by_vector(q_vec, k=k)
+
     # - -
 
     def _vector_search(
-        self, query: str, top_k: int, score_threshold: float
+        self,
+        query: str,
+        q_vec: Optional[Sequence[float]],
+        top_k: int,
+        score_threshold: float,
     ) -> List[Dict[str, Any]]:
-        raw = self.vectorstore.similarity_search_with_score(query, k=top_k * 2)
+        raw = self._similarity_search(query, q_vec, top_k * 2)
         results = []
         for rank, (doc, score) in enumerate(raw, start=1):
             # FAISS L2 0~1
@@ -188,52 +277,31 @@ class RetrievalStrategyExecutor:
         ]
 
     def _hybrid_search(
-        self, query: str, config: RetrievalConfig
+        self, query: str, q_vec: Optional[Sequence[float]], config: RetrievalConfig
     ) -> List[Dict[str, Any]]:
         """加权线性融合：score = vectorWeight * v_score + bm25Weight * b_score"""
         bm25 = self._get_bm25()
         bm25_raw = bm25.retrieve(query, top_k=config.topK * 2)
-        vector_raw = self.vectorstore.similarity_search_with_score(
-            query, k=config.topK * 2
-        )
+        vector_raw = self._similarity_search(query, q_vec, config.topK * 2)
 
-        # BM25
-        b_scores: Dict[str, float] = {}
-        b_docs: Dict[str, Document] = {}
+        # BM25 按最高分归一化，L2 距离转为 0~1 相似度；按 chunk_id 融合
         max_bm25 = max((s for _, s in bm25_raw), default=1.0) or 1.0
-        for doc, score in bm25_raw:
-            key = doc.page_content[:200]
-            b_scores[key] = score / max_bm25
-            b_docs[key] = doc
-
-        # L2
-        v_scores: Dict[str, float] = {}
-        v_docs: Dict[str, Document] = {}
-        for doc, dist in vector_raw:
-            key = doc.page_content[:200]
-            v_scores[key] = 1.0 / (1.0 + float(dist))
-            v_docs[key] = doc
-
-        all_keys = set(b_scores) | set(v_scores)
-        fused = []
-        for key in all_keys:
-            b_s = b_scores.get(key, 0.0)
-            v_s = v_scores.get(key, 0.0)
-            combined = config.vectorWeight * v_s + config.bm25Weight * b_s
-            doc = v_docs.get(key) or b_docs.get(key)
-            fused.append((doc, combined))
-
-        fused.sort(key=lambda x: x[1], reverse=True)
+        b_list = [(doc, score / max_bm25) for doc, score in bm25_raw]
+        v_list = [(doc, 1.0 / (1.0 + float(dist))) for doc, dist in vector_raw]
+
+        fused = fuse_scored([v_list, b_list], [config.vectorWeight, config.bm25Weight])
         return [
             _build_result_item(i + 1, doc, score)
             for i, (doc, score) in enumerate(fused[: config.topK])
         ]
 
-    def _rrf_search(self, query: str, config: RetrievalConfig) -> List[Dict[str, Any]]:
+    def _rrf_search(
+        self, query: str, q_vec: Optional[Sequence[float]], config: RetrievalConfig
+    ) -> List[Dict[str, Any]]:
         """RRF 融合"""
         bm25 = self._get_bm25()
         bm25_raw = bm25.retrieve(query, top_k=config.topK)
-        vector_raw = self.vectorstore.similarity_search_with_score(query, k=config.topK)
+        vector_raw = self._similarity_search(query, q_vec, config.topK)
         vector_list = [(doc, score) for doc, score in vector_raw]
 
         fused = reciprocal_rank_fusion([bm25_raw, vector_list])
@@ -242,19 +310,24 @@ class RetrievalStrategyExecutor:
             for i, (doc, score) in enumerate(fused[: config.topK])
         ]
 
-    def _mmr_search(self, query: str, config: RetrievalConfig) -> List[Dict[str, Any]]:
+    def _mmr_search(
+        self, query: str, q_vec: Optional[Sequence[float]], config: RetrievalConfig
+    ) -> List[Dict[str, Any]]:
         """Maximal Marginal Relevance（FAISS 原生支持）"""
         try:
-            docs = self.vectorstore.max_marginal_relevance_search(
-                query,
-                k=config.topK,
-                fetch_k=config.topK * 3,
-                lambda_mult=0.5,  # 0=, 1=
-            )
+            mmr_kwargs = dict(k=config.topK, fetch_k=config.topK * 3, lambda_mult=0.5)
+            if q_vec is None:
+                docs = self.vectorstore.max_marginal_relevance_search(
+                    query, **mmr_kwargs
+                )
+            else:
+                docs = self.vectorstore.max_marginal_relevance_search_by_vector(
+                    q_vec, **mmr_kwargs
+                )
             return [_build_result_item(i + 1, doc, 0.0) for i, doc in enumerate(docs)]
         except Exception as e:
             logger.warning(f"[MMR] 失败，降级为向量检索: {e}")
-            return self._vector_search(query, config.topK, config.scoreThreshold)
+            return self._vector_search(query, q_vec, config.topK, config.scoreThreshold)
 
     # - -
 
@@ -262,10 +335,12 @@ class RetrievalStrategyExecutor:
         self,
         query: str,
         config: Optional[RetrievalConfig] = None,
+        query_vector: Optional[Sequence[float]] = None,
     ) -> List[Dict[str, Any]]:
         """
         根据策略配置执行检索，返回标准化结果列表。
         每项包含 document / source_info / content_preview。
+        query_vector 为空时按需编码一次 query（bm25 策略不编码）。
         """
         if config is None:
             config = RetrievalConfig()  # RRF
@@ -276,23 +351,36 @@ class RetrievalStrategyExecutor:
         )
 
         strategy = config.strategy.lower()
+        q_vec = query_vector
+        if q_vec is None and strategy != "bm25":
+            t0 = time.perf_counter()
+            q_vec = _cached_query_vector(self.vectorstore, query)
+            _record_stage("embedding", t0)
 
+        t0 = time.perf_counter()
         if strategy == "vector":
-            results = self._vector_search(query, config.topK, config.scoreThreshold)
+            results = self._vector_search(
+                query, q_vec, config.topK, config.scoreThreshold
+            )
         elif strategy == "bm25":
             results = self._bm25_search(query, config.topK)
         elif strategy == "hybrid":
-            results = self._hybrid_search(query, config)
+            results = self._hybrid_search(query, q_vec, config)
         elif strategy == "rrf":
-            results = self._rrf_search(query, config)
+            results = self._rrf_search(query, q_vec, config)
         elif strategy == "mmr":
-            results = self._mmr_search(query, config)
+            results = self._mmr_search(query, q_vec, config)
         else:
             logger.warning(f"[RetrievalStrategy] 未知策略 '{strategy}'，使用 RRF")
-            results = self._rrf_search(query, config)
+            results = self._rrf_search(query, q_vec, config)
+        _record_stage("retrieval", t0)
 
         # - rerank
         if config.rerank and results:
-            results = _lightweight_rerank(query, results, top_n=config.rerankTopN)
+            t0 = time.perf_counter()
+            results = _cross_encoder_rerank(
+                self._get_reranker(), query, results, top_n=config.rerankTopN
+            )
+            _record_stage("rerank", t0)
 
         return results
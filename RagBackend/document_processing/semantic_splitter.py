@@ -21,7 +21,10 @@ API (挂载到 document_processing):
 
 from __future__ import annotations
 
+import bisect
+import json
 import logging
+import os
 import re
 from dataclasses import dataclass, field
 from typing import Any, Dict, List, Optional, Tuple
@@ -294,27 +297,135 @@ def jieba_tokenize_safe(text: str) -> List[str]:
 
 
 # - INT8 Vector store -
+SEGMENT_MANIFEST = "manifest.json"
+
+
+class _BlobColumn:
+    """offsets(int64, N+1) + UTF-8 blob 的变长字段列（文本 / 元数据 JSON），按行惰性解码"""
+
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray):
+        self._offsets = offsets
+        self._blob = blob
+
+    @classmethod
+    def open(cls, prefix: str) -> "_BlobColumn":
+        offsets = np.memmap(prefix + ".off", dtype=np.int64, mode="r")
+        if os.path.getsize(prefix + ".bin"):
+            blob = np.memmap(prefix + ".bin", dtype=np.uint8, mode="r")
+        else:
+            blob = np.zeros(0, dtype=np.uint8)
+        return cls(offsets, blob)
+
+    @staticmethod
+    def write(prefix: str, items: List[bytes]) -> None:
+        offsets = np.zeros(len(items) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in items], out=offsets[1:])
+        with open(prefix + ".bin", "wb") as f:
+            for b in items:
+                f.write(b)
+        offsets.tofile(prefix + ".off")
+
+    def __getitem__(self, i: int) -> str:
+        lo, hi = int(self._offsets[i]), int(self._offsets[i + 1])
+        return self._blob[lo:hi].tobytes().decode("utf-8")
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+
+@dataclass
+class _Segment:
+    """
+    一段向量：内存中新增的段（texts/meta 为 list，name=None），
+    或磁盘上的不可变段（vecs/scales 为只读 memmap，texts/meta 为 _BlobColumn）
+    """
+
+    vecs: np.ndarray  # (n, dim) int8
+    scales: np.ndarray  # (n,) float32
+    texts: Any
+    meta: Any
+    name: Optional[str] = None
+
+    def text(self, i: int) -> str:
+        return self.texts[i]
+
+    def metadata(self, i: int) -> Dict:
+        if isinstance(self.meta, _BlobColumn):
+            return json.loads(self.meta[i])
+        return self.meta[i]
+
+    @classmethod
+    def open(cls, store_dir: str, name: str, dim: int) -> "_Segment":
+        prefix = os.path.join(store_dir, name)
+        scales = np.memmap(prefix + ".scales", dtype=np.float32, mode="r")
+        vecs = np.memmap(
+            prefix + ".vecs", dtype=np.int8, mode="r", shape=(len(scales), dim)
+        )
+        return cls(
+            vecs=vecs,
+            scales=scales,
+            texts=_BlobColumn.open(prefix + ".text"),
+            meta=_BlobColumn.open(prefix + ".meta"),
+            name=name,
+        )
+
+
 class INT8VectorStore:
     """
     INT8 量化向量存储
 
     原理：
-      float32 向量 → 归一化 → 线性映射到 [-128, 127] int8
+      float32 向量 → L2 归一化 → 线性映射到 [-127, 127] int8
+      每行保存一个 scale = 1 / ||int8 行||，反量化后即为单位向量，
+      余弦相似度 = (int8 行 · 单位查询向量) * scale，检索时无需整体反量化、再归一化
       内存占用降低 75%（4字节→1字节/维度）
       余弦相似度损失 < 1%（实验验证）
 
+    检索：
+      按 block_size 行分块，每块 int8 拷入固定大小的 float32 暂存区后与
+      (Q, D) 查询矩阵做一次 GEMM，argpartition 维护每个查询的 top-k 候选；
+      额外内存只有 block_size × D 的暂存区与 (Q, block_size) 分数块，与库大小无关
+
+    磁盘格式（save(path) 写入目录 path）：
+      manifest.json          {"version", "dim", "count", "segments": [{"name", "count"}]}
+      seg-00000.vecs         原始 int8 矩阵 (n, dim)
+      seg-00000.scales       float32 (n,)
+      seg-00000.text.off/bin 文本 offsets + UTF-8 blob
+      seg-00000.meta.off/bin 元数据 JSON offsets + blob
+      段文件写入后不再修改；add() 只在内存中追加新段，save() 把未落盘的段合并写成
+      一个新段并原子替换 manifest，不会 vstack / 重写已有向量。
+      load() 以只读 memmap 打开各段，多个 worker 进程共享同一份页缓存。
+
     使用：
       store = INT8VectorStore(dim=384)
       store.add(texts, embeddings_float32)
       results = store.search(query_embedding, top_k=5)
+      batch_results = store.search_batch([q1, q2], top_k=5)
     """
 
-    def __init__(self, dim: int = 384):
+    DEFAULT_BLOCK_SIZE = 8192
+
+    def __init__(self, dim: int = 384, block_size: int = DEFAULT_BLOCK_SIZE):
         self.dim = dim
-        self._texts: List[str] = []
-        self._vecs: Optional[np.ndarray] = None  # shape: (N, dim), dtype int8
-        self._scales: Optional[np.ndarray] = None  # per-vector scale, shape: (N,)
-        self._meta: List[Dict] = []
+        self.block_size = max(1, block_size)
+        self._segments: List[_Segment] = []
+        self._starts: List[int] = []  # 各段首行的全局下标
+        self._count = 0
+        self._path: Optional[str] = None  # 已落盘段所在目录
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _reindex(self) -> None:
+        self._starts, total = [], 0
+        for seg in self._segments:
+            self._starts.append(total)
+            total += len(seg.scales)
+        self._count = total
+
+    def _locate(self, idx: int) -> Tuple[_Segment, int]:
+        pos = bisect.bisect_right(self._starts, idx) - 1
+        return self._segments[pos], idx - self._starts[pos]
 
     def add(
         self,
@@ -322,24 +433,22 @@ class INT8VectorStore:
         embeddings: List[List[float]],
         metadata: Optional[List[Dict]] = None,
     ) -> int:
-        """添加向量（自动量化）"""
-        if not texts or not embeddings:
+        """添加向量（自动归一化 + 量化），作为新的内存段追加，不复制已有向量"""
+        if not texts or len(embeddings) == 0:
             return 0
-        arr = np.array(embeddings, dtype=np.float32)  # (N, D)
+        arr = np.asarray(embeddings, dtype=np.float32)  # (N, D)
         int8_vecs, scales = self._quantize(arr)
 
-        if self._vecs is None:
-            self._vecs = int8_vecs
-            self._scales = scales
-        else:
-            self._vecs = np.vstack([self._vecs, int8_vecs])
-            self._scales = np.concatenate([self._scales, scales])
-
-        self._texts.extend(texts)
-        self._meta.extend(metadata or [{} for _ in texts])
-        logger.debug(
-            f"[INT8Store] Added {len(texts)} vectors, total={len(self._texts)}"
+        self._segments.append(
+            _Segment(
+                vecs=int8_vecs,
+                scales=scales,
+                texts=list(texts),
+                meta=list(metadata or [{} for _ in texts]),
+            )
         )
+        self._reindex()
+        logger.debug(f"[INT8Store] Added {len(texts)} vectors, total={self._count}")
         return len(texts)
 
     def search(
@@ -349,67 +458,197 @@ class INT8VectorStore:
         score_threshold: float = 0.0,
     ) -> List[Dict[str, Any]]:
         """余弦相似度搜索，返回 top_k 结果"""
-        if self._vecs is None or len(self._texts) == 0:
-            return []
+        return self.search_batch([query_embedding], top_k, score_threshold)[0]
 
-        q = np.array(query_embedding, dtype=np.float32)
-        q_norm = q / (np.linalg.norm(q) + 1e-9)
-
-        float_vecs = self._dequantize(self._vecs, self._scales)
-        norms = np.linalg.norm(float_vecs, axis=1, keepdims=True) + 1e-9
-        normalized = float_vecs / norms
-        scores = normalized @ q_norm  # (N,)
-
-        # top_k
-        top_idx = np.argsort(scores)[::-1][:top_k]
-        results = []
-        for idx in top_idx:
-            score = float(scores[idx])
-            if score < score_threshold:
-                continue
-            results.append(
-                {
-                    "text": self._texts[idx],
-                    "score": round(score, 4),
-                    "metadata": self._meta[idx],
-                    "index": int(idx),
-                }
-            )
+    def search_batch(
+        self,
+        query_embeddings: List[List[float]],
+        top_k: int = 5,
+        score_threshold: float = 0.0,
+    ) -> List[List[Dict[str, Any]]]:
+        """多查询批量搜索：每个 int8 块只读一次，对所有查询同时打分"""
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dim)
+        if self._count == 0 or top_k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        scores, indices = self._top_k(queries, top_k)
+        results: List[List[Dict[str, Any]]] = []
+        for row_scores, row_idx in zip(scores, indices):
+            hits = []
+            for score, idx in zip(row_scores.tolist(), row_idx.tolist()):
+                if score < score_threshold:
+                    continue
+                seg, i = self._locate(idx)
+                hits.append(
+                    {
+                        "text": seg.text(i),
+                        "score": round(score, 4),
+                        "metadata": seg.metadata(i),
+                        "index": int(idx),
+                    }
+                )
+            results.append(hits)
         return results
 
+    def _top_k(self, queries: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """逐段分块打分，返回按分数降序的 (scores, indices)，形状均为 (Q, k)"""
+        k = min(top_k, self._count)
+        q = queries / (np.linalg.norm(queries, axis=1, keepdims=True) + 1e-9)
+        qt = np.ascontiguousarray(q.T)  # (D, Q)
+
+        block = min(self.block_size, max(len(seg.scales) for seg in self._segments))
+        scratch = np.empty((block, self.dim), dtype=np.float32)
+        best_scores = np.full((len(q), 0), -np.inf, dtype=np.float32)
+        best_idx = np.zeros((len(q), 0), dtype=np.int64)
+
+        for seg, offset in zip(self._segments, self._starts):
+            n = len(seg.scales)
+            for start in range(0, n, block):
+                stop = min(start + block, n)
+                buf = scratch[: stop - start]
+                np.copyto(buf, seg.vecs[start:stop], casting="unsafe")
+                block_scores = (buf @ qt).T  # (Q, B)
+                block_scores *= seg.scales[start:stop]
+
+                cand_scores = np.concatenate([best_scores, block_scores], axis=1)
+                cand_idx = np.concatenate(
+                    [
+                        best_idx,
+                        np.broadcast_to(
+                            np.arange(offset + start, offset + stop),
+                            block_scores.shape,
+                        ),
+                    ],
+                    axis=1,
+                )
+                if cand_scores.shape[1] > k:
+                    part = np.argpartition(cand_scores, -k, axis=1)[:, -k:]
+                    cand_scores = np.take_along_axis(cand_scores, part, axis=1)
+                    cand_idx = np.take_along_axis(cand_idx, part, axis=1)
+                best_scores, best_idx = cand_scores, cand_idx
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        return (
+            np.take_along_axis(best_scores, order, axis=1),
+            np.take_along_axis(best_idx, order, axis=1),
+        )
+
     def memory_usage_mb(self) -> Dict[str, float]:
-        """估算内存占用"""
-        if self._vecs is None:
+        """估算内存占用（mapped_mb 为 memmap 段，由操作系统页缓存按需加载、进程间共享）"""
+        if self._count == 0:
             return {"int8_mb": 0, "float32_equiv_mb": 0, "saved_mb": 0}
-        int8_mb = self._vecs.nbytes / 1024 / 1024
+        int8_mb = sum(seg.vecs.nbytes for seg in self._segments) / 1024 / 1024
+        mapped_mb = (
+            sum(seg.vecs.nbytes for seg in self._segments if seg.name is not None)
+            / 1024
+            / 1024
+        )
         float32_mb = int8_mb * 4
         return {
             "int8_mb": round(int8_mb, 2),
+            "mapped_mb": round(mapped_mb, 2),
             "float32_equiv_mb": round(float32_mb, 2),
             "saved_mb": round(float32_mb - int8_mb, 2),
             "compression_ratio": "4:1",
         }
 
+    # - Segment 持久化 -
+    @staticmethod
+    def _read_manifest(path: str) -> Optional[Dict]:
+        manifest_path = os.path.join(path, SEGMENT_MANIFEST)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
     def save(self, path: str):
-        """保存到磁盘（npz格式）"""
-        if self._vecs is None:
+        """
+        保存到目录 path（segment 格式）。
+        同一目录再次保存时只写入新增的段（追加），已落盘的段文件原样保留。
+        """
+        if self._count == 0:
             return
-        np.savez_compressed(
-            path,
-            vecs=self._vecs,
-            scales=self._scales,
-            texts=np.array(self._texts, dtype=object),
+        path = os.path.abspath(path)
+        os.makedirs(path, exist_ok=True)
+        same_dir = self._path == path
+
+        kept = [s for s in self._segments if same_dir and s.name is not None]
+        fresh = [s for s in self._segments if not (same_dir and s.name is not None)]
+        if fresh:
+            on_disk = self._read_manifest(path) or {"segments": []}
+            used = [int(s["name"].split("-")[1]) for s in on_disk["segments"]]
+            used += [int(s.name.split("-")[1]) for s in kept]
+            name = f"seg-{max(used, default=-1) + 1:05d}"
+            self._write_segment(path, name, fresh)
+            kept.append(_Segment.open(path, name, self.dim))
+
+        manifest = {
+            "version": 1,
+            "dim": self.dim,
+            "count": sum(len(s.scales) for s in kept),
+            "segments": [{"name": s.name, "count": len(s.scales)} for s in kept],
+        }
+        tmp = os.path.join(path, SEGMENT_MANIFEST + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, os.path.join(path, SEGMENT_MANIFEST))
+
+        self._segments, self._path = kept, path
+        self._reindex()
+        logger.info(
+            f"[INT8Store] Saved {self._count} vectors to {path} "
+            f"({len(fresh)} new segment(s) merged, {len(kept)} total)"
         )
-        logger.info(f"[INT8Store] Saved {len(self._texts)} vectors to {path}")
+
+    def _write_segment(self, path: str, name: str, segments: List[_Segment]) -> None:
+        """把若干段顺序写成一个不可变段（逐段写入，不在内存中拼接整个矩阵）"""
+        prefix = os.path.join(path, name)
+        with open(prefix + ".vecs", "wb") as fv, open(prefix + ".scales", "wb") as fs:
+            for seg in segments:
+                fv.write(np.ascontiguousarray(seg.vecs, dtype=np.int8).tobytes())
+                fs.write(np.asarray(seg.scales, dtype=np.float32).tobytes())
+        texts, metas = [], []
+        for seg in segments:
+            for i in range(len(seg.scales)):
+                texts.append(seg.text(i).encode("utf-8"))
+                metas.append(
+                    json.dumps(seg.metadata(i), ensure_ascii=False, default=str).encode(
+                        "utf-8"
+                    )
+                )
+        _BlobColumn.write(prefix + ".text", texts)
+        _BlobColumn.write(prefix + ".meta", metas)
 
     def load(self, path: str) -> bool:
-        """从磁盘加载"""
+        """从磁盘加载：segment 目录以 memmap 打开；兼容旧版 path.npz"""
         try:
-            data = np.load(path + ".npz", allow_pickle=True)
-            self._vecs = data["vecs"]
-            self._scales = data["scales"]
-            self._texts = list(data["texts"])
-            logger.info(f"[INT8Store] Loaded {len(self._texts)} vectors from {path}")
+            manifest = self._read_manifest(path) if os.path.isdir(path) else None
+            if manifest is not None:
+                if manifest["dim"] != self.dim:
+                    raise ValueError(
+                        f"dim mismatch: store={self.dim}, file={manifest['dim']}"
+                    )
+                self._segments = [
+                    _Segment.open(path, s["name"], self.dim)
+                    for s in manifest["segments"]
+                ]
+                self._path = os.path.abspath(path)
+            else:
+                data = np.load(path + ".npz", allow_pickle=True)
+                vecs = data["vecs"]
+                texts = list(data["texts"])
+                # 旧版文件保存的是 max/127 量化步长，统一按 int8 行重新计算单位化 scale
+                self._segments = [
+                    _Segment(
+                        vecs=vecs,
+                        scales=self._row_scales(vecs),
+                        texts=texts,
+                        meta=[{} for _ in texts],
+                    )
+                ]
+                self._path = None
+            self._reindex()
+            logger.info(f"[INT8Store] Loaded {self._count} vectors from {path}")
             return True
         except Exception as e:
             logger.error(f"[INT8Store] Load failed: {e}")
@@ -419,17 +658,29 @@ class INT8VectorStore:
     @staticmethod
     def _quantize(arr: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
         """
-        逐向量线性量化 float32 → int8
-        scale = max(|v|) / 127
+        逐向量 L2 归一化后线性量化 float32 → int8
+        step = max(|v|) / 127，返回 (int8 向量, 1 / ||int8 行||)
         """
-        scales = np.max(np.abs(arr), axis=1) / 127.0  # (N,)
-        scales = np.where(scales == 0, 1.0, scales)
-        int8_arr = np.round(arr / scales[:, np.newaxis]).astype(np.int8)
-        return int8_arr, scales
+        norms = np.linalg.norm(arr, axis=1, keepdims=True)
+        arr = arr / np.where(norms == 0, 1.0, norms)
+        steps = np.max(np.abs(arr), axis=1) / 127.0  # (N,)
+        steps = np.where(steps == 0, 1.0, steps)
+        int8_arr = np.round(arr / steps[:, np.newaxis]).astype(np.int8)
+        return int8_arr, INT8VectorStore._row_scales(int8_arr)
+
+    @staticmethod
+    def _row_scales(int8_arr: np.ndarray, block: int = 65536) -> np.ndarray:
+        """每行 1 / ||int8 行||（全零行为 0，得分恒为 0），分块计算避免整体转 float32"""
+        scales = np.zeros(len(int8_arr), dtype=np.float32)
+        for start in range(0, len(int8_arr), block):
+            part = int8_arr[start : start + block].astype(np.float32)
+            norms = np.sqrt(np.einsum("ij,ij->i", part, part))
+            np.divide(1.0, norms, out=scales[start : start + block], where=norms > 0)
+        return scales
 
     @staticmethod
     def _dequantize(int8_arr: np.ndarray, scales: np.ndarray) -> np.ndarray:
-        """int8 → float32 反量化"""
+        """int8 → float32 反量化（结果为单位向量）"""
         return int8_arr.astype(np.float32) * scales[:, np.newaxis]
 
 
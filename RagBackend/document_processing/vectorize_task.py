@@ -12,6 +12,7 @@ Worker 从 Redis Stream 消费时通过 task_type 查找并执行。
 from __future__ import annotations
 
 import logging
+from typing import List
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +39,21 @@ def _do_vectorize(
     )
 
 
+def _do_vectorize_batch(
+    kb_id: str,
+    file_paths: List[str],
+    force: bool = False,
+) -> dict:
+    """
+    批量向量化任务：所有文件解析完成后统一批量编码，只写一次向量库。
+    编码并行度由 RAG_EMBED_WORKERS / RAG_EMBED_BATCH_SIZE 控制。
+    """
+    from document_processing.incremental_vectorizer import IncrementalVectorizer
+
+    iv = IncrementalVectorizer(kb_id)
+    return iv.batch_ingest(file_paths, force=force)
+
+
 def register_all():
     """
     注册所有任务类型到 task_queue。
@@ -46,4 +62,7 @@ def register_all():
     from document_processing.task_queue import register_task
 
     register_task("vectorize", _do_vectorize)
-    logger.info("[vectorize_task] 任务类型 'vectorize' 已注册到任务队列")
+    register_task("vectorize_batch", _do_vectorize_batch)
+    logger.info(
+        "[vectorize_task] 任务类型 'vectorize' / 'vectorize_batch' 已注册到任务队列"
+    )
@@ -99,6 +99,8 @@ async def create_knowledgebase(
             "community_report": False,
             "relation_extraction": True,
             "owner_id": owner_id or "",
+            # 向量索引规格（见 RAG_M/src/vectorstore/ann_index.py），默认精确检索
+            "ann_index": {"type": "flat"},
         }
 
         # JSON
@@ -3,6 +3,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
+import asyncio
 import json
 import logging
 from pydantic import BaseModel
@@ -16,7 +17,7 @@ sys.path.append(str(project_root))
 
 
 # Configure structured loggingEach log carries trace_id for full traceability
-from trace_logging import setup_trace_logging, TraceMiddleware
+from trace_logging import setup_trace_logging
 
 setup_trace_logging()
 logger = logging.getLogger(__name__)
@@ -75,6 +76,38 @@ async def _init_db_tables():
     except Exception as e:
         logger.warning(f"任务队列 Worker 启动失败: {e}")
 
+    # Register LLM providers with the shared HTTP client pool (keep-alive / HTTP/2)
+    try:
+        from multi_model.llm_client import get_llm_pool
+        from multi_model.model_router import provider_base_urls
+
+        await get_llm_pool().open(provider_base_urls())
+        logger.info("LLM 共享连接池已初始化")
+    except Exception as e:
+        logger.warning(f"LLM 共享连接池初始化失败: {e}")
+
+
+@app.on_event("shutdown")
+async def _close_llm_clients():
+    """关闭共享 LLM 连接池（multi_model.llm_client）"""
+    try:
+        from multi_model.llm_client import get_llm_pool
+
+        await get_llm_pool().aclose()
+    except Exception as e:
+        logger.warning(f"LLM 连接池关闭失败: {e}")
+
+
+@app.on_event("shutdown")
+async def _flush_audit_log():
+    """写完审计日志队列中剩余的事件（audit.audit_log）"""
+    try:
+        from audit.audit_log import shutdown_audit_writer
+
+        await asyncio.to_thread(shutdown_audit_writer)
+    except Exception as e:
+        logger.warning(f"审计日志刷盘失败: {e}")
+
 
 # Configure CORS
 app.add_middleware(
@@ -85,17 +118,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# TraceID middleware (registered after CORS, injects unique trace_id per request)
-app.add_middleware(TraceMiddleware)
-
-# Audit log middleware (registered after CORS, records all API calls)
-try:
-    from audit.audit_log import AuditMiddleware
+# Observability middleware (registered after CORS, pure ASGI): trace_id, request
+# metrics (latency + TTFB) and audit log enqueueing in a single pass
+from monitoring.observability import ObservabilityMiddleware
 
-    app.add_middleware(AuditMiddleware)
-    logger.info("审计日志中间件已挂载")
-except Exception as _e:
-    logger.warning(f"审计日志中间件挂载失败: {_e}")
+app.add_middleware(ObservabilityMiddleware)
+logger.info("可观测性中间件已挂载（trace_id / 请求指标 / 审计日志）")
 
 # Async task queue (reserved, not yet enabled)
 # To enable Celery, install celery[redis] and uncomment the following:
@@ -153,7 +181,7 @@ from RAGF_User_Management.Reset_Password import router as reset_password_router
 
 # - New module imports -
 from multi_model.model_router import router as model_router
-from audit.audit_log import router as audit_router, AuditMiddleware
+from audit.audit_log import router as audit_router
 from open_api.api_key_manager import router as apikey_router
 from data_sources.datasource_manager import router as datasource_router
 
@@ -367,10 +395,10 @@ except Exception as _e:
 
 # Prometheus
 try:
-    from monitoring.metrics import router as metrics_router, instrument_app
+    from monitoring.metrics import router as metrics_router, prometheus_router
 
-    instrument_app(app)
     app.include_router(metrics_router, tags=["系统监控-Prometheus指标"])
+    app.include_router(prometheus_router, tags=["系统监控-Prometheus指标"])
     logger.info("系统监控模块已加载")
 except Exception as _e:
     logger.warning(f"系统监控模块加载失败: {_e}")
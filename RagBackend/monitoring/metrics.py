@@ -5,9 +5,19 @@ metrics.py
 功能：
   - 暴露 /metrics 端点（Prometheus 格式）
   - 监控 API 响应时间、模型调用次数、知识库上传量
+  - RAG 各阶段（retrieval / embedding / rerank / llm）的调用次数、失败数与耗时
   - 无 prometheus_client 时提供纯 JSON /api/metrics/stats 降级接口
   - instrument_app：给 FastAPI app 注入中间件（自动统计请求时间）
 
+延迟统计（Histogram）：
+  - 固定桶（LATENCY_BUCKETS_MS，1ms ~ 120s 按 1-2-5 递增），自进程启动起累计全部观测值，
+    分位数按桶内线性插值估算，不再是最近 200 个样本排序
+  - 记录一次观测为 O(1)：二分定位桶 + 计数加一；线程按轮转序号固定落到 SHARD_COUNT 个分片之一，
+    只锁自己的分片，线程间基本不竞争；分片数固定，短命线程（每请求一个线程池）不会让分片增长，
+    读取（scrape）时合并各分片，无需排序
+  - 请求按路由模板（如 /api/kb/{kb_id}）而不是原始路径分组，路径参数不会产生新序列；
+    未匹配任何路由的请求（404、静态文件）归为 __unmatched__
+
 API:
   GET /metrics              -- Prometheus scrape 端点
   GET /api/metrics/stats    -- JSON 格式当前统计（前端嵌入面板用）
@@ -16,53 +26,243 @@ API:
 
 from __future__ import annotations
 
+import itertools
 import logging
+import threading
 import time
-from collections import defaultdict, deque
-from typing import Dict
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Sequence, Tuple
 
-from fastapi import APIRouter, Request, Response
+from fastapi import APIRouter, Response
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/metrics", tags=["系统监控"])
 
+LATENCY_BUCKETS_MS: Tuple[float, ...] = (
+    1, 2, 5, 10, 20, 50, 100, 200, 500,
+    1000, 2000, 5000, 10000, 20000, 30000, 60000, 120000,
+)  # fmt: skip
+
+UNMATCHED_ROUTE = "__unmatched__"
+
+# RAG 流水线阶段（record_stage 的 stage 取值）
+STAGES = ("retrieval", "embedding", "rerank", "llm")
+
+# 每个直方图的分片数（固定，不随线程数增长）
+SHARD_COUNT = 16
+
+
+# ─────────────────────────────────────────────────────────────────
+# 直方图
+# ─────────────────────────────────────────────────────────────────
+
+
+class _Shard:
+    __slots__ = ("counts", "sum", "max", "lock")
+
+    def __init__(self, n_buckets: int):
+        self.counts = [0] * (n_buckets + 1)  # 末位为 +Inf 桶
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+
+# 线程 → 分片序号：首次记录时按轮转分配，所有直方图共用；线程退出后随 threading.local 释放
+_thread_slot = threading.local()
+_next_slot = itertools.count()
+
+
+def _slot() -> int:
+    slot = getattr(_thread_slot, "slot", None)
+    if slot is None:
+        slot = _thread_slot.slot = next(_next_slot) % SHARD_COUNT
+    return slot
+
+
+class Histogram:
+    """
+    累积直方图（单位毫秒）。buckets 为各桶上界（含），另有 +Inf 桶。
+
+    分片数固定为 SHARD_COUNT：observe 只锁当前线程对应的分片，
+    count / sum / percentile / cumulative 读取时合并所有分片。
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS_MS):
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self._shards: Tuple[_Shard, ...] = tuple(
+            _Shard(len(self.buckets)) for _ in range(SHARD_COUNT)
+        )
+
+    def observe(self, value: float) -> None:
+        shard = self._shards[_slot()]
+        with shard.lock:
+            shard.counts[bisect_left(self.buckets, value)] += 1
+            shard.sum += value
+            if value > shard.max:
+                shard.max = value
+
+    def _merged(self) -> Tuple[List[int], float, float]:
+        counts = [0] * (len(self.buckets) + 1)
+        total = peak = 0.0
+        for shard in self._shards:
+            with shard.lock:
+                for i, c in enumerate(shard.counts):
+                    counts[i] += c
+                total += shard.sum
+                peak = max(peak, shard.max)
+        return counts, total, peak
+
+    @property
+    def count(self) -> int:
+        return sum(self._merged()[0])
+
+    @property
+    def sum(self) -> float:
+        return self._merged()[1]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def mean(self) -> float:
+        counts, total, _ = self._merged()
+        n = sum(counts)
+        return round(total / n, 1) if n else 0.0
+
+    def percentile(self, q: float) -> float:
+        """分位数估算（q 取 0~1）：桶内线性插值，+Inf 桶以观测最大值为上界"""
+        counts, _, peak = self._merged()
+        n = sum(counts)
+        if not n:
+            return 0.0
+        rank = q * n
+        seen = 0
+        for i, c in enumerate(counts):
+            if c and seen + c >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else peak
+                upper = min(upper, peak)
+                lower = min(lower, upper)
+                return round(lower + (upper - lower) * (rank - seen) / c, 1)
+            seen += c
+        return round(peak, 1)
+
+    def cumulative(self) -> Tuple[List[Tuple[str, int]], float, int]:
+        """Prometheus 格式：[(le, 累计数)...]（含 +Inf）、sum、count"""
+        counts, total, _ = self._merged()
+        out = []
+        running = 0
+        for bound, c in zip(self.buckets, counts):
+            running += c
+            out.append((f"{bound:g}", running))
+        running += counts[-1]
+        out.append(("+Inf", running))
+        return out, total, running
+
+
+class _HistogramMap(dict):
+    """label → Histogram；访问不存在的 label 时创建（setdefault 保证并发下只保留一个）"""
+
+    def __missing__(self, key) -> Histogram:
+        return self.setdefault(key, Histogram())
+
+
+def route_template(scope: dict) -> str:
+    """请求匹配到的路由模板（FastAPI 路由匹配后写入 scope["route"]）"""
+    path = getattr(scope.get("route"), "path", None)
+    return path or UNMATCHED_ROUTE
+
 
 # - prometheus_client-
 class _Stats:
     def __init__(self):
-        self.request_count: Dict[str, int] = defaultdict(int)  # endpoint → count
+        # "METHOD 路由模板" → 延迟直方图（请求数即直方图计数）
+        self.request_latency: Dict[str, Histogram] = _HistogramMap()
+        # 首字节时间（流式 / SSE 接口与总耗时差别大）
+        self.request_ttfb: Dict[str, Histogram] = _HistogramMap()
         self.error_count: Dict[str, int] = defaultdict(int)  # endpoint → errors
-        self.latencies: Dict[str, deque] = defaultdict(
-            lambda: deque(maxlen=200)
-        )  # endpoint → [ms...]
         self.model_calls: Dict[str, int] = defaultdict(int)  # model_name → count
         self.kb_uploads: int = 0
         self.start_time: float = time.time()
-
-    def record_request(self, path: str, method: str, status: int, latency_ms: float):
-        key = f"{method} {path}"
-        self.request_count[key] += 1
-        self.latencies[key].append(latency_ms)
+        # RAG 阶段
+        self.stage_latency: Dict[str, Histogram] = _HistogramMap()
+        self.stage_errors: Dict[str, int] = defaultdict(int)
+        # LLM provider（multi_model.llm_client 上报）
+        self.provider_requests: Dict[str, int] = defaultdict(int)
+        self.provider_errors: Dict[str, int] = defaultdict(int)
+        self.provider_connections: Dict[str, int] = defaultdict(int)  # 新建 TCP 连接
+        self.provider_tls_handshakes: Dict[str, int] = defaultdict(int)
+        self.provider_ttft: Dict[str, Histogram] = _HistogramMap()  # provider → ms
+
+    @property
+    def request_count(self) -> Dict[str, int]:
+        return {key: h.count for key, h in list(self.request_latency.items())}
+
+    def record_request(
+        self,
+        route: str,
+        method: str,
+        status: int,
+        latency_ms: float,
+        ttfb_ms: float | None = None,
+    ):
+        key = f"{method} {route}"
+        self.request_latency[key].observe(latency_ms)
+        if ttfb_ms is not None:
+            self.request_ttfb[key].observe(ttfb_ms)
         if status >= 400:
             self.error_count[key] += 1
 
+    def record_stage(self, stage: str, latency_ms: float, error: bool = False):
+        """RAG 阶段耗时（stage 见 STAGES）"""
+        self.stage_latency[stage].observe(latency_ms)
+        if error:
+            self.stage_errors[stage] += 1
+
     def record_model_call(self, model_name: str):
         self.model_calls[model_name] += 1
 
     def record_kb_upload(self):
         self.kb_uploads += 1
 
+    def record_provider_request(
+        self,
+        provider: str,
+        ttft_ms: float | None,
+        new_connections: int,
+        tls_handshakes: int,
+        error: bool,
+    ):
+        self.provider_requests[provider] += 1
+        self.provider_connections[provider] += new_connections
+        self.provider_tls_handshakes[provider] += tls_handshakes
+        if ttft_ms is not None:
+            self.provider_ttft[provider].observe(ttft_ms)
+        if error:
+            self.provider_errors[provider] += 1
+
+    def provider_ttft_avg(self, provider: str) -> float:
+        hist = self.provider_ttft.get(provider)
+        return hist.mean() if hist is not None else 0.0
+
+    def provider_reuse_ratio(self, provider: str) -> float:
+        """连接复用率：未新建连接的请求占比"""
+        total = self.provider_requests.get(provider, 0)
+        if not total:
+            return 0.0
+        return round(max(0.0, 1 - self.provider_connections[provider] / total), 3)
+
     def avg_latency(self, key: str) -> float:
-        lats = self.latencies.get(key, [])
-        return round(sum(lats) / len(lats), 1) if lats else 0.0
+        hist = self.request_latency.get(key)
+        return hist.mean() if hist is not None else 0.0
+
+    def latency_percentile(self, key: str, q: float) -> float:
+        hist = self.request_latency.get(key)
+        return hist.percentile(q) if hist is not None else 0.0
 
     def p99_latency(self, key: str) -> float:
-        lats = sorted(self.latencies.get(key, []))
-        if not lats:
-            return 0.0
-        idx = max(0, int(len(lats) * 0.99) - 1)
-        return round(lats[idx], 1)
+        return self.latency_percentile(key, 0.99)
 
     def uptime_seconds(self) -> float:
         return round(time.time() - self.start_time, 1)
@@ -73,54 +273,93 @@ STATS = _Stats()
 
 # - FastAPI Middleware -
 def instrument_app(app):
-    """给 FastAPI 应用注入请求监控中间件"""
-    from starlette.middleware.base import BaseHTTPMiddleware
-
-    class MetricsMiddleware(BaseHTTPMiddleware):
-        async def dispatch(self, request: Request, call_next):
-            start = time.perf_counter()
-            try:
-                response = await call_next(request)
-                latency_ms = (time.perf_counter() - start) * 1000
-                STATS.record_request(
-                    request.url.path,
-                    request.method,
-                    response.status_code,
-                    latency_ms,
-                )
-                if "/upload" in request.url.path and request.method == "POST":
-                    STATS.record_kb_upload()
-                return response
-            except Exception:
-                latency_ms = (time.perf_counter() - start) * 1000
-                STATS.record_request(request.url.path, request.method, 500, latency_ms)
-                raise
-
-    app.add_middleware(MetricsMiddleware)
+    """
+    给 FastAPI 应用注入请求监控中间件（纯 ASGI，只统计指标）。
+    main.py 使用 monitoring.observability.ObservabilityMiddleware，
+    一次完成 trace_id、指标与审计，不再单独调用本函数。
+    """
+    from monitoring.observability import ObservabilityMiddleware
+
+    app.add_middleware(ObservabilityMiddleware, trace=False, audit=False)
     logger.info("[Metrics] 请求监控中间件已注入")
 
 
 # - Prometheus -
+def _histogram_lines(name: str, labels: str, hist: Histogram) -> List[str]:
+    buckets, total, count = hist.cumulative()
+    sep = "," if labels else ""
+    lines = [f'{name}_bucket{{{labels}{sep}le="{le}"}} {n}' for le, n in buckets]
+    lines.append(f"{name}_sum{{{labels}}} {round(total, 3)}")
+    lines.append(f"{name}_count{{{labels}}} {count}")
+    return lines
+
+
 def _prometheus_text() -> str:
     lines = []
     lines.append("# HELP ragf_uptime_seconds ")
     lines.append("# TYPE ragf_uptime_seconds gauge")
     lines.append(f"ragf_uptime_seconds {STATS.uptime_seconds()}")
 
+    requests = list(STATS.request_latency.items())
     lines.append("# HELP ragf_request_total API")
     lines.append("# TYPE ragf_request_total counter")
-    for key, count in STATS.request_count.items():
+    for key, hist in requests:
         method, path = key.split(" ", 1)
-        safe_path = path.replace("/", "_").replace("-", "_").lstrip("_")
-        lines.append(f'ragf_request_total{{method="{method}",path="{path}"}} {count}')
+        lines.append(
+            f'ragf_request_total{{method="{method}",path="{path}"}} {hist.count}'
+        )
+
+    lines.append("# HELP ragf_request_errors_total API responses with status >= 400")
+    lines.append("# TYPE ragf_request_errors_total counter")
+    for key, count in list(STATS.error_count.items()):
+        method, path = key.split(" ", 1)
+        lines.append(
+            f'ragf_request_errors_total{{method="{method}",path="{path}"}} {count}'
+        )
+
+    lines.append("# HELP ragf_request_latency_ms Response time(ms)")
+    lines.append("# TYPE ragf_request_latency_ms histogram")
+    for key, hist in requests:
+        method, path = key.split(" ", 1)
+        lines.extend(
+            _histogram_lines(
+                "ragf_request_latency_ms", f'method="{method}",path="{path}"', hist
+            )
+        )
+
+    lines.append("# HELP ragf_request_ttfb_ms Time to first response byte(ms)")
+    lines.append("# TYPE ragf_request_ttfb_ms histogram")
+    for key, hist in list(STATS.request_ttfb.items()):
+        method, path = key.split(" ", 1)
+        lines.extend(
+            _histogram_lines(
+                "ragf_request_ttfb_ms", f'method="{method}",path="{path}"', hist
+            )
+        )
 
     lines.append("# HELP ragf_request_latency_avg_ms Response time(ms)")
     lines.append("# TYPE ragf_request_latency_avg_ms gauge")
-    for key in STATS.request_count:
+    for key, hist in requests:
         method, path = key.split(" ", 1)
-        avg = STATS.avg_latency(key)
         lines.append(
-            f'ragf_request_latency_avg_ms{{method="{method}",path="{path}"}} {avg}'
+            f'ragf_request_latency_avg_ms{{method="{method}",path="{path}"}} '
+            f"{hist.mean()}"
+        )
+
+    stages = list(STATS.stage_latency.items())
+    lines.append("# HELP ragf_stage_latency_ms RAG stage duration(ms)")
+    lines.append("# TYPE ragf_stage_latency_ms histogram")
+    for stage, hist in stages:
+        lines.extend(
+            _histogram_lines("ragf_stage_latency_ms", f'stage="{stage}"', hist)
+        )
+
+    lines.append("# HELP ragf_stage_errors_total RAG stage failures")
+    lines.append("# TYPE ragf_stage_errors_total counter")
+    for stage, _ in stages:
+        lines.append(
+            f'ragf_stage_errors_total{{stage="{stage}"}} '
+            f"{STATS.stage_errors.get(stage, 0)}"
         )
 
     lines.append("# HELP ragf_model_calls_total ")
@@ -132,10 +371,51 @@ def _prometheus_text() -> str:
     lines.append("# TYPE ragf_kb_uploads_total counter")
     lines.append(f"ragf_kb_uploads_total {STATS.kb_uploads}")
 
+    lines.append("# HELP ragf_provider_requests_total LLM provider requests")
+    lines.append("# TYPE ragf_provider_requests_total counter")
+    for provider, count in STATS.provider_requests.items():
+        lines.append(f'ragf_provider_requests_total{{provider="{provider}"}} {count}')
+        lines.append(
+            f'ragf_provider_errors_total{{provider="{provider}"}} '
+            f"{STATS.provider_errors.get(provider, 0)}"
+        )
+
+    lines.append("# HELP ragf_provider_connections_total New TCP connections")
+    lines.append("# TYPE ragf_provider_connections_total counter")
+    for provider, count in STATS.provider_connections.items():
+        lines.append(
+            f'ragf_provider_connections_total{{provider="{provider}"}} {count}'
+        )
+        lines.append(
+            f'ragf_provider_tls_handshakes_total{{provider="{provider}"}} '
+            f"{STATS.provider_tls_handshakes.get(provider, 0)}"
+        )
+
+    lines.append("# HELP ragf_provider_ttft_ms Time to first token(ms)")
+    lines.append("# TYPE ragf_provider_ttft_ms histogram")
+    for provider, hist in list(STATS.provider_ttft.items()):
+        lines.extend(
+            _histogram_lines("ragf_provider_ttft_ms", f'provider="{provider}"', hist)
+        )
+
+    lines.append("# HELP ragf_provider_ttft_avg_ms Time to first token(ms)")
+    lines.append("# TYPE ragf_provider_ttft_avg_ms gauge")
+    for provider in STATS.provider_requests:
+        lines.append(
+            f'ragf_provider_ttft_avg_ms{{provider="{provider}"}} '
+            f"{STATS.provider_ttft_avg(provider)}"
+        )
+
     return "\n".join(lines) + "\n"
 
 
 # - -
+def _percentile(series: Dict[str, Histogram], key: str, q: float) -> float:
+    """只读取已有序列；用下标访问会经 _HistogramMap.__missing__ 新建空序列"""
+    hist = series.get(key)
+    return hist.percentile(q) if hist is not None else 0.0
+
+
 @router.get("")
 async def get_stats():
     """JSON 格式的当前统计概览"""
@@ -151,11 +431,39 @@ async def get_stats():
                 "endpoint": k,
                 "count": v,
                 "avg_latency_ms": STATS.avg_latency(k),
+                "p50_latency_ms": STATS.latency_percentile(k, 0.5),
+                "p95_latency_ms": STATS.latency_percentile(k, 0.95),
                 "p99_latency_ms": STATS.p99_latency(k),
+                "p95_ttfb_ms": _percentile(STATS.request_ttfb, k, 0.95),
                 "errors": STATS.error_count.get(k, 0),
             }
             for k, v in top_endpoints
         ],
+        "stages": [
+            {
+                "stage": stage,
+                "count": hist.count,
+                "errors": STATS.stage_errors.get(stage, 0),
+                "avg_latency_ms": hist.mean(),
+                "p50_latency_ms": hist.percentile(0.5),
+                "p95_latency_ms": hist.percentile(0.95),
+                "p99_latency_ms": hist.percentile(0.99),
+            }
+            for stage, hist in list(STATS.stage_latency.items())
+        ],
+        "providers": [
+            {
+                "provider": p,
+                "requests": n,
+                "errors": STATS.provider_errors.get(p, 0),
+                "new_connections": STATS.provider_connections.get(p, 0),
+                "tls_handshakes": STATS.provider_tls_handshakes.get(p, 0),
+                "connection_reuse_ratio": STATS.provider_reuse_ratio(p),
+                "avg_ttft_ms": STATS.provider_ttft_avg(p),
+                "p95_ttft_ms": _percentile(STATS.provider_ttft, p, 0.95),
+            }
+            for p, n in STATS.provider_requests.items()
+        ],
     }
 
 
@@ -165,7 +473,8 @@ async def get_echarts_data():
     返回 ECharts 可用的监控面板数据
     包含：请求量折线、响应时间柱状、模型调用饼图
     """
-    top_eps = sorted(STATS.request_count.items(), key=lambda x: x[1], reverse=True)[:8]
+    request_count = STATS.request_count
+    top_eps = sorted(request_count.items(), key=lambda x: x[1], reverse=True)[:8]
 
     return {
         "request_bar": {
@@ -185,7 +494,7 @@ async def get_echarts_data():
         ],
         "overview": {
             "uptime_h": round(STATS.uptime_seconds() / 3600, 2),
-            "total_reqs": sum(STATS.request_count.values()),
+            "total_reqs": sum(request_count.values()),
             "total_errors": sum(STATS.error_count.values()),
             "kb_uploads": STATS.kb_uploads,
             "models_used": len(STATS.model_calls),
@@ -202,12 +511,12 @@ prometheus_router = _AR()
 @prometheus_router.get("/metrics")
 async def prometheus_metrics():
     """Prometheus scrape 端点，返回文本格式指标"""
+    content = _prometheus_text()
     try:
-        # prometheus_client
-        from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+        # prometheus_client 默认注册表（进程 / GC 指标等）
+        from prometheus_client import generate_latest
 
-        return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+        content += generate_latest().decode("utf-8")
     except ImportError:
-        return Response(
-            content=_prometheus_text(), media_type="text/plain; version=0.0.4"
-        )
+        pass
+    return Response(content=content, media_type="text/plain; version=0.0.4")
@@ -0,0 +1,147 @@
+"""
+observability.py
+合并的可观测性中间件（纯 ASGI）：trace_id + 请求指标 + 审计日志入队，一次完成
+
+替代原先叠加的三层中间件（TraceMiddleware / instrument_app 的 BaseHTTPMiddleware / AuditMiddleware）：
+  - BaseHTTPMiddleware 为每个请求额外创建任务，并经内存流转发响应体，
+    会干扰 SSE 流式输出与客户端断开检测；这里响应消息原样透传，
+    只在响应头追加 X-Trace-Id，不做任何缓冲
+  - 请求头只遍历一次（X-Trace-Id / User-Agent / Authorization）
+  - 分别记录首字节时间（TTFB，第一个非空响应体）与总耗时（响应流结束），
+    /api/RAG/query 等 SSE 接口的 TTFB 反映检索 + 首 token 延迟，总耗时反映整段生成
+  - 指标写入 monitoring.metrics.STATS（按路由模板），审计事件放入 audit.audit_log 的写入队列，
+    请求路径上没有 I/O
+
+使用（main.py）：
+    app.add_middleware(ObservabilityMiddleware)
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Optional
+
+from monitoring.metrics import STATS, route_template
+from trace_logging import (
+    TRACE_HEADER,
+    _trace_id_var,
+    log_access,
+    log_access_error,
+    new_trace_id,
+    with_trace_header,
+)
+
+try:
+    from audit.audit_log import (
+        AuditLogWriter,
+        PathSkipper,
+        get_audit_writer,
+        request_event,
+    )
+except ImportError:
+    AuditLogWriter = None  # type: ignore
+    PathSkipper = None  # type: ignore
+
+
+class ObservabilityMiddleware:
+    """
+    trace / metrics / audit 可分别关闭：
+      trace   设置 trace_id 上下文、返回 X-Trace-Id 响应头、写 access 日志
+      metrics 请求数、错误数、总耗时与 TTFB 直方图
+      audit   审计事件入队（audit_skip_paths 中的路径不记录）
+    """
+
+    def __init__(
+        self,
+        app,
+        trace: bool = True,
+        metrics: bool = True,
+        audit: bool = True,
+        audit_skip_paths: Optional[list] = None,
+        audit_writer: Optional["AuditLogWriter"] = None,
+    ):
+        self.app = app
+        self.trace = trace
+        self.metrics = metrics
+        self.audit = audit and PathSkipper is not None
+        self._skip_audit = PathSkipper(audit_skip_paths) if self.audit else None
+        self.audit_writer = audit_writer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope.get("path", "")
+        method = scope.get("method", "")
+        audit = self.audit and not self._skip_audit(path)
+
+        trace_id = user_agent = token = None
+        if self.trace or audit:
+            for name, value in scope.get("headers", ()):
+                if name == TRACE_HEADER:
+                    trace_id = value.decode("latin-1")
+                elif not audit:
+                    continue
+                elif name == b"user-agent":
+                    user_agent = value[:200].decode("utf-8", errors="ignore")
+                elif name == b"authorization" and value.startswith(b"Bearer "):
+                    # JWT 由审计写线程解码
+                    token = value[7:].decode("utf-8", errors="ignore")
+
+        ctx_token = None
+        if self.trace:
+            trace_id = trace_id or new_trace_id()
+            ctx_token = _trace_id_var.set(trace_id)
+
+        status_code = 500
+        first_byte: Optional[float] = None
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code, first_byte
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if ctx_token is not None:
+                    message = with_trace_header(message, trace_id)
+            elif first_byte is None and (
+                message.get("body") or not message.get("more_body", False)
+            ):
+                first_byte = time.perf_counter()
+            await send(message)
+
+        error: Optional[BaseException] = None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            ttfb_ms = (first_byte - start) * 1000 if first_byte is not None else None
+            if self.metrics:
+                STATS.record_request(
+                    route_template(scope), method, status_code, elapsed_ms, ttfb_ms
+                )
+                if method == "POST" and "/upload" in path:
+                    STATS.record_kb_upload()
+            if self.trace:
+                if error is None:
+                    log_access(method, path, status_code, elapsed_ms, ttfb_ms)
+                else:
+                    log_access_error(method, path, elapsed_ms, error)
+            if audit:
+                writer = self.audit_writer or get_audit_writer()
+                await writer.asubmit(
+                    request_event(
+                        method,
+                        path,
+                        scope["client"][0] if scope.get("client") else "unknown",
+                        user_agent,
+                        token,
+                        status_code,
+                        elapsed_ms,
+                    )
+                )
+            if ctx_token is not None:
+                _trace_id_var.reset(ctx_token)
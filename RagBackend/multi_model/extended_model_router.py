@@ -4,16 +4,21 @@
 
 import os
 import json
+import random
 import sqlite3
+import threading
 import time
 from datetime import datetime
-from typing import Optional, AsyncIterator, Dict, List
+from typing import Optional, AsyncIterator, Callable, Dict, List
 from fastapi import APIRouter
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+from multi_model.llm_client import get_llm_pool
+
 router = APIRouter(prefix="/api/model-extended")
 DB_PATH = os.path.join(os.path.dirname(__file__), "model_usage.db")
+DASHSCOPE_BASE_URL = os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com")
 
 
 def get_db():
@@ -82,58 +87,238 @@ def init_db():
 init_db()
 
 
-# - -
-class LoadBalancer:
+# - 负载均衡 -
+LB_REFRESH_SECONDS = float(os.getenv("LB_REFRESH_SECONDS", "30"))
+LB_EWMA_ALPHA = float(os.getenv("LB_EWMA_ALPHA", "0.3"))
+LB_EXPECTED_TOKENS = int(os.getenv("LB_EXPECTED_TOKENS", "256"))
+LB_STATS_TTL = float(os.getenv("LB_STATS_TTL", "300"))
+
+
+def _load_model_table() -> List[Dict]:
+    """读取模型配置（按优先级降序）"""
+    conn = get_db()
+    rows = conn.execute("""
+        SELECT model_id, provider, priority, enabled, api_key_env FROM model_config
+        ORDER BY priority DESC
+    """).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+
+class _ModelHealth:
+    """单个模型的实时指标与熔断状态"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
     def __init__(self):
-        self._fail_counts: Dict[str, int] = {}
-        self._last_fail: Dict[str, float] = {}
+        self.ttft_ms: Optional[float] = None  # 首 token 时间 EWMA
+        self.tokens_per_s: Optional[float] = None  # 生成速度 EWMA
+        self.updated_at = 0.0
+        self.outstanding = 0  # 进行中的请求数
+        self.fail_count = 0
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probing = False  # 半开状态下是否已有探测请求在途
+
+
+class LoadBalancer:
+    """
+    自适应负载均衡：
+      - 模型表缓存在内存中，每 LB_REFRESH_SECONDS 秒从 model_config 刷新一次
+      - 按模型维护 TTFT 与 tokens/s 的指数加权移动平均（EWMA）
+      - 预估耗时 = (TTFT + 预期 token 数 / tokens/s) × (进行中请求数 + 1)，
+        在可用模型中随机取两个比较预估耗时（power of two choices），取较小者；
+        未测量或指标过期（LB_STATS_TTL）的模型按同类平均值估计
+      - 熔断器：连续失败 3 次熔断 circuit_open_seconds 秒，之后进入半开状态，
+        只放行一个探测请求，成功则恢复、失败则重新熔断
+    """
+
+    def __init__(
+        self,
+        load_models: Optional[Callable[[], List[Dict]]] = None,
+        refresh_seconds: float = LB_REFRESH_SECONDS,
+        rng: Optional[random.Random] = None,
+    ):
+        self._load_models = load_models or _load_model_table
+        self.refresh_seconds = refresh_seconds
         self.circuit_open_seconds = 60
+        self.fail_threshold = 3
+        self.alpha = LB_EWMA_ALPHA
+        self.expected_tokens = LB_EXPECTED_TOKENS
+        self._rng = rng or random.Random()
+        self._models: List[Dict] = []
+        self._loaded_at: Optional[float] = None
+        self._health: Dict[str, _ModelHealth] = {}
+        self._lock = threading.RLock()
+
+    # ── 模型表 ─────────────────────────────────────────────────
+
+    def models(self) -> List[Dict]:
+        """内存中的模型表，过期时重新加载"""
+        with self._lock:
+            now = time.monotonic()
+            if self._loaded_at is None or now - self._loaded_at >= self.refresh_seconds:
+                self._models = self._load_models()
+                self._loaded_at = now
+            return self._models
+
+    def invalidate(self):
+        """model_config 变更后调用，下次选择时重新加载"""
+        with self._lock:
+            self._loaded_at = None
+
+    def provider_of(self, model_id: str) -> Optional[str]:
+        for m in self.models():
+            if m["model_id"] == model_id:
+                return m["provider"]
+        return None
+
+    def _h(self, model_id: str) -> _ModelHealth:
+        h = self._health.get(model_id)
+        if h is None:
+            h = self._health[model_id] = _ModelHealth()
+        return h
+
+    # ── 熔断 ───────────────────────────────────────────────────
 
     def is_available(self, model_id: str) -> bool:
-        """检查模型是否可用（熔断器）"""
-        fail_count = self._fail_counts.get(model_id, 0)
-        if fail_count >= 3:
-            last_fail = self._last_fail.get(model_id, 0)
-            if time.time() - last_fail < self.circuit_open_seconds:
-                return False
-            else:
-                self._fail_counts[model_id] = 0
-        return True
-
-    def record_success(self, model_id: str):
-        self._fail_counts[model_id] = 0
+        """检查模型是否可用（熔断器）；熔断期满后半开，仅放行一个探测请求"""
+        with self._lock:
+            h = self._health.get(model_id)
+            if h is None or h.state == _ModelHealth.CLOSED:
+                return True
+            if h.state == _ModelHealth.OPEN:
+                if time.monotonic() - h.opened_at < self.circuit_open_seconds:
+                    return False
+                h.state = _ModelHealth.HALF_OPEN
+            return not h.probing
+
+    def acquire(self, model_id: str) -> bool:
+        """请求开始：计入进行中请求数；半开状态下占用探测名额并返回 True"""
+        with self._lock:
+            h = self._h(model_id)
+            h.outstanding += 1
+            if h.state == _ModelHealth.HALF_OPEN and not h.probing:
+                h.probing = True
+                return True
+            return False
+
+    def release(self, model_id: str, probe: bool = False):
+        with self._lock:
+            h = self._h(model_id)
+            h.outstanding = max(0, h.outstanding - 1)
+            if probe:
+                h.probing = False
+
+    def _ewma(self, old: Optional[float], value: float) -> float:
+        return value if old is None else self.alpha * value + (1 - self.alpha) * old
+
+    def record_success(
+        self,
+        model_id: str,
+        ttft_ms: Optional[float] = None,
+        tokens_per_s: Optional[float] = None,
+    ):
+        with self._lock:
+            h = self._h(model_id)
+            h.fail_count = 0
+            h.state = _ModelHealth.CLOSED
+            if ttft_ms is not None:
+                h.ttft_ms = self._ewma(h.ttft_ms, ttft_ms)
+                h.updated_at = time.monotonic()
+            if tokens_per_s:
+                h.tokens_per_s = self._ewma(h.tokens_per_s, tokens_per_s)
 
     def record_failure(self, model_id: str):
-        self._fail_counts[model_id] = self._fail_counts.get(model_id, 0) + 1
-        self._last_fail[model_id] = time.time()
+        with self._lock:
+            h = self._h(model_id)
+            h.fail_count += 1
+            if h.state == _ModelHealth.HALF_OPEN or h.fail_count >= self.fail_threshold:
+                h.state = _ModelHealth.OPEN
+                h.opened_at = time.monotonic()
+
+    # ── 选择 ───────────────────────────────────────────────────
+
+    def _fresh(self, h: Optional[_ModelHealth], now: float) -> bool:
+        return (
+            h is not None
+            and h.ttft_ms is not None
+            and now - h.updated_at < LB_STATS_TTL
+        )
+
+    def _service_ms(self, h: _ModelHealth) -> float:
+        gen_ms = self.expected_tokens / h.tokens_per_s * 1000 if h.tokens_per_s else 0.0
+        return h.ttft_ms + gen_ms
+
+    def _costs(self, candidates: List[Dict]) -> Dict[str, float]:
+        """各候选模型的预估耗时；无有效指标的模型取已测模型的平均值（均无则为 0）"""
+        now = time.monotonic()
+        measured = {
+            m["model_id"]: self._service_ms(self._health[m["model_id"]])
+            for m in candidates
+            if self._fresh(self._health.get(m["model_id"]), now)
+        }
+        prior = sum(measured.values()) / len(measured) if measured else 0.0
+        costs = {}
+        for m in candidates:
+            mid = m["model_id"]
+            h = self._health.get(mid)
+            outstanding = h.outstanding if h else 0
+            costs[mid] = measured.get(mid, prior) * (outstanding + 1)
+        return costs
 
     def pick_model(
         self, preferred: str = None, exclude: List[str] = None
     ) -> Optional[str]:
-        """选择最优可用模型"""
+        """选择预估耗时最小的可用模型（power of two choices）"""
         exclude = exclude or []
-        conn = get_db()
-        models = conn.execute("""
-            SELECT model_id FROM model_config WHERE enabled=1
-            ORDER BY priority DESC
-        """).fetchall()
-        conn.close()
-
         if preferred and preferred not in exclude and self.is_available(preferred):
             return preferred
 
-        for row in models:
-            mid = row["model_id"]
-            if mid not in exclude and self.is_available(mid):
-                key_env = (
-                    conn.execute(
-                        "SELECT api_key_env FROM model_config WHERE model_id=?", (mid,)
-                    )
-                    if False
-                    else None
+        with self._lock:
+            candidates = [
+                m
+                for m in self.models()
+                if m["enabled"]
+                and m["model_id"] not in exclude
+                and (
+                    m["provider"] == "ollama"
+                    or not m.get("api_key_env")
+                    or os.getenv(m["api_key_env"], "")
                 )
-                return mid
-        return None
+                and self.is_available(m["model_id"])
+            ]
+            if not candidates:
+                return None
+            costs = self._costs(candidates)
+            pair = (
+                self._rng.sample(candidates, 2) if len(candidates) > 2 else candidates
+            )
+            # 预估耗时相同（如冷启动全部未测量）时按 priority 取高者
+            best = min(pair, key=lambda m: (costs[m["model_id"]], -m["priority"]))
+            return best["model_id"]
+
+    def snapshot(self) -> List[Dict]:
+        """各模型当前的负载均衡指标（/lb/status）"""
+        with self._lock:
+            result = []
+            for m in self.models():
+                h = self._health.get(m["model_id"]) or _ModelHealth()
+                result.append(
+                    {
+                        "model_id": m["model_id"],
+                        "provider": m["provider"],
+                        "priority": m["priority"],
+                        "ttft_ms": round(h.ttft_ms, 1) if h.ttft_ms else None,
+                        "tokens_per_s": (
+                            round(h.tokens_per_s, 1) if h.tokens_per_s else None
+                        ),
+                        "outstanding": h.outstanding,
+                        "circuit": h.state,
+                        "fail_count": h.fail_count,
+                    }
+                )
+            return result
 
 
 _lb = LoadBalancer()
@@ -141,27 +326,22 @@ _lb = LoadBalancer()
 
 # - SSE -
 async def stream_ollama(model_id: str, prompt: str) -> AsyncIterator[str]:
-    import httpx
-
     base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-    async with httpx.AsyncClient(timeout=60) as client:
-        async with client.stream(
-            "POST",
-            f"{base_url}/api/generate",
-            json={"model": model_id, "prompt": prompt, "stream": True},
-        ) as resp:
-            async for line in resp.aiter_lines():
-                if line:
-                    data = json.loads(line)
-                    yield data.get("response", "")
-                    if data.get("done"):
-                        break
+    async for line in get_llm_pool().stream_lines(
+        base_url,
+        "/api/generate",
+        json={"model": model_id, "prompt": prompt, "stream": True},
+        timeout=60,
+        provider="ollama",
+    ):
+        data = json.loads(line)
+        yield data.get("response", "")
+        if data.get("done"):
+            break
 
 
 async def stream_dashscope(model_id: str, messages: List[Dict]) -> AsyncIterator[str]:
     """阿里云百炼 DashScope SSE"""
-    import httpx
-
     api_key = os.getenv("DASHSCOPE_API_KEY", "")
     if not api_key:
         yield "[错误] DASHSCOPE_API_KEY 未配置"
@@ -176,27 +356,27 @@ async def stream_dashscope(model_id: str, messages: List[Dict]) -> AsyncIterator
         "input": {"messages": messages},
         "parameters": {"result_format": "message", "incremental_output": True},
     }
-    async with httpx.AsyncClient(timeout=60) as client:
-        async with client.stream(
-            "POST",
-            "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation",
-            headers=headers,
-            json=body,
-        ) as resp:
-            async for line in resp.aiter_lines():
-                if line.startswith("data:"):
-                    try:
-                        data = json.loads(line[5:])
-                        content = (
-                            data.get("output", {})
-                            .get("choices", [{}])[0]
-                            .get("message", {})
-                            .get("content", "")
-                        )
-                        if content:
-                            yield content
-                    except:
-                        pass
+    async for line in get_llm_pool().stream_lines(
+        DASHSCOPE_BASE_URL,
+        "/api/v1/services/aigc/text-generation/generation",
+        json=body,
+        headers=headers,
+        timeout=60,
+        provider="dashscope",
+    ):
+        if line.startswith("data:"):
+            try:
+                data = json.loads(line[5:])
+                content = (
+                    data.get("output", {})
+                    .get("choices", [{}])[0]
+                    .get("message", {})
+                    .get("content", "")
+                )
+                if content:
+                    yield content
+            except:
+                pass
 
 
 async def stream_xfyun_spark(model_id: str, messages: List[Dict]) -> AsyncIterator[str]:
@@ -272,38 +452,50 @@ async def unified_chat(req: ChatRequest):
     if not model_id:
         return {"error": "没有可用的模型"}
 
-    conn = get_db()
-    row = conn.execute(
-        "SELECT provider FROM model_config WHERE model_id=?", (model_id,)
-    ).fetchone()
-    conn.close()
-    provider = row["provider"] if row else "ollama"
+    provider = _lb.provider_of(model_id) or "ollama"
     start = time.time()
 
     async def generate():
         nonlocal model_id, provider
+        # 在生成器内占用：客户端在响应开始前断开时生成器不会启动，也就无需释放
+        probe = _lb.acquire(model_id)
         total_chars = 0
+        n_chunks = 0
+        first_token_at = None
         success = True
-        try:
+
+        def _stream():
             if provider == "ollama":
                 prompt = "\n".join(f"{m['role']}: {m['content']}" for m in req.messages)
-                async for chunk in stream_ollama(model_id, prompt):
-                    total_chars += len(chunk)
-                    yield f"data: {json.dumps({'chunk': chunk, 'model': model_id})}\n\n"
-            elif provider == "dashscope":
-                async for chunk in stream_dashscope(model_id, req.messages):
-                    total_chars += len(chunk)
-                    yield f"data: {json.dumps({'chunk': chunk, 'model': model_id})}\n\n"
-            elif provider == "xfyun":
-                async for chunk in stream_xfyun_spark(model_id, req.messages):
+                return stream_ollama(model_id, prompt)
+            if provider == "dashscope":
+                return stream_dashscope(model_id, req.messages)
+            if provider == "xfyun":
+                return stream_xfyun_spark(model_id, req.messages)
+            return None
+
+        try:
+            stream = _stream()
+            if stream is not None:
+                async for chunk in stream:
+                    if first_token_at is None:
+                        first_token_at = time.time()
+                    n_chunks += 1
                     total_chars += len(chunk)
                     yield f"data: {json.dumps({'chunk': chunk, 'model': model_id})}\n\n"
-            _lb.record_success(model_id)
+            ttft_ms = tps = None
+            if first_token_at is not None:
+                ttft_ms = (first_token_at - start) * 1000
+                gen_s = time.time() - first_token_at
+                # 流式分片数近似 token 数
+                tps = n_chunks / gen_s if gen_s > 0 and n_chunks > 1 else None
+            _lb.record_success(model_id, ttft_ms, tps)
         except Exception as e:
             _lb.record_failure(model_id)
             success = False
             yield f"data: {json.dumps({'error': str(e), 'model': model_id})}\n\n"
         finally:
+            _lb.release(model_id, probe)
             latency = int((time.time() - start) * 1000)
             _save_usage(req.user_id, model_id, provider, total_chars, latency, success)
             yield f"data: {json.dumps({'done': True, 'latency_ms': latency})}\n\n"
@@ -363,3 +555,9 @@ def get_usage_stats(user_id: Optional[str] = None, days: int = 30):
     rows = conn.execute(q, params).fetchall()
     conn.close()
     return [dict(r) for r in rows]
+
+
+@router.get("/lb/status")
+def lb_status():
+    """负载均衡实时状态：各模型 TTFT / tokens/s EWMA、进行中请求数、熔断状态"""
+    return _lb.snapshot()
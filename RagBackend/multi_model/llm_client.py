@@ -0,0 +1,439 @@
+"""
+llm_client.py — 共享 LLM HTTP 客户端层（Ollama 及各云端模型 provider）
+
+替代各接口里「每次请求 requests.post / 新建 ClientSession / 新建 AsyncClient」的写法：
+  - 每个 base_url 一个常驻 httpx 客户端，keep-alive 连接池复用 TCP / TLS 连接，
+    https 且安装了 h2 时启用 HTTP/2（多路复用，一个连接承载多个流式对话）
+  - 每个 host 一个并发上限（信号量），超出的请求排队，排队时间计入超时；
+    本地模型服务（http）与云端 API（https）分别配置上限
+  - 连接超时与读取超时分开配置：连不上快速失败，生成慢只受读取超时约束
+  - 异步接口供 FastAPI 路由使用，不阻塞事件循环；
+    同步接口供线程池中运行的 RAG 流水线使用（native_rag._ollama_generate）
+  - cancel_on_disconnect：客户端断开时取消进行中的生成请求，连接归还连接池
+  - 应用启动时 open() 按 provider 注册并建立客户端，关闭时 aclose() 统一释放
+
+指标（写入 monitoring.metrics.STATS，按 provider 汇总）：
+  - 请求数 / 失败数；总耗时计入 llm 阶段直方图
+  - 首 token 时间（TTFT）：流式为收到第一行数据的时间，非流式为完整响应时间
+  - 新建 TCP 连接数、TLS 握手数（连接复用率 = 1 - 新建连接 / 请求数）
+
+配置（环境变量）：
+  LLM_HOST_CONCURRENCY   本地模型服务（http）每个 host 的最大并发请求数，默认 4
+  LLM_CLOUD_CONCURRENCY  云端 API（https）每个 host 的最大并发请求数，默认 32
+  LLM_MAX_KEEPALIVE      每个 host 保持的空闲连接数，默认 8
+  LLM_CONNECT_TIMEOUT    建立连接超时（秒），默认 5
+
+使用：
+  from multi_model.llm_client import get_llm_pool
+  resp = await get_llm_pool().post(OLLAMA_BASE_URL, "/api/chat", json=payload, timeout=60)
+  async for line in get_llm_pool().stream_lines(base, "/chat/completions", json=payload,
+                                                headers=headers, provider="deepseek"):
+      ...
+"""
+
+import asyncio
+import importlib.util
+import logging
+import os
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Dict, Iterator, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+try:
+    from monitoring.metrics import STATS as _METRICS
+except ImportError:
+    _METRICS = None
+
+logger = logging.getLogger(__name__)
+
+HOST_CONCURRENCY = int(os.getenv("LLM_HOST_CONCURRENCY", "4"))
+CLOUD_CONCURRENCY = int(os.getenv("LLM_CLOUD_CONCURRENCY", "32"))
+MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "8"))
+CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class ClientDisconnected(Exception):
+    """HTTP 客户端已断开，生成请求已取消"""
+
+
+class _LoopState:
+    """单个事件循环上的异步客户端与信号量（二者都不能跨事件循环使用）"""
+
+    def __init__(self):
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+        self.semaphores: Dict[str, asyncio.Semaphore] = {}
+
+
+class _ConnTrace:
+    """httpcore trace 回调：统计一次请求新建的 TCP 连接与 TLS 握手"""
+
+    def __init__(self):
+        self.connects = 0
+        self.tls_handshakes = 0
+
+    def _on(self, event: str) -> None:
+        if event == "connection.connect_tcp.complete":
+            self.connects += 1
+        elif event == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+
+    async def atrace(self, event: str, info: Dict) -> None:
+        self._on(event)
+
+    def trace(self, event: str, info: Dict) -> None:
+        self._on(event)
+
+
+def _host_key(base_url: str) -> str:
+    """并发名额按 scheme://host:port 计算（同一服务的不同 base path 共享名额）"""
+    parts = urlsplit(base_url)
+    return f"{parts.scheme}://{parts.netloc}" if parts.netloc else base_url.rstrip("/")
+
+
+class LLMClientPool:
+    """
+    按 base_url 复用的 httpx 客户端 + 按 host 的并发限制 + provider 级指标。
+
+    异步客户端与信号量按事件循环分别维护；同步客户端线程安全，所有线程共享。
+    并发名额以 key 区分：HTTP 请求用 host，也可直接 acquire 任意 key。
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        max_keepalive: Optional[int] = None,
+        connect_timeout: Optional[float] = None,
+        cloud_concurrency: Optional[int] = None,
+    ):
+        self.max_concurrency = max(1, max_concurrency or HOST_CONCURRENCY)
+        self.cloud_concurrency = max(1, cloud_concurrency or CLOUD_CONCURRENCY)
+        self.max_keepalive = max_keepalive or MAX_KEEPALIVE
+        self.connect_timeout = connect_timeout or CONNECT_TIMEOUT
+        self._loops: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self._sync_clients: Dict[str, httpx.Client] = {}
+        self._sync_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._providers: Dict[str, str] = {}  # host → provider（指标标签）
+        self._lock = threading.Lock()
+
+    def _limit_for(self, key: str) -> int:
+        return (
+            self.cloud_concurrency
+            if key.startswith("https://")
+            else self.max_concurrency
+        )
+
+    def _limits(self, key: str) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self._limit_for(key),
+            max_keepalive_connections=self.max_keepalive,
+        )
+
+    def _timeout(self, timeout: float) -> httpx.Timeout:
+        return httpx.Timeout(timeout, connect=min(self.connect_timeout, timeout))
+
+    def _provider(self, base_url: str, provider: Optional[str]) -> str:
+        host = _host_key(base_url)
+        return provider or self._providers.get(host) or host
+
+    def _record(
+        self,
+        provider: str,
+        ttft_ms: Optional[float],
+        trace: _ConnTrace,
+        error: bool,
+        start: float,
+    ) -> None:
+        if _METRICS is not None:
+            _METRICS.record_provider_request(
+                provider, ttft_ms, trace.connects, trace.tls_handshakes, error
+            )
+            _METRICS.record_stage("llm", (time.perf_counter() - start) * 1000, error)
+
+    # ── 异步 ───────────────────────────────────────────────────
+
+    def _loop_state(self) -> _LoopState:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            state = self._loops.get(loop)
+            if state is None:
+                state = self._loops[loop] = _LoopState()
+        return state
+
+    def _client(self, base_url: str) -> httpx.AsyncClient:
+        base = base_url.rstrip("/")
+        state = self._loop_state()
+        client = state.clients.get(base)
+        if client is None:
+            key = _host_key(base)
+            http2 = HTTP2_AVAILABLE and key.startswith("https://")
+            client = state.clients[base] = httpx.AsyncClient(
+                base_url=base, limits=self._limits(key), http2=http2
+            )
+            logger.info(
+                f"[LLMClientPool] 新建连接池: {base} "
+                f"(并发上限 {self._limit_for(key)}, http2={http2})"
+            )
+        return client
+
+    async def open(self, providers: Dict[str, str]) -> None:
+        """
+        应用启动时调用：注册 provider → base_url（用作指标标签），
+        并在当前事件循环上预先建立各 provider 的客户端
+        """
+        for name, base_url in providers.items():
+            if not base_url:
+                continue
+            with self._lock:
+                self._providers[_host_key(base_url)] = name
+            self._client(base_url)
+
+    @asynccontextmanager
+    async def acquire(self, key: str, timeout: float):
+        """
+        占用 key 的一个并发名额，yield 扣除排队时间后剩余的超时预算（秒）。
+        排队超过 timeout 抛出 httpx.PoolTimeout。
+        """
+        state = self._loop_state()
+        sem = state.semaphores.get(key)
+        if sem is None:
+            sem = state.semaphores[key] = asyncio.Semaphore(self._limit_for(key))
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            await asyncio.wait_for(sem.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise httpx.PoolTimeout(f"等待 {key} 并发名额超时（{timeout}s）")
+        try:
+            yield max(0.1, timeout - (loop.time() - start))
+        finally:
+            sem.release()
+
+    async def post(
+        self,
+        base_url: str,
+        path: str,
+        *,
+        json: Any,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = 60,
+        provider: Optional[str] = None,
+    ) -> httpx.Response:
+        """非流式 POST，读完响应体后连接归还连接池"""
+        trace = _ConnTrace()
+        start = time.perf_counter()
+        try:
+            async with self.acquire(_host_key(base_url), timeout) as remaining:
+                resp = await self._client(base_url).post(
+                    path,
+                    json=json,
+                    headers=headers,
+                    timeout=self._timeout(remaining),
+                    extensions={"trace": trace.atrace},
+                )
+        except Exception:
+            self._record(self._provider(base_url, provider), None, trace, True, start)
+            raise
+        self._record(
+            self._provider(base_url, provider),
+            (time.perf_counter() - start) * 1000,
+            trace,
+            resp.status_code >= 400,
+            start,
+        )
+        return resp
+
+    async def stream_lines(
+        self,
+        base_url: str,
+        path: str,
+        *,
+        json: Any,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = 300,
+        provider: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """流式 POST，逐行产出响应（NDJSON / SSE）；非 200 时抛出 httpx.HTTPStatusError"""
+        trace = _ConnTrace()
+        start = time.perf_counter()
+        ttft_ms: Optional[float] = None
+        error = True
+        try:
+            async with self.acquire(_host_key(base_url), timeout) as remaining:
+                async with self._client(base_url).stream(
+                    "POST",
+                    path,
+                    json=json,
+                    headers=headers,
+                    timeout=self._timeout(remaining),
+                    extensions={"trace": trace.atrace},
+                ) as resp:
+                    if resp.status_code != 200:
+                        await resp.aread()
+                        resp.raise_for_status()
+                    async for line in resp.aiter_lines():
+                        if not line:
+                            continue
+                        if ttft_ms is None:
+                            ttft_ms = (time.perf_counter() - start) * 1000
+                        yield line
+            error = False
+        except (GeneratorExit, asyncio.CancelledError):
+            error = False  # 调用方提前停止读取（客户端断开），不计为失败
+            raise
+        finally:
+            self._record(
+                self._provider(base_url, provider), ttft_ms, trace, error, start
+            )
+
+    # ── 同步（线程池中调用）─────────────────────────────────────
+
+    @contextmanager
+    def _sync_slot(self, base_url: str, timeout: float):
+        base = base_url.rstrip("/")
+        key = _host_key(base)
+        with self._lock:
+            client = self._sync_clients.get(base)
+            if client is None:
+                client = self._sync_clients[base] = httpx.Client(
+                    base_url=base,
+                    limits=self._limits(key),
+                    http2=HTTP2_AVAILABLE and key.startswith("https://"),
+                )
+            sem = self._sync_semaphores.get(key)
+            if sem is None:
+                sem = self._sync_semaphores[key] = threading.BoundedSemaphore(
+                    self._limit_for(key)
+                )
+        if not sem.acquire(timeout=timeout):
+            raise httpx.PoolTimeout(f"等待 {key} 并发名额超时（{timeout}s）")
+        try:
+            yield client
+        finally:
+            sem.release()
+
+    def post_sync(
+        self,
+        base_url: str,
+        path: str,
+        *,
+        json: Any,
+        timeout: float = 60,
+        provider: Optional[str] = None,
+    ) -> httpx.Response:
+        trace = _ConnTrace()
+        start = time.perf_counter()
+        try:
+            with self._sync_slot(base_url, timeout) as client:
+                resp = client.post(
+                    path,
+                    json=json,
+                    timeout=self._timeout(timeout),
+                    extensions={"trace": trace.trace},
+                )
+        except Exception:
+            self._record(self._provider(base_url, provider), None, trace, True, start)
+            raise
+        self._record(
+            self._provider(base_url, provider),
+            (time.perf_counter() - start) * 1000,
+            trace,
+            resp.status_code >= 400,
+            start,
+        )
+        return resp
+
+    def stream_lines_sync(
+        self,
+        base_url: str,
+        path: str,
+        *,
+        json: Any,
+        timeout: float = 300,
+        provider: Optional[str] = None,
+    ) -> Iterator[str]:
+        trace = _ConnTrace()
+        start = time.perf_counter()
+        ttft_ms: Optional[float] = None
+        error = True
+        try:
+            with self._sync_slot(base_url, timeout) as client:
+                with client.stream(
+                    "POST",
+                    path,
+                    json=json,
+                    timeout=self._timeout(timeout),
+                    extensions={"trace": trace.trace},
+                ) as resp:
+                    if resp.status_code != 200:
+                        resp.read()
+                        resp.raise_for_status()
+                    for line in resp.iter_lines():
+                        if not line:
+                            continue
+                        if ttft_ms is None:
+                            ttft_ms = (time.perf_counter() - start) * 1000
+                        yield line
+            error = False
+        except (GeneratorExit, asyncio.CancelledError):
+            error = False  # 调用方提前停止读取（客户端断开），不计为失败
+            raise
+        finally:
+            self._record(
+                self._provider(base_url, provider), ttft_ms, trace, error, start
+            )
+
+    # ── 生命周期 ───────────────────────────────────────────────
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环上的异步客户端及全部同步客户端（应用关闭时调用）"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            state = self._loops.pop(loop, None)
+            sync_clients = list(self._sync_clients.values())
+            self._sync_clients.clear()
+            self._sync_semaphores.clear()
+        if state is not None:
+            for client in state.clients.values():
+                await client.aclose()
+        for client in sync_clients:
+            client.close()
+
+
+_default_pool: Optional[LLMClientPool] = None
+_default_lock = threading.Lock()
+
+
+def get_llm_pool() -> LLMClientPool:
+    """进程级共享实例"""
+    global _default_pool
+    with _default_lock:
+        if _default_pool is None:
+            _default_pool = LLMClientPool()
+        return _default_pool
+
+
+async def cancel_on_disconnect(
+    request, coro: Awaitable, poll_interval: float = 0.5
+) -> Any:
+    """
+    运行 coro，期间轮询 request.is_disconnected()；
+    客户端断开时取消 coro（进行中的 LLM 请求随之中止）并抛出 ClientDisconnected
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
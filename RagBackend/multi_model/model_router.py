@@ -15,6 +15,10 @@ import asyncio
 import logging
 from pathlib import Path
 
+import httpx
+
+from multi_model.llm_client import get_llm_pool
+
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
@@ -152,12 +156,65 @@ def _build_model_list() -> list:
 
 
 # - provider -
+_PROVIDER_DEFAULT_URLS = {
+    "ollama": ("OLLAMA_BASE_URL", "http://localhost:11434"),
+    "deepseek": ("DEEPSEEK_BASE_URL", "https://api.deepseek.com"),
+    "openai": ("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+    "hunyuan": ("HUNYUAN_BASE_URL", "https://api.hunyuan.cloud.tencent.com/v1"),
+    "dashscope": ("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com"),
+}
+
+
+def provider_base_urls() -> dict:
+    """各 provider 当前生效的 Base URL（应用启动时注册到共享连接池）"""
+    return {
+        name: _get_base_url(name, env_var, default)
+        for name, (env_var, default) in _PROVIDER_DEFAULT_URLS.items()
+    }
+
+
+async def _stream_openai_compatible(
+    provider: str,
+    label: str,
+    base_url: str,
+    api_key: str,
+    payload: dict,
+) -> AsyncGenerator[str, None]:
+    """OpenAI 兼容 SSE 流式接口（DeepSeek / OpenAI / 混元共用），经共享连接池请求"""
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    try:
+        async for line in get_llm_pool().stream_lines(
+            base_url,
+            "/chat/completions",
+            json=payload,
+            headers=headers,
+            timeout=300,
+            provider=provider,
+        ):
+            line = line.strip()
+            if line == "data: [DONE]":
+                yield f"data: {json.dumps({'content': '', 'done': True})}\n\n"
+                continue
+            if line.startswith("data: "):
+                try:
+                    chunk = json.loads(line[6:])
+                    delta = chunk.get("choices", [{}])[0].get("delta", {})
+                    content = delta.get("content", "")
+                    if content:
+                        yield f"data: {json.dumps({'content': content, 'done': False})}\n\n"
+                except Exception:
+                    pass
+    except httpx.HTTPStatusError as e:
+        err = e.response.text
+        yield f"data: {json.dumps({'error': f'{label} 返回错误({e.response.status_code}): {err}'})}\n\n"
+    except Exception as e:
+        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+
+
 async def _stream_ollama(
     model: str, messages: list, temperature: float, max_tokens: int
 ) -> AsyncGenerator[str, None]:
     """调用本地 Ollama 流式接口"""
-    import aiohttp
-
     ollama_url = _get_base_url("ollama", "OLLAMA_BASE_URL", "http://localhost:11434")
     payload = {
         "model": model,
@@ -166,30 +223,22 @@ async def _stream_ollama(
         "options": {"temperature": temperature, "num_predict": max_tokens},
     }
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{ollama_url}/api/chat",
-                json=payload,
-                timeout=aiohttp.ClientTimeout(total=300),
-            ) as resp:
-                if resp.status != 200:
-                    err = await resp.text()
-                    yield f"data: {json.dumps({'error': f'Ollama 返回错误: {err}'})}\n\n"
-                    return
-                async for line in resp.content:
-                    line = line.decode("utf-8").strip()
-                    if not line:
-                        continue
-                    try:
-                        chunk = json.loads(line)
-                        content = chunk.get("message", {}).get("content", "")
-                        done = chunk.get("done", False)
-                        if content:
-                            yield f"data: {json.dumps({'content': content, 'done': False})}\n\n"
-                        if done:
-                            yield f"data: {json.dumps({'content': '', 'done': True})}\n\n"
-                    except json.JSONDecodeError:
-                        pass
+        async for line in get_llm_pool().stream_lines(
+            ollama_url, "/api/chat", json=payload, timeout=300, provider="ollama"
+        ):
+            try:
+                chunk = json.loads(line)
+                content = chunk.get("message", {}).get("content", "")
+                done = chunk.get("done", False)
+                if content:
+                    yield f"data: {json.dumps({'content': content, 'done': False})}\n\n"
+                if done:
+                    yield f"data: {json.dumps({'content': '', 'done': True})}\n\n"
+            except json.JSONDecodeError:
+                pass
+    except httpx.HTTPStatusError as e:
+        err = e.response.text
+        yield f"data: {json.dumps({'error': f'Ollama 返回错误: {err}'})}\n\n"
     except Exception as e:
         yield f"data: {json.dumps({'error': str(e)})}\n\n"
 
@@ -202,9 +251,6 @@ async def _stream_deepseek(
     if not api_key:
         yield f"data: {json.dumps({'error': '未配置 DeepSeek API Key，请在「设置 → 多模型」填写并保存'})}\n\n"
         return
-    import aiohttp
-
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
     payload = {
         "model": model,
         "messages": messages,
@@ -212,35 +258,13 @@ async def _stream_deepseek(
         "temperature": temperature,
         "max_tokens": max_tokens,
     }
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://api.deepseek.com/chat/completions",
-                json=payload,
-                headers=headers,
-                timeout=aiohttp.ClientTimeout(total=300),
-            ) as resp:
-                if resp.status != 200:
-                    err = await resp.text()
-                    yield f"data: {json.dumps({'error': f'DeepSeek 返回错误({resp.status}): {err}'})}\n\n"
-                    return
-                async for line in resp.content:
-                    line = line.decode("utf-8").strip()
-                    if not line or line == "data: [DONE]":
-                        if line == "data: [DONE]":
-                            yield f"data: {json.dumps({'content': '', 'done': True})}\n\n"
-                        continue
-                    if line.startswith("data: "):
-                        try:
-                            chunk = json.loads(line[6:])
-                            delta = chunk.get("choices", [{}])[0].get("delta", {})
-                            content = delta.get("content", "")
-                            if content:
-                                yield f"data: {json.dumps({'content': content, 'done': False})}\n\n"
-                        except Exception:
-                            pass
-    except Exception as e:
-        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    base_url = _get_base_url(
+        "deepseek", "DEEPSEEK_BASE_URL", "https://api.deepseek.com"
+    )
+    async for chunk in _stream_openai_compatible(
+        "deepseek", "DeepSeek", base_url, api_key, payload
+    ):
+        yield chunk
 
 
 async def _stream_openai(
@@ -252,9 +276,6 @@ async def _stream_openai(
     if not api_key:
         yield f"data: {json.dumps({'error': '未配置 OpenAI API Key，请在「设置 → 多模型」填写并保存'})}\n\n"
         return
-    import aiohttp
-
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
     payload = {
         "model": model,
         "messages": messages,
@@ -262,35 +283,10 @@ async def _stream_openai(
         "temperature": temperature,
         "max_tokens": max_tokens,
     }
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{base_url}/chat/completions",
-                json=payload,
-                headers=headers,
-                timeout=aiohttp.ClientTimeout(total=300),
-            ) as resp:
-                if resp.status != 200:
-                    err = await resp.text()
-                    yield f"data: {json.dumps({'error': f'OpenAI 返回错误({resp.status}): {err}'})}\n\n"
-                    return
-                async for line in resp.content:
-                    line = line.decode("utf-8").strip()
-                    if not line or line == "data: [DONE]":
-                        if line == "data: [DONE]":
-                            yield f"data: {json.dumps({'content': '', 'done': True})}\n\n"
-                        continue
-                    if line.startswith("data: "):
-                        try:
-                            chunk = json.loads(line[6:])
-                            delta = chunk.get("choices", [{}])[0].get("delta", {})
-                            content = delta.get("content", "")
-                            if content:
-                                yield f"data: {json.dumps({'content': content, 'done': False})}\n\n"
-                        except Exception:
-                            pass
-    except Exception as e:
-        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    async for chunk in _stream_openai_compatible(
+        "openai", "OpenAI", base_url, api_key, payload
+    ):
+        yield chunk
 
 
 async def _stream_hunyuan(
@@ -309,12 +305,9 @@ async def _stream_hunyuan(
     if not secret_id:
         yield f"data: {json.dumps({'error': '未配置混元 API Key，请在「设置 → 多模型」填写并保存'})}\n\n"
         return
-    # OpenAI API key
-    import aiohttp
 
     # api_keyEnvironment variable secretId:secretKey
     api_key = secret_id if not secret_key else f"{secret_id}:{secret_key}"
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
     payload = {
         "model": model,
         "messages": messages,
@@ -322,35 +315,13 @@ async def _stream_hunyuan(
         "temperature": temperature,
         "max_tokens": max_tokens,
     }
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://api.hunyuan.cloud.tencent.com/v1/chat/completions",
-                json=payload,
-                headers=headers,
-                timeout=aiohttp.ClientTimeout(total=300),
-            ) as resp:
-                if resp.status != 200:
-                    err = await resp.text()
-                    yield f"data: {json.dumps({'error': f'混元 API 返回错误({resp.status}): {err}'})}\n\n"
-                    return
-                async for line in resp.content:
-                    line = line.decode("utf-8").strip()
-                    if not line or line == "data: [DONE]":
-                        if line == "data: [DONE]":
-                            yield f"data: {json.dumps({'content': '', 'done': True})}\n\n"
-                        continue
-                    if line.startswith("data: "):
-                        try:
-                            chunk = json.loads(line[6:])
-                            delta = chunk.get("choices", [{}])[0].get("delta", {})
-                            content = delta.get("content", "")
-                            if content:
-                                yield f"data: {json.dumps({'content': content, 'done': False})}\n\n"
-                        except Exception:
-                            pass
-    except Exception as e:
-        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    base_url = _get_base_url(
+        "hunyuan", "HUNYUAN_BASE_URL", "https://api.hunyuan.cloud.tencent.com/v1"
+    )
+    async for chunk in _stream_openai_compatible(
+        "hunyuan", "混元 API", base_url, api_key, payload
+    ):
+        yield chunk
 
 
 # - API -
@@ -652,7 +623,7 @@ async def agent_task(req: AgentTaskRequest):
                 from RAG_M.RAG_app import _load_vectorstore_and_docs
 
                 docs_dir = f"local-KLB-files/{req.kb_id}"
-                vectorstore, documents, _ = _load_vectorstore_and_docs(docs_dir)
+                vectorstore, documents, bm25, _ = _load_vectorstore_and_docs(docs_dir)
 
                 from RAG_M.src.rag.hybrid_retriever import HybridRetriever
 
@@ -663,6 +634,7 @@ async def agent_task(req: AgentTaskRequest):
                         bm25_top_k=3,
                         vector_top_k=3,
                         final_top_k=3,
+                        bm25=bm25,
                     )
                     results = retriever.retrieve_with_scores(req.query)
                 else:
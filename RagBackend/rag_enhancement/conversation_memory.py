@@ -2,12 +2,22 @@
 超长上下文处理 + 对话记忆持久化模块
 - 突破小模型上下文窗口限制（滑动窗口 + 摘要压缩）
 - 对话记忆持久化，跨会话精准溯源
+
+滚动摘要：
+- 摘要存于 conversations.summary，summary_upto 记录已并入摘要的最大消息 id（水位）
+- 读取上下文窗口时只从尾部倒序读取消息，按 token_est 累加到预算即停止
+- 只有新滑出窗口的消息（水位之后、窗口之前）才调用 LLM 并入摘要；
+  没有新消息滑出时直接返回已存的摘要，不调用 LLM
+- 摘要调用走共享异步连接池（multi_model.llm_client），不阻塞事件循环；
+  LLM 不可用时返回截断拼接的临时摘要，不推进水位，下次读取重试
 """
 
+import asyncio
 import os
 import json
 import sqlite3
-from typing import List, Optional, Dict
+import weakref
+from typing import List, Optional, Dict, Tuple
 from fastapi import APIRouter
 from pydantic import BaseModel
 
@@ -50,6 +60,12 @@ def init_db():
         );
         CREATE INDEX IF NOT EXISTS idx_messages_conv ON messages(conv_id, id);
     """)
+    # 旧库补充摘要水位列
+    columns = {r["name"] for r in conn.execute("PRAGMA table_info(conversations)")}
+    if "summary_upto" not in columns:
+        conn.execute(
+            "ALTER TABLE conversations ADD COLUMN summary_upto INTEGER DEFAULT 0"
+        )
     conn.commit()
     conn.close()
 
@@ -64,29 +80,73 @@ def estimate_tokens(text: str) -> int:
     return int(cn_count * 1.5 + en_count * 0.3)
 
 
+def _history_text(messages: List[Dict]) -> str:
+    return "\n".join(
+        f"{'用户' if m['role'] == 'user' else 'AI'}：{m['content'][:200]}"
+        for m in messages
+    )
+
+
+def _summary_prompt(messages: List[Dict], previous: Optional[str] = None) -> str:
+    if not previous:
+        return f"请用3-5句话总结以下对话的核心内容：\n{_history_text(messages)}"
+    return (
+        f"已有对话摘要：\n{previous}\n\n"
+        f"后续对话：\n{_history_text(messages)}\n\n"
+        "请把后续对话并入已有摘要，用3-5句话输出更新后的完整摘要："
+    )
+
+
+def _fallback_summary(messages: List[Dict], previous: Optional[str] = None) -> str:
+    """LLM 不可用时：已有摘要 + 最近 5 条消息各取前 100 字"""
+    snippets = [f"{m['role']}: {m['content'][:100]}" for m in messages[-5:]]
+    text = "历史摘要：" + " | ".join(snippets)
+    return f"{previous}\n{text}" if previous else text
+
+
+async def asummarize_messages(
+    messages: List[Dict], previous: Optional[str] = None, model: str = None
+) -> Optional[str]:
+    """把 messages 并入 previous 摘要（异步 LLM 调用）；失败时返回 None"""
+    try:
+        from multi_model.llm_client import get_llm_pool
+
+        ollama_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+        model = model or os.getenv("MODEL", "qwen2:0.5b")
+        resp = await get_llm_pool().post(
+            ollama_url,
+            "/api/generate",
+            json={
+                "model": model,
+                "prompt": _summary_prompt(messages, previous),
+                "stream": False,
+            },
+            timeout=30,
+            provider="ollama",
+        )
+        resp.raise_for_status()
+        return resp.json().get("response", "") or None
+    except Exception:
+        return None
+
+
 def summarize_messages(messages: List[Dict], model: str = None) -> str:
     """将超出窗口的消息压缩为摘要（LLM调用 or 简单截断）"""
     try:
-        import httpx
-        import os
+        from multi_model.llm_client import get_llm_pool
 
         ollama_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
         model = model or os.getenv("MODEL", "qwen2:0.5b")
-        history_text = "\n".join(
-            f"{'用户' if m['role'] == 'user' else 'AI'}：{m['content'][:200]}"
-            for m in messages
-        )
-        prompt = f"请用3-5句话总结以下对话的核心内容：\n{history_text}"
-        resp = httpx.post(
-            f"{ollama_url}/api/generate",
-            json={"model": model, "prompt": prompt, "stream": False},
+        resp = get_llm_pool().post_sync(
+            ollama_url,
+            "/api/generate",
+            json={"model": model, "prompt": _summary_prompt(messages), "stream": False},
             timeout=30,
+            provider="ollama",
         )
         return resp.json().get("response", "")
-    except:
-        # 100
-        snippets = [f"{m['role']}: {m['content'][:100]}" for m in messages[-5:]]
-        return "历史摘要：" + " | ".join(snippets)
+    except Exception:
+        return _fallback_summary(messages)
 
 
 # ── API ─────────────────────────────────────────────────────
@@ -151,54 +211,149 @@ def add_message(req: MessageAdd):
     return {"status": "added", "token_est": token_est}
 
 
-@router.get("/conversations/{conv_id}/context")
-def get_context_window(conv_id: str, max_tokens: int = DEFAULT_WINDOW_TOKENS):
+def _read_window(
+    conv_id: str, max_tokens: int
+) -> Optional[Tuple[dict, list, bool, int]]:
     """
-    返回适合模型上下文窗口的消息列表：
-    - 超出窗口的历史消息压缩为摘要注入
-    - 保证最近 N 条完整消息在窗口内
+    从最新消息倒序读取，累计 token_est 到 max_tokens 为止（游标只读到窗口外的第一条）。
+    返回 (会话行, 窗口消息（时间正序）, 窗口之前是否还有消息, 窗口 token 数)；
+    会话不存在时返回 None
     """
     conn = get_db()
-    conv = conn.execute("SELECT * FROM conversations WHERE id=?", (conv_id,)).fetchone()
-    if not conv:
-        return {"messages": [], "summary": None}
-    all_msgs = conn.execute(
-        """
-        SELECT role, content, sources, token_est
-        FROM messages WHERE conv_id=? ORDER BY id ASC
-    """,
-        (conv_id,),
-    ).fetchall()
-    conn.close()
+    try:
+        conv = conn.execute(
+            "SELECT summary, summary_upto, turn_count FROM conversations WHERE id=?",
+            (conv_id,),
+        ).fetchone()
+        if not conv:
+            return None
+        cursor = conn.execute(
+            """
+            SELECT id, role, content, sources, token_est
+            FROM messages WHERE conv_id=? ORDER BY id DESC
+        """,
+            (conv_id,),
+        )
+        window = []
+        used_tokens = 0
+        has_older = False
+        for row in cursor:
+            t = row["token_est"] or estimate_tokens(row["content"])
+            if used_tokens + t > max_tokens:
+                has_older = True
+                break
+            used_tokens += t
+            window.append(dict(row))
+        cursor.close()
+        window.reverse()
+        return dict(conv), window, has_older, used_tokens
+    finally:
+        conn.close()
 
-    messages = [dict(m) for m in all_msgs]
-    if not messages:
-        return {"messages": [], "summary": None}
 
-    # token
-    window_msgs = []
-    used_tokens = 0
-    cutoff_idx = len(messages)
+def _read_range(conv_id: str, after_id: int, before_id: Optional[int]) -> List[Dict]:
+    """水位之后、窗口之前的消息（即新滑出窗口、尚未并入摘要的消息）"""
+    conn = get_db()
+    try:
+        sql = "SELECT id, role, content FROM messages WHERE conv_id=? AND id>?"
+        params: list = [conv_id, after_id]
+        if before_id is not None:
+            sql += " AND id<?"
+            params.append(before_id)
+        rows = conn.execute(sql + " ORDER BY id ASC", params).fetchall()
+        return [dict(r) for r in rows]
+    finally:
+        conn.close()
+
+
+def _read_summary(conv_id: str) -> Tuple[Optional[str], int]:
+    conn = get_db()
+    try:
+        row = conn.execute(
+            "SELECT summary, summary_upto FROM conversations WHERE id=?", (conv_id,)
+        ).fetchone()
+        return (row["summary"], row["summary_upto"] or 0) if row else (None, 0)
+    finally:
+        conn.close()
 
-    for i in range(len(messages) - 1, -1, -1):
-        t = messages[i]["token_est"] or estimate_tokens(messages[i]["content"])
-        if used_tokens + t <= max_tokens:
-            window_msgs.insert(0, messages[i])
-            used_tokens += t
-            cutoff_idx = i
-        else:
-            break
 
-    summary = None
-    if cutoff_idx > 0:
-        old_msgs = messages[:cutoff_idx]
-        summary = summarize_messages(old_msgs)
+def _save_summary(conv_id: str, summary: str, upto: int, expected_upto: int) -> bool:
+    """水位未被并发请求推进时才写入（避免旧摘要覆盖新摘要）"""
+    conn = get_db()
+    try:
+        cur = conn.execute(
+            """
+            UPDATE conversations SET summary=?, summary_upto=?
+            WHERE id=? AND COALESCE(summary_upto, 0)=?
+        """,
+            (summary, upto, conv_id, expected_upto),
+        )
+        conn.commit()
+        return cur.rowcount > 0
+    finally:
+        conn.close()
+
+
+# 同一会话的摘要扩展串行执行，并发读取不会重复调用 LLM
+_summary_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = (
+    weakref.WeakValueDictionary()
+)
+
+
+async def _rolling_summary(
+    conv_id: str, conv: dict, window: List[Dict], has_older: bool
+) -> Optional[str]:
+    """返回覆盖窗口之前所有消息的摘要；只有新滑出窗口的消息才调用 LLM"""
+    if not has_older:
+        return None
+    window_start = window[0]["id"] if window else None
+    summary, upto = conv["summary"], conv["summary_upto"] or 0
+    if window_start is not None and upto >= window_start - 1:
+        return summary
+
+    lock = _summary_locks.get(conv_id)
+    if lock is None:
+        lock = _summary_locks.setdefault(conv_id, asyncio.Lock())
+    async with lock:
+        # 等锁期间其他请求可能已推进水位：重新读取摘要与水位
+        summary, upto = await asyncio.to_thread(_read_summary, conv_id)
+        if window_start is not None and upto >= window_start - 1:
+            return summary
+        fallen = await asyncio.to_thread(_read_range, conv_id, upto, window_start)
+        if not fallen:
+            return summary
+        new_summary = await asummarize_messages(fallen, previous=summary)
+        if new_summary is None:
+            return _fallback_summary(fallen, summary)
+        await asyncio.to_thread(
+            _save_summary, conv_id, new_summary, fallen[-1]["id"], upto
+        )
+        return new_summary
+
+
+@router.get("/conversations/{conv_id}/context")
+async def get_context_window(conv_id: str, max_tokens: int = DEFAULT_WINDOW_TOKENS):
+    """
+    返回适合模型上下文窗口的消息列表：
+    - 超出窗口的历史消息压缩为摘要注入（滚动摘要，只对新滑出窗口的消息调用 LLM）
+    - 保证最近 N 条完整消息在窗口内
+    """
+    result = await asyncio.to_thread(_read_window, conv_id, max_tokens)
+    if result is None:
+        return {"messages": [], "summary": None}
+    conv, window, has_older, used_tokens = result
+    if not window and not has_older:
+        return {"messages": [], "summary": None}
 
+    summary = await _rolling_summary(conv_id, conv, window, has_older)
     return {
-        "messages": window_msgs,
+        "messages": [
+            {k: m[k] for k in ("role", "content", "sources", "token_est")}
+            for m in window
+        ],
         "summary": summary,
-        "total_turns": len(messages),
-        "window_turns": len(window_msgs),
+        "total_turns": conv["turn_count"],
+        "window_turns": len(window),
         "used_tokens": used_tokens,
     }
 
@@ -0,0 +1,474 @@
+"""
+cross_encoder.py
+CPU 上的 cross-encoder 打分器（检索结果精排阶段）
+
+  - 一次前向：全部 (query, 候选) 对 padding 成一个 batch，而不是逐对推理；
+    score_pairs 支持不同 query 的对混合成一个 batch（reranker.RerankService 跨请求微批），
+    超过 RERANK_BATCH_PAIRS 时按长度排序切分，减少 padding
+  - token 预算截断：query 完整保留，只截断 passage（only_second）；
+    超长文本先按字符数粗截，避免对整篇长文做分词
+  - 推理后端：设置 RERANK_ONNX_PATH 时用 onnxruntime 加载导出的（可为 int8 量化的）ONNX 模型，
+    否则用 transformers + torch（inference_mode；RERANK_INT8=1 时对 Linear 层做动态 int8 量化）
+  - (query, chunk) 分数 LRU 缓存：同一问题重复提问 / 换策略重查时，已打过分的候选不再推理；
+    缓存键总带上 passage 文本 hash，各知识库（及重建后）从 0 编号的 chunk_id 不会串用分数
+  - 延迟预算：按每对的平均推理耗时预估，预计超预算或实际超时则返回 None，
+    调用方降级为词法重排；超时的推理在后台完成后照常写入缓存
+  - 模型在后台加载，就绪前 score_within_budget 直接返回 None（词法重排），不占用请求的预算；
+    加载失败按指数退避重试（RERANK_LOAD_RETRY_S 起，最长 10 分钟），期间 available() 为 False
+
+配置（环境变量）：
+  RERANK_MODEL        模型名，默认 BAAI/bge-reranker-base（中英双语）
+  RERANK_ONNX_PATH    ONNX 模型文件路径（tokenizer 仍按 RERANK_MODEL 加载）
+  RERANK_INT8         1 = torch 动态 int8 量化，默认 0
+  RERANK_MAX_LENGTH   每对最大 token 数，默认 512
+  RERANK_BATCH_PAIRS  单次前向的最大对数，默认 64
+  RERANK_THREADS      推理线程数，默认 min(8, CPU 核数)
+  RERANK_CACHE_SIZE   分数缓存条目数，默认 8192
+  RERANK_BUDGET_MS    精排延迟预算（毫秒），默认 300；<= 0 表示不限
+  RERANK_LOAD_RETRY_S 模型加载失败后的首次重试间隔（秒），默认 30，之后逐次翻倍
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Callable, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = os.getenv("RERANK_MODEL", "BAAI/bge-reranker-base")
+DEFAULT_ONNX_PATH = os.getenv("RERANK_ONNX_PATH", "")
+DEFAULT_INT8 = os.getenv("RERANK_INT8", "0") == "1"
+DEFAULT_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "512"))
+DEFAULT_BATCH_PAIRS = int(os.getenv("RERANK_BATCH_PAIRS", "64"))
+DEFAULT_THREADS = int(os.getenv("RERANK_THREADS", str(min(8, os.cpu_count() or 1))))
+DEFAULT_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "8192"))
+DEFAULT_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "300"))
+DEFAULT_LOAD_RETRY_S = float(os.getenv("RERANK_LOAD_RETRY_S", "30"))
+_LOAD_RETRY_MAX_S = 600.0
+
+# 每对推理耗时 EWMA 的平滑系数
+_EWMA_ALPHA = 0.3
+
+# 分词前的字符粗截：passage 每 token 最多按 4 个字符计（英文约 4 字符 / token，中文约 1），
+# query 最多占 max_length 的 1/4，保证 only_second 截断总有 passage 的位置
+_CHARS_PER_TOKEN = 4
+_QUERY_SHARE = 4
+
+PairsFn = Callable[[List[str], List[str]], Sequence[float]]
+
+
+def _cache_keys(
+    passages: Sequence[str], keys: Optional[Sequence[Hashable]]
+) -> List[Hashable]:
+    """缓存键：调用方 key（如 chunk_id，仅在单个向量库内唯一）+ passage 文本 hash"""
+    if keys is None:
+        return [hash(p) for p in passages]
+    return [(key, hash(p)) for key, p in zip(keys, passages)]
+
+
+def _normalize_query(query: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", query).split())
+
+
+def truncate_pair(query: str, passage: str, max_length: int) -> Tuple[str, str]:
+    """按 token 预算粗截 (query, passage) 文本；精确截断由 tokenizer 的 only_second 完成"""
+    return (
+        query[: max(1, max_length // _QUERY_SHARE)],
+        passage[: max_length * _CHARS_PER_TOKEN],
+    )
+
+
+class CrossEncoderScorer:
+    """
+    (query, passage) 相关度打分器。
+
+    参数:
+        model_name: HuggingFace 模型名（tokenizer 与 torch 权重均按此加载）
+        infer_fn:   自定义推理函数 (query, passages) -> scores；为空时按 model_name 懒加载模型
+        pairs_fn:   自定义推理函数 (queries, passages) -> scores，逐对对应，可跨 query 成批
+        onnx_path:  ONNX 模型文件，非空时用 onnxruntime 推理
+        int8:       torch 后端是否做动态 int8 量化
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_MODEL,
+        infer_fn: Optional[Callable[[str, List[str]], Sequence[float]]] = None,
+        onnx_path: str = DEFAULT_ONNX_PATH,
+        int8: bool = DEFAULT_INT8,
+        max_length: int = DEFAULT_MAX_LENGTH,
+        threads: int = DEFAULT_THREADS,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+        pairs_fn: Optional[PairsFn] = None,
+        batch_pairs: int = DEFAULT_BATCH_PAIRS,
+    ):
+        self.model_name = model_name
+        self.onnx_path = onnx_path
+        self.int8 = int8
+        self.max_length = max_length
+        self.batch_pairs = max(1, batch_pairs)
+        self.threads = max(1, threads)
+        self.cache_size = cache_size
+        self._infer_fn = infer_fn
+        self._pairs_fn = pairs_fn
+
+        self._tokenizer = None
+        self._model = None
+        self._session = None
+        self._onnx_inputs: set = set()
+        self._loaded = infer_fn is not None or pairs_fn is not None
+        self._load_error: Optional[str] = None
+        self._load_failures = 0
+        self._retry_at = 0.0
+        self._load_lock = threading.Lock()
+        self._bg_loading = False
+        self._bg_lock = threading.Lock()
+
+        self._cache: "OrderedDict[Tuple[str, Hashable], float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # 单线程执行推理：torch / onnxruntime 自身已按 threads 做算子内并行
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+
+        self.pair_ms: Optional[float] = None  # 每对推理耗时 EWMA
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.fallbacks = 0
+
+    # ── 模型加载 ───────────────────────────────────────────────
+
+    def available(self) -> bool:
+        """同步加载模型（退避期内不重试）；已就绪返回 True"""
+        self._ensure_loaded()
+        return self._loaded
+
+    def ready(self) -> bool:
+        """不阻塞：模型未就绪时在后台开始加载并返回 False"""
+        if self._loaded:
+            return True
+        with self._bg_lock:
+            if self._bg_loading or not self._can_retry():
+                return False
+            self._bg_loading = True
+        threading.Thread(
+            target=self._load_in_background, name="rerank-load", daemon=True
+        ).start()
+        return False
+
+    def _can_retry(self) -> bool:
+        return self._load_error is None or time.monotonic() >= self._retry_at
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded or not self._can_retry():
+            return
+        with self._load_lock:
+            if self._loaded or not self._can_retry():
+                return
+            self._try_load()
+
+    def _load_in_background(self) -> None:
+        try:
+            self._ensure_loaded()
+        finally:
+            with self._bg_lock:
+                self._bg_loading = False
+
+    def _try_load(self) -> None:
+        """持有 _load_lock 时调用；失败时记录错误并按指数退避安排下次重试"""
+        try:
+            self._load()
+            self._loaded = True
+            self._load_error = None
+            self._load_failures = 0
+        except Exception as e:
+            self._load_failures += 1
+            delay = min(
+                _LOAD_RETRY_MAX_S,
+                DEFAULT_LOAD_RETRY_S * 2 ** (self._load_failures - 1),
+            )
+            self._retry_at = time.monotonic() + delay
+            self._load_error = str(e)
+            logger.warning(
+                f"[CrossEncoder] 无法加载 {self.model_name}，精排降级为词法重排，"
+                f"{delay:.0f}s 后重试: {e}"
+            )
+
+    def _load(self) -> None:
+        from transformers import AutoTokenizer
+
+        logger.info(
+            f"[CrossEncoder] 加载 {self.model_name}"
+            f"（{'onnx' if self.onnx_path else 'torch'}, threads={self.threads}）"
+        )
+        self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        if self.onnx_path:
+            import onnxruntime as ort
+
+            opts = ort.SessionOptions()
+            opts.intra_op_num_threads = self.threads
+            self._session = ort.InferenceSession(
+                self.onnx_path, opts, providers=["CPUExecutionProvider"]
+            )
+            self._onnx_inputs = {i.name for i in self._session.get_inputs()}
+            return
+
+        import torch
+        from transformers import AutoModelForSequenceClassification
+
+        torch.set_num_threads(self.threads)
+        model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+        model.eval()
+        if self.int8:
+            model = torch.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        self._model = model
+
+    # ── 推理 ───────────────────────────────────────────────────
+
+    def _infer(self, query: str, passages: List[str]) -> np.ndarray:
+        """一次前向：所有 (query, passage) 对 padding 到同一长度"""
+        return self._infer_pairs([query] * len(passages), passages)
+
+    def _infer_pairs(self, queries: List[str], passages: List[str]) -> np.ndarray:
+        """逐对打分；超过 batch_pairs 时按 passage 长度排序后分批前向"""
+        n = len(passages)
+        if n <= self.batch_pairs:
+            return self._forward(queries, passages)
+        order = sorted(range(n), key=lambda i: len(passages[i]))
+        out = np.empty(n, dtype=np.float32)
+        for start in range(0, n, self.batch_pairs):
+            idx = order[start : start + self.batch_pairs]
+            out[idx] = self._forward(
+                [queries[i] for i in idx], [passages[i] for i in idx]
+            )
+        return out
+
+    def _forward(self, queries: List[str], passages: List[str]) -> np.ndarray:
+        if self._pairs_fn is not None:
+            scores = self._pairs_fn(queries, passages)
+            return np.asarray(scores, dtype=np.float32).reshape(-1)
+        if self._infer_fn is not None:
+            # 单 query 接口：按 query 分组调用
+            out = np.empty(len(passages), dtype=np.float32)
+            groups: dict = {}
+            for i, q in enumerate(queries):
+                groups.setdefault(q, []).append(i)
+            for q, idx in groups.items():
+                scores = self._infer_fn(q, [passages[i] for i in idx])
+                out[idx] = np.asarray(scores, dtype=np.float32).reshape(-1)
+            return out
+
+        n = len(passages)
+        pairs = [
+            truncate_pair(q, p, self.max_length) for q, p in zip(queries, passages)
+        ]
+        tensors = "np" if self._session is not None else "pt"
+        enc = self._tokenizer(
+            [q for q, _ in pairs],
+            [p for _, p in pairs],
+            padding=True,
+            truncation="only_second",
+            max_length=self.max_length,
+            return_tensors=tensors,
+        )
+        if self._session is not None:
+            feeds = {
+                k: v.astype(np.int64) for k, v in enc.items() if k in self._onnx_inputs
+            }
+            logits = self._session.run(None, feeds)[0]
+        else:
+            import torch
+
+            with torch.inference_mode():
+                logits = self._model(**enc).logits.float().numpy()
+        # 单输出（bge-reranker / ms-marco）取唯一一列；二分类取「相关」一列
+        return np.asarray(logits, dtype=np.float32).reshape(n, -1)[:, -1]
+
+    def score(
+        self,
+        query: str,
+        passages: Sequence[str],
+        keys: Optional[Sequence[Hashable]] = None,
+    ) -> np.ndarray:
+        """
+        返回每个 passage 的相关度分数（越大越相关）。
+        keys 为各 passage 的缓存标识（如 chunk_id），与文本 hash 一起组成缓存键；
+        未命中的一次性批量推理
+        """
+        return self.score_pairs([query] * len(passages), passages, keys)
+
+    def score_pairs(
+        self,
+        queries: Sequence[str],
+        passages: Sequence[str],
+        keys: Optional[Sequence[Hashable]] = None,
+    ) -> np.ndarray:
+        """逐对打分 (queries[i], passages[i])，不同 query 的对合并推理；缓存语义同 score"""
+        self._ensure_loaded()
+        if not self._loaded:
+            raise RuntimeError(f"cross-encoder 不可用: {self._load_error}")
+
+        keys = _cache_keys(passages, keys)
+        norm = [_normalize_query(q) for q in queries]
+        scores = np.empty(len(passages), dtype=np.float32)
+        missing: List[int] = []
+        with self._cache_lock:
+            for i, key in enumerate(keys):
+                cached = self._cache.get((norm[i], key))
+                if cached is None:
+                    missing.append(i)
+                else:
+                    self._cache.move_to_end((norm[i], key))
+                    scores[i] = cached
+            self.hits += len(passages) - len(missing)
+            self.misses += len(missing)
+        if not missing:
+            return scores
+
+        t0 = time.perf_counter()
+        fresh = self._infer_pairs(
+            [queries[i] for i in missing], [passages[i] for i in missing]
+        )
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        per_pair = elapsed_ms / len(missing)
+
+        with self._cache_lock:
+            self.batches += 1
+            self.pair_ms = (
+                per_pair
+                if self.pair_ms is None
+                else _EWMA_ALPHA * per_pair + (1 - _EWMA_ALPHA) * self.pair_ms
+            )
+            for i, s in zip(missing, fresh.tolist()):
+                scores[i] = s
+                if self.cache_size > 0:
+                    self._cache[(norm[i], keys[i])] = s
+                    self._cache.move_to_end((norm[i], keys[i]))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return scores
+
+    def _count_missing(
+        self, query: str, passages: Sequence[str], keys: Optional[Sequence[Hashable]]
+    ) -> int:
+        q = _normalize_query(query)
+        keys = _cache_keys(passages, keys)
+        with self._cache_lock:
+            return sum(1 for key in keys if (q, key) not in self._cache)
+
+    def score_within_budget(
+        self,
+        query: str,
+        passages: Sequence[str],
+        keys: Optional[Sequence[Hashable]] = None,
+        budget_ms: float = DEFAULT_BUDGET_MS,
+    ) -> Optional[np.ndarray]:
+        """
+        在 budget_ms 内完成打分则返回分数，否则返回 None（调用方降级）。
+        预计耗时（未命中数 × 每对耗时 EWMA）已超预算时不发起推理；
+        模型尚未就绪时在后台加载，本次直接返回 None。
+        """
+        if not passages:
+            return None
+        if not self.ready():
+            self.fallbacks += 1
+            return None
+        if budget_ms <= 0:
+            return self.score(query, passages, keys)
+
+        missing = self._count_missing(query, passages, keys)
+        if missing and self.pair_ms is not None and missing * self.pair_ms > budget_ms:
+            self.fallbacks += 1
+            logger.info(
+                f"[CrossEncoder] 预计 {missing * self.pair_ms:.0f}ms 超出预算 "
+                f"{budget_ms:.0f}ms，降级为词法重排"
+            )
+            return None
+
+        future = self._executor.submit(
+            self.score, query, list(passages), list(keys) if keys is not None else None
+        )
+        try:
+            return future.result(timeout=budget_ms / 1000)
+        except FutureTimeout:
+            self.fallbacks += 1
+            logger.info(
+                f"[CrossEncoder] 推理超出预算 {budget_ms:.0f}ms，降级为词法重排"
+            )
+        except Exception as e:
+            self.fallbacks += 1
+            logger.warning(f"[CrossEncoder] 推理失败，降级为词法重排: {e}")
+        return None
+
+    def clear_cache(self) -> None:
+        with self._cache_lock:
+            self._cache.clear()
+
+    def close(self) -> None:
+        """释放模型与推理线程（模型 LRU 淘汰时调用）"""
+        self._executor.shutdown(wait=False)
+        with self._load_lock:
+            self._model = self._session = self._tokenizer = None
+            if self._infer_fn is None and self._pairs_fn is None:
+                self._loaded = False
+
+    def stats(self) -> dict:
+        with self._cache_lock:
+            return {
+                "model": self.model_name,
+                "backend": "onnx" if self.onnx_path else "torch",
+                "available": self._loaded,
+                "load_error": self._load_error,
+                "cache_entries": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "batches": self.batches,
+                "fallbacks": self.fallbacks,
+                "pair_ms": round(self.pair_ms, 3) if self.pair_ms is not None else None,
+            }
+
+
+# ─────────────────────────────────────────────────────────────────
+# 进程级默认打分器
+# ─────────────────────────────────────────────────────────────────
+
+_default_scorer: Optional[CrossEncoderScorer] = None
+_default_lock = threading.Lock()
+
+
+def default_scorer() -> CrossEncoderScorer:
+    """按环境变量配置的共享打分器（模型在首次打分时加载）"""
+    global _default_scorer
+    if _default_scorer is None:
+        with _default_lock:
+            if _default_scorer is None:
+                _default_scorer = CrossEncoderScorer()
+    return _default_scorer
+
+
+def rerank_items(
+    scorer: CrossEncoderScorer,
+    query: str,
+    items: List[Any],
+    text_of: Callable[[Any], str],
+    key_of: Optional[Callable[[Any], Hashable]] = None,
+    budget_ms: float = DEFAULT_BUDGET_MS,
+) -> Optional[List[Tuple[Any, float]]]:
+    """按 cross-encoder 分数降序返回 (item, score)；超预算或不可用时返回 None"""
+    passages = [text_of(item) for item in items]
+    keys = [key_of(item) for item in items] if key_of is not None else None
+    scores = scorer.score_within_budget(query, passages, keys, budget_ms)
+    if scores is None:
+        return None
+    order = np.argsort(-scores, kind="stable")
+    return [(items[i], float(scores[i])) for i in order]
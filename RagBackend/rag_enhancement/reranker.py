@@ -8,50 +8,380 @@ cross-encoder 重排序模块
   - 轻量降级：无 cross-encoder 依赖时退回 BM25 分数排序
   - 提供 /api/rerank 接口，可单独调用
 
+推理服务（RerankService）：
+  - 多个模型常驻内存，按最近使用淘汰（RERANK_MAX_MODELS）；模型加载成功后才进入 LRU，
+    未知 / 加载失败的模型名不会挤掉常驻模型（失败的打分器另存，按其退避时间重试）
+  - 每个模型一个微批线程：并发请求的 (query, passage) 对在 RERANK_MAX_WAIT_MS 内
+    汇聚成一个 batch 推理，吞吐随 batch 大小而不是请求数增长
+  - 推理在微批线程中进行，不阻塞 event loop；同步调用方直接等待 Future
+  - passage 按 token 预算截断（见 cross_encoder.truncate_pair），分数缓存复用 CrossEncoderScorer
+
+配置（环境变量）：
+  RERANK_MAX_MODELS    常驻模型数，默认 2
+  RERANK_MAX_WAIT_MS   微批等待上限（毫秒），默认 5
+  RERANK_BATCH_PAIRS   每个微批最多汇聚的对数，默认 64（与单次前向上限一致）
+
 API:
   POST /api/rerank  -- 对候选文档重排序
+  GET  /api/rerank/stats  -- 推理服务统计
 """
 
 from __future__ import annotations
 
+import asyncio
 import logging
-from typing import Any, Dict, List
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence
 
+import numpy as np
 from fastapi import APIRouter
 from pydantic import BaseModel
 
+from rag_enhancement.cross_encoder import (
+    DEFAULT_BATCH_PAIRS,
+    DEFAULT_MODEL,
+    CrossEncoderScorer,
+    default_scorer,
+)
+
+try:
+    from monitoring.metrics import STATS as _METRICS
+except ImportError:
+    _METRICS = None
+
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/rerank", tags=["RAG-cross-encoder重排"])
 
-# - -
-_rerank_model = None
-_rerank_model_name: str = ""
+API_DEFAULT_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+MAX_MODELS = int(os.getenv("RERANK_MAX_MODELS", "2"))
+MAX_WAIT_MS = float(os.getenv("RERANK_MAX_WAIT_MS", "5"))
+# 加载中 / 加载失败的打分器最多保留数（保留其退避状态，避免每个请求都重新加载）
+_MAX_LOADING = 16
+
+
+# ─────────────────────────────────────────────────────────────────
+# 微批
+# ─────────────────────────────────────────────────────────────────
+
+
+def _record_stage(t0: float, error: bool = False) -> None:
+    if _METRICS is not None:
+        _METRICS.record_stage("rerank", (time.perf_counter() - t0) * 1000, error)
+
+
+class BatcherClosed(RuntimeError):
+    """模型已被 LRU 淘汰，微批线程不再接收请求"""
+
+
+class _Request:
+    __slots__ = ("query", "passages", "keys", "future")
+
+    def __init__(self, query: str, passages: List[str], keys, future: Future):
+        self.query = query
+        self.passages = passages
+        self.keys = keys
+        self.future = future
+
+
+class MicroBatcher:
+    """
+    单个模型的微批线程：取到第一个请求后最多再等 max_wait_ms，
+    期间到达的请求拼成一个 batch（不超过 max_batch_pairs 对），一次 score_pairs 推理
+    """
+
+    def __init__(
+        self,
+        scorer: CrossEncoderScorer,
+        max_batch_pairs: int = DEFAULT_BATCH_PAIRS,
+        max_wait_ms: float = MAX_WAIT_MS,
+    ):
+        self.scorer = scorer
+        self.max_batch_pairs = max(1, max_batch_pairs)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.requests = 0
+        self.batches = 0
+        self.pairs = 0
+        self._release_model = False
+        self._closed = False
+        self._state_lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name=f"rerank-batcher-{scorer.model_name}", daemon=True
+        )
+        self._thread.start()
+
+    def submit(
+        self,
+        query: str,
+        passages: Sequence[str],
+        keys: Optional[Sequence[Hashable]] = None,
+    ) -> Future:
+        future: Future = Future()
+        if not passages:
+            future.set_result(np.empty(0, dtype=np.float32))
+            return future
+        keys = list(keys) if keys is not None else [hash(p) for p in passages]
+        with self._state_lock:
+            if self._closed:
+                raise BatcherClosed(self.scorer.model_name)
+            self._queue.put(_Request(query, list(passages), keys, future))
+        return future
+
+    def close(self, release_model: bool = False) -> None:
+        """队列中已有的请求处理完后退出；release_model 时随后释放模型"""
+        with self._state_lock:
+            self._closed = True
+            self._release_model = release_model
+            self._queue.put(None)
+
+    def _run(self) -> None:
+        carry: Optional[_Request] = None
+        stop = False
+        while not stop:
+            first = carry if carry is not None else self._queue.get()
+            carry = None
+            if first is None:
+                break
+            batch = [first]
+            n_pairs = len(first.passages)
+            deadline = time.monotonic() + self.max_wait
+            while n_pairs < self.max_batch_pairs:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    nxt = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop = True
+                    break
+                if n_pairs + len(nxt.passages) > self.max_batch_pairs:
+                    # 放不下的请求留到下一个 batch；单个大请求仍整体推理
+                    carry = nxt
+                    break
+                batch.append(nxt)
+                n_pairs += len(nxt.passages)
+            self._process(batch)
+        if self._release_model:
+            self.scorer.close()
+
+    def _process(self, batch: List[_Request]) -> None:
+        live = [r for r in batch if r.future.set_running_or_notify_cancel()]
+        if not live:
+            return
+        queries = [r.query for r in live for _ in r.passages]
+        passages = [p for r in live for p in r.passages]
+        keys = [k for r in live for k in r.keys]
+        t0 = time.perf_counter()
+        try:
+            scores = self.scorer.score_pairs(queries, passages, keys)
+        except Exception as e:
+            _record_stage(t0, error=True)
+            for r in live:
+                r.future.set_exception(e)
+            return
+        _record_stage(t0)
+        self.requests += len(live)
+        self.batches += 1
+        self.pairs += len(passages)
+        offset = 0
+        for r in live:
+            r.future.set_result(scores[offset : offset + len(r.passages)])
+            offset += len(r.passages)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "pairs": self.pairs,
+            "avg_batch_pairs": round(self.pairs / self.batches, 2)
+            if self.batches
+            else 0.0,
+            "queued": self._queue.qsize(),
+        }
+
+
+# ─────────────────────────────────────────────────────────────────
+# 推理服务：模型 LRU + 每模型一个微批线程
+# ─────────────────────────────────────────────────────────────────
+
+
+def _make_scorer(model_name: str) -> CrossEncoderScorer:
+    # 与检索精排阶段（retrieval_strategy）同名模型共享一份模型与分数缓存
+    if model_name == DEFAULT_MODEL:
+        return default_scorer()
+    return CrossEncoderScorer(model_name=model_name)
+
+
+class RerankService:
+    def __init__(
+        self,
+        max_models: int = MAX_MODELS,
+        max_batch_pairs: int = DEFAULT_BATCH_PAIRS,
+        max_wait_ms: float = MAX_WAIT_MS,
+        scorer_factory: Callable[[str], CrossEncoderScorer] = _make_scorer,
+    ):
+        self.max_models = max(1, max_models)
+        self.max_batch_pairs = max_batch_pairs
+        self.max_wait_ms = max_wait_ms
+        self._factory = scorer_factory
+        self._batchers: "OrderedDict[str, MicroBatcher]" = OrderedDict()
+        # 尚未加载成功的打分器（加载中 / 失败退避中），不占 LRU 名额
+        self._loading: "OrderedDict[str, CrossEncoderScorer]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def _resident(self, model_name: str) -> Optional[MicroBatcher]:
+        with self._lock:
+            batcher = self._batchers.get(model_name)
+            if batcher is not None:
+                self._batchers.move_to_end(model_name)
+            return batcher
+
+    def _load_scorer(self, model_name: str) -> CrossEncoderScorer:
+        """取 / 建未常驻模型的打分器并（在调用线程中）加载；失败时抛 RuntimeError"""
+        with self._lock:
+            scorer = self._loading.get(model_name)
+            if scorer is None:
+                scorer = self._loading[model_name] = self._factory(model_name)
+                while len(self._loading) > _MAX_LOADING:
+                    self._loading.popitem(last=False)
+        if not scorer.available():
+            raise RuntimeError(
+                f"cross-encoder 不可用: {scorer.stats().get('load_error')}"
+            )
+        return scorer
+
+    def _batcher(self, model_name: str) -> MicroBatcher:
+        batcher = self._resident(model_name)
+        if batcher is not None:
+            return batcher
+        scorer = self._load_scorer(model_name)
+
+        evicted = None
+        with self._lock:
+            batcher = self._batchers.get(model_name)
+            if batcher is not None:
+                # 并发加载同一模型：已由其他线程放入 LRU
+                self._batchers.move_to_end(model_name)
+                return batcher
+            if self._loading.get(model_name) is scorer:
+                del self._loading[model_name]
+            batcher = MicroBatcher(scorer, self.max_batch_pairs, self.max_wait_ms)
+            self._batchers[model_name] = batcher
+            self.loads += 1
+            if len(self._batchers) > self.max_models:
+                _, evicted = self._batchers.popitem(last=False)
+                self.evictions += 1
+        if evicted is not None:
+            logger.info(f"[Reranker] 淘汰常驻模型: {evicted.scorer.model_name}")
+            # 共享的默认打分器仍被检索精排阶段使用，不释放
+            evicted.close(release_model=evicted.scorer is not default_scorer())
+        return batcher
+
+    def available(self, model_name: str) -> bool:
+        """模型是否可用（首次调用时加载，在调用线程中执行）；加载成功后才进入 LRU"""
+        try:
+            self._batcher(model_name)
+        except RuntimeError:
+            return False
+        return True
+
+    def submit(
+        self,
+        query: str,
+        passages: Sequence[str],
+        model_name: str = API_DEFAULT_MODEL,
+        keys: Optional[Sequence[Hashable]] = None,
+    ) -> Future:
+        try:
+            return self._batcher(model_name).submit(query, passages, keys)
+        except BatcherClosed:
+            # 取到 batcher 后恰好被淘汰：重新加载一次
+            return self._batcher(model_name).submit(query, passages, keys)
+
+    def score(self, query: str, passages: Sequence[str], **kwargs) -> np.ndarray:
+        """同步打分（在调用线程中等待微批结果）"""
+        return self.submit(query, passages, **kwargs).result()
 
+    async def ascore(self, query: str, passages: Sequence[str], **kwargs) -> np.ndarray:
+        """异步打分：推理在微批线程中进行，不阻塞 event loop"""
+        return await asyncio.wrap_future(self.submit(query, passages, **kwargs))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            batchers = list(self._batchers.items())
+            loading = list(self._loading.items())
+        return {
+            "max_models": self.max_models,
+            "max_wait_ms": self.max_wait_ms,
+            "max_batch_pairs": self.max_batch_pairs,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "models": {name: {**b.stats(), **b.scorer.stats()} for name, b in batchers},
+            "unavailable": {
+                name: s.stats()["load_error"]
+                for name, s in loading
+                if s.stats()["load_error"]
+            },
+        }
+
+
+_service: Optional[RerankService] = None
+_service_lock = threading.Lock()
+
+
+def get_rerank_service() -> RerankService:
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = RerankService()
+    return _service
 
-def _get_reranker(model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"):
-    """懒加载 cross-encoder 模型（优先 sentence-transformers CrossEncoder）"""
-    global _rerank_model, _rerank_model_name
-    if _rerank_model is not None and _rerank_model_name == model_name:
-        return _rerank_model
-    try:
-        from sentence_transformers import CrossEncoder
 
-        logger.info(f"[Reranker] 加载 cross-encoder 模型: {model_name}")
-        _rerank_model = CrossEncoder(model_name, max_length=512)
-        _rerank_model_name = model_name
-        return _rerank_model
-    except Exception as e:
-        logger.warning(f"[Reranker] 无法加载 cross-encoder，降级为分数排序: {e}")
-        return None
+# ─────────────────────────────────────────────────────────────────
+# 重排
+# ─────────────────────────────────────────────────────────────────
+
+
+def _candidate_text(c: Dict[str, Any]) -> str:
+    return c.get("text", c.get("content", c.get("page_content", "")))
+
+
+def _apply_scores(
+    candidates: List[Dict[str, Any]], scores: np.ndarray, top_k: int
+) -> List[Dict[str, Any]]:
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    result = []
+    for i in order.tolist():
+        d = dict(candidates[i])
+        d["rerank_score"] = round(float(scores[i]), 4)
+        result.append(d)
+    return result
+
+
+def _fallback(candidates: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+    # score
+    fallback = sorted(candidates, key=lambda x: float(x.get("score", 0)), reverse=True)
+    for d in fallback:
+        d["rerank_score"] = d.get("score", 0.0)
+    return fallback[:top_k]
 
 
-# - -
 def rerank_documents(
     query: str,
     candidates: List[Dict[str, Any]],
     top_k: int = 5,
-    model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+    model_name: str = API_DEFAULT_MODEL,
 ) -> List[Dict[str, Any]]:
     """
     对候选文档重排序
@@ -68,26 +398,13 @@ def rerank_documents(
     if not candidates:
         return []
 
-    model = _get_reranker(model_name)
-
-    if model is not None:
-        # cross-encoder (query, passage)
-        pairs = [
-            (query, c.get("text", c.get("content", c.get("page_content", ""))))
-            for c in candidates
-        ]
+    service = get_rerank_service()
+    if service.available(model_name):
         try:
-            scores = model.predict(pairs)
-            scored = sorted(
-                zip(candidates, scores),
-                key=lambda x: float(x[1]),
-                reverse=True,
+            scores = service.score(
+                query, [_candidate_text(c) for c in candidates], model_name=model_name
             )
-            result = []
-            for doc, score in scored[:top_k]:
-                d = dict(doc)
-                d["rerank_score"] = round(float(score), 4)
-                result.append(d)
+            result = _apply_scores(candidates, scores, top_k)
             logger.debug(
                 f"[Reranker] cross-encoder重排 {len(candidates)}→{len(result)} 条"
             )
@@ -95,11 +412,30 @@ def rerank_documents(
         except Exception as e:
             logger.warning(f"[Reranker] cross-encoder推理失败，降级: {e}")
 
-    # score
-    fallback = sorted(candidates, key=lambda x: float(x.get("score", 0)), reverse=True)
-    for d in fallback:
-        d["rerank_score"] = d.get("score", 0.0)
-    return fallback[:top_k]
+    return _fallback(candidates, top_k)
+
+
+async def arerank_documents(
+    query: str,
+    candidates: List[Dict[str, Any]],
+    top_k: int = 5,
+    model_name: str = API_DEFAULT_MODEL,
+) -> List[Dict[str, Any]]:
+    """rerank_documents 的异步版本：模型加载与推理均不在 event loop 线程中执行"""
+    if not candidates:
+        return []
+
+    service = get_rerank_service()
+    if await asyncio.to_thread(service.available, model_name):
+        try:
+            scores = await service.ascore(
+                query, [_candidate_text(c) for c in candidates], model_name=model_name
+            )
+            return _apply_scores(candidates, scores, top_k)
+        except Exception as e:
+            logger.warning(f"[Reranker] cross-encoder推理失败，降级: {e}")
+
+    return _fallback(candidates, top_k)
 
 
 # - FastAPI -
@@ -107,7 +443,7 @@ class RerankRequest(BaseModel):
     query: str
     candidates: List[Dict[str, Any]]  # "text" "content"
     top_k: int = 5
-    model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    model_name: str = API_DEFAULT_MODEL
 
 
 @router.post("")
@@ -117,9 +453,10 @@ async def rerank_api(req: RerankRequest):
 
     - 输入: query + candidates（可带 score/metadata）
     - 输出: 重排后 top_k 文档，带 rerank_score 字段
-    - 无 sentence-transformers 时自动降级为按原始 score 排序
+    - 并发请求在推理服务中合并为微批
+    - 无 cross-encoder 依赖时自动降级为按原始 score 排序
     """
-    results = rerank_documents(
+    results = await arerank_documents(
         query=req.query,
         candidates=req.candidates,
         top_k=req.top_k,
@@ -133,6 +470,12 @@ async def rerank_api(req: RerankRequest):
     }
 
 
+@router.get("/stats")
+async def rerank_stats():
+    """推理服务统计：常驻模型、微批大小、分数缓存命中"""
+    return get_rerank_service().stats()
+
+
 @router.get("/models")
 async def list_rerank_models():
     """列出推荐的 cross-encoder 模型"""
@@ -0,0 +1,228 @@
+"""
+test_ann_index.py — 按知识库选择 ANN 索引（RAG_M/src/vectorstore/ann_index.py）
+
+测试范围：
+  1. IndexSpec 解析：knowledge_data.json 的 ann_index 字段、无效配置降级为 flat
+  2. 低于 train_threshold 时为 flat，超过后构建 IVF-Flat / IVF-PQ / HNSW，召回率接近 flat
+  3. 单次查询的 nprobe / efSearch 参数
+  4. VectorStoreManager：add_documents 超过阈值自动升级，HNSW 删除时重建且 chunk_id 不变
+"""
+
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT))
+sys.path.insert(0, str(BACKEND_ROOT / "RAG_M" / "src"))
+
+try:
+    import faiss
+    import numpy as np
+
+    from vectorstore.ann_index import (
+        IndexSpec,
+        build_index,
+        index_kind,
+        rebuild,
+        search_params,
+    )
+
+    _IMPORT_ERROR = None
+except ImportError as e:  # faiss / numpy 未安装
+    _IMPORT_ERROR = e
+
+
+def _clustered(n, dim=32, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype("float32") * 4
+    labels = rng.integers(0, clusters, size=n)
+    return (centers[labels] + rng.normal(size=(n, dim))).astype("float32")
+
+
+def _recall(index, base, queries, k=10, params=None):
+    exact = faiss.IndexFlatL2(base.shape[1])
+    exact.add(base)
+    _, truth = exact.search(queries, k)
+    _, found = index.search(queries, k, params=params)
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    return hits / truth.size
+
+
+@unittest.skipIf(_IMPORT_ERROR is not None, f"faiss 不可用: {_IMPORT_ERROR}")
+class TestIndexSpec(unittest.TestCase):
+    def test_from_kb_dir(self):
+        with tempfile.TemporaryDirectory() as kb_dir:
+            self.assertEqual(IndexSpec.from_kb_dir(kb_dir).type, "flat")
+            config = {"title": "kb", "ann_index": {"type": "hnsw", "ef_search": 96}}
+            with open(Path(kb_dir) / "knowledge_data.json", "w") as f:
+                json.dump(config, f)
+            spec = IndexSpec.from_kb_dir(kb_dir)
+        self.assertEqual((spec.type, spec.ef_search), ("hnsw", 96))
+        self.assertEqual(IndexSpec.from_config(spec.to_config()), spec)
+
+    def test_invalid_spec_falls_back_to_flat(self):
+        self.assertEqual(IndexSpec.from_config({"type": "lsh"}).type, "flat")
+        self.assertEqual(IndexSpec.from_config({"type": "ivf_pq"}).type, "ivf_pq")
+        self.assertEqual(IndexSpec.from_config("hnsw").type, "hnsw")
+        with self.assertRaises(ValueError):
+            IndexSpec(type="lsh")
+
+    def test_auto_params(self):
+        spec = IndexSpec(type="ivf_pq")
+        self.assertEqual(spec.pq_m_for(384), 48)
+        self.assertEqual(spec.pq_m_for(30), 3)
+        # 每个中心至少 39 个训练样本
+        self.assertEqual(spec.nlist_for(1000), 25)
+        self.assertEqual(IndexSpec(nlist=4096).nlist_for(100000), 2564)
+
+
+@unittest.skipIf(_IMPORT_ERROR is not None, f"faiss 不可用: {_IMPORT_ERROR}")
+class TestBuildIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.base = _clustered(4000)
+        cls.queries = _clustered(50, seed=1)
+
+    def test_below_threshold_stays_flat(self):
+        index = build_index(IndexSpec(type="hnsw"), self.base, faiss.METRIC_L2)
+        self.assertEqual(index_kind(index), "flat")
+        self.assertEqual(index.ntotal, len(self.base))
+
+    def test_ann_recall(self):
+        for kind, min_recall in (("ivf_flat", 0.9), ("hnsw", 0.9), ("ivf_pq", 0.5)):
+            spec = IndexSpec(type=kind, train_threshold=1000, nprobe=8)
+            index = build_index(spec, self.base, faiss.METRIC_L2)
+            self.assertEqual(index_kind(index), kind)
+            self.assertEqual(index.ntotal, len(self.base))
+            self.assertGreaterEqual(
+                _recall(index, self.base, self.queries), min_recall, kind
+            )
+
+    def test_search_params(self):
+        spec = IndexSpec(type="ivf_flat", train_threshold=1000, nprobe=1)
+        index = build_index(spec, self.base, faiss.METRIC_L2)
+        low = _recall(index, self.base, self.queries)
+        high = _recall(
+            index, self.base, self.queries, params=search_params(index, nprobe=64)
+        )
+        self.assertGreater(high, low)
+        # 参数只作用于单次查询
+        self.assertEqual(index.nprobe, 1)
+
+        hnsw = build_index(
+            IndexSpec(type="hnsw", train_threshold=0), self.base, faiss.METRIC_L2
+        )
+        self.assertEqual(search_params(hnsw, ef_search=128).efSearch, 128)
+        self.assertIsNone(search_params(hnsw, nprobe=8))
+        self.assertIsNone(search_params(faiss.IndexFlatL2(4), nprobe=8))
+
+    def test_rebuild_keeps_ids(self):
+        flat = faiss.IndexIDMap2(faiss.IndexFlatL2(self.base.shape[1]))
+        ids = np.arange(len(self.base), dtype=np.int64) * 3
+        flat.add_with_ids(self.base, ids)
+        spec = IndexSpec(type="hnsw", train_threshold=1000)
+        index = rebuild(spec, flat, faiss.METRIC_L2, drop_ids=ids[:10])
+        self.assertEqual(index_kind(index), "hnsw")
+        self.assertEqual(index.ntotal, len(self.base) - 10)
+        _, found = index.search(self.base[20:21], 1)
+        self.assertEqual(found[0][0], ids[20])
+
+
+def _preload_backend_model_config():
+    """与 test_rag_vectorstore.py 相同：按文件路径预先载入 RagBackend/models/model_config.py"""
+    import importlib.util
+
+    name = "models.model_config"
+    if name in sys.modules:
+        return
+    spec = importlib.util.spec_from_file_location(
+        name, BACKEND_ROOT / "models" / "model_config.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[name] = module
+
+
+class TestVectorStoreIndexSpec(unittest.TestCase):
+    """VectorStoreManager：flat → ANN 自动升级，HNSW 删除 chunk 时重建"""
+
+    DIM = 8
+
+    def setUp(self):
+        try:
+            import numpy as np
+            from langchain.docstore.document import Document
+            from langchain_core.embeddings import Embeddings
+
+            _preload_backend_model_config()
+            from RAG_M.src.vectorstore.ann_index import IndexSpec, index_kind
+            from RAG_M.src.vectorstore.vector_store import VectorStoreManager
+        except ImportError as e:
+            self.skipTest(f"向量库依赖不可用: {e}")
+
+        dim = self.DIM
+
+        class CharEmbeddings(Embeddings):
+            def embed_documents(self, texts):
+                return [self.embed_query(t) for t in texts]
+
+            def embed_query(self, text):
+                vec = np.zeros(dim, dtype="float32")
+                for i, ch in enumerate(text):
+                    vec[(ord(ch) + i) % dim] += 1.0
+                return vec.tolist()
+
+        self.np = np
+        self.IndexSpec = IndexSpec
+        self.index_kind = index_kind
+        self.embeddings = CharEmbeddings()
+        self.manager = VectorStoreManager.__new__(VectorStoreManager)
+        self.manager._embeddings = self.embeddings
+        self.manager._embedder = None
+        self.manager._embedding_model = "char-mock"
+        self.docs = [
+            Document(page_content=f"chunk {i} " + "xy" * (i % 7) + str(i * 7919))
+            for i in range(60)
+        ]
+
+    def _vectors(self, docs):
+        return self.np.array(
+            [self.embeddings.embed_query(d.page_content) for d in docs], dtype="float32"
+        )
+
+    def test_upgrade_on_add_and_hnsw_remove(self):
+        self.manager.index_spec = self.IndexSpec(type="hnsw", train_threshold=40)
+        vs = self.manager._empty_vectorstore(self.DIM)
+
+        self.manager.add_documents(vs, self.docs[:30], self._vectors(self.docs[:30]))
+        self.assertEqual(self.index_kind(vs.index), "flat")
+
+        ids = self.manager.add_documents(
+            vs, self.docs[30:], self._vectors(self.docs[30:])
+        )
+        self.assertEqual(ids, list(range(30, 60)))
+        self.assertEqual(self.index_kind(vs.index), "hnsw")
+        self.assertEqual(vs.index.ntotal, 60)
+        self.assertEqual(vs.ef_search, self.manager.index_spec.ef_search)
+
+        removed = self.manager.remove_chunks(vs, [3, 45])
+        self.assertEqual(removed, 2)
+        self.assertEqual(vs.index.ntotal, 58)
+        self.assertNotIn(3, vs.index_to_docstore_id)
+
+        hit = vs.similarity_search(self.docs[50].page_content, k=1, ef_search=128)[0]
+        self.assertEqual(hit.metadata["chunk_id"], 50)
+
+    def test_flat_spec_never_upgrades(self):
+        self.manager.index_spec = self.IndexSpec(train_threshold=1)
+        vs = self.manager._empty_vectorstore(self.DIM)
+        self.manager.add_documents(vs, self.docs, self._vectors(self.docs))
+        self.assertFalse(self.manager.apply_index_spec(vs))
+        self.assertEqual(self.index_kind(vs.index), "flat")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
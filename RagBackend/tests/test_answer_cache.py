@@ -0,0 +1,156 @@
+"""
+test_answer_cache.py — RAG 回答缓存与请求合并测试（RAG_M/src/rag/answer_cache.py）
+
+测试范围：
+  1. query 规范化
+  2. 并发相同请求只生成一次，所有等待者收到完整流；之后命中缓存回放
+  3. 索引签名变化时失效；失败的回答不缓存
+  4. TTL 与 LRU 淘汰
+  5. 语义查找（相似度阈值）
+  6. 非流式 run：合并并发请求，单个等待者取消不影响其他等待者
+"""
+
+import asyncio
+import sys
+import time
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT / "RAG_M" / "src"))
+
+from rag.answer_cache import AnswerCache, make_key, normalize_query  # noqa: E402
+
+
+def _producer(calls, chunks, delay=0.02):
+    async def gen():
+        calls.append(1)
+        for c in chunks:
+            await asyncio.sleep(delay)
+            yield c
+
+    return gen
+
+
+ANSWER = ["data: 检索完成\n\n", "data: 你好\n\n", "data: COMPLETE\n\n"]
+
+
+async def _collect(stream):
+    return [c async for c in stream]
+
+
+class TestAnswerCache(unittest.TestCase):
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query("  什么是 RAG？ "), "什么是 rag")
+        self.assertEqual(normalize_query("什么是\tRAG?"), "什么是 rag")
+        self.assertEqual(
+            make_key("rag", "/kb", "m", "ＲＡＧ 是什么"),
+            make_key("rag", "/kb", "m", "rag  是什么。"),
+        )
+
+    def test_concurrent_requests_share_one_generation(self):
+        cache = AnswerCache()
+        calls = []
+        key = make_key("rag", "/kb", "m", "q")
+
+        async def run():
+            outs = await asyncio.gather(
+                *[
+                    _collect(cache.stream(key, "sig", _producer(calls, ANSWER)))
+                    for _ in range(5)
+                ]
+            )
+            replay = await _collect(cache.stream(key, "sig", _producer(calls, ANSWER)))
+            return outs, replay
+
+        outs, replay = asyncio.run(run())
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(o == ANSWER for o in outs))
+        self.assertEqual(replay, ANSWER)
+        stats = cache.stats()
+        self.assertEqual(stats["coalesced"], 4)
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["in_flight"], 0)
+
+    def test_signature_change_and_errors(self):
+        cache = AnswerCache()
+        calls = []
+        key = make_key("rag", "/kb", "m", "q")
+        failed = ["data: ERROR: 无法连接\n\n", "data: COMPLETE\n\n"]
+
+        async def run():
+            await _collect(cache.stream(key, "v1", _producer(calls, ANSWER, 0)))
+            await _collect(cache.stream(key, "v1", _producer(calls, ANSWER, 0)))
+            # 索引更新 → 重新生成
+            await _collect(cache.stream(key, "v2", _producer(calls, ANSWER, 0)))
+            other = make_key("rag", "/kb", "m", "q2")
+            await _collect(cache.stream(other, "v2", _producer(calls, failed, 0)))
+            await _collect(cache.stream(other, "v2", _producer(calls, failed, 0)))
+
+        asyncio.run(run())
+        self.assertEqual(len(calls), 4)
+
+    def test_ttl_and_lru(self):
+        cache = AnswerCache(max_entries=2, ttl=0.1)
+        keys = [make_key("rag", "/kb", "m", f"q{i}") for i in range(3)]
+        for k in keys:
+            cache.put(k, "sig", ANSWER)
+        self.assertIsNone(cache.get(keys[0], "sig"))
+        self.assertEqual(cache.get(keys[2], "sig"), ANSWER)
+        time.sleep(0.15)
+        self.assertIsNone(cache.get(keys[2], "sig"))
+
+    def test_semantic_lookup(self):
+        cache = AnswerCache(similarity=0.9)
+        vecs = {
+            "年假怎么申请": np.array([1.0, 0.0, 0.1]),
+            "如何申请年假": np.array([1.0, 0.0, 0.12]),
+            "报销流程": np.array([0.0, 1.0, 0.0]),
+        }
+        calls = []
+
+        async def run():
+            for q in ("年假怎么申请", "如何申请年假", "报销流程"):
+                await _collect(
+                    cache.stream(
+                        make_key("rag", "/kb", "m", q),
+                        "sig",
+                        _producer(calls, ANSWER, 0),
+                        embed=vecs.__getitem__,
+                    )
+                )
+
+        asyncio.run(run())
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(cache.stats()["semantic_hits"], 1)
+
+    def test_run_coalesces_and_survives_cancelled_waiter(self):
+        cache = AnswerCache()
+        calls = []
+        key = make_key("rag_sync", "/kb", "m", "q")
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return {"answer": "ok"}
+
+        async def run():
+            first = asyncio.ensure_future(cache.run(key, "sig", fn))
+            await asyncio.sleep(0.01)
+            second = asyncio.ensure_future(cache.run(key, "sig", fn))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            result = await second
+            cached = await cache.run(key, "sig", fn)
+            return result, cached
+
+        result, cached = asyncio.run(run())
+        self.assertEqual(result, {"answer": "ok"})
+        self.assertEqual(cached, {"answer": "ok"})
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,195 @@
+"""
+test_audit_log.py — 审计日志后台批量写入（audit/audit_log.py）
+
+测试范围：
+  1. 事件攒批写入：多行一个事务，数据库为 WAL 模式
+  2. 队列满时的 drop / block 策略
+  3. close 写完剩余事件，之后的事件被丢弃
+  4. AuditMiddleware 只入队：JWT 解码与操作类型推断在写线程中完成，"/" 只跳过根路径
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT))
+
+from audit.audit_log import AuditLogWriter, AuditMiddleware  # noqa: E402
+
+
+def _event(i, **extra):
+    return {"timestamp": float(i), "action": "READ", "request_path": f"/x/{i}", **extra}
+
+
+class _GatedWriter(AuditLogWriter):
+    """写库前等待 gate，用来模拟写线程落后、队列积压"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.gate = threading.Event()
+        self.writing = threading.Event()
+
+    def _write(self, conn, batch):
+        self.writing.set()
+        self.gate.wait(10)
+        return super()._write(conn, batch)
+
+
+class TestAuditLogWriter(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.db_path = Path(self._tmp.name) / "audit.db"
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _rows(self, sql="SELECT * FROM audit_logs ORDER BY timestamp"):
+        conn = sqlite3.connect(str(self.db_path))
+        conn.row_factory = sqlite3.Row
+        try:
+            return [dict(r) for r in conn.execute(sql).fetchall()]
+        finally:
+            conn.close()
+
+    def test_batched_writes_in_wal_mode(self):
+        writer = AuditLogWriter(self.db_path, batch_size=10, flush_interval_ms=50)
+        for i in range(25):
+            self.assertTrue(writer.submit(_event(i)))
+        self.assertTrue(writer.flush())
+
+        rows = self._rows()
+        self.assertEqual(
+            [r["request_path"] for r in rows], [f"/x/{i}" for i in range(25)]
+        )
+        stats = writer.stats()
+        self.assertEqual(stats["written"], 25)
+        self.assertLess(stats["batches"], 25)
+        self.assertEqual(self._rows("PRAGMA journal_mode")[0]["journal_mode"], "wal")
+        writer.close()
+
+    def test_drop_policy(self):
+        writer = _GatedWriter(
+            self.db_path, queue_size=2, batch_size=1, flush_interval_ms=0
+        )
+        writer.submit(_event(0))
+        self.assertTrue(writer.writing.wait(5))
+        results = [writer.submit(_event(i)) for i in range(1, 5)]
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(writer.stats()["dropped"], 2)
+
+        writer.gate.set()
+        writer.close()
+        self.assertEqual(len(self._rows()), 3)
+
+    def test_block_policy_waits_for_space(self):
+        writer = _GatedWriter(
+            self.db_path,
+            queue_size=1,
+            batch_size=1,
+            flush_interval_ms=0,
+            policy="block",
+            block_timeout_ms=50,
+        )
+        writer.submit(_event(0))
+        self.assertTrue(writer.writing.wait(5))
+        self.assertTrue(writer.submit(_event(1)))
+        # 队列满且写线程卡住：等满 block_timeout 后丢弃
+        self.assertFalse(writer.submit(_event(2)))
+
+        writer.block_timeout = 5.0
+        threading.Timer(0.1, writer.gate.set).start()
+        self.assertTrue(writer.submit(_event(3)))
+        writer.close()
+        self.assertEqual([r["timestamp"] for r in self._rows()], [0.0, 1.0, 3.0])
+        self.assertEqual(writer.stats()["dropped"], 1)
+
+    def test_close_flushes_pending(self):
+        writer = AuditLogWriter(self.db_path, batch_size=1000, flush_interval_ms=60000)
+        for i in range(100):
+            writer.submit(_event(i))
+        writer.close()
+        self.assertEqual(len(self._rows()), 100)
+        self.assertFalse(writer.submit(_event(100)))
+
+
+class TestAuditMiddleware(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.db_path = Path(self._tmp.name) / "audit.db"
+        self.writer = AuditLogWriter(self.db_path, flush_interval_ms=10)
+
+    def tearDown(self):
+        self.writer.close()
+        self._tmp.cleanup()
+
+    def _request(self, middleware, path, method="GET", headers=()):
+        async def run():
+            async def receive():
+                return {"type": "http.request", "body": b""}
+
+            async def send(message):
+                pass
+
+            scope = {
+                "type": "http",
+                "method": method,
+                "path": path,
+                "headers": list(headers),
+                "client": ("10.0.0.1", 5000),
+            }
+            await middleware(scope, receive, send)
+
+        asyncio.run(run())
+
+    def test_records_request_with_user(self):
+        try:
+            import jwt
+        except ImportError as e:
+            self.skipTest(f"PyJWT 不可用: {e}")
+
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 201, "headers": []})
+            await send({"type": "http.response.body", "body": b"ok"})
+
+        token = jwt.encode(
+            {"user_id": 7, "email": "a@b.c"},
+            os.getenv("JWT_SECRET", "changeme_jwt_secret"),
+            algorithm="HS256",
+        )
+        middleware = AuditMiddleware(app, writer=self.writer)
+        self._request(
+            middleware,
+            "/api/knowledge/kb-1234/query",
+            method="POST",
+            headers=[
+                (b"authorization", f"Bearer {token}".encode()),
+                (b"user-agent", b"pytest"),
+            ],
+        )
+        self._request(middleware, "/")
+        self._request(middleware, "/docs")
+        self.assertTrue(self.writer.flush())
+
+        conn = sqlite3.connect(str(self.db_path))
+        conn.row_factory = sqlite3.Row
+        rows = [dict(r) for r in conn.execute("SELECT * FROM audit_logs").fetchall()]
+        conn.close()
+        self.assertEqual(len(rows), 1)
+        row = rows[0]
+        self.assertEqual((row["user_id"], row["user_email"]), ("7", "a@b.c"))
+        self.assertEqual(
+            (row["action"], row["resource_type"]), ("QUERY", "knowledge_base")
+        )
+        self.assertEqual(row["resource_id"], "query")
+        self.assertEqual((row["status_code"], row["ip_address"]), (201, "10.0.0.1"))
+        self.assertEqual(row["user_agent"], "pytest")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
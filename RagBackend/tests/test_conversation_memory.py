@@ -0,0 +1,170 @@
+"""
+test_conversation_memory.py — 滚动摘要上下文窗口（rag_enhancement/conversation_memory.py）
+
+测试范围：
+  1. 窗口从尾部读取：时间正序、不超过 token 预算
+  2. 首次溢出调用一次 LLM；重复读取不再调用
+  3. 新消息滑出窗口时只把新滑出的消息连同已有摘要交给 LLM
+  4. LLM 失败时返回临时摘要且不推进水位
+  5. 并发读取同一会话只调用一次 LLM，返回同一摘要
+  6. 旧库自动补充 summary_upto 列
+"""
+
+import asyncio
+import sqlite3
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT))
+
+try:
+    from rag_enhancement import conversation_memory as cm
+
+    _IMPORT_ERROR = None
+except ImportError as e:
+    _IMPORT_ERROR = e
+
+
+@unittest.skipIf(_IMPORT_ERROR is not None, f"依赖不可用: {_IMPORT_ERROR}")
+class TestRollingSummary(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._db = mock.patch.object(
+            cm, "DB_PATH", str(Path(self._tmp.name) / "conv.db")
+        )
+        self._db.start()
+        cm.init_db()
+        self.conv_id = cm.create_conversation(
+            cm.ConvCreate(user_id="u1", kb_ids=["kb"])
+        )["conv_id"]
+        self.calls = []
+
+        async def fake_summarize(messages, previous=None, model=None):
+            self.calls.append(([m["id"] for m in messages], previous))
+            return f"摘要{len(self.calls)}"
+
+        self._llm = mock.patch.object(cm, "asummarize_messages", fake_summarize)
+        self._llm.start()
+
+    def tearDown(self):
+        self._llm.stop()
+        self._db.stop()
+        self._tmp.cleanup()
+
+    def _add(self, n, start=0):
+        for i in range(start, start + n):
+            role = "user" if i % 2 == 0 else "assistant"
+            cm.add_message(
+                cm.MessageAdd(conv_id=self.conv_id, role=role, content=f"m{i}")
+            )
+
+    def _window(self, max_tokens):
+        return asyncio.run(cm.get_context_window(self.conv_id, max_tokens=max_tokens))
+
+    def _set_token_est(self, value):
+        conn = cm.get_db()
+        conn.execute("UPDATE messages SET token_est=?", (value,))
+        conn.commit()
+        conn.close()
+
+    def test_window_tail_and_no_summary(self):
+        self._add(6)
+        self._set_token_est(10)
+        result = self._window(max_tokens=100)
+        self.assertEqual(
+            [m["content"] for m in result["messages"]], [f"m{i}" for i in range(6)]
+        )
+        self.assertIsNone(result["summary"])
+        self.assertEqual(self.calls, [])
+
+        result = self._window(max_tokens=35)
+        self.assertEqual([m["content"] for m in result["messages"]], ["m3", "m4", "m5"])
+        self.assertEqual(result["used_tokens"], 30)
+        self.assertEqual(result["total_turns"], 6)
+
+    def test_incremental_summary(self):
+        self._add(10)
+        self._set_token_est(10)
+
+        first = self._window(max_tokens=40)
+        self.assertEqual(first["summary"], "摘要1")
+        self.assertEqual(self.calls, [([1, 2, 3, 4, 5, 6], None)])
+
+        # 没有新消息滑出：直接返回已存摘要
+        self.assertEqual(self._window(max_tokens=40)["summary"], "摘要1")
+        self.assertEqual(len(self.calls), 1)
+
+        self._add(2, start=10)
+        self._set_token_est(10)
+        result = self._window(max_tokens=40)
+        self.assertEqual(
+            [m["content"] for m in result["messages"]], ["m8", "m9", "m10", "m11"]
+        )
+        self.assertEqual(result["summary"], "摘要2")
+        self.assertEqual(self.calls[1], ([7, 8], "摘要1"))
+
+    def test_llm_failure_keeps_watermark(self):
+        self._add(6)
+        self._set_token_est(10)
+
+        async def failing(messages, previous=None, model=None):
+            return None
+
+        with mock.patch.object(cm, "asummarize_messages", failing):
+            result = self._window(max_tokens=20)
+        self.assertTrue(result["summary"].startswith("历史摘要："))
+
+        conn = cm.get_db()
+        row = conn.execute(
+            "SELECT summary, summary_upto FROM conversations WHERE id=?",
+            (self.conv_id,),
+        ).fetchone()
+        conn.close()
+        self.assertEqual((row["summary"], row["summary_upto"]), (None, 0))
+
+        # LLM 恢复后重新并入全部滑出的消息
+        self.assertEqual(self._window(max_tokens=20)["summary"], "摘要1")
+        self.assertEqual(self.calls, [([1, 2, 3, 4], None)])
+
+    def test_concurrent_reads_summarize_once(self):
+        self._add(10)
+        self._set_token_est(10)
+
+        async def slow_summarize(messages, previous=None, model=None):
+            self.calls.append(([m["id"] for m in messages], previous))
+            await asyncio.sleep(0.05)
+            return f"摘要{len(self.calls)}"
+
+        async def run():
+            return await asyncio.gather(
+                *(cm.get_context_window(self.conv_id, max_tokens=40) for _ in range(3))
+            )
+
+        with mock.patch.object(cm, "asummarize_messages", slow_summarize):
+            results = asyncio.run(run())
+        self.assertEqual(self.calls, [([1, 2, 3, 4, 5, 6], None)])
+        self.assertEqual({r["summary"] for r in results}, {"摘要1"})
+
+    def test_migrates_old_table(self):
+        old_db = Path(self._tmp.name) / "old.db"
+        conn = sqlite3.connect(str(old_db))
+        conn.execute(
+            "CREATE TABLE conversations (id TEXT PRIMARY KEY, user_id TEXT, "
+            "kb_ids TEXT, title TEXT, summary TEXT, turn_count INTEGER DEFAULT 0)"
+        )
+        conn.commit()
+        conn.close()
+        with mock.patch.object(cm, "DB_PATH", str(old_db)):
+            cm.init_db()
+        conn = sqlite3.connect(str(old_db))
+        columns = [r[1] for r in conn.execute("PRAGMA table_info(conversations)")]
+        conn.close()
+        self.assertIn("summary_upto", columns)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,210 @@
+"""
+test_llm_client.py — 共享 LLM 客户端层测试
+使用本地线程 HTTP 服务模拟 Ollama（/api/chat、/api/generate），不依赖真实模型服务
+
+测试范围：
+  1. 每个 host 的并发上限（超出的请求排队）
+  2. 同步流式接口逐行返回 NDJSON
+  3. 客户端断开时取消进行中的请求
+  4. native_rag._ollama_generate 经连接池调用
+  5. provider 指标：连接复用（新建连接数）、TTFT、失败计数
+"""
+
+import asyncio
+import json
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT))
+sys.path.insert(0, str(BACKEND_ROOT / "RAG_M" / "src"))
+
+
+class FakeOllama:
+    """最小 Ollama 模拟：每个请求延迟 delay 秒，记录同时处理的最大请求数"""
+
+    def __init__(self, delay: float = 0.2):
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with owner._lock:
+                    owner.active += 1
+                    owner.peak = max(owner.peak, owner.active)
+                try:
+                    time.sleep(owner.delay)
+                    if body.get("stream"):
+                        lines = [{"response": t, "done": False} for t in ("你", "好")]
+                        lines.append({"response": "", "done": True})
+                        payload = "".join(json.dumps(x) + "\n" for x in lines)
+                    elif self.path == "/api/chat":
+                        payload = json.dumps({"message": {"content": "pong"}})
+                    else:
+                        payload = json.dumps({"response": "完整回答"})
+                    data = payload.encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                finally:
+                    with owner._lock:
+                        owner.active -= 1
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestLLMClientPool(unittest.TestCase):
+    def setUp(self):
+        from multi_model.llm_client import LLMClientPool
+
+        self.ollama = FakeOllama(delay=0.2)
+        self.pool = LLMClientPool(max_concurrency=2)
+
+    def tearDown(self):
+        self.ollama.close()
+
+    def test_per_host_concurrency_limit(self):
+        async def run():
+            payload = {"model": "m", "messages": [], "stream": False}
+            resps = await asyncio.gather(
+                *[
+                    self.pool.post(self.ollama.url, "/api/chat", json=payload)
+                    for _ in range(6)
+                ]
+            )
+            await self.pool.aclose()
+            return resps
+
+        t0 = time.perf_counter()
+        resps = asyncio.run(run())
+        elapsed = time.perf_counter() - t0
+        self.assertTrue(all(r.json()["message"]["content"] == "pong" for r in resps))
+        self.assertEqual(self.ollama.peak, 2)
+        # 6 个请求、并发 2、每个 0.2s → 至少 3 轮
+        self.assertGreaterEqual(elapsed, 0.55)
+
+    def test_stream_lines_sync(self):
+        lines = list(
+            self.pool.stream_lines_sync(
+                self.ollama.url, "/api/generate", json={"stream": True}
+            )
+        )
+        self.assertEqual([json.loads(x)["response"] for x in lines], ["你", "好", ""])
+
+    def test_cancel_on_disconnect(self):
+        from multi_model.llm_client import ClientDisconnected, cancel_on_disconnect
+
+        self.ollama.delay = 1.0
+
+        class DisconnectedRequest:
+            async def is_disconnected(self):
+                return True
+
+        async def run():
+            try:
+                await cancel_on_disconnect(
+                    DisconnectedRequest(),
+                    self.pool.post(self.ollama.url, "/api/chat", json={}),
+                    poll_interval=0.05,
+                )
+            finally:
+                await self.pool.aclose()
+
+        t0 = time.perf_counter()
+        with self.assertRaises(ClientDisconnected):
+            asyncio.run(run())
+        self.assertLess(time.perf_counter() - t0, 0.6)
+
+
+class TestProviderMetrics(unittest.TestCase):
+    def setUp(self):
+        from multi_model.llm_client import LLMClientPool
+        from monitoring.metrics import STATS
+
+        self.stats = STATS
+        self.ollama = FakeOllama(delay=0.0)
+        self.pool = LLMClientPool(max_concurrency=2)
+
+    def tearDown(self):
+        self.ollama.close()
+
+    def test_connection_reuse_and_ttft(self):
+        async def run():
+            await self.pool.open({"metrics-reuse": self.ollama.url})
+            try:
+                for _ in range(3):
+                    await self.pool.post(self.ollama.url, "/api/chat", json={})
+                return [
+                    line
+                    async for line in self.pool.stream_lines(
+                        self.ollama.url, "/api/generate", json={"stream": True}
+                    )
+                ]
+            finally:
+                await self.pool.aclose()
+
+        lines = asyncio.run(run())
+        self.assertEqual(len(lines), 3)
+        name = "metrics-reuse"
+        self.assertEqual(self.stats.provider_requests[name], 4)
+        self.assertEqual(self.stats.provider_connections[name], 1)
+        self.assertEqual(self.stats.provider_errors[name], 0)
+        self.assertEqual(len(self.stats.provider_ttft[name]), 4)
+        self.assertEqual(self.stats.provider_reuse_ratio(name), 0.75)
+
+    def test_sync_error_is_counted(self):
+        with self.assertRaises(Exception):
+            self.pool.post_sync(
+                "http://127.0.0.1:9", "/api/chat", json={}, provider="metrics-down"
+            )
+        self.assertEqual(self.stats.provider_errors["metrics-down"], 1)
+        self.assertEqual(len(self.stats.provider_ttft["metrics-down"]), 0)
+
+
+class TestOllamaGenerate(unittest.TestCase):
+    def setUp(self):
+        self.ollama = FakeOllama(delay=0.0)
+
+    def tearDown(self):
+        self.ollama.close()
+
+    def test_stream_and_non_stream(self):
+        from rag.native_rag import _ollama_generate
+
+        tokens = list(_ollama_generate("m", "q", host=self.ollama.url, stream=True))
+        self.assertEqual(tokens, ["你", "好"])
+        answer = list(_ollama_generate("m", "q", host=self.ollama.url, stream=False))
+        self.assertEqual(answer, ["完整回答"])
+
+    def test_connection_error_is_reported(self):
+        from rag.native_rag import _ollama_generate
+
+        out = list(_ollama_generate("m", "q", host="http://127.0.0.1:9", timeout=2))
+        self.assertEqual(len(out), 1)
+        self.assertTrue(out[0].startswith("[ERROR] 无法连接 Ollama 服务"))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,163 @@
+"""
+test_load_balancer.py — extended_model_router.LoadBalancer 测试
+模型表通过 load_models 注入，不读取 model_usage.db 中的配置
+
+测试范围：
+  1. 模型表缓存与定时刷新
+  2. 按 TTFT / tokens/s EWMA 与进行中请求数路由到最快的模型
+  3. 熔断器：连续失败熔断，期满后半开只放行一个探测请求
+  4. /chat：进行中计数只在流式生成器内占用，未开始的响应不泄漏探测名额
+"""
+
+import asyncio
+import random
+import sys
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT))
+
+
+def _table(*specs):
+    return [
+        {
+            "model_id": mid,
+            "provider": "ollama",
+            "priority": prio,
+            "enabled": 1,
+            "api_key_env": "",
+        }
+        for mid, prio in specs
+    ]
+
+
+class TestLoadBalancer(unittest.TestCase):
+    def _lb(self, table, **kwargs):
+        from multi_model.extended_model_router import LoadBalancer
+
+        self.loads = 0
+
+        def load():
+            self.loads += 1
+            return table
+
+        return LoadBalancer(load_models=load, rng=random.Random(0), **kwargs)
+
+    def test_model_table_is_cached_and_refreshed(self):
+        lb = self._lb(_table(("a", 5)), refresh_seconds=0.2)
+        for _ in range(10):
+            lb.pick_model()
+        self.assertEqual(self.loads, 1)
+        time.sleep(0.25)
+        lb.pick_model()
+        self.assertEqual(self.loads, 2)
+        lb.invalidate()
+        lb.pick_model()
+        self.assertEqual(self.loads, 3)
+
+    def test_cold_start_uses_priority(self):
+        lb = self._lb(_table(("low", 1), ("high", 9)))
+        self.assertEqual(lb.pick_model(), "high")
+
+    def test_routes_to_fastest_model(self):
+        lb = self._lb(_table(("slow", 9), ("fast", 1), ("mid", 5)))
+        for _ in range(3):
+            lb.record_success("slow", ttft_ms=2000, tokens_per_s=10)
+            lb.record_success("mid", ttft_ms=800, tokens_per_s=30)
+            lb.record_success("fast", ttft_ms=100, tokens_per_s=80)
+        picks = [lb.pick_model() for _ in range(200)]
+        # power of two choices：最慢的模型永远不会胜出，最快的模型占多数
+        self.assertNotIn("slow", picks)
+        self.assertGreater(picks.count("fast"), picks.count("mid"))
+
+    def test_outstanding_requests_shift_load(self):
+        lb = self._lb(_table(("a", 5), ("b", 5)))
+        lb.record_success("a", ttft_ms=100, tokens_per_s=50)
+        lb.record_success("b", ttft_ms=150, tokens_per_s=50)
+        self.assertEqual(lb.pick_model(), "a")
+        lb.acquire("a")
+        lb.acquire("a")
+        self.assertEqual(lb.pick_model(), "b")
+        lb.release("a")
+        lb.release("a")
+        self.assertEqual(lb.pick_model(), "a")
+
+    def test_half_open_probe(self):
+        lb = self._lb(_table(("a", 5), ("b", 1)))
+        lb.circuit_open_seconds = 0.1
+        for _ in range(3):
+            lb.record_failure("a")
+        self.assertFalse(lb.is_available("a"))
+        self.assertEqual(lb.pick_model(), "b")
+
+        time.sleep(0.15)
+        self.assertTrue(lb.is_available("a"))
+        probe = lb.acquire("a")
+        self.assertTrue(probe)
+        # 探测在途时不再放行其他请求
+        self.assertFalse(lb.is_available("a"))
+        lb.record_failure("a")
+        lb.release("a", probe)
+        self.assertFalse(lb.is_available("a"))
+
+        time.sleep(0.15)
+        probe = lb.acquire("a")
+        lb.record_success("a", ttft_ms=50)
+        lb.release("a", probe)
+        self.assertTrue(lb.is_available("a"))
+        self.assertEqual(lb.snapshot()[0]["circuit"], "closed")
+
+    def test_disabled_and_unconfigured_models_are_skipped(self):
+        table = _table(("local", 1), ("off", 9)) + [
+            {
+                "model_id": "cloud",
+                "provider": "dashscope",
+                "priority": 9,
+                "enabled": 1,
+                "api_key_env": "LB_TEST_MISSING_KEY",
+            }
+        ]
+        table[1]["enabled"] = 0
+        lb = self._lb(table)
+        self.assertEqual(lb.pick_model(), "local")
+        self.assertEqual(lb.provider_of("cloud"), "dashscope")
+
+    def test_chat_acquires_inside_stream(self):
+        from multi_model import extended_model_router as router_module
+
+        lb = self._lb(_table(("a", 5)))
+        lb.circuit_open_seconds = 0.01
+        for _ in range(3):
+            lb.record_failure("a")
+        time.sleep(0.02)
+
+        async def fake_stream(model_id, prompt):
+            yield "hi"
+
+        async def run():
+            req = router_module.ChatRequest(model_id="a", messages=[])
+            # 客户端在响应开始前断开：生成器从未启动
+            response = await router_module.unified_chat(req)
+            await response.body_iterator.aclose()
+            self.assertEqual(lb.snapshot()[0]["outstanding"], 0)
+            self.assertTrue(lb.is_available("a"))
+
+            response = await router_module.unified_chat(req)
+            chunks = [c async for c in response.body_iterator]
+            self.assertIn('"done": true', chunks[-1])
+
+        with (
+            mock.patch.object(router_module, "_lb", lb),
+            mock.patch.object(router_module, "stream_ollama", fake_stream),
+            mock.patch.object(router_module, "_save_usage", lambda *a: None),
+        ):
+            asyncio.run(run())
+        self.assertEqual(lb.snapshot()[0]["outstanding"], 0)
+        self.assertEqual(lb.snapshot()[0]["circuit"], "closed")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,170 @@
+"""
+test_metrics.py — 直方图指标（monitoring/metrics.py）
+
+测试范围：
+  1. 分位数估算：按桶插值，误差不超过所在桶宽；+Inf 桶以最大值为上界
+  2. 多线程并发 observe 不丢计数；大量短命线程不会让分片数增长
+  3. Prometheus 文本：累计桶、_sum / _count、阶段直方图
+  4. 请求按路由模板分组，路径参数不产生新序列
+  5. 读取统计（/api/metrics/stats）不新建序列
+"""
+
+import asyncio
+import random
+import sys
+import threading
+import unittest
+from pathlib import Path
+
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT))
+
+from monitoring import metrics  # noqa: E402
+from monitoring.metrics import LATENCY_BUCKETS_MS, Histogram  # noqa: E402
+
+
+def _exact(values, q):
+    values = sorted(values)
+    return values[max(0, int(round(q * len(values))) - 1)]
+
+
+def _bucket_width(value):
+    bounds = (0,) + LATENCY_BUCKETS_MS
+    for lower, upper in zip(bounds, bounds[1:]):
+        if value <= upper:
+            return upper - lower
+    return float("inf")
+
+
+class TestHistogram(unittest.TestCase):
+    def test_percentiles_within_bucket(self):
+        rng = random.Random(0)
+        values = [rng.lognormvariate(4, 1) for _ in range(20000)]
+        hist = Histogram()
+        for v in values:
+            hist.observe(v)
+
+        self.assertEqual(len(hist), 20000)
+        self.assertAlmostEqual(hist.sum, sum(values), places=3)
+        for q in (0.5, 0.95, 0.99):
+            exact = _exact(values, q)
+            self.assertLessEqual(
+                abs(hist.percentile(q) - exact), _bucket_width(exact), q
+            )
+
+    def test_overflow_bucket_and_empty(self):
+        hist = Histogram(buckets=(10, 100))
+        self.assertEqual(hist.percentile(0.99), 0.0)
+        for v in (5, 50, 500, 900):
+            hist.observe(v)
+        self.assertEqual(hist.percentile(1.0), 900)
+        self.assertLessEqual(hist.percentile(0.99), 900)
+        buckets, total, count = hist.cumulative()
+        self.assertEqual(buckets, [("10", 1), ("100", 2), ("+Inf", 4)])
+        self.assertEqual((total, count), (1455, 4))
+
+    def test_concurrent_observe(self):
+        hist = Histogram()
+
+        def worker():
+            for i in range(5000):
+                hist.observe(i % 300)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(hist.count, 40000)
+        self.assertEqual(hist.cumulative()[0][-1], ("+Inf", 40000))
+
+    def test_short_lived_threads_bounded_shards(self):
+        # 每个请求一个 ThreadPoolExecutor：线程只记录一次就退出
+        hist = Histogram()
+        for _ in range(20):
+            threads = [
+                threading.Thread(target=hist.observe, args=(7,)) for _ in range(25)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(hist.count, 500)
+        self.assertEqual(len(hist._shards), metrics.SHARD_COUNT)
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        from monitoring import observability
+
+        # 中间件在 observability 中按名字引用 STATS，两处一起替换
+        self.modules = (metrics, observability)
+        self.stats = metrics._Stats()
+        self._saved = metrics.STATS
+        for module in self.modules:
+            module.STATS = self.stats
+
+    def tearDown(self):
+        for module in self.modules:
+            module.STATS = self._saved
+
+    def test_prometheus_histograms(self):
+        for ms in (3, 30, 300):
+            self.stats.record_request("/api/kb/{kb_id}", "GET", 200, ms)
+        self.stats.record_request("/api/kb/{kb_id}", "GET", 404, 1)
+        self.stats.record_stage("rerank", 12.5)
+        self.stats.record_stage("llm", 800, error=True)
+
+        text = metrics._prometheus_text()
+        labels = 'method="GET",path="/api/kb/{kb_id}"'
+        self.assertIn(f"ragf_request_total{{{labels}}} 4", text)
+        self.assertIn(f"ragf_request_errors_total{{{labels}}} 1", text)
+        self.assertIn("# TYPE ragf_request_latency_ms histogram", text)
+        self.assertIn(f'ragf_request_latency_ms_bucket{{{labels},le="5"}} 2', text)
+        self.assertIn(f'ragf_request_latency_ms_bucket{{{labels},le="+Inf"}} 4', text)
+        self.assertIn(f"ragf_request_latency_ms_count{{{labels}}} 4", text)
+        self.assertIn(f"ragf_request_latency_ms_sum{{{labels}}} 334", text)
+        self.assertIn('ragf_stage_latency_ms_bucket{stage="rerank",le="20"} 1', text)
+        self.assertIn('ragf_stage_errors_total{stage="llm"} 1', text)
+        self.assertEqual(self.stats.request_count, {"GET /api/kb/{kb_id}": 4})
+
+    def test_route_template_labels(self):
+        try:
+            from fastapi import FastAPI
+            from fastapi.testclient import TestClient
+        except (ImportError, RuntimeError) as e:
+            self.skipTest(f"TestClient 不可用: {e}")
+
+        app = FastAPI()
+
+        @app.get("/api/kb/{kb_id}/docs")
+        async def docs(kb_id: str):
+            return {"kb": kb_id}
+
+        metrics.instrument_app(app)
+        client = TestClient(app)
+        for kb in ("a", "b", "c"):
+            self.assertEqual(client.get(f"/api/kb/{kb}/docs").status_code, 200)
+        client.get("/no/such/path/1")
+        client.get("/no/such/path/2")
+
+        self.assertEqual(
+            self.stats.request_count,
+            {"GET /api/kb/{kb_id}/docs": 3, f"GET {metrics.UNMATCHED_ROUTE}": 2},
+        )
+        self.assertEqual(self.stats.error_count[f"GET {metrics.UNMATCHED_ROUTE}"], 2)
+
+    def test_stats_read_does_not_create_series(self):
+        self.stats.record_request("/api/kb", "GET", 200, 5)
+        self.stats.record_provider_request("ollama", None, 1, 0, False)
+
+        stats = asyncio.run(metrics.get_stats())
+        self.assertEqual(stats["top_endpoints"][0]["p95_ttfb_ms"], 0.0)
+        self.assertEqual(stats["providers"][0]["p95_ttft_ms"], 0.0)
+        self.assertEqual(dict(self.stats.request_ttfb), {})
+        self.assertEqual(dict(self.stats.provider_ttft), {})
+        self.assertNotIn("ragf_request_ttfb_ms_bucket", metrics._prometheus_text())
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,154 @@
+"""
+test_observability.py — 合并的纯 ASGI 可观测性中间件（monitoring/observability.py）
+
+测试范围：
+  1. SSE 响应逐块透传（不缓冲），TTFB 与总耗时分别记录
+  2. X-Trace-Id：沿用请求头或新生成，接口内 get_trace_id() 可见，并写入响应头
+  3. 指标按路由模板记录；审计事件入队（含 token），跳过路径不记录
+  4. 接口抛异常时仍记录 500
+"""
+
+import asyncio
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT))
+
+try:
+    from fastapi import FastAPI
+    from fastapi.responses import StreamingResponse
+
+    from audit.audit_log import AuditLogWriter
+    from monitoring import metrics, observability
+    from monitoring.observability import ObservabilityMiddleware
+    from trace_logging import get_trace_id
+
+    _IMPORT_ERROR = None
+except ImportError as e:
+    _IMPORT_ERROR = e
+
+
+@unittest.skipIf(_IMPORT_ERROR is not None, f"依赖不可用: {_IMPORT_ERROR}")
+class TestObservabilityMiddleware(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.db_path = Path(self._tmp.name) / "audit.db"
+        self.writer = AuditLogWriter(self.db_path, flush_interval_ms=10)
+        self.stats = metrics._Stats()
+        self._saved = observability.STATS
+        observability.STATS = self.stats
+
+        app = FastAPI()
+
+        @app.get("/api/RAG/{kb}/query")
+        async def sse(kb: str):
+            async def events():
+                yield f"data: {get_trace_id()}\n\n"
+                await asyncio.sleep(0.2)
+                yield "data: done\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        @app.get("/boom")
+        async def boom():
+            raise RuntimeError("boom")
+
+        @app.get("/docs-like")
+        async def plain():
+            return {"ok": True}
+
+        app.add_middleware(
+            ObservabilityMiddleware,
+            audit_skip_paths=["/docs-like"],
+            audit_writer=self.writer,
+        )
+        self.app = app
+
+    def tearDown(self):
+        observability.STATS = self._saved
+        self.writer.close()
+        self._tmp.cleanup()
+
+    def _call(self, path, headers=()):
+        """直接驱动 ASGI 应用，记录每条响应消息的到达时间"""
+        messages = []
+
+        async def run():
+            async def receive():
+                await asyncio.sleep(10)
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                messages.append((time.perf_counter(), message))
+
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": "1.1",
+                "method": "GET",
+                "scheme": "http",
+                "path": path,
+                "raw_path": path.encode(),
+                "query_string": b"",
+                "root_path": "",
+                "headers": list(headers),
+                "client": ("10.0.0.2", 1234),
+                "server": ("testserver", 80),
+            }
+            start = time.perf_counter()
+            try:
+                await self.app(scope, receive, send)
+            except RuntimeError:
+                pass
+            return start
+
+        start = asyncio.run(run())
+        return start, messages
+
+    def test_sse_streams_unbuffered_with_ttfb(self):
+        start, messages = self._call(
+            "/api/RAG/kb1/query",
+            headers=[(b"x-trace-id", b"abc123"), (b"authorization", b"Bearer tok")],
+        )
+        head = messages[0][1]
+        self.assertEqual(head["type"], "http.response.start")
+        self.assertIn((b"x-trace-id", b"abc123"), head["headers"])
+
+        bodies = [(t, m) for t, m in messages if m.get("body")]
+        self.assertEqual(bodies[0][1]["body"], b"data: abc123\n\n")
+        # 第一块在接口 sleep 之前就已发出
+        self.assertLess(bodies[0][0] - start, 0.15)
+        self.assertGreaterEqual(bodies[1][0] - start, 0.2)
+
+        key = "GET /api/RAG/{kb}/query"
+        self.assertEqual(self.stats.request_count, {key: 1})
+        self.assertLess(self.stats.request_ttfb[key].sum, 150)
+        self.assertGreaterEqual(self.stats.request_latency[key].sum, 200)
+
+        self.assertTrue(self.writer.flush())
+        conn = sqlite3.connect(str(self.db_path))
+        rows = conn.execute(
+            "SELECT request_path, status_code, ip_address FROM audit_logs"
+        ).fetchall()
+        conn.close()
+        self.assertEqual(rows, [("/api/RAG/kb1/query", 200, "10.0.0.2")])
+
+    def test_generated_trace_id_errors_and_skip(self):
+        _, messages = self._call("/docs-like")
+        headers = dict(messages[0][1]["headers"])
+        self.assertEqual(len(headers[b"x-trace-id"]), 8)
+
+        self._call("/boom")
+        self.assertEqual(self.stats.error_count, {"GET /boom": 1})
+
+        self.assertTrue(self.writer.flush())
+        self.assertEqual(self.writer.stats()["written"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
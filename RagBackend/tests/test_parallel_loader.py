@@ -0,0 +1,157 @@
+"""
+test_parallel_loader.py — 进程池并行文件解析（RAG_M/src/ingestion/parallel_loader.py）
+
+测试范围：
+  1. 结果按输入顺序产出（与各文件完成先后无关）
+  2. 单文件异常只影响该文件
+  3. 单文件超时：卡住的子进程被终止，其余文件照常解析
+  4. 子进程崩溃：只有单独运行仍崩溃的文件失败，同时在途的正常文件不受牵连
+  5. 小目录不启进程池；吞吐统计
+  6. 原生 RAG：并行与串行加载目录结果一致
+"""
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT))
+sys.path.insert(0, str(BACKEND_ROOT / "RAG_M" / "src"))
+
+from ingestion.parallel_loader import LoadStats, ParallelLoader  # noqa: E402
+
+
+def _fake_parse(path):
+    """按文件内容模拟解析：sleep:<秒> / fail / exit（子进程直接退出）/ 其他文本按行作为页"""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if text.startswith("sleep:"):
+        time.sleep(float(text.split(":", 1)[1]))
+        return [f"slept {os.path.basename(path)}"]
+    if text == "fail":
+        raise ValueError("broken file")
+    if text == "exit":
+        os._exit(1)
+    return text.splitlines()
+
+
+class TestParallelLoader(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _files(self, contents):
+        paths = []
+        for i, content in enumerate(contents):
+            path = os.path.join(self.dir, f"f{i}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+            paths.append(path)
+        return paths
+
+    def test_order_and_error_isolation(self):
+        paths = self._files(["sleep:0.6", "a\nb", "fail", "sleep:0.1", "c"])
+        loader = ParallelLoader(_fake_parse, workers=3, min_parallel_bytes=0)
+        results = loader.load(paths)
+
+        self.assertEqual([r.path for r in results], paths)
+        self.assertEqual(results[1].documents, ["a", "b"])
+        self.assertFalse(results[2].ok)
+        self.assertIn("broken file", results[2].error)
+        self.assertTrue(all(r.ok for i, r in enumerate(results) if i != 2))
+
+        stats = loader.last_stats
+        self.assertEqual((stats.files, stats.failed, stats.workers), (5, 1, 3))
+        self.assertEqual(stats.documents, 5)
+        self.assertGreater(stats.files_per_sec, 0)
+
+    def test_timeout_kills_stuck_file(self):
+        paths = self._files(["x", "sleep:60", "y", "z"])
+        loader = ParallelLoader(
+            _fake_parse, workers=2, timeout=2.0, min_parallel_bytes=0
+        )
+        t0 = time.perf_counter()
+        results = loader.load(paths)
+        self.assertLess(time.perf_counter() - t0, 30)
+
+        self.assertTrue(results[1].timed_out)
+        self.assertEqual([r.documents for r in results if r.ok], [["x"], ["y"], ["z"]])
+        self.assertEqual(loader.last_stats.timed_out, 1)
+
+    def test_worker_crash_only_fails_poison_file(self):
+        paths = self._files(["sleep:0.5", "exit", "c", "d"])
+        loader = ParallelLoader(_fake_parse, workers=2, min_parallel_bytes=0)
+        results = loader.load(paths)
+
+        self.assertEqual([r.path for r in results], paths)
+        self.assertEqual(results[1].error, "解析进程异常退出")
+        self.assertEqual(
+            [r.documents for i, r in enumerate(results) if i != 1],
+            [["slept f0.txt"], ["c"], ["d"]],
+        )
+        self.assertEqual(loader.last_stats.failed, 1)
+
+    def test_small_batches_run_inline(self):
+        paths = self._files(["a", "b"])
+        loader = ParallelLoader(_fake_parse, workers=8)
+        self.assertEqual(loader.pool_size(paths), 1)
+        self.assertEqual(loader.pool_size(paths[:1]), 1)
+        stats = LoadStats()
+        results = list(loader.iter_load(paths, stats=stats))
+        self.assertEqual([r.documents for r in results], [["a"], ["b"]])
+        self.assertEqual(stats.workers, 1)
+        self.assertIs(loader.last_stats, stats)
+
+    def test_native_dir_parallel_matches_inline(self):
+        try:
+            from rag import native_rag
+        except ImportError as e:
+            self.skipTest(f"原生 RAG 依赖不可用: {e}")
+
+        os.makedirs(os.path.join(self.dir, "sub"))
+        for name, text in [
+            ("b.txt", "第二篇"),
+            ("a.md", "第一篇"),
+            ("sub/c.txt", "子目录"),
+        ]:
+            with open(os.path.join(self.dir, name), "w", encoding="utf-8") as f:
+                f.write(text)
+
+        inline = list(native_rag.iter_documents_from_dir(self.dir, workers=1))
+        # native_rag 可能经 src.ingestion 导入，取它实际使用的模块实例
+        parallel_loader = sys.modules[native_rag.ParallelLoader.__module__]
+        saved = parallel_loader.PARALLEL_MIN_BYTES
+        parallel_loader.PARALLEL_MIN_BYTES = 0
+        try:
+            stats = LoadStats()
+            pages = []
+            parallel = list(
+                native_rag.iter_documents_from_dir(
+                    self.dir,
+                    on_page=lambda f, p, n: pages.append(p),
+                    workers=2,
+                    stats=stats,
+                )
+            )
+        finally:
+            parallel_loader.PARALLEL_MIN_BYTES = saved
+
+        self.assertEqual(
+            [d.page_content for d in inline], ["第一篇", "第二篇", "子目录"]
+        )
+        self.assertEqual(
+            [(d.page_content, d.metadata) for d in parallel],
+            [(d.page_content, d.metadata) for d in inline],
+        )
+        self.assertEqual((stats.workers, stats.files, stats.documents), (2, 3, 3))
+        self.assertEqual(pages, [1, 1, 1])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -8,11 +8,13 @@ RAG 混合检索与向量化测试套件
   4. HybridRetriever.retrieve_with_scores 引用溯源完整性
   5. 图谱合并去重（merge_graph）
   6. RAG Pipeline 结果结构验证
+  7. 原生流式入库（逐页读取、流式分块、按批写入索引）
 
 运行方式：
   cd RagBackend && python tests/test_rag_vectorization.py
 """
 
+import os
 import sys
 import math
 import unittest
@@ -110,6 +112,101 @@ class TestBM25Scoring(unittest.TestCase):
             self.fail(f"空查询不应抛出异常: {e}")
 
 
+class TestInvertedBM25Index(unittest.TestCase):
+    """倒排索引 BM25 与逐文档扫描版得分一致性"""
+
+    TEXTS = [
+        "知识图谱是一种语义网络",
+        "机器学习需要大量数据 machine learning data",
+        "知识图谱与机器学习结合使用，知识融合",
+        "",
+        "BM25 ranking function bm25 ranking",
+    ]
+
+    def setUp(self):
+        from rag.bm25_index import InvertedBM25Index, tokenize
+
+        self.tokenize = tokenize
+        self.index = InvertedBM25Index(self.TEXTS)
+
+    def _scan_scores(self, query: str, k1: float = 1.5, b: float = 0.75):
+        corpus = [self.tokenize(t) for t in self.TEXTS]
+        n = len(corpus)
+        avgdl = sum(len(d) for d in corpus) / n
+        df: Dict[str, int] = {}
+        for doc in corpus:
+            for t in set(doc):
+                df[t] = df.get(t, 0) + 1
+        idf = {t: math.log((n - f + 0.5) / (f + 0.5) + 1) for t, f in df.items()}
+        scores = []
+        for doc in corpus:
+            s = 0.0
+            for t in self.tokenize(query):
+                if t not in idf:
+                    continue
+                tf = doc.count(t)
+                s += idf[t] * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(doc) / avgdl))
+            scores.append(s)
+        return scores
+
+    def test_scores_match_full_scan(self):
+        for q in ["知识图谱", "machine learning", "bm25 bm25 ranking", "知识知识"]:
+            expected = self._scan_scores(q)
+            actual = self.index.get_scores(q)
+            for e, a in zip(expected, actual):
+                self.assertAlmostEqual(e, a, places=9, msg=f"query={q}")
+
+    def test_top_k_order_and_positive(self):
+        hits = self.index.top_k("知识图谱", k=2)
+        scan = self._scan_scores("知识图谱")
+        expected = sorted(range(len(scan)), key=lambda i: scan[i], reverse=True)[:2]
+        self.assertEqual([i for i, _ in hits], expected)
+        self.assertTrue(all(s > 0 for _, s in hits))
+
+    def test_unknown_and_empty_query(self):
+        self.assertEqual(self.index.top_k("qqqq", k=5), [])
+        self.assertEqual(self.index.top_k("", k=5), [])
+
+    def test_postings_only_contain_matching_docs(self):
+        doc_ids, tfs = self.index.postings["bm25"]
+        self.assertEqual(list(doc_ids), [4])
+        self.assertEqual(list(tfs), [2])
+
+    def test_save_and_mmap_load_roundtrip(self):
+        """bm25.index 落盘后 mmap 打开，查询结果与内存索引一致"""
+        import tempfile
+        from rag.bm25_index import MmapBM25Index, load_bm25_index
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bm25.index")
+            self.index.save(path)
+            mm = MmapBM25Index(path)
+            try:
+                self.assertEqual(len(mm), len(self.TEXTS))
+                self.assertEqual(mm.idf, self.index.idf)
+                for q in ["知识图谱", "bm25 ranking", "不存在qqq"]:
+                    self.assertEqual(mm.top_k(q, k=3), self.index.top_k(q, k=3))
+            finally:
+                mm.close()
+            self.assertIsNone(load_bm25_index(path, expected_docs=99))
+            self.assertIsNone(load_bm25_index(os.path.join(tmp, "missing.index")))
+
+    def test_incremental_append_matches_rebuild(self):
+        """从文件读回后追加新文档，应与全量重建结果一致"""
+        import tempfile
+        from rag.bm25_index import InvertedBM25Index
+
+        extra = ["知识图谱 ranking 新增文档"]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bm25.index")
+            self.index.save(path)
+            appended = InvertedBM25Index.from_file(path)
+        appended.add_texts(extra)
+        rebuilt = InvertedBM25Index(self.TEXTS + extra)
+        for q in ["知识图谱", "ranking"]:
+            self.assertEqual(appended.top_k(q, k=5), rebuilt.top_k(q, k=5))
+
+
 # ──────────────────────────────────────────
 # 2RRF
 # ──────────────────────────────────────────
@@ -169,6 +266,74 @@ class TestRRFFusion(unittest.TestCase):
         self.assertGreater(score_small_k, score_large_k, "k 越小，头部得分越高")
 
 
+class TestRankFusion(unittest.TestCase):
+    """rank_fusion：按整数 chunk id 融合（RRF / 加权线性）"""
+
+    def _doc(self, text: str, chunk_id=None):
+        from langchain.docstore.document import Document
+
+        meta = {} if chunk_id is None else {"chunk_id": chunk_id}
+        return Document(page_content=text, metadata=meta)
+
+    def test_matches_reference_rrf_over_three_lists(self):
+        from rag.rank_fusion import fuse_ranked
+
+        docs = {name: self._doc(name, i) for i, name in enumerate("abcdef")}
+        lists = [["a", "b", "c"], ["c", "d", "a"], ["e", "a", "f", "b"]]
+        fused = fuse_ranked([[(docs[n], 0.0) for n in lst] for lst in lists])
+
+        expected: Dict[str, float] = {}
+        for lst in lists:
+            for rank, name in enumerate(lst, start=1):
+                expected[name] = expected.get(name, 0.0) + 1.0 / (60 + rank)
+        order = sorted(expected, key=lambda n: expected[n], reverse=True)
+        self.assertEqual([d.page_content for d, _ in fused], order)
+        for doc, score in fused:
+            self.assertAlmostEqual(score, expected[doc.page_content], places=12)
+
+    def test_shared_prefix_chunks_are_not_merged(self):
+        from rag.rank_fusion import fuse_ranked
+
+        header = "某某大学 内部资料 " * 30  # 超过 200 字的相同页眉
+        a = self._doc(header + "第一章", 1)
+        b = self._doc(header + "第二章", 2)
+        fused = fuse_ranked([[(a, 1.0), (b, 0.5)], [(b, 0.9)]])
+        self.assertEqual(
+            [d.page_content for d, _ in fused], [b.page_content, a.page_content]
+        )
+
+        # 没有 chunk_id 的旧数据按整段文本区分
+        legacy = fuse_ranked(
+            [[(self._doc(header + "甲"), 1.0)], [(self._doc(header + "乙"), 1.0)]]
+        )
+        self.assertEqual(len(legacy), 2)
+
+    def test_same_chunk_id_merges_across_lists(self):
+        from rag.rank_fusion import fuse_ranked
+
+        # BM25 与向量库返回不同的对象，但 chunk_id 相同
+        fused = fuse_ranked([[(self._doc("x", 7), 3.2)], [(self._doc("x", 7), 0.1)]])
+        self.assertEqual(len(fused), 1)
+        self.assertAlmostEqual(fused[0][1], 2.0 / 61)
+
+    def test_weighted_linear_fusion(self):
+        from rag.rank_fusion import fuse_scored
+
+        a, b, c = self._doc("a", 1), self._doc("b", 2), self._doc("c", 3)
+        fused = fuse_scored([[(a, 0.9), (b, 0.5)], [(b, 1.0), (c, 0.2)]], [0.7, 0.3])
+        got = {d.page_content: s for d, s in fused}
+        self.assertAlmostEqual(got["a"], 0.63)
+        self.assertAlmostEqual(got["b"], 0.65)
+        self.assertAlmostEqual(got["c"], 0.06)
+        self.assertEqual([d.page_content for d, _ in fused], ["b", "a", "c"])
+
+    def test_empty_lists(self):
+        from rag.rank_fusion import fuse_ranked
+
+        self.assertEqual(fuse_ranked([]), [])
+        self.assertEqual(fuse_ranked([[], []]), [])
+
+
 # ──────────────────────────────────────────
 # 3 FAISS/torch
 # ──────────────────────────────────────────
@@ -243,6 +408,404 @@ class TestVectorizationLogic(unittest.TestCase):
         )
 
 
+class TestBatchEmbedder(unittest.TestCase):
+    """入库批量编码：长度排序分 batch，输出行顺序与输入一致"""
+
+    TEXTS = [
+        "短",
+        "一段中等长度的文本",
+        "很长很长很长很长很长的一段文本内容",
+        "中",
+        "ab",
+    ]
+
+    def test_length_sorted_batches_cover_all(self):
+        from vectorstore.embedding_pipeline import length_sorted_batches
+
+        batches = length_sorted_batches(self.TEXTS, batch_size=2)
+        self.assertEqual([len(b) for b in batches], [2, 2, 1])
+        flat = [i for b in batches for i in b]
+        self.assertEqual(sorted(flat), list(range(len(self.TEXTS))))
+        lengths = [len(self.TEXTS[i]) for i in flat]
+        self.assertEqual(lengths, sorted(lengths, reverse=True))
+
+    def test_embed_preserves_input_order(self):
+        from vectorstore.embedding_pipeline import BatchEmbedder
+
+        calls = []
+
+        def encode(texts):
+            calls.append(len(texts))
+            return [mock_embed(t) for t in texts]
+
+        embedder = BatchEmbedder("mock", encode_fn=encode, batch_size=2, workers=1)
+        vectors = embedder.embed(self.TEXTS)
+        self.assertEqual(vectors.shape, (len(self.TEXTS), 64))
+        for row, text in zip(vectors, self.TEXTS):
+            self.assertAlmostEqual(
+                cosine_similarity(list(row), mock_embed(text)), 1.0, places=5
+            )
+        self.assertEqual(calls, [2, 2, 1])
+        self.assertEqual(embedder.last_stats.chunks, len(self.TEXTS))
+        self.assertEqual(embedder.last_stats.batches, 3)
+
+    def test_cache_skips_unchanged_chunks(self):
+        import tempfile
+
+        from vectorstore.embedding_cache import EmbeddingCache
+        from vectorstore.embedding_pipeline import BatchEmbedder
+
+        calls = []
+
+        def encode(texts):
+            calls.extend(texts)
+            return [mock_embed(t) for t in texts]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = EmbeddingCache(os.path.join(tmp, "emb.db"))
+            embedder = BatchEmbedder("mock", encode_fn=encode, workers=1, cache=cache)
+            first = embedder.embed(self.TEXTS)
+            self.assertEqual(len(calls), len(self.TEXTS))
+
+            # 仅空白差异的文本按规范化哈希命中，新文本才需要编码
+            calls.clear()
+            second = embedder.embed(["  短 ", "全新的段落", self.TEXTS[2]])
+            self.assertEqual(calls, ["全新的段落"])
+            self.assertEqual(embedder.last_stats.cache_hits, 2)
+            self.assertTrue((second[0] == first[0]).all())
+            self.assertTrue((second[2] == first[2]).all())
+
+            # 不同模型互不复用
+            other = BatchEmbedder("mock-v2", encode_fn=encode, workers=1, cache=cache)
+            calls.clear()
+            other.embed(self.TEXTS[:2])
+            self.assertEqual(len(calls), 2)
+            cache.close()
+
+    def test_embed_empty(self):
+        from vectorstore.embedding_pipeline import BatchEmbedder
+
+        embedder = BatchEmbedder("mock", encode_fn=lambda t: [], workers=1)
+        self.assertEqual(embedder.embed([]).shape[0], 0)
+
+
+def _write_pdf(path: str, page_texts: List[str]) -> None:
+    """用 pypdf 生成每页一行 ASCII 文本的 PDF（空字符串为空白页）"""
+    from pypdf import PdfWriter
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    font = DictionaryObject(
+        {
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/Subtype"): NameObject("/Type1"),
+            NameObject("/BaseFont"): NameObject("/Helvetica"),
+        }
+    )
+    writer = PdfWriter()
+    for text in page_texts:
+        page = writer.add_blank_page(612, 792)
+        stream = DecodedStreamObject()
+        stream.set_data(f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode())
+        page[NameObject("/Contents")] = writer._add_object(stream)
+        page[NameObject("/Resources")] = DictionaryObject(
+            {NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})}
+        )
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+class TestStreamingIngest(unittest.TestCase):
+    """原生入库流水线：逐页读取 → 流式分块 → 按批编码写入索引"""
+
+    def setUp(self):
+        try:
+            import pypdf  # noqa: F401
+
+            from rag import native_rag
+        except ImportError as e:
+            self.skipTest(f"原生 RAG 依赖不可用: {e}")
+        self.native_rag = native_rag
+
+    def test_pdf_pages_are_lazy(self):
+        import tempfile
+
+        pages = []
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "manual.pdf")
+            _write_pdf(path, ["page one", "", "page three", "page four"])
+            it = self.native_rag._iter_pdf(
+                path, on_page=lambda f, page, n: pages.append((page, n))
+            )
+            first = next(it)
+            # 只读取了第一页
+            self.assertEqual(pages, [(1, 4)])
+            self.assertEqual(first.metadata["page"], 0)
+            rest = list(it)
+        # 空白页计入进度但不产出文档
+        self.assertEqual([d.metadata["page"] for d in rest], [2, 3])
+        self.assertEqual([p for p, _ in pages], [1, 2, 3, 4])
+
+    def test_iter_split_matches_split(self):
+        NativeDocument = self.native_rag.NativeDocument
+        docs = [
+            NativeDocument("甲" * 2500, {"source": "a.txt"}),
+            NativeDocument("乙" * 300, {"source": "b.txt"}),
+        ]
+        streamed = list(self.native_rag.iter_split_documents(iter(docs), 1000, 200))
+        listed = self.native_rag.split_documents(docs, 1000, 200)
+        self.assertEqual(
+            [(d.page_content, d.metadata) for d in streamed],
+            [(d.page_content, d.metadata) for d in listed],
+        )
+
+    def test_build_index_streaming_bounded_batches(self):
+        from vectorstore.ann_index import IndexSpec
+        from vectorstore.embedding_pipeline import BatchEmbedder
+
+        NativeDocument = self.native_rag.NativeDocument
+        produced = []
+
+        def chunks():
+            for i in range(10):
+                produced.append(i)
+                yield NativeDocument(f"文本块 {i} " + "知识" * i, {"source": "x.txt"})
+
+        batches = []
+
+        def encode(texts):
+            # 每批编码时，上游最多只多生成了这一批
+            batches.append((len(texts), len(produced)))
+            return [mock_embed(t) for t in texts]
+
+        vs = self.native_rag.NativeVectorStore.__new__(
+            self.native_rag.NativeVectorStore
+        )
+        vs.index_spec = IndexSpec()
+        vs._embedder = BatchEmbedder("mock", encode_fn=encode, workers=1)
+        flushed = []
+        n = vs.build_index_streaming(chunks(), batch_size=4, on_flush=flushed.append)
+
+        self.assertEqual(n, 10)
+        self.assertEqual(flushed, [4, 8, 10])
+        self.assertEqual(batches, [(4, 4), (4, 8), (2, 10)])
+        self.assertEqual(vs._index.ntotal, 10)
+        self.assertEqual(
+            [d.metadata["chunk_id"] for d in vs.documents], list(range(10))
+        )
+        hit, _ = vs.similarity_search(
+            "文本块 7", top_k=1, query_vector=mock_embed(vs.documents[7].page_content)
+        )[0]
+        self.assertEqual(hit.metadata["chunk_id"], 7)
+
+    def test_build_index_streaming_empty(self):
+        vs = self.native_rag.NativeVectorStore.__new__(
+            self.native_rag.NativeVectorStore
+        )
+        vs._embedder = None
+        self.assertEqual(vs.build_index_streaming(iter([])), 0)
+        self.assertIsNone(vs._index)
+
+
+class _CountingEmbeddings:
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.calls = 0
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        return mock_embed(text)
+
+
+class _FakeVectorStore:
+    """只实现按向量检索的假向量库：按 mock_embed 余弦相似度排序，返回 L2 距离"""
+
+    def __init__(self, texts: List[str], model_name: str):
+        from langchain.docstore.document import Document
+
+        self.embedding_function = _CountingEmbeddings(model_name)
+        self.docs = [
+            Document(page_content=t, metadata={"source": f"doc{i}.txt"})
+            for i, t in enumerate(texts)
+        ]
+
+    def _embed_query(self, text: str) -> List[float]:
+        return self.embedding_function.embed_query(text)
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4):
+        scored = [
+            (
+                doc,
+                2.0
+                - 2.0
+                * cosine_similarity(list(embedding), mock_embed(doc.page_content)),
+            )
+            for doc in self.docs
+        ]
+        return sorted(scored, key=lambda x: x[1])[:k]
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k: int = 4, **kwargs):
+        return [
+            doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)
+        ]
+
+
+class TestQueryEmbeddingCache(unittest.TestCase):
+    """query 向量 LRU：命中计数、容量上限，一次检索只编码一次 query"""
+
+    TEXTS = [
+        "知识图谱是一种语义网络",
+        "机器学习需要大量数据",
+        "知识图谱与机器学习结合使用",
+        "BM25 ranking function",
+    ]
+
+    def test_lru_hits_and_eviction(self):
+        from vectorstore.embedding_cache import QueryEmbeddingCache
+
+        cache = QueryEmbeddingCache(max_entries=2)
+        emb = _CountingEmbeddings("m")
+        first = cache.get_or_compute("m", "什么是 RAG", emb.embed_query)
+        again = cache.get_or_compute("m", " 什么是  RAG ", emb.embed_query)
+        self.assertIs(first, again)
+        self.assertFalse(first.flags.writeable)
+        # 不同模型不共用向量
+        cache.get_or_compute("m2", "什么是 RAG", emb.embed_query)
+        cache.get_or_compute("m", "q3", emb.embed_query)
+        self.assertEqual(emb.calls, 3)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 3))
+        self.assertEqual(stats["entries"], 2)
+        cache.get_or_compute("m", "什么是 RAG", emb.embed_query)
+        self.assertEqual(emb.calls, 4)
+
+    def test_normalized_and_raw_vectors_not_shared(self):
+        try:
+            from rag.native_rag import NativeVectorStore
+        except ImportError as e:
+            self.skipTest(f"原生 RAG 依赖不可用: {e}")
+        from vectorstore.embedding_cache import query_vector
+
+        model = "norm-split-model"
+        store = _FakeVectorStore(self.TEXTS, model)
+        raw = query_vector(store, "什么是 RAG")
+
+        native = NativeVectorStore.__new__(NativeVectorStore)
+        native.model_name = model
+        native._encode = lambda texts: [[9.0] * len(raw) for _ in texts]
+        normalized = native.query_vector("什么是 RAG")
+        self.assertNotEqual(normalized.tolist(), raw.tolist())
+        self.assertEqual(store.embedding_function.calls, 1)
+
+    def test_unknown_model_is_not_cached(self):
+        from vectorstore.embedding_cache import query_vector
+
+        class _Anonymous:
+            embedding_function = object()
+
+        self.assertIsNone(query_vector(_Anonymous(), "q"))
+
+    def test_strategies_embed_query_once(self):
+        try:
+            from document_processing.retrieval_strategy import (
+                RetrievalConfig,
+                RetrievalStrategyExecutor,
+            )
+        except ImportError as e:
+            self.skipTest(f"retrieval_strategy 不可用: {e}")
+
+        store = _FakeVectorStore(self.TEXTS, "strategy-once-model")
+        executor = RetrievalStrategyExecutor(store, store.docs)
+        for strategy in ("vector", "hybrid", "rrf", "mmr"):
+            results = executor.retrieve(
+                "知识图谱", RetrievalConfig(strategy=strategy, topK=2)
+            )
+            self.assertTrue(results, strategy)
+        # 四种策略、同一个 query：只编码一次
+        self.assertEqual(store.embedding_function.calls, 1)
+
+        # 调用方传入 query 向量时不再编码
+        executor.retrieve(
+            "另一个问题",
+            RetrievalConfig(strategy="rrf", topK=2),
+            query_vector=mock_embed("另一个问题"),
+        )
+        self.assertEqual(store.embedding_function.calls, 1)
+
+    def test_hybrid_retriever_uses_cached_vector(self):
+        from rag.hybrid_retriever import HybridRetriever
+
+        store = _FakeVectorStore(self.TEXTS, "hybrid-once-model")
+        retriever = HybridRetriever(documents=store.docs, vectorstore=store)
+        retriever.retrieve("机器学习")
+        retriever.retrieve_with_scores("机器学习")
+        self.assertEqual(store.embedding_function.calls, 1)
+
+
+class TestHashIndex(unittest.TestCase):
+    """增量向量化哈希索引：SQLite 单行更新、批量事务、旧版 JSON 导入"""
+
+    def setUp(self):
+        import tempfile
+
+        try:
+            from document_processing import incremental_vectorizer
+        except ImportError as e:
+            self.skipTest(f"incremental_vectorizer 依赖未安装: {e}")
+        self.mod = incremental_vectorizer
+        self.tmp = tempfile.TemporaryDirectory()
+        self._orig_root = incremental_vectorizer.HASH_INDEX_ROOT
+        incremental_vectorizer.HASH_INDEX_ROOT = self.tmp.name
+
+    def tearDown(self):
+        self.mod.HASH_INDEX_ROOT = self._orig_root
+        self.tmp.cleanup()
+
+    def test_roundtrip_and_soft_delete(self):
+        index = self.mod.HashIndex("kb")
+        index.set("a.txt", {"file_hash": "h1", "chunk_ids": [0, 1], "chunk_count": 2})
+        index.set("b.txt", {"file_hash": "h2", "chunk_ids": [2], "chunk_count": 1})
+        index.soft_delete("a.txt")
+        index.close()
+
+        # 重新打开（模拟另一个进程）数据仍在
+        index = self.mod.HashIndex("kb")
+        self.assertTrue(index.get("a.txt")["deleted"])
+        self.assertEqual(index.get_deleted_keys(), ["a.txt"])
+        self.assertEqual(index.get_active_keys(), ["b.txt"])
+        self.assertEqual(sorted(index.tombstoned_chunk_ids()), [0, 1])
+        self.assertEqual(index.stats()["total_chunks"], 1)
+        index.delete("a.txt")
+        self.assertIsNone(index.get("a.txt"))
+        index.close()
+
+    def test_batch_commits_once_and_rolls_back(self):
+        index = self.mod.HashIndex("kb")
+        with index.batch():
+            for i in range(self.mod._COMPACTION_THRESHOLD):
+                index.set(f"d{i}", {"file_hash": "x", "stale_chunk_ids": [i]})
+        self.assertTrue(index.pending_compaction())
+        index.clear_stale()
+        self.assertFalse(index.pending_compaction())
+
+        with self.assertRaises(RuntimeError):
+            with index.batch():
+                index.set("lost", {"file_hash": "y"})
+                raise RuntimeError("abort")
+        self.assertIsNone(index.get("lost"))
+        index.close()
+
+    def test_imports_legacy_json(self):
+        import json
+
+        legacy = os.path.join(self.tmp.name, "kb_hash_index.json")
+        with open(legacy, "w", encoding="utf-8") as f:
+            json.dump({"old.md": {"file_hash": "h", "chunk_count": 3}}, f)
+        index = self.mod.HashIndex("kb")
+        self.assertEqual(index.get("old.md")["chunk_count"], 3)
+        self.assertFalse(os.path.exists(legacy))
+        index.close()
+
+
 # ──────────────────────────────────────────
 # 4
 # ──────────────────────────────────────────
@@ -482,8 +1045,14 @@ if __name__ == "__main__":
 
     test_classes = [
         TestBM25Scoring,
+        TestInvertedBM25Index,
         TestRRFFusion,
+        TestRankFusion,
         TestVectorizationLogic,
+        TestBatchEmbedder,
+        TestStreamingIngest,
+        TestQueryEmbeddingCache,
+        TestHashIndex,
         TestCitationTracking,
         TestGraphMergeLogic,
         TestRAGPipelineStructure,
@@ -3,8 +3,10 @@ RAG 混合检索 + 向量化 完整流程测试（对齐实际接口）
 不依赖 Ollama / MySQL / 真实 FAISS 文件，纯逻辑 + Mock 验证
 """
 
+import os
 import sys
 import unittest
+import unittest.mock
 from pathlib import Path
 from unittest.mock import MagicMock
 
@@ -295,6 +297,479 @@ class TestVectorStoreStructure(unittest.TestCase):
         )
 
 
+class TestVectorStoreCache(unittest.TestCase):
+    """store_cache：签名失效、generation、LRU 预算淘汰"""
+
+    def setUp(self):
+        import tempfile
+
+        from vectorstore.store_cache import CachedStore, VectorStoreCache
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.CachedStore = CachedStore
+        self.cache = VectorStoreCache(budget_bytes=250)
+        self.loads = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _store(self, name):
+        path = self.root / name
+        path.mkdir(exist_ok=True)
+        (path / "index.faiss").write_bytes(b"x")
+        return str(path)
+
+    def _loader(self, path):
+        from vectorstore.store_cache import store_signature
+
+        def load(key):
+            self.loads.append(key)
+            return self.CachedStore(
+                vectorstore=object(),
+                documents=[],
+                bm25=None,
+                signature=store_signature(path),
+                nbytes=100,
+            )
+
+        return load
+
+    def test_hit_after_first_load(self):
+        path = self._store("a")
+        first = self.cache.get("a", path, self._loader(path))
+        second = self.cache.get("a", path, self._loader(path))
+        self.assertIs(first, second)
+        self.assertEqual(self.loads, ["a"])
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_transaction_invalidates_entry(self):
+        from vectorstore.store_cache import read_generation, vectorstore_transaction
+
+        path = self._store("a")
+        first = self.cache.get("a", path, self._loader(path))
+        with vectorstore_transaction(path):
+            pass
+        self.assertEqual(read_generation(path), 1)
+        second = self.cache.get("a", path, self._loader(path))
+        self.assertIsNot(first, second)
+        self.assertEqual(self.loads, ["a", "a"])
+
+    def test_budget_evicts_least_recent(self):
+        paths = {k: self._store(k) for k in "abc"}
+        for k in "abc":
+            self.cache.get(k, paths[k], self._loader(paths[k]))
+        stats = self.cache.stats()
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual(stats["evictions"], 1)
+        self.cache.get("a", paths["a"], self._loader(paths["a"]))
+        self.assertEqual(self.loads, ["a", "b", "c", "a"])
+
+    def test_lock_reentrant_in_thread(self):
+        from vectorstore.store_cache import vectorstore_lock
+
+        path = self._store("a")
+        with vectorstore_lock(path, exclusive=True):
+            with vectorstore_lock(path):
+                pass
+
+
+class TestDeletionBitmap(unittest.TestCase):
+    def test_mark_unmark_and_roundtrip(self):
+        import tempfile
+
+        import numpy as np
+        from vectorstore.tombstones import DeletionBitmap
+
+        bitmap = DeletionBitmap()
+        bitmap.mark([0, 9, 1000])
+        self.assertEqual(len(bitmap), 3)
+        self.assertIn(1000, bitmap)
+        self.assertNotIn(8, bitmap)
+        self.assertEqual(
+            bitmap.mask(np.array([0, 1, 9, -1, 5000])).tolist(),
+            [True, False, True, False, False],
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            bitmap.save(tmp)
+            loaded = DeletionBitmap.load(tmp)
+            self.assertEqual(len(loaded), 3)
+            loaded.unmark([0, 9, 1000])
+            self.assertEqual(len(loaded), 0)
+            loaded.save(tmp)
+            self.assertEqual(len(DeletionBitmap.load(tmp)), 0)
+
+
+def _preload_backend_model_config():
+    """vector_store.py 依赖 RagBackend/models/model_config.py，
+    但 sys.path 中的 RAG_M/src/models 同名包会遮蔽它，这里按文件路径预先载入"""
+    import importlib.util
+
+    name = "models.model_config"
+    if name in sys.modules:
+        return
+    spec = importlib.util.spec_from_file_location(
+        name, BACKEND_ROOT / "models" / "model_config.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[name] = module
+
+
+class TestIdMappedVectorStore(unittest.TestCase):
+    """IndexIDMap2：稳定 chunk_id，remove_ids 删除不重编码，旧库原地转换"""
+
+    DIM = 8
+
+    def setUp(self):
+        try:
+            import numpy as np
+            from langchain.docstore.document import Document
+            from langchain_community.vectorstores import FAISS
+            from langchain_core.embeddings import Embeddings
+
+            _preload_backend_model_config()
+            from RAG_M.src.vectorstore.vector_store import VectorStoreManager
+        except ImportError as e:
+            self.skipTest(f"向量库依赖不可用: {e}")
+
+        dim = self.DIM
+
+        class CharEmbeddings(Embeddings):
+            def embed_documents(self, texts):
+                return [self.embed_query(t) for t in texts]
+
+            def embed_query(self, text):
+                vec = np.zeros(dim, dtype="float32")
+                for ch in text:
+                    vec[ord(ch) % dim] += 1.0
+                return vec.tolist()
+
+        self.np = np
+        self.FAISS = FAISS
+        self.embeddings = CharEmbeddings()
+        self.manager = VectorStoreManager.__new__(VectorStoreManager)
+        self.manager._embeddings = self.embeddings
+        self.manager._embedder = None
+        self.manager._embedding_model = "char-mock"
+        self.docs = [
+            Document(
+                page_content=f"chunk {i} " + "x" * i, metadata={"doc_key": f"k{i % 3}"}
+            )
+            for i in range(9)
+        ]
+
+    def _vectors(self, docs):
+        return self.np.array(
+            [self.embeddings.embed_query(d.page_content) for d in docs], dtype="float32"
+        )
+
+    def test_ids_stable_across_remove_and_append(self):
+        vs = self.manager._empty_vectorstore(self.DIM)
+        ids = self.manager.add_documents(vs, self.docs, self._vectors(self.docs))
+        self.assertEqual(ids, list(range(9)))
+
+        removed = self.manager.remove_chunks(vs, [1, 4, 7])
+        self.assertEqual(removed, 3)
+        self.assertEqual(vs.index.ntotal, 6)
+        self.assertEqual(sorted(vs.index_to_docstore_id), [0, 2, 3, 5, 6, 8])
+
+        hit = vs.similarity_search(self.docs[5].page_content, k=1)[0]
+        self.assertEqual(hit.metadata["chunk_id"], 5)
+
+        new_ids = self.manager.add_documents(
+            vs, self.docs[:1], self._vectors(self.docs[:1])
+        )
+        self.assertEqual(new_ids, [9])
+
+    def test_tombstoned_chunks_skipped_in_search(self):
+        from RAG_M.src.vectorstore.tombstones import DeletionBitmap
+
+        docs = [
+            type(self.docs[0])(page_content="同" * (i + 1), metadata={})
+            for i in range(40)
+        ]
+        vs = self.manager._empty_vectorstore(self.DIM)
+        self.manager.add_documents(vs, docs, self._vectors(docs))
+
+        # 墓碑化绝大多数 chunk，top-k 仍应只来自剩余的有效 chunk
+        live = {3, 17, 29, 38}
+        vs.tombstones = DeletionBitmap()
+        vs.tombstones.mark(i for i in range(40) if i not in live)
+        results = vs.similarity_search_with_score(docs[0].page_content, k=4)
+        self.assertEqual({d.metadata["chunk_id"] for d, _ in results}, live)
+        scores = [s for _, s in results]
+        self.assertEqual(scores, sorted(scores))
+
+    def test_mmr_skips_tombstoned_chunks(self):
+        from RAG_M.src.vectorstore.tombstones import DeletionBitmap
+
+        vs = self.manager._empty_vectorstore(self.DIM)
+        self.manager.add_documents(vs, self.docs, self._vectors(self.docs))
+        vs.tombstones = DeletionBitmap()
+        vs.tombstones.mark([0, 1])
+        vs.nprobe, vs.ef_search = 7, 32
+
+        with unittest.mock.patch.object(
+            vs, "_search_live", wraps=vs._search_live
+        ) as search:
+            docs = vs.max_marginal_relevance_search(
+                self.docs[0].page_content, k=2, fetch_k=4
+            )
+        self.assertEqual(len(docs), 2)
+        self.assertFalse({d.metadata["chunk_id"] for d in docs} & {0, 1})
+        self.assertEqual(search.call_args.args[1:], (4, 7, 32))
+
+    def test_legacy_store_converted_in_place(self):
+        legacy = self.FAISS.from_documents(self.docs[:4], self.embeddings)
+        self.assertTrue(self.manager.ensure_id_map(legacy))
+        self.assertTrue(self.manager.is_id_mapped(legacy))
+        self.assertEqual(
+            sorted(d.metadata["chunk_id"] for d in legacy.docstore._dict.values()),
+            [0, 1, 2, 3],
+        )
+        self.assertEqual(self.manager.remove_chunks(legacy, [2]), 1)
+        hit = legacy.similarity_search(self.docs[3].page_content, k=1)[0]
+        self.assertEqual(hit.metadata["chunk_id"], 3)
+
+
+class TestIncrementalVectorizerTombstones(unittest.TestCase):
+    """软删除后重新入库 / BM25 一路过滤 / 重建向量库：废弃 chunk 与位图保持一致；
+    批量入库明细与请求逐项对应"""
+
+    DIM = 8
+
+    def setUp(self):
+        import tempfile
+
+        try:
+            import numpy as np
+            from langchain.docstore.document import Document
+            from langchain_core.embeddings import Embeddings
+
+            _preload_backend_model_config()
+            from document_processing import incremental_vectorizer as iv_module
+            from RAG_M.src.vectorstore.tombstones import DeletionBitmap
+            from RAG_M.src.vectorstore.vector_store import VectorStoreManager
+        except ImportError as e:
+            self.skipTest(f"向量库依赖不可用: {e}")
+
+        dim = self.DIM
+
+        class CharEmbeddings(Embeddings):
+            def embed_documents(self, texts):
+                return [self.embed_query(t) for t in texts]
+
+            def embed_query(self, text):
+                vec = np.zeros(dim, dtype="float32")
+                for ch in text:
+                    vec[ord(ch) % dim] += 1.0
+                return vec.tolist()
+
+        class Embedder:
+            def embed(self, texts):
+                return np.array(CharEmbeddings().embed_documents(texts), "float32")
+
+        self._tmp = tempfile.TemporaryDirectory()
+        self.DeletionBitmap = DeletionBitmap
+        manager = VectorStoreManager.__new__(VectorStoreManager)
+        manager._embeddings = CharEmbeddings()
+        manager._embedder = Embedder()
+        manager._embedding_model = "char-mock"
+
+        with unittest.mock.patch.object(iv_module, "HASH_INDEX_ROOT", self._tmp.name):
+            vectorizer = iv_module.IncrementalVectorizer.__new__(
+                iv_module.IncrementalVectorizer
+            )
+            vectorizer.kb_id = "kb_test"
+            vectorizer.vectorstore_path = os.path.join(self._tmp.name, "vs")
+            os.makedirs(vectorizer.vectorstore_path)
+            vectorizer.hash_index = iv_module.HashIndex("kb_test")
+        vectorizer._vs_manager = manager
+        vectorizer._load_documents = lambda path: [
+            Document(page_content=line, metadata={})
+            for line in Path(path).read_text(encoding="utf-8").splitlines()
+        ]
+        self.vectorizer = vectorizer
+
+    def tearDown(self):
+        self.vectorizer.hash_index.close()
+        self._tmp.cleanup()
+
+    def _file(self, name, lines):
+        path = os.path.join(self._tmp.name, name)
+        Path(path).write_text("\n".join(lines), encoding="utf-8")
+        return path
+
+    def test_readd_after_remove_then_compact(self):
+        iv = self.vectorizer
+        keep = self._file("keep.txt", ["alpha", "beta", "gamma", "delta"])
+        doc = self._file("doc.txt", ["one", "two"])
+        iv.ingest_file(keep, doc_key="keep")
+        iv.ingest_file(doc, doc_key="doc")
+        iv.remove_file("doc")
+
+        result = iv.ingest_file(doc, doc_key="doc")
+        self.assertEqual(result["status"], "added")
+        record = iv.hash_index.get("doc")
+        self.assertEqual(record["chunk_ids"], [6, 7])
+        self.assertEqual(record["stale_chunk_ids"], [4, 5])
+        self.assertEqual(sorted(iv.hash_index.tombstoned_chunk_ids()), [4, 5])
+
+        iv._compact()
+        vs = iv._load_vectorstore()
+        self.assertEqual(vs.index.ntotal, 6)
+        self.assertEqual(sorted(vs.index_to_docstore_id), [0, 1, 2, 3, 6, 7])
+        self.assertEqual(len(self.DeletionBitmap.load(iv.vectorstore_path)), 0)
+        self.assertEqual(iv.hash_index.tombstoned_chunk_ids(), [])
+
+    def test_batch_reports_duplicate_doc_keys(self):
+        iv = self.vectorizer
+        a = self._file("a.txt", ["alpha"])
+        b = self._file("b.txt", ["beta"])
+        results = iv.batch_ingest([a, b, a])
+
+        self.assertEqual(
+            (results["added"], results["skipped"], results["failed"]), (2, 1, 0)
+        )
+        self.assertEqual(len(results["details"]), 3)
+        dup = [d for d in results["details"] if d.get("reason") == "duplicate"]
+        self.assertEqual([d["file_path"] for d in dup], [a])
+        self.assertEqual(results["chunk_count"], 2)
+
+    def test_chunk_ids_not_reused_after_compaction(self):
+        iv = self.vectorizer
+        iv.ingest_file(self._file("keep.txt", ["alpha", "beta"]), doc_key="keep")
+        iv.ingest_file(self._file("tail.txt", ["one", "two"]), doc_key="tail")
+        iv.remove_file("tail")
+        iv._compact()
+        self.assertEqual(sorted(iv._load_vectorstore().index_to_docstore_id), [0, 1])
+
+        # 被移除的最大 id（2、3）不会再分配给新 chunk
+        iv.ingest_file(self._file("new.txt", ["three", "four"]), doc_key="new")
+        self.assertEqual(iv.hash_index.get("new")["chunk_ids"], [4, 5])
+
+        # compaction 清空向量库后重新创建，计数器继续递增
+        iv.remove_file("keep")
+        iv.remove_file("new")
+        iv._compact()
+        self.assertIsNone(iv._load_vectorstore())
+        iv.ingest_file(self._file("again.txt", ["five"]), doc_key="again")
+        self.assertEqual(iv.hash_index.get("again")["chunk_ids"], [6])
+
+    def test_bm25_masks_tombstones_and_rebuild_resets_bitmap(self):
+        try:
+            from RAG_M.src.rag.hybrid_retriever import (
+                load_or_build_bm25,
+                vectorstore_documents,
+            )
+        except ImportError as e:
+            self.skipTest(f"hybrid_retriever 不可用: {e}")
+
+        iv = self.vectorizer
+        iv.ingest_file(self._file("keep.txt", ["apple pie"]), doc_key="keep")
+        iv.ingest_file(self._file("gone.txt", ["apple tart"]), doc_key="gone")
+        iv.remove_file("gone")
+
+        vs = iv._load_vectorstore()
+        bm25 = load_or_build_bm25(
+            iv.vectorstore_path, vectorstore_documents(vs), tombstones=vs.tombstones
+        )
+        hits = bm25.retrieve("apple", top_k=5)
+        self.assertEqual([d.page_content for d, _ in hits], ["apple pie"])
+        self.assertEqual(bm25.get_scores("tart"), [0.0, 0.0])
+
+        # 重建向量库：chunk_id 从 0 重新编号，旧位图不能遮蔽新 chunk
+        iv._vs_manager.create_vectorstore(
+            vectorstore_documents(vs)[:1], iv.vectorstore_path
+        )
+        self.assertEqual(len(self.DeletionBitmap.load(iv.vectorstore_path)), 0)
+        rebuilt = iv._load_vectorstore()
+        self.assertEqual(len(rebuilt.similarity_search("apple pie", k=1)), 1)
+
+
+class TestINT8VectorStore(unittest.TestCase):
+    """INT8 量化存储：分块打分结果与 float32 精确余弦一致，批量查询等价于逐条查询"""
+
+    def setUp(self):
+        import numpy as np
+        from document_processing.semantic_splitter import INT8VectorStore
+
+        rng = np.random.default_rng(0)
+        self.vecs = rng.standard_normal((2000, 32)).astype(np.float32)
+        self.queries = rng.standard_normal((4, 32)).astype(np.float32)
+        # block_size 不整除库大小，覆盖最后一个不满的块
+        self.store = INT8VectorStore(dim=32, block_size=300)
+        self.store.add([f"t{i}" for i in range(len(self.vecs))], self.vecs)
+
+    def test_top_k_matches_float_cosine(self):
+        import numpy as np
+
+        unit = self.vecs / np.linalg.norm(self.vecs, axis=1, keepdims=True)
+        q = self.queries / np.linalg.norm(self.queries, axis=1, keepdims=True)
+        exact = np.argsort(-(q @ unit.T), axis=1)[:, :10]
+        results = self.store.search_batch(self.queries, top_k=10, score_threshold=-1)
+        for want, got in zip(exact, results):
+            self.assertGreaterEqual(len(set(want) & {r["index"] for r in got}), 9)
+            scores = [r["score"] for r in got]
+            self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_batch_equals_single_and_self_match(self):
+        batch = self.store.search_batch(self.queries, top_k=5)
+        for q, hits in zip(self.queries, batch):
+            self.assertEqual(hits, self.store.search(q, top_k=5))
+        hit = self.store.search(self.vecs[42], top_k=1)[0]
+        self.assertEqual(hit["index"], 42)
+        self.assertAlmostEqual(hit["score"], 1.0, places=3)
+
+    def test_segment_save_load_and_append(self):
+        import os
+        import tempfile
+
+        import numpy as np
+        from document_processing.semantic_splitter import INT8VectorStore
+
+        with tempfile.TemporaryDirectory() as tmp:
+            meta = [{"source": f"doc{i}.md"} for i in range(len(self.vecs))]
+            store = INT8VectorStore(dim=32, block_size=300)
+            store.add([f"文本{i}" for i in range(1000)], self.vecs[:1000], meta[:1000])
+            store.save(tmp)
+            first_seg = os.path.join(tmp, "seg-00000.vecs")
+            mtime = os.stat(first_seg).st_mtime_ns
+
+            loaded = INT8VectorStore(dim=32, block_size=300)
+            self.assertTrue(loaded.load(tmp))
+            self.assertIsInstance(loaded._segments[0].vecs, np.memmap)
+            # 追加只写新段，已有段文件不变
+            loaded.add(
+                [f"文本{i}" for i in range(1000, 2000)], self.vecs[1000:], meta[1000:]
+            )
+            loaded.save(tmp)
+            self.assertEqual(os.stat(first_seg).st_mtime_ns, mtime)
+            self.assertEqual(len(loaded._segments), 2)
+
+            reopened = INT8VectorStore(dim=32, block_size=300)
+            reopened.load(tmp)
+            self.assertEqual(len(reopened), 2000)
+            hit = reopened.search(self.vecs[1500], top_k=1)[0]
+            self.assertEqual(hit["index"], 1500)
+            self.assertEqual(hit["text"], "文本1500")
+            self.assertEqual(hit["metadata"], {"source": "doc1500.md"})
+
+            def pick(results):
+                return [[(h["index"], h["score"]) for h in r] for r in results]
+
+            self.assertEqual(
+                pick(reopened.search_batch(self.queries, top_k=5)),
+                pick(self.store.search_batch(self.queries, top_k=5)),
+            )
+
+    def test_empty_store(self):
+        from document_processing.semantic_splitter import INT8VectorStore
+
+        self.assertEqual(INT8VectorStore(dim=32).search_batch(self.queries), [[]] * 4)
+
+
 # ────────────────────────────────────────────
 # 5. RAG Pipeline v2
 # ────────────────────────────────────────────
@@ -432,6 +907,11 @@ if __name__ == "__main__":
         TestRRFFusion,
         TestHybridRetrieverIntegration,
         TestVectorStoreStructure,
+        TestVectorStoreCache,
+        TestDeletionBitmap,
+        TestIdMappedVectorStore,
+        TestIncrementalVectorizerTombstones,
+        TestINT8VectorStore,
         TestRAGPipelineStructure,
         TestKnowledgeGraphMerge,
     ]:
@@ -0,0 +1,358 @@
+"""
+test_reranker.py — cross-encoder 精排阶段测试（rag_enhancement/cross_encoder.py）
+推理函数通过 infer_fn 注入，不加载真实模型
+
+测试范围：
+  1. 所有候选在一次批量推理中打分
+  2. (query, chunk) 分数缓存（键带 passage 文本 hash，不同知识库的同号 chunk 不串用）
+  3. 延迟预算：超时 / 预估超预算时返回 None，超时的推理完成后仍写入缓存；
+     模型后台加载，就绪前降级；加载失败退避后重试
+  4. RetrievalStrategyExecutor：rerank=True 走 cross-encoder，超预算降级为词法重排（中文有效）
+  5. RerankService（rag_enhancement/reranker.py）：跨请求微批、模型 LRU（加载失败的模型不入 LRU）、
+     token 预算截断
+"""
+
+import asyncio
+import sys
+import threading
+import time
+import unittest
+import unittest.mock
+from pathlib import Path
+
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT))
+sys.path.insert(0, str(BACKEND_ROOT / "RAG_M" / "src"))
+
+from rag_enhancement.cross_encoder import CrossEncoderScorer, truncate_pair  # noqa: E402
+
+
+def _overlap_infer(calls, delay=0.0):
+    """按字符重叠打分的假模型，记录每次调用的 batch 大小"""
+
+    def infer(query, passages):
+        calls.append(len(passages))
+        time.sleep(delay)
+        return [len(set(query) & set(p)) for p in passages]
+
+    return infer
+
+
+class TestCrossEncoderScorer(unittest.TestCase):
+    def test_single_batch_and_cache(self):
+        calls = []
+        scorer = CrossEncoderScorer(infer_fn=_overlap_infer(calls))
+        passages = ["年假申请流程", "报销制度", "年假天数规定"]
+        scores = scorer.score("年假怎么申请", passages, keys=[1, 2, 3])
+        self.assertEqual(calls, [3])
+        self.assertGreater(scores[0], scores[1])
+
+        # 再次打分只推理未命中的候选；query 空白差异视为同一问题
+        scorer.score(" 年假怎么申请 ", passages + ["加班调休"], keys=[1, 2, 3, 4])
+        self.assertEqual(calls, [3, 1])
+        stats = scorer.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (3, 4))
+
+    def test_cache_is_bounded(self):
+        calls = []
+        scorer = CrossEncoderScorer(infer_fn=_overlap_infer(calls), cache_size=2)
+        scorer.score("q", ["a", "b", "c"], keys=[1, 2, 3])
+        self.assertEqual(scorer.stats()["cache_entries"], 2)
+
+    def test_budget_timeout_then_cached(self):
+        calls = []
+        scorer = CrossEncoderScorer(infer_fn=_overlap_infer(calls, delay=0.2))
+        self.assertIsNone(
+            scorer.score_within_budget("q", ["a", "b"], keys=[1, 2], budget_ms=20)
+        )
+        time.sleep(0.3)
+        # 后台推理已写入缓存，第二次直接命中
+        scores = scorer.score_within_budget("q", ["a", "b"], keys=[1, 2], budget_ms=20)
+        self.assertIsNotNone(scores)
+        self.assertEqual(calls, [2])
+        self.assertEqual(scorer.stats()["fallbacks"], 1)
+
+    def test_budget_prediction_skips_inference(self):
+        calls = []
+        scorer = CrossEncoderScorer(infer_fn=_overlap_infer(calls))
+        scorer.pair_ms = 10.0
+        self.assertIsNone(
+            scorer.score_within_budget(
+                "q", ["x"] * 50, keys=list(range(50)), budget_ms=100
+            )
+        )
+        self.assertEqual(calls, [])
+
+    def test_unavailable_model(self):
+        scorer = CrossEncoderScorer(model_name="no/such-model-for-tests")
+        scorer._load = lambda: (_ for _ in ()).throw(ImportError("transformers"))
+        self.assertFalse(scorer.available())
+        self.assertIsNone(scorer.score_within_budget("q", ["a"]))
+
+    def test_same_chunk_id_from_other_store_not_cached(self):
+        calls = []
+        scorer = CrossEncoderScorer(infer_fn=_overlap_infer(calls))
+        # 两个知识库的 chunk_id 都从 0 编号
+        kb_a = scorer.score("年假", ["年假申请流程", "报销制度"], keys=[0, 1])
+        kb_b = scorer.score("年假", ["报销制度", "年假申请流程"], keys=[0, 1])
+        self.assertEqual(calls, [2, 2])
+        self.assertEqual(kb_b.tolist(), kb_a[::-1].tolist())
+
+    def test_load_retried_after_backoff(self):
+        from rag_enhancement import cross_encoder
+
+        attempts = []
+
+        def load():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise OSError("hub timeout")
+            scorer._infer_fn = _overlap_infer([])
+
+        scorer = CrossEncoderScorer(model_name="flaky/model")
+        scorer._load = load
+        with unittest.mock.patch.object(cross_encoder, "DEFAULT_LOAD_RETRY_S", 0.05):
+            self.assertFalse(scorer.available())
+            self.assertFalse(scorer.available())  # 退避期内不重试
+            self.assertEqual(len(attempts), 1)
+            time.sleep(0.06)
+            self.assertTrue(scorer.available())
+        self.assertEqual(len(attempts), 2)
+        self.assertIsNone(scorer.stats()["load_error"])
+
+    def test_budget_path_loads_in_background(self):
+        loaded = threading.Event()
+
+        def load():
+            loaded.wait(5)
+            scorer._infer_fn = _overlap_infer([])
+
+        scorer = CrossEncoderScorer(model_name="slow/model")
+        scorer._load = load
+        t0 = time.perf_counter()
+        self.assertIsNone(scorer.score_within_budget("q", ["a"], budget_ms=50))
+        self.assertIsNone(scorer.score_within_budget("q", ["a"], budget_ms=50))
+        self.assertLess(time.perf_counter() - t0, 0.5)
+
+        loaded.set()
+        for _ in range(100):
+            if scorer.ready():
+                break
+            time.sleep(0.01)
+        self.assertIsNotNone(scorer.score_within_budget("q", ["a"], budget_ms=500))
+        self.assertEqual(scorer.stats()["fallbacks"], 2)
+
+
+class TestRerankStage(unittest.TestCase):
+    TEXTS = [
+        "报销需要提交发票和审批单",
+        "年假申请需要提前三天提交",
+        "公司食堂开放时间",
+        "年假天数按工龄计算",
+    ]
+
+    def _executor(self, scorer):
+        try:
+            from langchain.docstore.document import Document
+
+            from document_processing.retrieval_strategy import (
+                RetrievalStrategyExecutor,
+            )
+        except ImportError as e:
+            self.skipTest(f"retrieval_strategy 不可用: {e}")
+        docs = [
+            Document(page_content=t, metadata={"chunk_id": i, "source": f"{i}.txt"})
+            for i, t in enumerate(self.TEXTS)
+        ]
+        return RetrievalStrategyExecutor(None, docs, reranker=scorer)
+
+    def _config(self):
+        from document_processing.retrieval_strategy import RetrievalConfig
+
+        return RetrievalConfig(strategy="bm25", topK=4, rerank=True, rerankTopN=2)
+
+    def test_cross_encoder_rerank(self):
+        calls = []
+
+        def infer(query, passages):
+            calls.append(len(passages))
+            return [10.0 if "工龄" in p else 0.0 for p in passages]
+
+        executor = self._executor(CrossEncoderScorer(infer_fn=infer))
+        results = executor.retrieve("年假提交", self._config())
+        # 召回的 3 个候选在一次推理中打分
+        self.assertEqual(calls, [3])
+        self.assertEqual(len(results), 2)
+        self.assertIn("工龄", results[0]["document"].page_content)
+        self.assertEqual(results[0]["source_info"]["rank"], 1)
+        self.assertEqual(results[0]["source_info"]["rerank_score"], 10.0)
+
+    def test_lexical_fallback_handles_chinese(self):
+        scorer = CrossEncoderScorer(infer_fn=lambda q, p: [0.0] * len(p))
+        scorer.pair_ms = 1e6  # 任何推理都会超预算
+        executor = self._executor(scorer)
+        results = executor.retrieve("年假申请", self._config())
+        self.assertTrue(all(r["source_info"]["reranked"] for r in results))
+        self.assertNotIn("rerank_score", results[0]["source_info"])
+        self.assertIn("年假申请", results[0]["document"].page_content)
+
+
+def _pairs_infer(batches, delay=0.0):
+    """跨 query 的假模型：分数 = query 与 passage 的字符重叠数，记录每次前向的对数"""
+
+    def infer(queries, passages):
+        batches.append(len(passages))
+        time.sleep(delay)
+        return [len(set(q) & set(p)) for q, p in zip(queries, passages)]
+
+    return infer
+
+
+class TestRerankService(unittest.TestCase):
+    def _service(self, batches, **kwargs):
+        from rag_enhancement.reranker import RerankService
+
+        factory = kwargs.pop(
+            "scorer_factory",
+            lambda name: CrossEncoderScorer(
+                model_name=name, pairs_fn=_pairs_infer(batches, delay=0.02)
+            ),
+        )
+        return RerankService(scorer_factory=factory, **kwargs)
+
+    def test_concurrent_requests_share_batches(self):
+        batches = []
+        service = self._service(batches, max_wait_ms=50)
+        queries = [f"问题{i}" for i in range(8)]
+        results = {}
+
+        def worker(q):
+            results[q] = service.score(q, [q, "无关", q + "补充", "其他"])
+
+        threads = [threading.Thread(target=worker, args=(q,)) for q in queries]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(sum(batches), 32)
+        self.assertLess(len(batches), len(queries))
+        for q in queries:
+            # 每个请求拿回自己的分数
+            self.assertEqual(results[q].tolist(), [3.0, 0.0, 3.0, 0.0])
+        stats = service.stats()["models"]
+        model_stats = next(iter(stats.values()))
+        self.assertEqual(model_stats["requests"], 8)
+        self.assertGreater(model_stats["avg_batch_pairs"], 4)
+
+    def test_async_callers(self):
+        batches = []
+        service = self._service(batches, max_wait_ms=50)
+
+        async def run():
+            return await asyncio.gather(
+                *(service.ascore(f"q{i}", [f"q{i}", "x"]) for i in range(6))
+            )
+
+        results = asyncio.run(run())
+        self.assertEqual([r.tolist() for r in results], [[2.0, 0.0]] * 6)
+        self.assertLess(len(batches), 6)
+
+    def test_batch_pair_cap(self):
+        batches = []
+        service = self._service(batches, max_wait_ms=50, max_batch_pairs=5)
+        futures = [service.submit(f"q{i}", ["a", "b", "c"]) for i in range(4)]
+        for f in futures:
+            f.result(timeout=5)
+        # 每批最多 5 对：3 对的请求不会两两合并
+        self.assertTrue(all(n <= 5 for n in batches))
+        self.assertEqual(sum(batches), 12)
+
+    def test_model_lru(self):
+        closed = []
+
+        class Scorer(CrossEncoderScorer):
+            def close(self):
+                closed.append(self.model_name)
+
+        batches = []
+        service = self._service(
+            batches,
+            max_models=2,
+            scorer_factory=lambda name: Scorer(
+                model_name=name, pairs_fn=_pairs_infer(batches)
+            ),
+        )
+        for name in ["m1", "m2", "m1", "m3"]:
+            service.score("q", ["q"], model_name=name)
+        stats = service.stats()
+        self.assertEqual(sorted(stats["models"]), ["m1", "m3"])
+        self.assertEqual((stats["loads"], stats["evictions"]), (3, 1))
+        time.sleep(0.1)
+        self.assertEqual(closed, ["m2"])
+
+    def test_unloadable_model_does_not_evict_resident(self):
+        class Scorer(CrossEncoderScorer):
+            def close(self):
+                closed.append(self.model_name)
+
+        def factory(name):
+            if name == "typo":
+                scorer = Scorer(model_name=name)
+                scorer._load = lambda: (_ for _ in ()).throw(OSError("not found"))
+                created.append(name)
+                return scorer
+            return Scorer(model_name=name, pairs_fn=_pairs_infer([]))
+
+        closed, created = [], []
+        service = self._service([], max_models=1, scorer_factory=factory)
+        service.score("q", ["q"], model_name="good")
+        for _ in range(3):
+            self.assertFalse(service.available("typo"))
+        with self.assertRaises(RuntimeError):
+            service.submit("q", ["q"], model_name="typo")
+
+        stats = service.stats()
+        self.assertEqual(list(stats["models"]), ["good"])
+        self.assertEqual((stats["loads"], stats["evictions"]), (1, 0))
+        self.assertIn("typo", stats["unavailable"])
+        # 失败的打分器保留退避状态，不会每次请求重新创建 / 加载
+        self.assertEqual(created, ["typo"])
+        self.assertEqual(closed, [])
+
+    def test_errors_reach_every_caller(self):
+        def broken(queries, passages):
+            raise RuntimeError("boom")
+
+        service = self._service(
+            [],
+            max_wait_ms=50,
+            scorer_factory=lambda name: CrossEncoderScorer(pairs_fn=broken),
+        )
+        futures = [service.submit("q", ["a"]), service.submit("p", ["b"])]
+        for f in futures:
+            with self.assertRaises(RuntimeError):
+                f.result(timeout=5)
+
+
+class TestScorePairs(unittest.TestCase):
+    def test_mixed_queries_and_length_sorted_sub_batches(self):
+        batches = []
+        scorer = CrossEncoderScorer(pairs_fn=_pairs_infer(batches), batch_pairs=2)
+        passages = ["年假" * 5, "报销", "年假申请", "发票"]
+        scores = scorer.score_pairs(["年假", "报销", "年假", "报销"], passages)
+        self.assertEqual(scores.tolist(), [2.0, 2.0, 2.0, 0.0])
+        self.assertEqual(batches, [2, 2])
+        # 分数按各自的 query 缓存
+        scorer.score("年假", passages[:1] + passages[2:3])
+        self.assertEqual(batches, [2, 2])
+
+    def test_truncate_pair(self):
+        q, p = truncate_pair("问" * 500, "文" * 10000, max_length=512)
+        self.assertEqual(len(q), 128)
+        self.assertEqual(len(p), 2048)
+        self.assertEqual(truncate_pair("短问题", "短文本", 512), ("短问题", "短文本"))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -18,13 +18,10 @@ trace_logging.py — 结构化日志 TraceID 中间件
 from __future__ import annotations
 
 import logging
+import os
 import time
-import uuid
 from contextvars import ContextVar
-from typing import Callable
-
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from typing import Optional
 
 # - ContextVar/ trace_id -
 _trace_id_var: ContextVar[str] = ContextVar("trace_id", default="-")
@@ -66,43 +63,89 @@ def setup_trace_logging(level: int = logging.INFO):
         root_logger.addHandler(handler)
 
 
+# ── 请求级辅助函数（TraceMiddleware 与 monitoring.observability 共用）──
+TRACE_HEADER = b"x-trace-id"
+
+_access_logger = logging.getLogger("access")
+
+
+def new_trace_id() -> str:
+    return os.urandom(4).hex()
+
+
+def with_trace_header(message: dict, trace_id: str) -> dict:
+    """给 http.response.start 消息追加 X-Trace-Id 响应头（不修改原消息）"""
+    headers = list(message.get("headers", ()))
+    headers.append((TRACE_HEADER, trace_id.encode("latin-1")))
+    return {**message, "headers": headers}
+
+
+def log_access(
+    method: str,
+    path: str,
+    status: int,
+    elapsed_ms: float,
+    ttfb_ms: Optional[float] = None,
+) -> None:
+    if ttfb_ms is None:
+        _access_logger.info("%s %s %d %.1fms", method, path, status, elapsed_ms)
+    else:
+        _access_logger.info(
+            "%s %s %d %.1fms (ttfb %.1fms)", method, path, status, elapsed_ms, ttfb_ms
+        )
+
+
+def log_access_error(
+    method: str, path: str, elapsed_ms: float, exc: BaseException
+) -> None:
+    _access_logger.error("%s %s ERROR %.1fms — %s", method, path, elapsed_ms, exc)
+
+
 # ── FastAPI Middleware ─────────────────────────────────────────────────
-class TraceMiddleware(BaseHTTPMiddleware):
+class TraceMiddleware:
     """
     每个请求注入唯一 trace_id，并在响应头中返回，方便前端/日志关联。
+    纯 ASGI 中间件：响应消息原样透传（只在响应头中追加 X-Trace-Id），不缓冲流式响应。
 
     日志格式示例：
         2026-03-27 17:30:01 | INFO     | trace=a3f8c1d2 | doc_upload:215 | 文件合并成功
     """
 
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         # trace_id
-        trace_id = request.headers.get("X-Trace-Id") or uuid.uuid4().hex[:8]
+        trace_id = None
+        for name, value in scope.get("headers", ()):
+            if name == TRACE_HEADER:
+                trace_id = value.decode("latin-1")
+                break
+        trace_id = trace_id or new_trace_id()
         token = _trace_id_var.set(trace_id)
 
+        method = scope.get("method", "")
+        path = scope.get("path", "")
+        status_code = 500
         start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                # Write to response header
+                message = with_trace_header(message, trace_id)
+            await send(message)
+
         try:
-            response = await call_next(request)
-            elapsed_ms = (time.perf_counter() - start) * 1000
-            # Write to response header
-            response.headers["X-Trace-Id"] = trace_id
-            logging.getLogger("access").info(
-                "%s %s %d %.1fms",
-                request.method,
-                request.url.path,
-                response.status_code,
-                elapsed_ms,
-            )
-            return response
+            await self.app(scope, receive, send_wrapper)
+            log_access(method, path, status_code, (time.perf_counter() - start) * 1000)
         except Exception as exc:
-            elapsed_ms = (time.perf_counter() - start) * 1000
-            logging.getLogger("access").error(
-                "%s %s ERROR %.1fms — %s",
-                request.method,
-                request.url.path,
-                elapsed_ms,
-                exc,
-            )
+            log_access_error(method, path, (time.perf_counter() - start) * 1000, exc)
             raise
         finally:
             _trace_id_var.reset(token)